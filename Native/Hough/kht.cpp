@@ -98,3 +98,19 @@ kht_wrapper(double (*lines_array)[2], unsigned char *binary_image, const size_t
 
 	return lines_count;
 }
+
+// Run the KHT on a batch of binary images of the same size in one call. The lines of the i-th image are
+// stored in lines_array[i*lines_max] to lines_array[i*lines_max + lines_counts[i] - 1].
+extern "C" void
+kht_wrapper_batch(double (*lines_array)[2], size_t *lines_counts, unsigned char *binary_images, const size_t images_count,
+			const size_t image_width, const size_t image_height, const size_t lines_max,
+			const size_t cluster_min_size, const double cluster_min_deviation, const double delta, const double kernel_min_height,
+			const double n_sigmas)
+{
+	const size_t image_size = image_width*image_height;
+
+	for(size_t i=0; i<images_count; i++) {
+		lines_counts[i] = kht_wrapper( lines_array + i*lines_max, binary_images + i*image_size, image_width, image_height,
+			lines_max, cluster_min_size, cluster_min_deviation, delta, kernel_min_height, n_sigmas );
+	}
+}
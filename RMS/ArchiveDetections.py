@@ -10,8 +10,8 @@ from RMS.Formats.FFfile import validFFName
 from RMS.Logger import getLogger
 from RMS.Misc import archiveDir, tarWithProgress
 from RMS.Routines import MaskImage
-from Utils.GenerateThumbnails import generateThumbnails
-from Utils.StackFFs import stackFFs
+from Utils.GenerateTimelapse import generateTimelapse, timelapseFfmpegPath
+from Utils.NightSweep import StackProduct, ThumbnailProduct, TimelapseProduct, sweepFFs
 
 
 # Get the logger from the main module
@@ -146,9 +146,13 @@ def archiveFieldsums(dir_path):
 
 
 
-def archiveDetections(captured_path, archived_path, ff_detected, config, extra_files=None):
+def archiveDetections(captured_path, archived_path, ff_detected, config, extra_files=None,
+    timelapse_file_name=None):
     """ Create thumbnails and compress all files with detections and the accompanying files in one archive.
 
+    The thumbnails, the stacks and the timelapse are all made in one pass over the FF files (see 
+    Utils.NightSweep), so every FF file is read only once.
+
     Arguments:
         captured_path: [str] Path where the captured files are located.
         archived_path: [str] Path where the detected files will be archived to.
@@ -158,6 +162,8 @@ def archiveDetections(captured_path, archived_path, ff_detected, config, extra_f
     Keyword arguments:
         extra_files: [list] A list of extra files (with fill paths) which will be be saved to the night 
             archive.
+        timelapse_file_name: [str] If given, a timelapse of all FF files is made in the captured directory
+            with this name. None by default.
 
     Return:
         archive_name: [str] Name of the archive where the files were compressed to.
@@ -167,87 +173,93 @@ def archiveDetections(captured_path, archived_path, ff_detected, config, extra_f
     # Get the list of files to archive
     file_list = selectFiles(config, captured_path, ff_detected)
 
-    
-    log.info('Generating thumbnails...')
 
+    # Load the mask for stack
+    mask = None
     try:
-
-        # Generate captured thumbnails
-        captured_mosaic_file = generateThumbnails(captured_path, config, 'CAPTURED')
-
-        # Generate detected thumbnails
-        detected_mosaic_file = generateThumbnails(captured_path, config, 'DETECTED', \
-            file_list=sorted(file_list), no_stack=True)
-
-        # Add the detected mosaic file to the selected list
-        file_list.append(captured_mosaic_file)
-        file_list.append(detected_mosaic_file)
+        mask_path_default = os.path.join(config.config_file_path, config.mask_file)
+        if os.path.exists(mask_path_default) and config.stack_mask:
+            mask_path = os.path.abspath(mask_path_default)
+            mask = MaskImage.loadMask(mask_path)
 
     except Exception as e:
-        log.error('Generating thumbnails failed with error:' + repr(e))
+        log.error('Loading the mask failed with error:' + repr(e))
         log.error("".join(traceback.format_exception(*sys.exc_info())))
 
 
+    log.info('Generating thumbnails, a stack of all captured images and a stack of {:d} detections...'\
+        .format(len(ff_detected)))
 
-    log.info('Generating a stack of all captured images...')
-
-    try:
-
-        # Load the mask for stack
-        mask = None
-        mask_path_default = os.path.join(config.config_file_path, config.mask_file)
-        if os.path.exists(mask_path_default) and config.stack_mask:
-            mask_path = os.path.abspath(mask_path_default)
-            mask = MaskImage.loadMask(mask_path)
+    products = [
 
+        # Captured and detected thumbnails
+        ThumbnailProduct(captured_path, config, 'CAPTURED'),
+        ThumbnailProduct(captured_path, config, 'DETECTED', file_list=sorted(file_list), no_stack=True),
 
         # Make a co-added image of all captured images
-        captured_stack_path, _ = stackFFs(captured_path, 'jpg', deinterlace=(config.deinterlace_order > 0), 
-            subavg=True, mask=mask, captured_stack=True)
+        StackProduct(captured_path, 'jpg', deinterlace=(config.deinterlace_order > 0), subavg=True, 
+            mask=mask, captured_stack=True),
 
-        if captured_stack_path is not None:
+        # Make a co-added image of all detections. Filter out possible clouds
+        StackProduct(captured_path, 'jpg', deinterlace=(config.deinterlace_order > 0), subavg=True, 
+            filter_bright=True, file_list=sorted(ff_detected), mask=mask)
+        ]
 
-            log.info("Captured stack saved to: {:s}".format(captured_stack_path))
 
-            # Extract the name of the stack image
-            stack_file = os.path.basename(captured_stack_path)
-            
-            # Add the stack path to the list of files to put in the archive
-            file_list.append(stack_file)
+    # Stream the timelapse frames into ffmpeg during the same pass, if it is available
+    make_timelapse = False
+    if timelapse_file_name is not None:
+
+        ffmpeg_path = timelapseFfmpegPath()
+        if ffmpeg_path is not None:
+            products.append(TimelapseProduct(os.path.join(captured_path, os.path.basename(timelapse_file_name)), 
+                ffmpeg_path))
 
         else:
-            log.info("Captured stack could not be saved!")
+            make_timelapse = True
 
-    except Exception as e:
-        log.error('Generating captured stack failed with error:' + repr(e))
-        log.error("".join(traceback.format_exception(*sys.exc_info())))
 
+    results = sweepFFs(captured_path, products)
 
-    log.info('Generating a stack of {:d} detections...'.format(len(ff_detected)))
+    captured_mosaic_file, detected_mosaic_file, captured_stack, detected_stack = results[:4]
 
-    try:
 
-        # Make a co-added image of all detections. Filter out possible clouds
-        detected_stack_path, _ = stackFFs(captured_path, 'jpg', deinterlace=(config.deinterlace_order > 0), 
-            subavg=True, filter_bright=True, file_list=sorted(ff_detected), mask=mask)
+    # Add the mosaic files to the selected list
+    if (captured_mosaic_file is not None) and (detected_mosaic_file is not None):
+        file_list.append(captured_mosaic_file)
+        file_list.append(detected_mosaic_file)
 
-        if detected_stack_path is not None:
+    else:
+        log.error('Generating thumbnails failed!')
 
-            log.info("Detected stack saved to: {:s}".format(detected_stack_path))
+
+    for stack_type, stack in [("Captured", captured_stack), ("Detected", detected_stack)]:
+
+        if (stack is not None) and (stack[0] is not None):
+
+            log.info("{:s} stack saved to: {:s}".format(stack_type, stack[0]))
 
             # Extract the name of the stack image
-            stack_file = os.path.basename(detected_stack_path)
+            stack_file = os.path.basename(stack[0])
             
             # Add the stack path to the list of files to put in the archive
             file_list.append(stack_file)
 
         else:
-            log.info("Detected stack could not be saved!")
+            log.info("{:s} stack could not be saved!".format(stack_type))
 
 
-    except Exception as e:
-        log.error('Generating stack failed with error:' + repr(e))
-        log.error("".join(traceback.format_exception(*sys.exc_info())))
+    # Make the timelapse from temporary images if it could not be streamed
+    if make_timelapse:
+
+        log.info('Generating a timelapse...')
+
+        try:
+            generateTimelapse(captured_path, output_file=timelapse_file_name)
+
+        except Exception as e:
+            log.error('Generating a timelapse failed with error:' + repr(e))
+            log.error("".join(traceback.format_exception(*sys.exc_info())))
 
 
 
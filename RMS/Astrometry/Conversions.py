@@ -347,6 +347,33 @@ def latLonAlt2ECEF(lat, lon, h):
     return ecef_x, ecef_y, ecef_z
 
 
+
+def latLonAlt2ECEFArrays(lat, lon, h):
+    """ Same as latLonAlt2ECEF, for arrays of geographical coordinates.
+
+    Arguments:
+        lat: [ndarray] latitudes in radians (+north)
+        lon: [ndarray] longitudes in radians (+east)
+        h: [ndarray] elevations in meters (WGS84)
+
+    Return:
+        (x, y, z): [tuple of ndarrays] ECEF coordinates
+
+    """
+
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    h = np.asarray(h, dtype=np.float64)
+
+    N = EARTH.EQUATORIAL_RADIUS/np.sqrt(1.0 - (EARTH.E**2)*np.sin(lat)**2)
+
+    ecef_x = (N + h)*np.cos(lat)*np.cos(lon)
+    ecef_y = (N + h)*np.cos(lat)*np.sin(lon)
+    ecef_z = ((1 - EARTH.E**2)*N + h)*np.sin(lat)
+
+    return tuple(np.broadcast_arrays(ecef_x, ecef_y, ecef_z))
+
+
 @floatArguments
 def geo2Cartesian(lat, lon, h, julian_date):
     """ Convert geographical Earth coordinates to Cartesian ECI coordinate system (Earth center as origin).
@@ -388,6 +415,33 @@ def geo2Cartesian(lat, lon, h, julian_date):
 
 
 
+def geo2CartesianArrays(lat, lon, h, julian_date):
+    """ Same as geo2Cartesian, for arrays of geographical coordinates.
+
+    Arguments:
+        lat: [ndarray] Latitudes in degrees (+N), WGS84.
+        lon: [ndarray] Longitudes in degrees (+E), WGS84.
+        h: [ndarray] Elevations in meters (WGS84 convention).
+        julian_date: [float] Julian date, epoch J2000.0.
+
+    Return:
+        (x, y, z): [tuple of ndarrays] Cartesian ECI coordinates in meters.
+
+    """
+
+    ecef_x, ecef_y, ecef_z = latLonAlt2ECEFArrays(np.radians(lat), np.radians(lon), h)
+
+    # Local sidereal time of every point
+    _, GST = JD2LST(julian_date, 0)
+    LST_rad = np.radians((GST + np.asarray(lon, dtype=np.float64) + 360)%360)
+
+    # The distance from the Earth's axis and the height above the equator plane don't change
+    p = np.sqrt(ecef_x**2 + ecef_y**2)
+
+    return p*np.cos(LST_rad), p*np.sin(LST_rad), ecef_z
+
+
+
 def ecef2LatLonAlt(x, y, z):
     """ Convert Earth centered - Earth fixed coordinates to geographical coordinates (latitude, longitude, 
         elevation).
@@ -435,6 +489,47 @@ def ecef2LatLonAlt(x, y, z):
 
 
 
+def ecef2LatLonAltArrays(x, y, z):
+    """ Same as ecef2LatLonAlt, for arrays of ECEF coordinates.
+
+    Arguments:
+        x: [ndarray] ECEF x coordinates
+        y: [ndarray] ECEF y coordinates
+        z: [ndarray] ECEF z coordinates
+
+    Return:
+        (lat, lon, alt): [tuple of ndarrays] latitudes and longitudes in radians, WGS84 elevations in meters
+
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+
+    # Calculate the polar eccentricity
+    ep = np.sqrt((EARTH.EQUATORIAL_RADIUS**2 - EARTH.POLAR_RADIUS**2)/(EARTH.POLAR_RADIUS**2))
+
+    lon = np.arctan2(y, x)
+
+    p = np.sqrt(x**2  +  y**2)
+
+    theta = np.arctan2( z*EARTH.EQUATORIAL_RADIUS, p*EARTH.POLAR_RADIUS)
+
+    lat = np.arctan2(z + (ep**2)*EARTH.POLAR_RADIUS*np.sin(theta)**3, \
+        p - (EARTH.E**2)*EARTH.EQUATORIAL_RADIUS*np.cos(theta)**3)
+
+    N = EARTH.EQUATORIAL_RADIUS/np.sqrt(1.0 - (EARTH.E**2)*np.sin(lat)**2)
+
+    # Correct for numerical instability in altitude near exact poles
+    near_pole = (np.abs(x) < 1000) & (np.abs(y) < 1000)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alt = np.where(near_pole, np.abs(z) - EARTH.POLAR_RADIUS, p/np.cos(lat) - N)
+
+
+    return lat, lon, alt
+
+
+
 def ECEF2AltAz(s_vect, p_vect):
     """ Given two sets of ECEF coordinates, compute alt/az which point from the point S to the point P.
 
@@ -814,6 +909,65 @@ def areaGeoPolygon(lats, lons, ht):
 
 
 
+def areaGeoPolygonArrays(lats, lons, ht):
+    """ Same as areaGeoPolygon, for many polygons with the same number of vertices at once.
+
+    Arguments:
+        lats: [ndarray] Latitudes of the vertices (degrees), the last axis runs along each polygon.
+        lons: [ndarray] Longitudes of the vertices (degrees), the same shape as lats.
+        ht: [float or ndarray] Height above sea level (meters), broadcast against the polygons.
+
+    Return:
+        area: [ndarray] Area enclosed by every polygon in m^2.
+
+    """
+
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+
+    # Compute the mean latitude of every polygon
+    lat_mean = np.mean(lats, axis=-1)
+
+    # Get distance from Earth centre to the position given by mean geographical coordinates, in WGS84 (m)
+    N = EARTH.EQUATORIAL_RADIUS/np.sqrt(1.0 - (EARTH.E**2)*np.sin(lat_mean)**2)
+
+    # Compute the total radius including the height
+    radius = N + ht
+
+    # Close the polygons (if a polygon was already closed, the added step has zero length and doesn't
+    #   change the area)
+    lats = np.concatenate([lats, lats[..., :1]], axis=-1)
+    lons = np.concatenate([lons, lons[..., :1]], axis=-1)
+
+    # Get colatitude (a measure of surface distance as an angle)
+    a = np.sin(lats/2)**2 + np.cos(lats)*np.sin(lons/2)**2
+    colat = 2*np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    # Azimuth of each point in segment from the arbitrary origin
+    az = np.arctan2(np.cos(lats)*np.sin(lons), np.sin(lats))%(2*np.pi)
+
+    # Calculate step sizes
+    daz = np.diff(az, axis=-1)
+    daz = (daz + np.pi)%(2*np.pi) - np.pi
+
+    # Determine average surface distance for each step
+    deltas = np.diff(colat, axis=-1)/2
+    colat = colat[..., 0:-1] + deltas
+
+    # Integral over azimuth is 1-cos(colatitudes)
+    integrands = (1 - np.cos(colat))*daz
+
+    # Integrate and save the answer as a fraction of the unit sphere
+    area = np.abs(np.sum(integrands, axis=-1))/(4*np.pi)
+
+    # Choose the inner area
+    area = np.minimum(area, 1 - area)
+
+    # Compute the area in square meters
+    return area*4*np.pi*radius**2
+
+
+
 def raDec2Vector(ra, dec):
     """ Convert stellar equatorial coordinates to a vector with X, Y and Z components.
     @param ra: [float] right ascension in degrees
@@ -1,6 +1,8 @@
 #!python
 #cython: language_level=3
 
+import weakref
+
 import numpy as np
 
 # Cython import
@@ -29,6 +31,7 @@ cdef extern from "math.h":
     double sqrt(double)
     double hypot(double, double)
     double fmod(double, double)
+    double floor(double)
     double M_PI "M_PI"
 
 
@@ -106,15 +109,166 @@ cpdef double angularSeparation(double ra1, double dec1, double ra2, double dec2)
 
 
 
+class StarCatalogIndex(object):
+    def __init__(self, catalog_list, zone_height=2.0):
+        """ Index of catalog stars by their position on the sky. The sky is divided into declination zones,
+            and every zone into RA cells of about the same angular size. The indices of the stars in every 
+            cell are kept in catalog order.
+
+        Arguments:
+            catalog_list: [ndarray] An array of (ra, dec, mag, ...) entries for stars (J2000, degrees).
+
+        Keyword arguments:
+            zone_height: [float] Height of declination zones (degrees). 2 by default.
+        """
+
+        self.zone_height = zone_height
+        self.n_zones = int(np.ceil(180.0/zone_height))
+        self.shape = (catalog_list.shape[0], catalog_list.shape[1])
+        self.data_ptr = catalog_list.__array_interface__['data'][0]
+
+        ra = np.mod(catalog_list[:, 0], 360.0)
+        dec = catalog_list[:, 1]
+
+        # Number of RA cells in every zone, so the cells are about as wide as the zones are high
+        zone_dec_edges = 90.0 - zone_height*np.arange(self.n_zones + 1)
+        zone_max_cos = np.cos(np.radians(np.clip(np.minimum(np.abs(zone_dec_edges[:-1]), 
+            np.abs(zone_dec_edges[1:])), 0, 90)))
+        zone_max_cos[(zone_dec_edges[:-1] >= 0) & (zone_dec_edges[1:] <= 0)] = 1.0
+        self.zone_cells = np.maximum(1, np.floor(360.0*zone_max_cos/zone_height)).astype(np.int64)
+        self.zone_first_cell = np.concatenate([[0], np.cumsum(self.zone_cells)]).astype(np.int64)
+
+        # Assign every star to a cell (stars with invalid coordinates are not indexed, as they never pass
+        #   the radius check)
+        valid = np.isfinite(ra) & np.isfinite(dec)
+        star_indices = np.where(valid)[0]
+
+        zones = np.clip(((90.0 - dec[valid])/zone_height).astype(np.int64), 0, self.n_zones - 1)
+        cells = np.minimum((ra[valid]/360.0*self.zone_cells[zones]).astype(np.int64), 
+            self.zone_cells[zones] - 1)
+        cell_ids = self.zone_first_cell[zones] + cells
+
+        # Sort the stars by cell, keeping the catalog order inside every cell
+        sort_order = np.argsort(cell_ids, kind='stable')
+        self.cell_stars = star_indices[sort_order].astype(np.int64)
+
+        n_cells = self.zone_first_cell[-1]
+        self.cell_start = np.concatenate([[0], np.cumsum(np.bincount(cell_ids, minlength=n_cells))])\
+            .astype(np.int64)
+
+
+    def matches(self, catalog_list):
+        """ Check that the index was built for an array of this shape and memory location. """
+
+        return (self.shape == (catalog_list.shape[0], catalog_list.shape[1])) \
+            and (self.data_ptr == catalog_list.__array_interface__['data'][0])
+
+
+    def candidates(self, double ra_c, double dec_c, double radius):
+        """ Return the sorted indices of all catalog stars in the cells which overlap the given cone.
+
+        Arguments:
+            ra_c: [float] Centre of extraction RA (degrees).
+            dec_c: [float] Centre of extraction dec (degrees).
+            radius: [float] Extraction radius (degrees).
+
+        Return:
+            [ndarray] Indices of catalog stars.
+        """
+
+        cdef int zone, zone_min, zone_max, cell_min, cell_max, n_cells, c
+        cdef double dec_min, dec_max, ra_half_width, cell_width
+
+        dec_min = max(dec_c - radius, -90)
+        dec_max = min(dec_c + radius, 90)
+
+        zone_min = max(<int>((90.0 - dec_max)/self.zone_height), 0)
+        zone_max = min(<int>((90.0 - dec_min)/self.zone_height), self.n_zones - 1)
+
+        # RA half-width of the cone (the cone contains a pole if it reaches over +/- 90 deg)
+        if (radius >= 90) or (fabs(dec_c) + radius >= 90):
+            ra_half_width = 180.0
+        else:
+            ra_half_width = degrees(asin(sin(radians(radius))/cos(radians(dec_c))))
+
+        ra_c = ra_c%360.0
+
+        slices = []
+        for zone in range(zone_min, zone_max + 1):
+
+            n_cells = self.zone_cells[zone]
+            cell_width = 360.0/n_cells
+
+            # Take one more cell on both sides, to be safe from rounding errors
+            cell_min = <int>floor((ra_c - ra_half_width)/cell_width) - 1
+            cell_max = <int>floor((ra_c + ra_half_width)/cell_width) + 1
+
+            # Take the whole zone if the cone covers all of it
+            if (ra_half_width >= 180) or (cell_max - cell_min + 1 >= n_cells):
+                cell_min = 0
+                cell_max = n_cells - 1
+
+            for c in range(cell_min, cell_max + 1):
+                cell = self.zone_first_cell[zone] + c%n_cells
+                slices.append(self.cell_stars[self.cell_start[cell]:self.cell_start[cell + 1]])
+
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.sort(np.concatenate(slices))
+
+
+
+# Indices of the loaded catalogs, by the id of the catalog array
+CATALOG_INDICES = {}
+
+
+def buildCatalogIndex(catalog_list):
+    """ Build the sky index of the given star catalog (or return the existing one) which is used by 
+        subsetCatalog. The index is kept as long as the catalog array exists. The RA and dec of the catalog
+        array should not be changed in place after the index was built.
+
+    Arguments:
+        catalog_list: [ndarray] An array of (ra, dec, mag) entries for stars (J2000, degrees).
+
+    Return:
+        [StarCatalogIndex]
+    """
+
+    key = id(catalog_list)
+
+    if key in CATALOG_INDICES:
+
+        catalog_ref, index = CATALOG_INDICES[key]
+
+        if (catalog_ref() is catalog_list) and index.matches(catalog_list):
+            return index
+
+    index = StarCatalogIndex(catalog_list)
+
+    # Remove the index when the catalog array is deleted
+    def _remove(ref, key=key):
+        entry = CATALOG_INDICES.get(key)
+        if (entry is not None) and (entry[0] is ref):
+            del CATALOG_INDICES[key]
+
+    CATALOG_INDICES[key] = (weakref.ref(catalog_list, _remove), index)
+
+    return index
+
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False) 
 def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, double dec_c, double jd,
         double lat, double lon, double radius, double mag_limit, bool remove_under_horizon=True):
     """ Make a subset of stars from the given star catalog around the given coordinates with a given radius.
     
+    The catalog is indexed by sky position on the first call (see buildCatalogIndex), and only the stars
+    close to the extraction radius are checked.
+
     Arguments:
-        catalog_list: [ndarray] An array of (ra, dec, mag) pairs for stars (J2000, degrees). Note that the 
-            array needs to be sorted by descending declination!
+        catalog_list: [ndarray] An array of (ra, dec, mag) pairs for stars (J2000, degrees).
         ra_c: [float] Centre of extraction RA (degrees).
         dec_c: [float] Centre of extraction dec (degrees).
         jd: [float] Julian date of observations.
@@ -136,8 +290,7 @@ def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, do
 
 
     # Define variables
-    cdef int i, k
-    cdef double dec_min, dec_max
+    cdef int i, j, k
     cdef double ra, dec, mag, elev
     cdef np.ndarray[FLOAT_TYPE_t, ndim=2] filtered_list = np.zeros(shape=(catalog_list.shape[0], \
         catalog_list.shape[1]), dtype=FLOAT_TYPE)
@@ -145,30 +298,19 @@ def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, do
     cdef np.ndarray[INT_TYPE_t, ndim=1] filtered_indices = np.zeros(shape=(catalog_list.shape[0]), \
         dtype=INT_TYPE)
 
-    # Calculate minimum and maximum declination
-    dec_min = dec_c - radius
-    if dec_min < -90:
-        dec_min = -90
-
-    dec_max = dec_c + radius
-    if dec_max > 90:
-        dec_max = 90
+    # Take only the stars in the parts of the sky which overlap the extraction radius
+    cdef np.ndarray[np.int64_t, ndim=1] candidates = buildCatalogIndex(catalog_list).candidates(ra_c, dec_c, \
+        radius)
 
     k = 0
-    for i in range(catalog_list.shape[0]):
+    for j in range(candidates.shape[0]):
+
+        i = candidates[j]
 
         ra = catalog_list[i,0]
         dec = catalog_list[i,1]
         mag = catalog_list[i,2]
 
-        # Skip if the declination is too large
-        if dec > dec_max:
-            continue
-
-        # End the loop if the declination is too small
-        if dec < dec_min:
-            break
-
         # Add star to the list if it is within a given radius and has a certain brightness
         if (angularSeparation(ra, dec, ra_c, dec_c) <= radius) and (mag <= mag_limit):
 
@@ -194,11 +336,41 @@ def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, do
 
 
 
+# Above this number of image-catalog star pairs, the catalog stars are put into a grid for matching
+cdef long MATCH_GRID_MIN_PAIRS = 10000
+
+
+def matchStars(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYPE_t, ndim=1] cat_x_array, \
+    np.ndarray[FLOAT_TYPE_t, ndim=1] cat_y_array, np.ndarray[INT_TYPE_t, ndim=1] cat_good_indices, \
+    double max_radius):
+    """ Match image stars to the closest catalog stars within the given radius.
+
+    Arguments:
+        stars_list: [ndarray] Image stars, the first two columns are Y and X image coordinates.
+        cat_x_array: [ndarray] X image coordinates of catalog stars.
+        cat_y_array: [ndarray] Y image coordinates of catalog stars.
+        cat_good_indices: [ndarray] Indices of catalog stars which should be used.
+        max_radius: [float] Maximum matching distance in pixels.
+
+    Return:
+        matched_indices: [ndarray] (N, 3) array of (image star index, catalog star index, distance) for 
+            every matched image star.
+    """
+
+    # Use the spatial index when there are many stars, for a few stars checking all pairs is faster
+    if <long>stars_list.shape[0]*<long>cat_good_indices.shape[0] >= MATCH_GRID_MIN_PAIRS:
+        return matchStarsGrid(stars_list, cat_x_array, cat_y_array, cat_good_indices, max_radius)
+
+    return matchStarsBruteForce(stars_list, cat_x_array, cat_y_array, cat_good_indices, max_radius)
+
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def matchStars(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYPE_t, ndim=1] cat_x_array, \
+def matchStarsBruteForce(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYPE_t, ndim=1] cat_x_array, \
     np.ndarray[FLOAT_TYPE_t, ndim=1] cat_y_array, np.ndarray[INT_TYPE_t, ndim=1] cat_good_indices, \
     double max_radius):
+    """ Match stars by checking all pairs of image and catalog stars. See matchStars for the arguments. """
         
 
     cdef int i, j
@@ -266,6 +438,148 @@ def matchStars(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYP
 
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def matchStarsGrid(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYPE_t, ndim=1] cat_x_array, \
+    np.ndarray[FLOAT_TYPE_t, ndim=1] cat_y_array, np.ndarray[INT_TYPE_t, ndim=1] cat_good_indices, \
+    double max_radius):
+    """ Match stars using a grid of catalog stars. The grid cells are at least max_radius wide, so only the
+        cell of the image star and its 8 neighbours are searched. The results are the same as for 
+        matchStarsBruteForce (for equally distant catalog stars, the one which comes first in 
+        cat_good_indices is taken). See matchStars for the arguments.
+    """
+
+    cdef int i, j, k, n, cell_x, cell_y, cx, cy, cell, best_j
+    cdef unsigned int cat_idx
+    cdef int matched = 0
+    cdef double min_dist, dist, im_star_y, im_star_x, cat_x, cat_y
+    cdef double x_min, x_max, y_min, y_max, cell_size
+
+    # Get the lengths of input arrays
+    cdef int stars_len = stars_list.shape[0]
+    cdef int cat_len = cat_good_indices.shape[0]
+
+    # List for matched indices
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=2] matched_indices = np.zeros(shape=(stars_len, 3), dtype=FLOAT_TYPE)
+
+    if (stars_len == 0) or (cat_len == 0) or not (max_radius > 0):
+        return matched_indices[:0]
+
+
+    ### Build the grid ###
+
+    # Only the catalog stars within max_radius of the image stars' bounding box can be matched
+    if not np.any(np.isfinite(stars_list[:, 0]) & np.isfinite(stars_list[:, 1])):
+        return matched_indices[:0]
+
+    x_min = np.nanmin(stars_list[:, 1]) - max_radius
+    x_max = np.nanmax(stars_list[:, 1]) + max_radius
+    y_min = np.nanmin(stars_list[:, 0]) - max_radius
+    y_max = np.nanmax(stars_list[:, 0]) + max_radius
+
+    # Limit the number of cells to about the number of catalog stars
+    cell_size = max(max_radius, sqrt((x_max - x_min)*(y_max - y_min)/cat_len))
+
+    cdef int n_cells_x = <int>((x_max - x_min)/cell_size) + 1
+    cdef int n_cells_y = <int>((y_max - y_min)/cell_size) + 1
+
+    # Cell of every catalog star (-1 if it is outside the grid)
+    cdef np.ndarray[np.int32_t, ndim=1] star_cell = np.empty(cat_len, dtype=np.int32)
+
+    # Start of every cell in the sorted list of catalog stars
+    cdef np.ndarray[np.int32_t, ndim=1] cell_start = np.zeros(n_cells_x*n_cells_y + 1, dtype=np.int32)
+
+    for j in range(cat_len):
+
+        cat_idx = cat_good_indices[j]
+        cat_x = cat_x_array[cat_idx]
+        cat_y = cat_y_array[cat_idx]
+
+        # Skip the stars outside the grid (the check is False for NaNs as well)
+        if not ((cat_x >= x_min) and (cat_x <= x_max) and (cat_y >= y_min) and (cat_y <= y_max)):
+            star_cell[j] = -1
+            continue
+
+        cell_x = min(<int>((cat_x - x_min)/cell_size), n_cells_x - 1)
+        cell_y = min(<int>((cat_y - y_min)/cell_size), n_cells_y - 1)
+
+        star_cell[j] = cell_y*n_cells_x + cell_x
+        cell_start[star_cell[j] + 1] += 1
+
+    # Turn the counts into cell offsets
+    for cell in range(n_cells_x*n_cells_y):
+        cell_start[cell + 1] += cell_start[cell]
+
+    # Sort the stars into the cells (counting sort, keeps the order of the stars inside every cell)
+    cdef np.ndarray[np.int32_t, ndim=1] fill = cell_start[:-1].copy()
+    cdef np.ndarray[np.int32_t, ndim=1] cell_stars = np.empty(max(cell_start[n_cells_x*n_cells_y], 1), 
+        dtype=np.int32)
+
+    for j in range(cat_len):
+
+        if star_cell[j] < 0:
+            continue
+
+        cell_stars[fill[star_cell[j]]] = j
+        fill[star_cell[j]] += 1
+
+    ### ###
+
+
+    ### Match image and catalog stars ###
+
+    for i in range(stars_len):
+
+        # Extract image star coordinates
+        im_star_y = stars_list[i, 0]
+        im_star_x = stars_list[i, 1]
+
+        min_dist = max_radius
+        best_j = -1
+
+        if (im_star_x != im_star_x) or (im_star_y != im_star_y):
+            continue
+
+        cell_x = min(<int>((im_star_x - x_min)/cell_size), n_cells_x - 1)
+        cell_y = min(<int>((im_star_y - y_min)/cell_size), n_cells_y - 1)
+
+        # Check the catalog stars in the neighbouring cells
+        for cy in range(max(cell_y - 1, 0), min(cell_y + 2, n_cells_y)):
+            for cx in range(max(cell_x - 1, 0), min(cell_x + 2, n_cells_x)):
+
+                cell = cy*n_cells_x + cx
+
+                for k in range(cell_start[cell], cell_start[cell + 1]):
+
+                    j = cell_stars[k]
+                    cat_idx = cat_good_indices[j]
+
+                    # Calculate the distance between stars
+                    dist = sqrt((im_star_x - cat_x_array[cat_idx])**2 + (im_star_y - cat_y_array[cat_idx])**2)
+
+                    # Take the closest star, or the one which comes first if they are equally distant
+                    if (dist < min_dist) or ((dist == min_dist) and (best_j >= 0) and (j < best_j)):
+                        min_dist = dist
+                        best_j = j
+
+
+        # Take the best matched star if the distance was within the maximum radius
+        if best_j >= 0:
+
+            # Add the matched indices to the output list
+            matched_indices[matched, 0] = i
+            matched_indices[matched, 1] = cat_good_indices[best_j]
+            matched_indices[matched, 2] = min_dist
+
+            matched += 1
+
+
+    # Cut the output list to the number of matched stars
+    return matched_indices[:matched]
+
+
+
 @cython.cdivision(True)
 cdef double cyjd2LST(double jd, double lon):
     """ Convert Julian date to apparent Local Sidereal Time. The times is apparent, not mean!
@@ -99,15 +99,14 @@ class BufferedCapture(Process):
     
     running = False
     
-    def __init__(self, array1, start_time1, array2, start_time2, config, video_file=None, night_data_dir=None,
+    def __init__(self, frame_buffer, config, video_file=None, night_data_dir=None,
                  saved_frames_dir=None, daytime_mode=None, camera_mode_switch_trigger=None):
-        """ Populate arrays with (startTime, frames) after startCapture is called.
+        """ Populate the frame ring buffer with (startTime, frames) blocks after startCapture is called.
         
         Arguments:
-            array1: numpy array in shared memory that is going to be filled with frames
-            start_time1: float in shared memory that holds time of first frame in array1
-            array2: second numpy array in shared memory
-            start_time2: float in shared memory that holds time of first frame in array2
+            frame_buffer: [FrameRingBuffer] ring buffer in shared memory that is going to be filled with
+                blocks of frames
+            config: configuration class
 
         Keyword arguments:
             video_file: [str] Path to the video file, if it was given as the video source. None by default.
@@ -138,13 +137,8 @@ class BufferedCapture(Process):
         else:
             self.camera_mode_switch_trigger = camera_mode_switch_trigger
 
-        # Store shared memory arrays and values for compressor (these are designed for multiprocessing)
-        self.array1 = array1
-        self.start_time1 = start_time1
-        self.array2 = array2
-        self.start_time2 = start_time2
-        self.start_time1.value = 0
-        self.start_time2.value = 0
+        # Store the shared memory ring buffer for the compressor (designed for multiprocessing)
+        self.frame_buffer = frame_buffer
 
         # Initialize shared values for raw frame saving (these are designed for multiprocessing)
         if self.config.save_frames:
@@ -218,8 +212,7 @@ class BufferedCapture(Process):
         try:
             log.debug('Freeing shared memory resources...')
             # Frame buffers
-            del self.array1
-            del self.array2
+            del self.frame_buffer
 
             # Raw frame and timestamp buffers if they exist
             if self.config.save_frames:
@@ -542,6 +535,10 @@ class BufferedCapture(Process):
                 if ret:
                     timestamp = time.time()
 
+            # Frames from a GRAY8 pipeline are already single-channel
+            if self.native_gray:
+                return ret, frame, timestamp
+
             # Check if frame contains color information
             if check_color:
                 self.convert_to_gray = self.isGrayscale(frame)
@@ -1052,6 +1049,9 @@ class BufferedCapture(Process):
         # Assume OpenCV as the default video device type, which will be overridden if GStreamer is used
         self.video_device_type = "cv2"
 
+        # Frames are delivered as native GRAY8 only if the GStreamer pipeline is renegotiated below
+        self.native_gray = False
+
         # Use a file as the video source
         if self.video_file is not None:
 
@@ -1244,6 +1244,31 @@ class BufferedCapture(Process):
                     log.info("Video format: {}, {}P, color: {}".format(self.config.gst_colorspace, height, 
                                                                        not self.convert_to_gray))
 
+                    # Keep track of the camera mode the pipeline caps were negotiated for
+                    self.pipeline_daytime_mode = self.daytime_mode.value
+
+                    # If the stream is mono at night, restart the pipeline with GRAY8 caps so only the luma 
+                    #   plane is converted and the frames can be copied to the frame buffer as they are
+                    if self.config.gst_native_gray and self.convert_to_gray \
+                        and (self.config.gst_colorspace != 'GRAY8') and (not self.daytime_mode.value):
+
+                        log.info("Mono stream detected, restarting the GStreamer pipeline with GRAY8 caps...")
+
+                        self.device = self.createGstreamDevice(
+                            'GRAY8', gst_decoder=self.config.gst_decoder,
+                            video_file_dir=raw_video_dir, segment_duration_sec=self.config.raw_video_duration,
+                            max_retries=5, retry_interval=1
+                            )
+
+                        if not self.device:
+                            raise ValueError("Could not create the GRAY8 GStreamer pipeline.")
+
+                        self.pts_buffer = []
+                        self.frame_shape = (height, width)
+                        self.native_gray = True
+
+                        log.info("Video format: GRAY8, {}P, color: False".format(height))
+
                     # Set the video device type
                     self.video_device_type = "gst"
 
@@ -1517,6 +1542,8 @@ class BufferedCapture(Process):
             self.start_timestamp = 0
             self.frame_shape = None
             self.convert_to_gray = False
+            self.native_gray = False
+            self.pipeline_daytime_mode = None
 
             # Initialize smoothing variables
             self.startup_flag = True
@@ -1618,9 +1645,9 @@ class BufferedCapture(Process):
             # Convert the first time to a UNIX timestamp
             video_first_timestamp = (video_first_time - datetime.datetime(1970, 1, 1)).total_seconds()
 
-        # Use the first frame buffer to start - it will be flip-flopped between the first and the second
-        #   buffer during capture, to prevent any data loss
-        buffer_one = True
+        # Slot of the frame ring buffer which is currently being filled. It is kept until a full block is
+        #   committed to the compression, and a new one is taken for the next block
+        write_slot = None
 
         wait_for_reconnect = False
 
@@ -1635,29 +1662,25 @@ class BufferedCapture(Process):
         # Run until stopped from the outside
         while not self.exit.is_set():
 
-            # Wait until the compression is done (only when a video file is used)
-            if self.video_file is not None:
-                
-                wait_for_compression = False
+            # Take a free slot in the frame ring buffer for the next block
+            if write_slot is None:
+
+                # When a video file is used, wait until the compression frees up a slot
+                if self.video_file is not None:
+                    write_slot = self.frame_buffer.acquireWriteSlot(block=True, timeout=0.5)
 
-                if buffer_one:
-                    if self.start_time1.value == -1:
-                        wait_for_compression = True
+                    if write_slot is None:
+                        log.debug("Waiting for the compression to free up a frame buffer slot...")
+                        continue
+
+                # Never wait when capturing from a camera - if the ring is full, the block will be dropped
                 else:
-                    if self.start_time2.value == -1:
-                        wait_for_compression = True
+                    write_slot = self.frame_buffer.acquireWriteSlot(block=False)
 
-                if wait_for_compression:
-                    log.debug("Waiting for the {:d}. compression thread to finish...".format(int(not buffer_one) + 1))
-                    time.sleep(0.1)
-                    continue
+                    if write_slot is None:
+                        log.warning("All {:d} frame buffer slots are waiting for compression, the next block "
+                                    "will be dropped!".format(self.frame_buffer.n_slots))
 
-            
-            if buffer_one:
-                self.start_time1.value = 0
-            else:
-                self.start_time2.value = 0
-            
 
             # If the video device was disconnected, wait 5s for reconnection
             if wait_for_reconnect:
@@ -1718,6 +1741,19 @@ class BufferedCapture(Process):
                     switchCameraMode(self.config, self.daytime_mode, self.camera_mode_switch_trigger)
 
 
+            # Restart the GStreamer pipeline if the day/night mode changed, so the caps are renegotiated: 
+            #   daytime frames need the color caps, and the night stream is checked again for native GRAY8
+            if self.config.gst_native_gray and (self.video_file is None) and (self.video_device_type == "gst") \
+                and (self.pipeline_daytime_mode is not None) \
+                and (self.pipeline_daytime_mode != self.daytime_mode.value) \
+                and (self.native_gray or self.pipeline_daytime_mode):
+
+                log.info("Camera mode changed, restarting the GStreamer pipeline to renegotiate the caps...")
+                self.releaseResources()
+                wait_for_reconnect = True
+                continue
+
+
             log.info('Grabbing a new block of {:d} frames...'.format(block_frames))
             for i in range(block_frames):
 
@@ -1957,10 +1993,8 @@ class BufferedCapture(Process):
                     # Assign the frame to shared memory (track time to do so)
   
                     t1_assign = time.time()
-                    if buffer_one:
-                        self.array1[i, :gray.shape[0], :gray.shape[1]] = gray
-                    else:
-                        self.array2[i, :gray.shape[0], :gray.shape[1]] = gray
+                    if write_slot is not None:
+                        self.frame_buffer.frames(write_slot)[i, :gray.shape[0], :gray.shape[1]] = gray
 
                     t_assignment = time.time() - t1_assign
 
@@ -1988,20 +2022,22 @@ class BufferedCapture(Process):
                 and not self.daytime_mode.value
                 and first_frame_timestamp is not None):
 
-                # Set the starting value of the frame block, which indicates to the compression that the
-                # block is ready for processing
-                if buffer_one:
-                    self.start_time1.value = first_frame_timestamp
+                # Commit the frame block with its starting time, which hands it over to the compression
+                if write_slot is not None:
+                    self.frame_buffer.commitWriteSlot(write_slot, first_frame_timestamp)
+                    write_slot = None
+
+                    log.info('New block of raw frames available for compression with starting time: {:s}'
+                             .format(str(first_frame_timestamp)))
 
                 else:
-                    self.start_time2.value = first_frame_timestamp
+                    self.frame_buffer.dropBlock()
+                    self.dropped_frames.value += block_frames
 
-                log.info('New block of raw frames available for compression with starting time: {:s}'
-                         .format(str(first_frame_timestamp)))
+                    log.info('Frame block with starting time {:s} dropped, frame buffer is full! Dropped '
+                             'blocks so far: {:d}'.format(str(first_frame_timestamp),
+                                                         self.frame_buffer.droppedBlocks()))
 
-            
-            # Switch the frame block buffer flags
-            buffer_one = not buffer_one
             if self.config.report_dropped_frames:
                 log.info('Estimated FPS: {:.3f}'.format(block_frames/(time.time() - t_block)))
         
@@ -2051,6 +2087,7 @@ if __name__ == "__main__":
     import multiprocessing
 
     import RMS.ConfigReader as cr
+    from RMS.FrameBuffer import FrameRingBuffer
     from RMS.Logger import initLogging
 
     ###
@@ -2084,10 +2121,7 @@ if __name__ == "__main__":
 
 
     # Init dummy shared memory
-    sharedArrayBase = multiprocessing.Array(ctypes.c_uint8, 256*(config.width)*(config.height))
-    sharedArray = np.ctypeslib.as_array(sharedArrayBase.get_obj())
-    sharedArray = sharedArray.reshape(256, (config.height), (config.width))
-    startTime = multiprocessing.Value('d', 0.0)
+    frame_buffer = FrameRingBuffer(2, 256, config.height, config.width)
 
 
     # If a video is given, use it as the video source
@@ -2095,8 +2129,7 @@ if __name__ == "__main__":
 
         print("Using video file: {}".format(cml_args.video_file))
 
-        bc = BufferedCapture(sharedArray, startTime, sharedArray, startTime, config, 
-                             video_file=cml_args.video_file)
+        bc = BufferedCapture(frame_buffer, config, video_file=cml_args.video_file)
         
         bc.initVideoDevice()
         
@@ -2119,7 +2152,7 @@ if __name__ == "__main__":
     else:
 
         # Init the BufferedCapture object
-        bc = BufferedCapture(sharedArray, startTime, sharedArray, startTime, config)
+        bc = BufferedCapture(frame_buffer, config)
 
         device = bc.createGstreamDevice('BGR', video_file_dir=None, segment_duration_sec=config.raw_video_duration)
 
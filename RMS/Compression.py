@@ -26,7 +26,7 @@ import numpy as np
 import cv2
 
 
-from RMS.VideoExtraction import Extractor
+from RMS.VideoExtraction import ExtractionWorker
 from RMS.Formats import FFfile, FFStruct
 from RMS.Formats import FieldIntensities
 from RMS.Logger import getLogger
@@ -53,29 +53,26 @@ class Compressor(multiprocessing.Process):
 
     running = False
     
-    def __init__(self, data_dir, array1, start_time1, array2, start_time2, config, detector=None):
+    def __init__(self, data_dir, frame_buffer, config, detector=None):
         """
 
         Arguments:
-            array1: first numpy array in shared memory of grayscale video frames
-            start_time1: float in shared memory that holds time of first frame in array1
-            array2: second numpy array in shared memory
-            start_time2: float in shared memory that holds time of first frame in array2
+            data_dir: [str] Path to the directory where the FF files will be saved.
+            frame_buffer: [FrameRingBuffer] ring buffer in shared memory which holds blocks of grayscale
+                video frames and the times of their first frames
             config: configuration class
 
         Keyword arguments:
             detector: [Detector object] Handle to Detector object used for running star extraction and
-                meteor detection.
+                meteor detection. The jobs carry only the directory and the FF file name, so the config has
+                to be given to the detector through its extra function arguments.
 
         """
         
         super(Compressor, self).__init__()
         
         self.data_dir = data_dir
-        self.array1 = array1
-        self.start_time1 = start_time1
-        self.array2 = array2
-        self.start_time2 = start_time2
+        self.frame_buffer = frame_buffer
         self.config = config
 
         self.detector = detector
@@ -102,7 +99,8 @@ class Compressor(multiprocessing.Process):
         """
         
         # Run cythonized compression
-        ftp_array, fieldsum = compressFrames(frames, self.config.deinterlace_order)
+        ftp_array, fieldsum = compressFrames(frames, self.config.deinterlace_order, 
+            num_threads=self.config.compression_threads)
 
         return ftp_array, fieldsum
     
@@ -217,8 +215,7 @@ class Compressor(multiprocessing.Process):
         # Free shared memory after the compressor is done
         try:
             log.debug('Freeing frame buffers in Compressor...')
-            del self.array1
-            del self.array2
+            del self.frame_buffer
         except Exception as e:
             log.debug('Freeing frame buffers failed with error:' + repr(e))
             log.debug(repr(traceback.format_exception(*sys.exc_info())))
@@ -241,64 +238,32 @@ class Compressor(multiprocessing.Process):
         """
         
         n = 0
+
+        # Start the fireball extraction, it runs in one process for the whole night
+        extraction_worker = None
+        if self.config.enable_fireball_detection:
+            extraction_worker = ExtractionWorker(self.config, self.data_dir, self.frame_buffer.block_frames,
+                self.frame_buffer.height, self.frame_buffer.width,
+                n_slots=self.config.fireball_extraction_slots)
+            extraction_worker.start()
         
         # Repeat until the compressor is killed from the outside
         while not self.exit.is_set():
 
-            # Block until frames are available
-            while (self.start_time1.value == 0) and (self.start_time2.value == 0):
-
-                # Exit function if process was stopped from the outside
-                if self.exit.is_set():
-
-                    log.debug('Compression run exit')
-                    self.run_exited.set()
-
-                    return None
-
-                time.sleep(0.1)
-
-                
-
-            t = time.time()
-
-            
-            buffer_one = True
-            if self.start_time1.value > 0:
-
-                # Retrieve time of first frame
-                startTime = float(self.start_time1.value)
-
-                # Copy frames
-                frames = self.array1
+            # Block until a block of frames is available, but wake up regularly to check the exit flag
+            slot, startTime = self.frame_buffer.acquireReadSlot(timeout=0.5)
 
-                # Tell the capture thread to wait until the compression is completed by setting this to -1
-                self.start_time1.value = -1
-                buffer_one = True
-
-            elif self.start_time2.value > 0:
-
-                # Retrieve time of first frame
-                startTime = float(self.start_time2.value)
-
-                # Copy frames
-                frames = self.array2
-
-                # Tell the capture thread to wait until the compression is completed
-                self.start_time2.value = -1
-                buffer_one = False
-
-            else:
-
-                # Wait until data is available
-                log.debug("Compression waiting for frames...")
-                time.sleep(0.1)
+            if slot is None:
                 continue
 
-            
             log.debug("Compressing frame block with start time at: {:s}".format(str(startTime)))
+            log.debug("Frame buffer queue depth: {:d}/{:d}, max: {:d}, dropped blocks: {:d}".format(
+                self.frame_buffer.depth(), self.frame_buffer.n_slots, self.frame_buffer.maxDepth(),
+                self.frame_buffer.droppedBlocks()))
+
+            # Frames are not copied, the slot stays reserved until it is released
+            frames = self.frame_buffer.frames(slot)
 
-            #log.debug("memory copy: " + str(time.time() - t) + "s")
             t = time.time()
             
             
@@ -306,12 +271,13 @@ class Compressor(multiprocessing.Process):
             compressed, field_intensities = self.compress(frames)
 
             
-            # Once the compression is done, tell the capture thread to keep filling the buffer
-            if buffer_one:
-                self.start_time1.value = 0
+            # The fireball extraction gets its own copy of the raw frames, as the capture will overwrite them
+            extraction_slot = None
+            if extraction_worker is not None:
+                extraction_slot = extraction_worker.copyBlock(frames)
 
-            else:
-                self.start_time2.value = 0
+            # Once the compression is done, return the slot to the capture
+            self.frame_buffer.releaseReadSlot(slot)
 
 
             # Cut out the compressed frames to the proper size
@@ -336,12 +302,19 @@ class Compressor(multiprocessing.Process):
             # Save the extracted intensities per every field
             FieldIntensities.saveFieldIntensitiesBin(field_intensities, self.data_dir, filename_micros)
 
-            # Run the extractor
-            if self.config.enable_fireball_detection:
-                extractor = Extractor(self.config, self.data_dir)
-                extractor.start(frames, compressed, filename_millis)
+            # Queue the block for the fireball extraction
+            if extraction_worker is not None:
+
+                if extraction_slot is None:
+                    log.warning("Fireball extraction is behind, skipping: {:s}".format(filename_millis))
 
-                log.debug('Extractor started for: ' + filename_millis)
+                else:
+                    extraction_worker.submit(extraction_slot, compressed, filename_millis)
+                    log.debug('Extraction queued for: ' + filename_millis)
+
+                log.debug("Fireball extraction backlog: {:d}/{:d}, max: {:d}, skipped blocks: {:d}".format(
+                    extraction_worker.backlog(), extraction_worker.blocks.n_slots,
+                    extraction_worker.maxBacklog(), extraction_worker.skippedBlocks()))
 
 
             # Fully format the filename (this could not have been done before as the extractor has to add
@@ -353,11 +326,16 @@ class Compressor(multiprocessing.Process):
             if self.detector is not None:
 
                 # Add the file to the detector queue
-                self.detector.addJob([self.data_dir, filename, self.config])
+                self.detector.addJob([self.data_dir, filename])
                 log.info('Added file for detection: {:s}'.format(filename))
 
 
 
+        # Let the extraction finish the queued blocks
+        if extraction_worker is not None:
+            log.debug('Stopping the fireball extraction...')
+            extraction_worker.stop(timeout=30)
+
         log.debug('Compression run exit')
         time.sleep(1.0)
         self.run_exited.set()
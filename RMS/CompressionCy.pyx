@@ -3,6 +3,7 @@ import numpy as np
 # Cython import
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange, threadid
 
 # Define numpy types
 INT8_TYPE = np.uint8
@@ -17,13 +18,63 @@ ctypedef np.float64_t FLOAT_TYPE_t
 
 # Declare math functions
 cdef extern from "math.h":
-    double sqrt(double)
+    double sqrt(double) nogil
+
+
+
+def _randomTable():
+    """ Generate the table of 2**16 pseudorandom numbers which is used to randomly select the frame of the 
+        maximum pixel value when there are several frames with the same maximum. The table is generated
+        from a fixed seed, so the serial and the parallel compression give identical results.
+    """
+
+    cdef np.ndarray[INT8_TYPE_t, ndim=1] randomN = np.empty(shape=[65536], dtype=INT8_TYPE)
+    cdef unsigned int arand = 0
+    cdef unsigned int n
+
+    for n in range(65536):
+        arand = (arand*32719 + 3)%32749
+        randomN[n] = <unsigned char>(32767.0/<double>(1 + arand%32767))
+
+    return randomN
+
+
+# The random table is computed only once, when the module is loaded
+RANDOM_N = _randomTable()
+
+
+
+cdef inline unsigned short _rowRandStart(unsigned int y) nogil:
+    """ Position in the random table at the beginning of the given image row. Every row starts at a fixed 
+        position, so the rows can be compressed independently and in any order. The multiplier spreads the
+        rows over the whole table.
+    """
+
+    return <unsigned short>((1 + y*40503)%65536)
 
 
 @cython.cdivision(True)
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def compressFrames(np.ndarray[INT8_TYPE_t, ndim=3] frames, int deinterlace_order):
+def compressFrames(np.ndarray[INT8_TYPE_t, ndim=3] frames, int deinterlace_order, int num_threads=1):
+    """ Compress a block of frames to the four-frame temporal pixel (FTP) format and compute the sum of
+        intensities per every field.
+
+    Arguments:
+        frames: [3D ndarray] Grayscale frames (N, y, x).
+        deinterlace_order: [int] Deinterlacing order. Negative values disable the per-field sums.
+
+    Keyword arguments:
+        num_threads: [int] Number of threads to use. If larger than 1, rows of the image are compressed in
+            parallel. The result is identical for any number of threads. 1 by default.
+
+    Return:
+        ftp_array, fieldsum: [tuple of ndarrays] FTP array (4, y, x) and field sums.
+    """
+
+    if num_threads > 1:
+        return compressFramesParallel(frames, deinterlace_order, num_threads)
+
 
     # Init the output four frame temporal pixel array
     cdef np.ndarray[INT8_TYPE_t, ndim=3] ftp_array = np.empty([4, frames.shape[1], frames.shape[2]], 
@@ -48,7 +99,7 @@ def compressFrames(np.ndarray[INT8_TYPE_t, ndim=3] frames, int deinterlace_order
         deinterlace_multiplier = 2
 
     
-    cdef unsigned short rand_count = 1
+    cdef unsigned short rand_count
 
     cdef unsigned int var, max_val, max_val_2, max_val_3, max_val_4, max_frame, mean, pixel, n, num_equal
     
@@ -61,17 +112,15 @@ def compressFrames(np.ndarray[INT8_TYPE_t, ndim=3] frames, int deinterlace_order
 
     cdef unsigned int fieldsum_indx
     
-    # Populate the randomN array with 2**16 random numbers
-    cdef np.ndarray[INT8_TYPE_t, ndim=1] randomN = np.empty(shape=[65536], dtype=INT8_TYPE)
-    cdef unsigned int arand = randomN[0]
+    # The randomN array with 2**16 random numbers
+    cdef np.ndarray[INT8_TYPE_t, ndim=1] randomN = RANDOM_N
 
 
-    for n in range(65536):
-        arand = (arand*32719 + 3)%32749
-        randomN[n] = <unsigned char>(32767.0/<double>(1 + arand%32767))
+    for y in range(height):
 
+        # The random counter starts at a fixed position in every row
+        rand_count = _rowRandStart(y)
 
-    for y in range(height):
         for x in range(width):
         
             acc = 0
@@ -174,4 +223,157 @@ def compressFrames(np.ndarray[INT8_TYPE_t, ndim=3] frames, int deinterlace_order
             ftp_array[3, y, x] = var
 
 
-    return ftp_array, fieldsum[:frames_num*deinterlace_multiplier]
\ No newline at end of file
+    return ftp_array, fieldsum[:frames_num*deinterlace_multiplier]
+
+
+
+
+@cython.cdivision(True)
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _compressRow(unsigned char[:, :, :] frames, unsigned char[:, :, :] ftp_array, 
+    unsigned char[:] randomN, unsigned int[:] fieldsum, unsigned int y, int deinterlace_order, 
+    unsigned int deinterlace_multiplier) nogil:
+    """ Compress one row of the frame block. This is the same algorithm as in compressFrames, but the field
+        sums are accumulated into a thread-private array.
+    """
+
+    cdef unsigned int var, max_val, max_val_2, max_val_3, max_val_4, max_frame, mean, pixel, n, num_equal
+    cdef unsigned int x, acc
+    cdef unsigned int width = frames.shape[2]
+    cdef unsigned int frames_num = frames.shape[0]
+    cdef unsigned int frames_num_minus_four = frames_num - 4
+    cdef unsigned int frames_num_minus_five = frames_num - 5
+    cdef unsigned int fieldsum_indx
+    cdef unsigned short rand_count = _rowRandStart(y)
+
+    # The field index only depends on the row
+    cdef unsigned int field_offset = (deinterlace_multiplier - 1)*((y + deinterlace_order)%2)
+
+    for x in range(width):
+    
+        acc = 0
+        var = 0
+        max_val = 0
+        max_val_2 = 0
+        max_val_3 = 0
+        max_val_4 = 0
+        max_frame = 0
+        num_equal = 0
+        
+        for n in range(frames_num):
+        
+            pixel = frames[n, y, x]
+            acc += pixel
+            var += pixel*pixel
+            
+            if pixel > max_val:
+                
+                max_val_4 = max_val_3
+                max_val_3 = max_val_2
+                max_val_2 = max_val
+                max_val = pixel
+
+                max_frame = n
+                num_equal = 1
+
+
+            else:
+
+                if max_val == pixel:
+                
+                    num_equal += 1
+                    
+                    rand_count = (rand_count + 1)%65536
+
+                    if num_equal <= randomN[rand_count]:
+                        max_frame = n
+
+
+                if pixel > max_val_2:
+                    max_val_4 = max_val_3
+                    max_val_3 = max_val_2
+                    max_val_2 = pixel
+
+                elif pixel > max_val_3:
+                    max_val_4 = max_val_3
+                    max_val_3 = pixel
+
+                elif pixel > max_val_4:
+                    max_val_4 = pixel
+
+
+            fieldsum_indx = deinterlace_multiplier*n + field_offset
+            fieldsum[fieldsum_indx] += pixel
+
+        
+        # Calculate mean without top 4 max values
+        acc -= max_val + max_val_2 + max_val_3 + max_val_4
+        mean = acc/frames_num_minus_four
+
+        # Calculate stddev without top 4 max values
+        var -= max_val*max_val + max_val_2*max_val_2 + max_val_3*max_val_3 + max_val_4*max_val_4
+        var -= acc*mean    
+        var = <unsigned int> sqrt(var/frames_num_minus_five)
+
+        if var == 0:
+            var = 1
+        
+        ftp_array[0, y, x] = max_val
+        ftp_array[1, y, x] = max_frame
+        ftp_array[2, y, x] = mean
+        ftp_array[3, y, x] = var
+
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def compressFramesParallel(np.ndarray[INT8_TYPE_t, ndim=3] frames, int deinterlace_order, int num_threads):
+    """ Multithreaded version of compressFrames, the image rows are distributed among threads. The output is 
+        bit-identical to the serial version, as the random counter starts at a fixed position in every row.
+
+    Arguments:
+        frames: [3D ndarray] Grayscale frames (N, y, x).
+        deinterlace_order: [int] Deinterlacing order. Negative values disable the per-field sums.
+        num_threads: [int] Number of threads to use.
+
+    Return:
+        ftp_array, fieldsum: [tuple of ndarrays] FTP array (4, y, x) and field sums.
+    """
+
+    cdef unsigned int height = frames.shape[1]
+    cdef unsigned int width = frames.shape[2]
+    cdef unsigned int frames_num = frames.shape[0]
+    cdef unsigned int deinterlace_multiplier
+    cdef int y
+    cdef int tid
+
+    if num_threads < 1:
+        num_threads = 1
+
+    if deinterlace_order < 0:
+        deinterlace_multiplier = 1
+    else:
+        deinterlace_multiplier = 2
+
+    # Init the outputs. Every thread gets its own field sum array to avoid write contention
+    ftp_array = np.empty([4, height, width], dtype=INT8_TYPE)
+    fieldsum_threads = np.zeros((num_threads, 2*frames_num), INT32_TYPE)
+
+    cdef unsigned char[:, :, :] frames_view = frames
+    cdef unsigned char[:, :, :] ftp_view = ftp_array
+    cdef unsigned int[:, :] fieldsum_view = fieldsum_threads
+    cdef unsigned char[:] random_view = RANDOM_N
+
+
+    # Compress all rows in parallel
+    for y in prange(height, nogil=True, schedule='static', num_threads=num_threads):
+        tid = threadid()
+        _compressRow(frames_view, ftp_view, random_view, fieldsum_view[tid], y, deinterlace_order, 
+            deinterlace_multiplier)
+
+
+    # Sum up field sums from all threads (unsigned 32-bit overflow behaves the same as in the serial sum)
+    fieldsum = np.sum(fieldsum_threads, axis=0, dtype=INT32_TYPE)
+
+    return ftp_array, fieldsum[:frames_num*deinterlace_multiplier]
@@ -17,6 +17,7 @@
 from __future__ import absolute_import, division, print_function
 
 import math
+import multiprocessing
 import os
 import sys
 from RMS.Misc import getRmsRootDir
@@ -292,6 +293,9 @@ class Config:
         # Decoder for the gstreamer media backend (e.g. decodebin, avdec_h264, nvh264dec)
         self.gst_decoder = "avdec_h264"
 
+        # Renegotiate the gstreamer caps to GRAY8 when the camera delivers a mono stream at night
+        self.gst_native_gray = False
+
         # Path to the json file containing camera settings
         self.camera_settings_path = "./camera_settings.json"
 
@@ -438,6 +442,12 @@ class Config:
         # Set PNG compression for the saved frames for png file type
         self.png_compression = 3
 
+        # Append the saved frames to hourly segment files instead of saving each frame into its own file
+        self.frame_container = False
+
+        # Number of threads used to encode the saved frames in the container mode
+        self.frame_encode_threads = 2
+
         # Set the time interval for saving video frames (s)
         self.frame_save_interval = 5
 
@@ -503,6 +513,15 @@ class Config:
         # 1 - Normal, 2 - Skip uploading FFs, 3 - Skip FFs and FRs
         self.upload_mode = 1
 
+        # Number of files uploaded at the same time, each on its own SFTP channel of the same SSH connection
+        self.upload_threads = 2
+
+        # Size of the upload chunks in MB. Interrupted uploads are continued from the last complete chunk
+        self.upload_chunk_size = 1.0
+
+        # Maximum upload rate in kB/s, shared by all parallel uploads. 0 disables the limit
+        self.upload_bandwidth_limit = 0
+
         self.event_monitor_enabled = True
         self.event_monitor_db_name = "event_monitor.db"
         self.event_monitor_webpage = "https://globalmeteornetwork.org/events/event_watchlist.txt"
@@ -515,11 +534,25 @@ class Config:
 
         ##### Weave compilation arguments
         self.extra_compile_args = ["-O3"]
+
+        ##### Compression
+
+        # Number of 256-frame blocks in the ring buffer between the capture and the compression (min 2). Every
+        #   slot takes 256*width*height bytes of RAM
+        self.frame_buffer_slots = 2
+
+        # Number of threads used to compress one block of frames. 1 uses the serial compression
+        self.compression_threads = 1
         
         ##### FireballDetection
 
         self.enable_fireball_detection = True
 
+        # Number of 256-frame blocks the fireball extraction can hold (min 1). The raw frames are copied to
+        #   these blocks, so the capture can reuse its buffer while the extraction is running. Every block
+        #   takes 256*width*height bytes of RAM
+        self.fireball_extraction_slots = 2
+
         self.f = 16                    # subsampling factor
         self.max_time = 25             # maximum time for line finding
         
@@ -552,6 +585,12 @@ class Config:
         self.point_ratio_threshold = 0.7# ratio of how many points must be close to the line before considering searching for another line
         self.max_lines = 5             # maximum number of lines
 
+        # Line finder used on the fireball point cloud - 'pairs' tests every pair of points, 'ransac' tests a 
+        #   sample of pairs and searches only the points close to each line, so the point cloud doesn't have
+        #   to be subsampled to max_points
+        self.fireball_line_finder = 'pairs'
+        self.fireball_line_hypotheses = 2000 # number of point pairs tested for every line by 'ransac'
+
         ##### MeteorDetection
         
         # KHT detection parameters
@@ -625,6 +664,7 @@ class Config:
         self.segment_radius = 4 # radius (in pixels) of image segment around the detected star on which to perform the fit
         self.roundness_threshold = 0.5 # minimum ratio of 2D Gaussian sigma X and sigma Y to be taken as a stars (hot pixels are narrow, while stars are round)
         self.max_feature_ratio = 0.8 # maximum ratio between 2 sigma of the star and the image segment area
+        self.psf_fit_batch = False # fit all star candidates at once, instead of one by one with curve_fit
 
 
         ##### Calibration
@@ -1149,6 +1189,9 @@ def parseCapture(config, parser):
     if parser.has_option(section, "gst_decoder"):
         config.gst_decoder = parser.get(section, "gst_decoder")
 
+    if parser.has_option(section, "gst_native_gray"):
+        config.gst_native_gray = parser.getboolean(section, "gst_native_gray")
+
     if parser.has_option(section, "camera_settings_path") and os.path.isfile(parser.get(section, "camera_settings_path")):
         config.camera_settings_path = parser.get(section, "camera_settings_path")
     else:
@@ -1269,6 +1312,12 @@ def parseCapture(config, parser):
             print()
             print("WARNING! The png_compression must be between 0 and 9. It has been reset to 3!")
 
+    if parser.has_option(section, "frame_container"):
+        config.frame_container = parser.getboolean(section, "frame_container")
+
+    if parser.has_option(section, "frame_encode_threads"):
+        config.frame_encode_threads = parser.getint(section, "frame_encode_threads")
+
 
     # Load the interval for saving video frame
     if parser.has_option(section, "frame_save_interval"):
@@ -1364,6 +1413,18 @@ def parseUpload(config, parser):
     if parser.has_option(section, "upload_mode"):
         config.upload_mode = parser.getint(section, "upload_mode")
 
+    # Number of parallel uploads
+    if parser.has_option(section, "upload_threads"):
+        config.upload_threads = parser.getint(section, "upload_threads")
+
+    # Size of the upload chunks
+    if parser.has_option(section, "upload_chunk_size"):
+        config.upload_chunk_size = parser.getfloat(section, "upload_chunk_size")
+
+    # Upload bandwidth limit
+    if parser.has_option(section, "upload_bandwidth_limit"):
+        config.upload_bandwidth_limit = parser.getfloat(section, "upload_bandwidth_limit")
+
     # Event monitor enabled
     if parser.has_option(section, "event_monitor_enabled"):
         config.event_monitor_enabled = parser.getboolean(section, "event_monitor_enabled")
@@ -1416,7 +1477,25 @@ def parseBuildArgs(config, parser):
 
 def parseCompression(config, parser):
     section = "Compression"
-    pass
+
+    if not parser.has_section(section):
+        return
+
+    if parser.has_option(section, "frame_buffer_slots"):
+        config.frame_buffer_slots = parser.getint(section, "frame_buffer_slots")
+
+        # At least two slots are needed so the capture and the compression can run at the same time
+        if config.frame_buffer_slots < 2:
+            config.frame_buffer_slots = 2
+            print()
+            print("WARNING! The frame_buffer_slots must be at least 2. It has been reset to 2!")
+
+    if parser.has_option(section, "compression_threads"):
+        config.compression_threads = parser.getint(section, "compression_threads")
+
+        # 0 or negative values use all available cores
+        if config.compression_threads <= 0:
+            config.compression_threads = multiprocessing.cpu_count()
 
 
 
@@ -1428,6 +1507,9 @@ def parseFireballDetection(config, parser):
 
     if parser.has_option(section, "enable_fireball_detection"):
         config.enable_fireball_detection = parser.getboolean(section, "enable_fireball_detection")
+
+    if parser.has_option(section, "fireball_extraction_slots"):
+        config.fireball_extraction_slots = max(1, parser.getint(section, "fireball_extraction_slots"))
     
     if parser.has_option(section, "subsampling_size"):
         config.f = parser.getint(section, "subsampling_size")
@@ -1501,6 +1583,18 @@ def parseFireballDetection(config, parser):
     
     if parser.has_option(section, "max_lines"):
         config.max_lines = parser.getint(section, "max_lines")
+
+    if parser.has_option(section, "fireball_line_finder"):
+        config.fireball_line_finder = parser.get(section, "fireball_line_finder").strip().lower()
+
+        if config.fireball_line_finder not in ['pairs', 'ransac']:
+            print()
+            print("WARNING! Unknown fireball_line_finder: {:s}, using 'pairs'!".format(
+                config.fireball_line_finder))
+            config.fireball_line_finder = 'pairs'
+
+    if parser.has_option(section, "fireball_line_hypotheses"):
+        config.fireball_line_hypotheses = max(1, parser.getint(section, "fireball_line_hypotheses"))
     
 
 
@@ -1706,6 +1800,9 @@ def parseStarExtraction(config, parser):
     if parser.has_option(section, "max_feature_ratio"):
         config.max_feature_ratio = parser.getfloat(section, "max_feature_ratio")
 
+    if parser.has_option(section, "psf_fit_batch"):
+        config.psf_fit_batch = parser.getboolean(section, "psf_fit_batch")
+
 
 
 def parseCalibration(config, parser):
@@ -32,8 +32,9 @@ from RMS.Formats.FFfile import validFFName, constructFFName
 from RMS.Formats.FrameInterface import detectInputType, detectInputTypeFile, checkIfVideoFile
 from RMS.ExtractStars import extractStarsFF
 from RMS.ExtractStarsFrameInterface import extractStarsFrameInterface
-from RMS.Detection import detectMeteors
-from RMS.DetectionTools import loadImageCalibration
+from RMS.Detection import detectMeteors, preprocessFF
+from RMS.DetectionTools import loadImageCalibration, loadImageCalibrationCached
+from RMS.SharedCalibration import loadSharedImageCalibration
 from RMS.QueuedPool import QueuedPool
 from RMS.Logger import getLogger
 from RMS.Misc import RmsDateTime
@@ -182,7 +183,8 @@ def saveResultsFrameInterface(star_list, meteor_list, img_handle, config, chunk_
                                      img_handle.dir_path, config.stationID, config.fps)
 
 
-def detectStarsAndMeteors(ff_directory, ff_name, config, flat_struct=None, dark=None, mask=None):
+def detectStarsAndMeteors(ff_directory, ff_name, config, flat_struct=None, dark=None, mask=None, 
+    calibration=None):
     """ Run the star extraction and subsequently runs meteor detection on the FF file if there are enough
         stars on the image.
 
@@ -195,6 +197,9 @@ def detectStarsAndMeteors(ff_directory, ff_name, config, flat_struct=None, dark=
         flat_struct: [Flat struct] Structure containing the flat field. None by default.
         dark: [ndarray]
         mask: [MaskStruct]
+        calibration: [SharedImageCalibration] Calibration images in shared memory, loaded once for all 
+            files. If not given or if it doesn't match the image type, the calibration is loaded from disk
+            once per process, and reloaded only when the calibration files change. None by default.
 
     Return:
         [ff_name, star_list, meteor_list] detected stars and meteors
@@ -218,14 +223,24 @@ def detectStarsAndMeteors(ff_directory, ff_name, config, flat_struct=None, dark=
 
 
 
-    # Load mask, dark, flat
-    mask, dark, flat_struct = loadImageCalibration(ff_directory, config, dtype=img_handle.ff.dtype, \
-        byteswap=img_handle.byteswap)
+    # Take the mask, dark and flat from shared memory if they were loaded for this type of image
+    if (calibration is not None) and calibration.matches(img_handle.ff.dtype, img_handle.byteswap):
+        mask, dark, flat_struct = calibration.get()
+
+    # Otherwise load them from disk, or take the ones already loaded by this process
+    else:
+        mask, dark, flat_struct = loadImageCalibrationCached(ff_directory, config, \
+            dtype=img_handle.ff.dtype, byteswap=img_handle.byteswap)
 
 
-    # Run star extraction on FF files
+    # Apply the dark, flat and mask to the FF once, the same calibrated FF is used for the star extraction
+    #   and for the meteor detection
+    img_handle = preprocessFF(img_handle, mask, flat_struct, dark)
+
+
+    # Run star extraction on the already loaded FF file
     star_list = extractStarsFF(ff_directory, ff_name, config=config, 
-                               flat_struct=flat_struct, dark=dark, mask=mask)
+                               flat_struct=flat_struct, dark=dark, mask=mask, ff=img_handle.ff)
 
 
     log.info('Detected stars: ' + str(len(star_list[1])))
@@ -407,9 +422,14 @@ def detectStarsAndMeteorsDirectory(dir_path, config, output_suffix=''):
 
     log.info('Starting detection...')
 
-    # Initialize the detector
+    # Load the calibration images once into shared memory (FF files are always 8-bit)
+    calibration = loadSharedImageCalibration(ff_dir, config, dtype=np.uint8)
+
+    # Initialize the detector. The config and the calibration are given to the workers once when they 
+    #   start, so the jobs only carry the file names
     detector = QueuedPool(detectStarsAndMeteors, cores=config.num_cores, log=log, backup_dir=ff_dir, \
-        input_queue_maxsize=None)
+        input_queue_maxsize=None, func_extra_args=(config,), func_kwargs={'calibration': calibration}, 
+        fast_transport=True)
 
     # Start the detection
     detector.startPool()
@@ -422,7 +442,7 @@ def detectStarsAndMeteorsDirectory(dir_path, config, output_suffix=''):
             # Add a job as long as there are available workers to receive it
             if detector.available_workers.value() > 0:
                 log.info('Adding for detection: {}'.format(ff_name))
-                detector.addJob([ff_dir, ff_name, config], wait_time=0)
+                detector.addJob([ff_dir, ff_name], wait_time=0)
                 break
             else:
                 time.sleep(0.1)
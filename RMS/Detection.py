@@ -387,6 +387,145 @@ def checkWhiteRatio(img_thres, ff, max_white_ratio):
 
 
 
+class KHTEngine(object):
+    def __init__(self, kht_lib_path):
+        """ Wrapper around the compiled KHT library. The library is loaded only once, and the input and output 
+            buffers are reused between the calls. Use getKHTEngine to get the engine for the given library.
+
+        Arguments:
+            kht_lib_path: [string] path to the compiled KHT library
+        """
+
+        self.kht_lib_path = kht_lib_path
+
+        # Load the KHT library
+        self.kht = ctypes.cdll.LoadLibrary(kht_lib_path)
+        self.kht.kht_wrapper.argtypes = [npct.ndpointer(dtype=np.double, ndim=2),
+                                         npct.ndpointer(dtype=np.byte, ndim=1),
+                                         ctypes.c_size_t,
+                                         ctypes.c_size_t,
+                                         ctypes.c_size_t,
+                                         ctypes.c_size_t,
+                                         ctypes.c_double,
+                                         ctypes.c_double,
+                                         ctypes.c_double,
+                                         ctypes.c_double]
+        self.kht.kht_wrapper.restype = ctypes.c_size_t
+
+        # The batch function is not available in libraries built before it was added
+        self.batch_available = hasattr(self.kht, 'kht_wrapper_batch')
+
+        if self.batch_available:
+            self.kht.kht_wrapper_batch.argtypes = [npct.ndpointer(dtype=np.double, ndim=3, flags='C_CONTIGUOUS'),
+                                                   npct.ndpointer(dtype=np.uintp, ndim=1, flags='C_CONTIGUOUS'),
+                                                   npct.ndpointer(dtype=np.byte, ndim=2, flags='C_CONTIGUOUS'),
+                                                   ctypes.c_size_t,
+                                                   ctypes.c_size_t,
+                                                   ctypes.c_size_t,
+                                                   ctypes.c_size_t,
+                                                   ctypes.c_size_t,
+                                                   ctypes.c_double,
+                                                   ctypes.c_double,
+                                                   ctypes.c_double,
+                                                   ctypes.c_double]
+            self.kht.kht_wrapper_batch.restype = None
+
+        # KHT parameters: cluster_min_size (px), cluster_min_deviation, delta, kernel_min_height, n_sigmas
+        self.kht_params = (9, 2, 0.1, 0.004, 1)
+
+        # Reused buffers for the lines, the line counts and the images
+        self.lines_buffer = np.empty((0, 0, 2), np.double)
+        self.counts_buffer = np.empty(0, np.uintp)
+        self.img_buffer = np.empty((0, 0), np.byte)
+
+
+    def _prepareBuffers(self, n_images, img_size, max_lines):
+        """ Grow the buffers if they are too small for the given number of images, image size and number of
+            lines, and return views of the needed size.
+        """
+
+        if (self.lines_buffer.shape[0] < n_images) or (self.lines_buffer.shape[1] != max_lines):
+            self.lines_buffer = np.empty((max(n_images, self.lines_buffer.shape[0]), max_lines, 2), np.double)
+            self.counts_buffer = np.empty(self.lines_buffer.shape[0], np.uintp)
+
+        if (self.img_buffer.shape[0] < n_images) or (self.img_buffer.shape[1] != img_size):
+            self.img_buffer = np.empty((max(n_images, self.img_buffer.shape[0]), img_size), np.byte)
+
+        return self.lines_buffer[:n_images], self.counts_buffer[:n_images], self.img_buffer[:n_images]
+
+
+    def findLines(self, img, max_lines):
+        """ Find lines on the given binary image.
+
+        Arguments:
+            img: [ndarray] Binary image (non-zero values are feature pixels).
+            max_lines: [int] Maximum number of lines to return.
+
+        Return:
+            [ndarray] Array of (rho, theta) pairs, shape (N, 2).
+        """
+
+        return self.findLinesBatch([img], max_lines)[0]
+
+
+    def findLinesBatch(self, imgs, max_lines):
+        """ Find lines on a list of binary images of the same size. If the library supports it, all images
+            are processed in one native call.
+
+        Arguments:
+            imgs: [list] A list of binary images (non-zero values are feature pixels).
+            max_lines: [int] Maximum number of lines to return per image.
+
+        Return:
+            [list] A list of arrays of (rho, theta) pairs, one for every image.
+        """
+
+        if not len(imgs):
+            return []
+
+        h, w = imgs[0].shape
+        lines, counts, img_buffer = self._prepareBuffers(len(imgs), w*h, max_lines)
+
+        # Convert the images to feed them into the KHT (the KHT clears the pixels of the image it runs on, 
+        #   so the images have to be copied to the buffer every time)
+        for i, img in enumerate(imgs):
+            np.multiply(img.reshape(-1) != 0, 255, out=img_buffer[i], casting='unsafe')
+
+        if self.batch_available:
+            self.kht.kht_wrapper_batch(lines, counts, img_buffer, len(imgs), w, h, max_lines, \
+                *self.kht_params)
+
+        else:
+            for i in range(len(imgs)):
+                counts[i] = self.kht.kht_wrapper(lines[i], img_buffer[i], w, h, max_lines, *self.kht_params)
+
+        # Return copies, as the buffers are reused
+        return [lines[i, :counts[i]].copy() for i in range(len(imgs))]
+
+
+
+# KHT engines loaded in this process, one per library path
+KHT_ENGINES = {}
+
+
+def getKHTEngine(kht_lib_path):
+    """ Return the KHT engine for the given library. The library is loaded on the first call in every
+        process.
+
+    Arguments:
+        kht_lib_path: [string] path to the compiled KHT library
+
+    Return:
+        [KHTEngine]
+    """
+
+    if kht_lib_path not in KHT_ENGINES:
+        KHT_ENGINES[kht_lib_path] = KHTEngine(kht_lib_path)
+
+    return KHT_ENGINES[kht_lib_path]
+
+
+
 def getLines(img_handle, k1, j1, time_slide, time_window_size, max_lines, max_white_ratio, kht_lib_path, \
     mask=None, flat_struct=None, dark=None, debug=False):
     """ Get (rho, phi) pairs for each meteor present on the image using KHT.
@@ -409,22 +548,15 @@ def getLines(img_handle, k1, j1, time_slide, time_window_size, max_lines, max_wh
         [list] a list of all found lines
     """
 
-    # Load the KHT library
-    kht = ctypes.cdll.LoadLibrary(kht_lib_path)
-    kht.kht_wrapper.argtypes = [npct.ndpointer(dtype=np.double, ndim=2),
-                                npct.ndpointer(dtype=np.byte, ndim=1),
-                                ctypes.c_size_t,
-                                ctypes.c_size_t,
-                                ctypes.c_size_t,
-                                ctypes.c_size_t,
-                                ctypes.c_double,
-                                ctypes.c_double,
-                                ctypes.c_double,
-                                ctypes.c_double]
-    kht.kht_wrapper.restype = ctypes.c_size_t
+    # Get the KHT library (loaded once per process)
+    kht = getKHTEngine(kht_lib_path)
 
     line_results = []
 
+    # Morphed images and their time ranges, collected so the KHT can be run on all of them at once
+    window_imgs = []
+    window_ranges = []
+
 
     # If the input is a single FF file, threshold the image right away
     if img_handle.input_type == 'ff':
@@ -527,22 +659,32 @@ def getLines(img_handle, k1, j1, time_slide, time_window_size, max_lines, max_wh
             show(str(frame_min) + "-" + str(frame_max) + " morph", img)
 
 
-        # Get image shape
-        w, h = img.shape[1], img.shape[0]
+        # The time windows of an FF file are all run through the KHT at once at the end. Frame chunks
+        #   are processed right away, as img_handle.ff changes with every chunk
+        window_imgs.append(img)
+        window_ranges.append((frame_min, frame_max))
 
-        # Convert the image to feed it into the KHT
-        img_flatten = (img.flatten().astype(np.byte)*255).astype(np.byte)
-        
-        # Predefine the line output
-        lines = np.empty((max_lines, 2), np.double)
-        
-        # Call the KHT line finding
-        # Parameters: cluster_min_size (px), cluster_min_deviation, delta, kernel_min_height, n_sigmas
-        length = kht.kht_wrapper(lines, img_flatten, w, h, max_lines, 9, 2, 0.1, 0.004, 1)
-        
-        # Cut the line array to the number of found lines
-        lines = lines[:length]
+        if img_handle.input_type != 'ff':
+            line_results += _collectKHTLines(kht, img_handle, window_imgs, window_ranges, max_lines, debug)
+
+            window_imgs = []
+            window_ranges = []
+
+
+    line_results += _collectKHTLines(kht, img_handle, window_imgs, window_ranges, max_lines, debug)
+
+    return line_results
+
+
+
+def _collectKHTLines(kht, img_handle, window_imgs, window_ranges, max_lines, debug):
+    """ Run the KHT on the morphed images of the given time windows and return the found lines as 
+        [rho, theta, frame_min, frame_max] lists. 
+    """
+
+    line_results = []
 
+    for lines, (frame_min, frame_max) in zip(kht.findLinesBatch(window_imgs, max_lines), window_ranges):
 
         # Skip further operations if there are no lines
         frame_lines = []
@@ -137,6 +137,66 @@ def loadImageCalibration(dir_path, config, dtype=None, byteswap=False):
 
 
 
+# Calibration loaded by loadImageCalibrationCached, kept for the lifetime of the process
+_CALIBRATION_CACHE = {}
+
+
+def _calibrationStamp(dir_path, config):
+    """ Return the modification times and sizes of all files loadImageCalibration may load, None for the
+        files which don't exist.
+    """
+
+    paths = [os.path.join(dir_path, config.mask_file), os.path.join(config.config_file_path, config.mask_file)]
+
+    if config.use_dark:
+        paths += [os.path.join(dir_path, config.dark_file), config.dark_file]
+
+    if config.use_flat:
+        paths += [os.path.join(dir_path, config.flat_file), config.flat_file]
+
+    stamp = []
+    for path in paths:
+
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime, stat.st_size))
+
+        except OSError:
+            stamp.append(None)
+
+    return tuple(stamp)
+
+
+
+def loadImageCalibrationCached(dir_path, config, dtype=None, byteswap=False):
+    """ Load the mask, dark and flat like loadImageCalibration, but only once per process. The calibration
+        is loaded from disk again only if any of the calibration files was changed, added or removed.
+
+        The returned images are shared by all callers and must not be modified (e.g. binned in place).
+
+    Arguments and return values are the same as for loadImageCalibration.
+    """
+
+    key = (os.path.abspath(dir_path), config.config_file_path, config.mask_file, config.dark_file,
+        config.flat_file, config.use_dark, config.use_flat, None if dtype is None else np.dtype(dtype).str,
+        byteswap)
+
+    stamp = _calibrationStamp(dir_path, config)
+
+    cached = _CALIBRATION_CACHE.get(key)
+    if (cached is not None) and (cached[0] == stamp):
+        return cached[1]
+
+    calibration = loadImageCalibration(dir_path, config, dtype=dtype, byteswap=byteswap)
+
+    # Only the calibration of the last directory is kept
+    _CALIBRATION_CACHE.clear()
+    _CALIBRATION_CACHE[key] = (stamp, calibration)
+
+    return calibration
+
+
+
 def binImageCalibration(config, mask, dark, flat_struct):
     """ Bin the calibration images. """
 
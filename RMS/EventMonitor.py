@@ -57,6 +57,7 @@ import RMS.ConfigReader as cr
 
 from RMS.Astrometry.Conversions import datetime2JD, geo2Cartesian, altAz2RADec, vectNorm, raDec2Vector
 from RMS.Astrometry.Conversions import latLonAlt2ECEF, AER2LatLonAlt, AEH2Range, ECEF2AltAz, ecef2LatLonAlt
+from RMS.Astrometry.Conversions import latLonAlt2ECEFArrays, ecef2LatLonAltArrays, geo2CartesianArrays
 from RMS.Logger import getLogger
 from RMS.Math import angularSeparationVect
 from RMS.Formats.FFfile import convertFRNameToFF
@@ -712,6 +713,331 @@ class EventContainer(object):
         end_start_az, end_start_el = ECEF2AltAz(end_pt, start_pt)
         return revAz(end_start_az), end_start_el
 
+class TrajectoryPopulation(object):
+
+    """ A population of trajectories around an event, held as numpy arrays with one element per trajectory,
+        so the whole population can be checked at once.
+
+    """
+    def __init__(self, event, population_size):
+
+        """
+        Create a population of identical copies of the event trajectory
+
+        arguments:
+            event: [EventContainer] event to copy
+            population_size: [int] number of trajectories
+
+        """
+
+        self.event = event
+        self.lat = np.full(population_size, float(event.lat))
+        self.lon = np.full(population_size, float(event.lon))
+        self.ht = np.full(population_size, float(event.ht))
+        self.lat2 = np.full(population_size, float(event.lat2))
+        self.lon2 = np.full(population_size, float(event.lon2))
+        self.ht2 = np.full(population_size, float(event.ht2))
+        self.azim = np.full(population_size, float(event.azim))
+        self.elev = np.full(population_size, float(event.elev))
+
+    def __len__(self):
+
+        return len(self.lat)
+
+    def applyCartesianSD(self, seed = None):
+
+        """
+        Apply standard deviation to the Cartesian coordinates of all trajectories, as
+        EventContainer.applyCartesianSD does for a list of events
+
+        arguments:
+            seed: optional, set the seed for the standard deviation generation
+
+        """
+
+        if seed is not None:
+            np.random.seed(seed)
+
+        if not self.event.hasCartSD():
+            return
+
+        start_vect, end_vect = self.event.eventToECEFVector()
+        n = len(self)
+        start_vects = np.array(start_vect) + np.random.normal(scale=abs(self.event.cart_std), size=(n, 3))
+        end_vects = np.array(end_vect) + np.random.normal(scale=abs(self.event.cart2_std), size=(n, 3))
+
+        self.lat, self.lon, self.ht = ecefArray2LatLonAlt(start_vects)
+        self.lat2, self.lon2, self.ht2 = ecefArray2LatLonAlt(end_vects)
+
+    def applyPolarSD(self, seed = None):
+
+        """
+        Apply standard deviation to the Polar coordinates of all trajectories, as
+        EventContainer.applyPolarSD does for a list of events
+
+        arguments:
+            seed: optional, set the seed for the standard deviation generation
+
+        """
+
+        if seed is not None:
+            np.random.seed(seed)
+
+        n, ev = len(self), self.event
+        self.lat = self.lat + np.random.normal(scale=1, size=n) * ev.lat_std
+        self.lon = self.lon + np.random.normal(scale=1, size=n) * ev.lon_std
+        self.ht = self.ht + np.random.normal(scale=1, size=n) * ev.ht_std
+        self.lat2 = self.lat2 + np.random.normal(scale=1, size=n) * ev.lat2_std
+        self.lon2 = self.lon2 + np.random.normal(scale=1, size=n) * ev.lon2_std
+        self.ht2 = self.ht2 + np.random.normal(scale=1, size=n) * ev.ht2_std
+        self.azim = self.azim + np.random.normal(scale=1, size=n) * ev.azim_std
+        self.elev = self.elev + np.random.normal(scale=1, size=n) * ev.elev_std
+
+    def appendEvents(self, events):
+
+        """
+        Append trajectories from a list of events to the population
+
+        arguments:
+            events: [list] of EventContainer
+
+        """
+
+        if len(events) == 0:
+            return
+
+        for name in ['lat', 'lon', 'ht', 'lat2', 'lon2', 'ht2', 'azim', 'elev']:
+            values = np.array([float(getattr(ev, name)) for ev in events])
+            setattr(self, name, np.concatenate([getattr(self, name), values]))
+
+    def member(self, i):
+
+        """
+        Return one trajectory of the population as an event
+
+        arguments:
+            i: [int] index of the trajectory
+
+        returns:
+            event: [EventContainer]
+
+        """
+
+        event = copy.copy(self.event)
+        event.lat, event.lon, event.ht = float(self.lat[i]), float(self.lon[i]), float(self.ht[i])
+        event.lat2, event.lon2, event.ht2 = float(self.lat2[i]), float(self.lon2[i]), float(self.ht2[i])
+        event.azim, event.elev = float(self.azim[i]), float(self.elev[i])
+
+        return event
+
+    def minimumDistances(self, ref_lat, ref_lon, ref_ele):
+
+        """
+        For every trajectory, the smallest of the distances from the reference point to the start, the end and
+        the closest point of the infinitely extended trajectory
+
+        arguments:
+            ref_lat: [float] Station latitude (degrees)
+            ref_lon: [float] Station longitude (degrees)
+            ref_ele: [float] Station height (metres)
+
+        returns:
+            min_dist: [ndarray] distances in metres
+
+        """
+
+        start_dist, end_dist, closest_dist = calculateClosestPointArrays(self.lat, self.lon, self.ht * 1000,
+                                                                         self.lat2, self.lon2, self.ht2 * 1000,
+                                                                         ref_lat, ref_lon, ref_ele)
+
+        return np.minimum(np.minimum(start_dist, end_dist), closest_dist)
+
+class EventFileIndex(object):
+
+    """ A persistent index of the times of the data files in the night directories, kept in an SQLite
+        database next to the EventMonitor database. A directory is rescanned only when its modification
+        time changes, so looking up the files of an event is a range query instead of a directory listing.
+
+    """
+    def __init__(self, db_path, extensions=(".fits", ".bin")):
+
+        """
+        arguments:
+            db_path: [str] path to the index database
+            extensions: [tuple] extensions of the files which are indexed
+
+        """
+
+        self.db_path = db_path
+        self.extensions = tuple(extensions)
+
+        # The connection is opened in the process which uses the index
+        self.conn = None
+        self.conn_pid = None
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        state['conn'] = None
+        state['conn_pid'] = None
+
+        return state
+
+    def getConnection(self):
+
+        """ Open the index database, creating the tables if needed.
+
+        returns:
+            conn: [connection] connection to the index database
+
+        """
+
+        if self.conn is not None and self.conn_pid == os.getpid():
+            return self.conn
+
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn_pid = os.getpid()
+
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS directories (
+                                 directory TEXT PRIMARY KEY,
+                                 mtime REAL NOT NULL,
+                                 scantime REAL NOT NULL
+                                 )""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                                 directory TEXT NOT NULL,
+                                 filename TEXT NOT NULL,
+                                 extension TEXT NOT NULL,
+                                 filetime REAL NOT NULL,
+                                 PRIMARY KEY (directory, filename)
+                                 )""")
+        self.conn.execute("""CREATE INDEX IF NOT EXISTS files_time
+                                 ON files (directory, extension, filetime)""")
+        self.conn.commit()
+
+        return self.conn
+
+    def indexes(self, file_extension):
+
+        """ True if files with the given extension are indexed """
+
+        return file_extension in self.extensions
+
+    def refreshDirectory(self, directory):
+
+        """
+        Rescan the directory if it changed since it was last indexed. A directory which was modified
+        within a few seconds of the last scan is always rescanned, as the modification time might
+        not have changed for files added later on file systems with a coarse time resolution.
+
+        arguments:
+            directory: [str] path to the directory
+
+        """
+
+        conn = self.getConnection()
+
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            mtime = None
+
+        row = conn.execute("SELECT mtime, scantime FROM directories WHERE directory = ?",
+                           (directory,)).fetchone()
+
+        if row is not None and mtime is not None and row[0] == mtime and row[1] - mtime > 2:
+            return
+
+        conn.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        conn.execute("DELETE FROM directories WHERE directory = ?", (directory,))
+
+        if mtime is not None:
+
+            scan_time = time.time()
+            rows = []
+            for file_name in os.listdir(directory):
+                for file_extension in self.extensions:
+                    if file_name.endswith(file_extension):
+                        file_time = posixSeconds(convertGMNTimeToPOSIX(file_name[10:25]))
+                        rows.append((directory, file_name, file_extension, file_time))
+                        break
+
+            conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO directories VALUES (?, ?, ?)", (directory, mtime, scan_time))
+
+        conn.commit()
+
+    def pruneDirectories(self):
+
+        """ Remove the directories which no longer exist from the index """
+
+        conn = self.getConnection()
+        for (directory,) in conn.execute("SELECT directory FROM directories").fetchall():
+            if not os.path.isdir(directory):
+                conn.execute("DELETE FROM files WHERE directory = ?", (directory,))
+                conn.execute("DELETE FROM directories WHERE directory = ?", (directory,))
+        conn.commit()
+
+    def filesInRange(self, directory, file_extension, start_time, end_time):
+
+        """
+        arguments:
+            directory: [str] path to the directory
+            file_extension: [str] extension of the files
+            start_time: [float] start of the range, POSIX seconds (exclusive)
+            end_time: [float] end of the range, POSIX seconds (exclusive)
+
+        returns:
+            file_names: [list] names of the files in the range, in name order
+
+        """
+
+        rows = self.getConnection().execute(
+            """SELECT filename FROM files WHERE directory = ? AND extension = ? AND filetime > ? AND filetime < ?
+               ORDER BY filename""", (directory, file_extension, start_time, end_time)).fetchall()
+
+        return [row[0] for row in rows]
+
+    def firstFile(self, directory, file_extension, after_time=None):
+
+        """
+        arguments:
+            directory: [str] path to the directory
+            file_extension: [str] extension of the files
+            after_time: [float] if given, only consider files after this time, POSIX seconds
+
+        returns:
+            file_name: [str] the first file in name order, None if there is no such file
+
+        """
+
+        if after_time is None:
+            after_time = float("-inf")
+
+        row = self.getConnection().execute(
+            """SELECT filename FROM files WHERE directory = ? AND extension = ? AND filetime > ?
+               ORDER BY filename LIMIT 1""", (directory, file_extension, after_time)).fetchone()
+
+        return None if row is None else row[0]
+
+    def previousFile(self, directory, file_extension, file_name):
+
+        """
+        arguments:
+            directory: [str] path to the directory
+            file_extension: [str] extension of the files
+            file_name: [str] name of a file
+
+        returns:
+            file_name: [str] the file before the given one in name order, None if there is no such file
+
+        """
+
+        row = self.getConnection().execute(
+            """SELECT filename FROM files WHERE directory = ? AND extension = ? AND filename < ?
+               ORDER BY filename DESC LIMIT 1""", (directory, file_extension, file_name)).fetchone()
+
+        return None if row is None else row[0]
+
 class EventMonitor(multiprocessing.Process):
 
     def __init__(self, config):
@@ -731,6 +1057,9 @@ class EventMonitor(multiprocessing.Process):
 
         self.createDB()
 
+        # Index of the data file times, next to the EventMonitor database
+        self.file_index = EventFileIndex(os.path.splitext(self.event_monitor_db_path)[0] + "_file_index.db")
+
         # Load the EventMonitor database. Any problems, delete and recreate.
         self.db_conn = self.getConnectionToEventMonitorDB()
         self.upgradeDB(self.db_conn)
@@ -1499,6 +1828,8 @@ class EventMonitor(multiprocessing.Process):
            If the file being compared is the first file after the event time, put the previous file into the list,
            if it is not already there.
 
+           The .fits and .bin files are looked up in the file index (see EventFileIndex).
+
            Arguments:
                 event: [event] Event of interest
                 directory_list: [list of paths] List of directories which may contain the files sought
@@ -1514,44 +1845,53 @@ class EventMonitor(multiprocessing.Process):
         except:
             event_time = convertGMNTimeToPOSIX(event.dt)
 
-        seeking_first_fits_after_event = True # to prevent warning of possibly uninitialised variable
+        # File times are naive UTC
+        if event_time.tzinfo is not None:
+            event_time = event_time.replace(tzinfo=None) - event_time.utcoffset()
+
+        event_seconds = posixSeconds(event_time)
+        time_tolerance = float(event.time_tolerance)
+
         file_list = []
-        # Iterate through the directory list, appending files with the correct extension
 
+        self.file_index.pruneDirectories()
 
-        last_fits_file = None
+        # Iterate through the directory list, appending files with the correct extension
         for directory in directory_list:
+            self.file_index.refreshDirectory(directory)
             for file_extension in file_extension_list:
-                # get the directory into name order
-                dirlist = os.listdir(directory)
-                dirlist.sort()
+
+                # Scan the directory for files which are not indexed
+                if not self.file_index.indexes(file_extension):
+                    for file in sorted(os.listdir(directory)):
+                        if file.endswith(file_extension):
+                            file_POSIX_time = convertGMNTimeToPOSIX(file[10:25])
+                            if abs((file_POSIX_time - event_time).total_seconds()) < time_tolerance:
+                                file_list.append(os.path.join(directory, file))
+                    continue
+
+                first_file = self.file_index.firstFile(directory, file_extension)
+                if file_extension == ".fits" and first_file is None:
+                    # If there are no fits files then return the list so far
+                    log.info("No fits files in {}".format(directory))
+                    return file_list
+
+                for file in self.file_index.filesInRange(directory, file_extension,
+                                                         event_seconds - time_tolerance,
+                                                         event_seconds + time_tolerance):
+                    file_list.append(os.path.join(directory, file))
+
                 if file_extension == ".fits":
-                    fits_list = glob.glob(os.path.join(directory,"*.fits"))
-                    fits_list.sort()
+                    # Add the fits file before the first fits file after the event time (or the first fits file
+                    # if all are after the event) unless already in the list
+                    first_after_event = self.file_index.firstFile(directory, file_extension, event_seconds)
+                    if first_after_event is not None:
+                        last_fits_file = self.file_index.previousFile(directory, file_extension, first_after_event)
+                        if last_fits_file is None:
+                            last_fits_file = first_file
+                        if os.path.join(directory, last_fits_file) not in file_list:
+                            file_list.append(os.path.join(directory, last_fits_file))
 
-                    if len(fits_list) == 0:
-                        # If fits_list is empty then return an empty list
-                        log.info("No fits files in {}".format(directory))
-                        return file_list
-                    else:
-                        # Initialise last_fits_file with the first from the list
-                        last_fits_file = fits_list[0]
-
-                        seeking_first_fits_after_event = True
-                for file in dirlist:
-                    if file.endswith(file_extension):
-                        file_POSIX_time = convertGMNTimeToPOSIX(file[10:25])
-                        if abs((file_POSIX_time - event_time).total_seconds()) < event.time_tolerance:
-                            file_list.append(os.path.join(directory, file))
-
-                        if file_extension == ".fits":
-                        # if this is the first fits file after the event time, add the previous fits file
-                        # unless already in the list
-                            if file_POSIX_time > event_time and seeking_first_fits_after_event:
-                                if last_fits_file not in file_list:
-                                    file_list.append(os.path.join(directory, last_fits_file))
-                                    seeking_first_fits_after_event = False
-                            last_fits_file = file
         return file_list
 
     def getFileList(self, event):
@@ -1625,13 +1965,9 @@ class EventMonitor(multiprocessing.Process):
 
         fov_vec = np.array(raDec2Vector(fov_ra, fov_dec))
 
-        # iterate along the trajectory counting points in the field of view
-        points_in_fov = 0
-        for i in range(0, 100):
-            point = (stapt_rel + i * traj_inc)
-            point_fov = angularSeparationVectDeg(vectNorm(point), vectNorm(fov_vec))
-            if point_fov < diagonal_fov / 2:
-                points_in_fov += 1
+        # count the points along the trajectory in the field of view
+        points_in_fov = int(countPointsInFOV(stapt_rel[np.newaxis, :], traj_inc[np.newaxis, :], fov_vec,
+                                             diagonal_fov)[0])
 
         # calculate some additional information for confidence
         start_distance = (np.sqrt(np.sum(stapt_rel ** 2)))
@@ -1641,6 +1977,46 @@ class EventMonitor(multiprocessing.Process):
 
         return points_in_fov, start_distance, start_angle, end_distance, end_angle, fov_ra, fov_dec
 
+    def trajectoriesVisible(self, rp, population, indices):
+
+        """
+        Given a platepar and a population of trajectories, calculate how many of the 100 points along every
+        selected trajectory would be in the FoV. This is the same as trajectoryVisible, for many trajectories.
+
+        Args:
+            rp: [platepar] reference platepar
+            population: [TrajectoryPopulation] population of trajectories
+            indices: [ndarray] indices of the trajectories to check
+
+        Returns:
+            points_in_fov: [ndarray] the number of points out of 100 in the field of view, for every index
+
+        """
+
+        indices = np.asarray(indices, dtype=int)
+        if len(indices) == 0:
+            return np.zeros(0, dtype=int)
+
+        # Calculate diagonal FoV of camera
+        diagonal_fov = np.sqrt(rp.fov_v ** 2 + rp.fov_h ** 2)
+
+        # Calculation origin will be the ECI of the station taken from the platepar
+        jul_date = datetime2JD(convertGMNTimeToPOSIX(population.event.dt))
+        origin = np.array(geo2Cartesian(rp.lat, rp.lon, rp.elev, jul_date))
+
+        # Convert trajectory start and end point coordinates to cartesian ECI at JD of event
+        traj_sta_pts = np.column_stack(geo2CartesianArrays(population.lat[indices], population.lon[indices],
+                                                           population.ht[indices] * 1000, jul_date))
+        traj_end_pts = np.column_stack(geo2CartesianArrays(population.lat2[indices], population.lon2[indices],
+                                                           population.ht2[indices] * 1000, jul_date))
+
+        # the az_centre, alt_centre of the camera, and the Field of View RA and Dec at event time
+        az_centre, alt_centre = platepar2AltAz(rp)
+        fov_ra, fov_dec = altAz2RADec(az_centre, alt_centre, jul_date, rp.lat, rp.lon)
+        fov_vec = np.array(raDec2Vector(fov_ra, fov_dec))
+
+        return countPointsInFOV(traj_sta_pts - origin, (traj_end_pts - traj_sta_pts) / 100, fov_vec, diagonal_fov)
+
     def trajectoryThroughFOV(self, event):
 
         """
@@ -1922,41 +2298,57 @@ class EventMonitor(multiprocessing.Process):
                 continue
 
             # Initialise the population of trajectories
-            event_population = []
             # If we have any standard deviation definitions then create a population of 1000, else create a population of 1
             if observed_event.hasCartSD() or observed_event.hasPolarSD():
                 log.info("Working with standard deviations")
-                event_population = observed_event.appendPopulation(event_population,1000)
+                event_population = TrajectoryPopulation(observed_event, 1000)
             else:
                 log.info("Working without standard deviations")
-                event_population = observed_event.appendPopulation(event_population,1)
-
-
+                event_population = TrajectoryPopulation(observed_event, 1)
 
             # Apply SD to the population
             if observed_event.hasCartSD():
                 log.info("Applying cartesian standard deviations")
-                event_population = observed_event.applyCartesianSD(event_population)
+                event_population.applyCartesianSD()
             if observed_event.hasPolarSD():
                 log.info("Applying polar standard deviations")
-                event_population = observed_event.applyPolarSD(event_population)
+                event_population.applyPolarSD()
 
             # Add trajectories with elevations from observed value to 15 deg
             if observed_event.elev_is_max:
                 log.info("Rotating trajectory around observed point")
-                event_population = observed_event.addElevationRange(event_population, observed_event, 15)
+                event_population.appendEvents(observed_event.addElevationRange([], observed_event, 15))
+
+            # From the infinitely extended trajectories, work out the closest point to the camera for the whole
+            # population at once. ev_con.elevation is the height above sea level of the station in metres
+            min_dists = event_population.minimumDistances(ev_con.latitude, ev_con.longitude, ev_con.elevation)
+
+            # Trajectories inside the closeradius are uploaded with no further checks
+            inside_close = (min_dists < observed_event.close_radius * 1000) & (not test_mode)
+
+            # Count the points in the FoV for all trajectories inside the farradius at once
+            check_fov = (min_dists < observed_event.far_radius * 1000) | test_mode
+            fov_counts = np.zeros(len(event_population), dtype=int)
+            if np.any(check_fov):
+                rp = Platepar()
+                if self.getPlateparFilePath(observed_event) == "":
+                    rp.read(os.path.abspath('.'))
+                else:
+                    rp.read(self.getPlateparFilePath(observed_event))
+                fov_indices = np.flatnonzero(check_fov)
+                fov_counts[fov_indices] = self.trajectoriesVisible(rp, event_population, fov_indices)
+
+            # Only the trajectories inside the closeradius or through the FoV can lead to an upload, the checks
+            # below are run on them in population order until the first upload succeeds
+            candidates = np.flatnonzero(inside_close | (check_fov & (fov_counts > 0)))
 
             # Start testing trajectories from the population
-            for event in event_population:
+            for i in candidates:
                 # check if this has already been handled
                 if self.eventProcessed(observed_event.uuid):
                     break # do no more work on any version of this trajectory - break exits loop
-                # From the infinitely extended trajectory, work out the closest point to the camera
-                # ev_con.elevation is the height above sea level of the station in metres, no conversion required
-                start_dist, end_dist, atmos_dist = calculateClosestPoint(event.lat, event.lon, event.ht * 1000,
-                                                                              event.lat2, event.lon2, event.ht2 * 1000,
-                                                                              ev_con.latitude, ev_con.longitude, ev_con.elevation)
-                min_dist = min([start_dist, end_dist, atmos_dist])
+                event = event_population.member(i)
+                min_dist = min_dists[i]
 
                 # If this version of the trajectory outside the farradius, continue
                 if min_dist > event.far_radius * 1000 and not test_mode:
@@ -2231,6 +2623,119 @@ def calculateClosestPoint(beg_lat, beg_lon, beg_ele, end_lat, end_lon, end_ele,
 
         return start_dist, end_dist, closest_dist
 
+def latLonAlt2ECEFDegArrays(lat, lon, h):
+    """ Convert arrays of geographical coordinates to Earth centered - Earth fixed coordinates.
+
+    Arguments:
+        lat: [ndarray] latitude in degrees (+north)
+        lon: [ndarray] longitude in degrees (+east)
+        h: [ndarray] elevation in metres (WGS84)
+
+    Return:
+        ecef: [ndarray] (n, 3) array of ECEF coordinates
+
+    """
+
+    # Call library function, after converting to radians
+    return np.column_stack(latLonAlt2ECEFArrays(np.radians(lat), np.radians(lon), h))
+
+def ecefArray2LatLonAlt(ecef):
+    """
+        Convert an (n, 3) array of ECEF vectors (meters) to lat(deg),lon(deg),ht(km) arrays
+
+        arguments: ecef
+
+        returns: lat, lon, ht
+
+        """
+
+    # Call library function, and convert the results to degrees and km
+    lat, lon, alt = ecef2LatLonAltArrays(ecef[:, 0], ecef[:, 1], ecef[:, 2])
+
+    return np.degrees(lat), np.degrees(lon), alt / 1000
+
+def calculateClosestPointArrays(beg_lat, beg_lon, beg_ele, end_lat, end_lon, end_ele, ref_lat, ref_lon, ref_ele):
+
+        """
+        Calculate the closest approach of many trajectories to a reference point, as calculateClosestPoint
+        does for one trajectory
+
+        Args:
+            beg_lat: [ndarray] Starting latitudes of the trajectories
+            beg_lon: [ndarray] Starting longitudes of the trajectories
+            beg_ele: [ndarray] Beginning heights of the trajectories
+            end_lat: [ndarray] Ending latitudes of the trajectories
+            end_lon: [ndarray] Ending longitudes of the trajectories
+            end_ele: [ndarray] Ending heights of the trajectories
+            ref_lat: [float] Station latitude
+            ref_lon: [float] Station longitude
+            ref_ele: [float] Station height
+
+        Returns:
+            start_dist: [ndarray] Distances from station to start of trajectories
+            end_dist: [ndarray] Distances from station to end of trajectories
+            closest_dist: [ndarray] Distances at the closest points (possibly outside the start and end)
+
+        """
+
+        beg_ecef = latLonAlt2ECEFDegArrays(beg_lat, beg_lon, beg_ele)
+        end_ecef = latLonAlt2ECEFDegArrays(end_lat, end_lon, end_ele)
+        ref_ecef = np.array(latLonAlt2ECEFDeg(ref_lat, ref_lon, ref_ele))
+
+        start_vec, end_vec = (ref_ecef - beg_ecef), (ref_ecef - end_ecef)
+        start_dist, end_dist = np.sqrt(np.sum(start_vec ** 2, axis=1)), np.sqrt(np.sum(end_vec ** 2, axis=1))
+
+        # Trajectories of zero length have no direction, use the start distance for them
+        zero_length = (np.asarray(beg_lat) == np.asarray(end_lat)) & (np.asarray(beg_lon) == np.asarray(end_lon)) \
+                      & (np.asarray(beg_ele) == np.asarray(end_ele))
+
+        traj_vec = end_ecef - beg_ecef
+        traj_len = np.sqrt(np.sum(traj_vec ** 2, axis=1))
+        traj_len[traj_len == 0] = 1
+        traj_vec = traj_vec / traj_len[:, np.newaxis]
+
+        # Project the ref vect onto the traj vector, and calculate the closest distance
+        proj_vec = beg_ecef + np.sum(start_vec * traj_vec, axis=1)[:, np.newaxis] * traj_vec
+        closest_dist = np.sqrt(np.sum((ref_ecef - proj_vec) ** 2, axis=1))
+        closest_dist = np.where(zero_length, start_dist, closest_dist)
+
+        return start_dist, end_dist, closest_dist
+
+def countPointsInFOV(stapt_rel, traj_inc, fov_vec, diagonal_fov, n_points=100):
+
+    """
+    Count the points along trajectories which are inside the field of view
+
+    Args:
+        stapt_rel: [ndarray] (n, 3) trajectory start points relative to the station
+        traj_inc: [ndarray] (n, 3) increments between the points along the trajectories
+        fov_vec: [ndarray] vector of the centre of the FOV
+        diagonal_fov: [float] diagonal field of view (degrees)
+
+    Keyword arguments:
+        n_points: [int] number of points along every trajectory
+
+    Returns:
+        points_in_fov: [ndarray] number of points in the FOV for every trajectory
+
+    """
+
+    fov_vec = vectNorm(np.asarray(fov_vec, dtype=np.float64))
+    steps = np.arange(n_points)[np.newaxis, :, np.newaxis]
+
+    points_in_fov = np.zeros(len(stapt_rel), dtype=int)
+
+    # Work in blocks of trajectories, to limit the memory used by the points
+    block = 1000
+    for i in range(0, len(stapt_rel), block):
+
+        points = stapt_rel[i:i + block, np.newaxis, :] + steps * traj_inc[i:i + block, np.newaxis, :]
+        points = points / np.sqrt(np.sum(points ** 2, axis=2))[:, :, np.newaxis]
+        point_fov = np.degrees(np.abs(np.arccos(np.dot(points, fov_vec))))
+        points_in_fov[i:i + block] = np.sum(point_fov < diagonal_fov / 2, axis=1)
+
+    return points_in_fov
+
 def revAz(azim):
 
     """
@@ -2340,6 +2845,20 @@ def convertGMNTimeToPOSIX(timestring):
         dt_object = datetime.datetime.strptime("20000101_000000".strip(), "%Y%m%d_%H%M%S")
     return dt_object
 
+def posixSeconds(dt_object):
+
+    """
+    Converts a naive UTC datetime into seconds since the POSIX epoch
+
+    arguments:
+        dt_object: [datetime] time
+
+    returns:
+        [float] seconds since 1970-01-01
+    """
+
+    return (dt_object - datetime.datetime(1970, 1, 1)).total_seconds()
+
 def createATestEvent07():
 
 
@@ -2852,6 +3371,58 @@ def testTimeObjectCreator():
 
     return success
 
+def testTrajectoryPopulation():
+
+
+    """
+    Tests that the array calculations on a population of trajectories match the calculations on single events
+
+
+    return:
+        [bool]
+    """
+
+    success = True
+    event = createATestEvent07()
+    event.cart_std, event.cart2_std = 1000, 2000
+    event.lat_std, event.ht2_std = 0.1, 2
+
+    population = TrajectoryPopulation(event, 200)
+    population.applyCartesianSD(seed = 0)
+    population.applyPolarSD()
+    population.appendEvents([event])
+
+    success = success if len(population) == 201 else False
+
+    ref_lat, ref_lon, ref_ele = -32.0, 116.0, 100
+    jul_date = datetime2JD(convertGMNTimeToPOSIX(event.dt))
+    min_dists = population.minimumDistances(ref_lat, ref_lon, ref_ele)
+    eci = np.column_stack(geo2CartesianArrays(population.lat, population.lon, population.ht * 1000, jul_date))
+
+    for i in range(len(population)):
+
+        e = population.member(i)
+
+        # Closest approach
+        start_dist, end_dist, closest_dist = calculateClosestPoint(e.lat, e.lon, e.ht * 1000,
+                                                                   e.lat2, e.lon2, e.ht2 * 1000,
+                                                                   ref_lat, ref_lon, ref_ele)
+        success = success if abs(min(start_dist, end_dist, closest_dist) - min_dists[i]) < 1e-3 else False
+
+        # Conversion to ECI
+        eci_single = np.array(geo2Cartesian(e.lat, e.lon, e.ht * 1000, jul_date))
+        success = success if np.max(np.abs(eci_single - eci[i])) < 1e-3 else False
+
+    # Conversion from ECEF
+    ecef = latLonAlt2ECEFDegArrays(population.lat, population.lon, population.ht * 1000)
+    lat, lon, ht = ecefArray2LatLonAlt(ecef)
+    for i in range(len(population)):
+        lat_s, lon_s, ht_s = ecefV2LatLonAlt(ecef[i])
+        success = success if abs(lat[i] - lat_s) < 1e-9 and abs(lon[i] - lon_s) < 1e-9 else False
+        success = success if abs(ht[i] - ht_s) < 1e-6 else False
+
+    return success
+
 def testIndividuals(logging = True):
 
 
@@ -2958,6 +3529,13 @@ def testIndividuals(logging = True):
         log.error("Apply Polar SD fail")
         individuals_success = False
 
+    if testTrajectoryPopulation():
+        if logging:
+            log.info("Trajectory population success")
+    else:
+        log.error("Trajectory population fail")
+        individuals_success = False
+
     return individuals_success
 
 if __name__ == "__main__":
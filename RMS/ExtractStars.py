@@ -33,7 +33,7 @@ import scipy.ndimage.filters as filters
 import RMS.ConfigReader as cr
 from RMS.Formats import FFfile
 from RMS.Formats import CALSTARS
-from RMS.DetectionTools import loadImageCalibration
+from RMS.SharedCalibration import loadSharedImageCalibration
 from RMS.Logger import getLogger
 from RMS.Math import twoDGaussian
 from RMS.Routines import MaskImage
@@ -53,7 +53,8 @@ log = getLogger("logger")
 
 def extractStars(img, img_median=None, mask=None, gamma=1.0, max_star_candidates=1000, border=10,
                  neighborhood_size=10, intensity_threshold=18, 
-                 segment_radius=4, roundness_threshold=0.5, max_feature_ratio=0.8, bit_depth=8):
+                 segment_radius=4, roundness_threshold=0.5, max_feature_ratio=0.8, bit_depth=8, 
+                 batch_fit=False):
     """ Extracts stars on a given image by searching for local maxima and applying PSF fit for star 
         confirmation.
 
@@ -76,6 +77,8 @@ def extractStars(img, img_median=None, mask=None, gamma=1.0, max_star_candidates
             (hot pixels are narrow, while stars are round).
         max_feature_ratio: [float] Maximum ratio between 2 sigma of the star and the image segment area.
         bit_depth: [int] Bit depth of the image. 8 bits by default.
+        batch_fit: [bool] Fit all candidates at once with fitPSFBatch. If False, every candidate is fitted
+            separately with fitPSF. False by default.
     
     Return:
         x2, y2, background, intensity, fwhm: [list of ndarrays]
@@ -142,11 +145,12 @@ def extractStars(img, img_median=None, mask=None, gamma=1.0, max_star_candidates
     # # Plot stars before the PSF fit
     # plotStars(ff, x, y)
 
-    # Fit a PSF to each star on the raw image
+    # Fit a PSF to each star on the raw image (all candidates are fitted at once if batch_fit is True)
+    fitFunc = fitPSFBatch if batch_fit else fitPSF
     (
         x_arr, y_arr, amplitude, intensity, 
         sigma_y_fitted, sigma_x_fitted, background, snr, saturated_count
-    ) = fitPSF(
+    ) = fitFunc(
         img, img_median, x_init, y_init, 
         gamma=gamma,
         segment_radius=segment_radius, roundness_threshold=roundness_threshold, 
@@ -251,7 +255,8 @@ def extractStarsFF(
         border=10,
         max_global_intensity=150, 
         neighborhood_size=10, intensity_threshold=18, 
-        segment_radius=4, roundness_threshold=0.5, max_feature_ratio=0.8
+        segment_radius=4, roundness_threshold=0.5, max_feature_ratio=0.8, batch_fit=False,
+        calibration=None, ff=None
         ):
     """ Extracts stars on a given FF bin by searching for local maxima and applying PSF fit for star 
         confirmation.
@@ -271,6 +276,12 @@ def extractStarsFF(
         flat_struct: [Flat struct] Structure containing the flat field. None by default.
         dark: [ndarray] Dark frame. None by default.
         mask: [ndarray] Mask image. None by default.
+        batch_fit: [bool] Fit all star candidates at once, see extractStars. False by default.
+        calibration: [SharedImageCalibration] Calibration images in shared memory. If given, the mask, 
+            dark and flat are taken from it. None by default.
+        ff: [FFStruct] The FF file, if it was already read. If it was already calibrated (ff.calibrated is
+            True), the dark, flat and mask are not applied again. Otherwise they are applied to the given
+            structure in place. None by default, in which case the FF file is read from disk.
 
     Return:
         x2, y2, background, intensity, fwhm: [list of ndarrays]
@@ -293,9 +304,15 @@ def extractStarsFF(
         segment_radius = config.segment_radius
         roundness_threshold = config.roundness_threshold
         max_feature_ratio = config.max_feature_ratio
+        batch_fit = config.psf_fit_batch
+
+    # Take the calibration images from shared memory, if given
+    if calibration is not None:
+        mask, dark, flat_struct = calibration.get()
         
-    # Load the FF bin file
-    ff = FFfile.read(ff_dir, ff_name)
+    # Load the FF bin file, if it was not given
+    if ff is None:
+        ff = FFfile.read(ff_dir, ff_name)
 
 
     # If the FF file could not be read, skip star extraction
@@ -303,17 +320,20 @@ def extractStarsFF(
         return error_return
 
 
-    # Apply the dark frame
-    if dark is not None:
-        ff.avepixel = Image.applyDark(ff.avepixel, dark)
+    # Calibrate the FF, unless that was already done
+    if not ff.calibrated:
 
-    # Apply the flat
-    if flat_struct is not None:
-        ff.avepixel = Image.applyFlat(ff.avepixel, flat_struct)
+        # Apply the dark frame
+        if dark is not None:
+            ff.avepixel = Image.applyDark(ff.avepixel, dark)
 
-    # Mask the FF file
-    if mask is not None:
-        ff = MaskImage.applyMask(ff, mask, ff_flag=True)
+        # Apply the flat
+        if flat_struct is not None:
+            ff.avepixel = Image.applyFlat(ff.avepixel, flat_struct)
+
+        # Mask the FF file
+        if mask is not None:
+            ff = MaskImage.applyMask(ff, mask, ff_flag=True)
 
 
     # Calculate image mean and stddev
@@ -334,7 +354,7 @@ def extractStarsFF(
         max_star_candidates=config.max_stars, border=border,
         neighborhood_size=neighborhood_size, intensity_threshold=intensity_threshold, 
         segment_radius=segment_radius, roundness_threshold=roundness_threshold, 
-        max_feature_ratio=max_feature_ratio, bit_depth=config.bit_depth
+        max_feature_ratio=max_feature_ratio, bit_depth=config.bit_depth, batch_fit=batch_fit
     )
 
     # If the star extraction failed, return an empty list
@@ -355,7 +375,7 @@ def extractStarsImgHandle(img_handle,
         border=10,
         max_global_intensity=150, 
         neighborhood_size=10, intensity_threshold=18, 
-        segment_radius=4, roundness_threshold=0.5, max_feature_ratio=0.8
+        segment_radius=4, roundness_threshold=0.5, max_feature_ratio=0.8, batch_fit=False
     ):
 
     """ Extracts stars on a given image handle by searching for local maxima and applying PSF fit for star 
@@ -379,6 +399,7 @@ def extractStarsImgHandle(img_handle,
         roundness_threshold: [float] Minimum ratio of 2D Gaussian sigma X and sigma Y to be taken as a stars
             (hot pixels are narrow, while stars are round).
         max_feature_ratio: [float] Maximum ratio between 2 sigma of the star and the image segment area.
+        batch_fit: [bool] Fit all star candidates at once, see extractStars. False by default.
 
     Return:
         x2, y2, background, intensity, fwhm: [list of ndarrays]
@@ -401,6 +422,7 @@ def extractStarsImgHandle(img_handle,
         segment_radius = config.segment_radius
         roundness_threshold = config.roundness_threshold
         max_feature_ratio = config.max_feature_ratio
+        batch_fit = config.psf_fit_batch
 
 
     star_list = []
@@ -449,7 +471,7 @@ def extractStarsImgHandle(img_handle,
             max_star_candidates=config.max_stars, border=border,
             neighborhood_size=neighborhood_size, intensity_threshold=intensity_threshold, 
             segment_radius=segment_radius, roundness_threshold=roundness_threshold, 
-            max_feature_ratio=max_feature_ratio
+            max_feature_ratio=max_feature_ratio, batch_fit=batch_fit
         )
 
         # If the star extraction failed, return an empty list
@@ -495,9 +517,149 @@ def extractStarsImgHandle(img_handle,
 
 
 
+def _psfPhotometry(star_seg, popt, segment_radius, roundness_threshold, max_feature_ratio, gamma, 
+    saturation_threshold_report):
+    """ Filter the fitted star candidate and compute its intensity, SNR and the number of saturated pixels.
+
+    Arguments:
+        star_seg: [ndarray] Image segment around the star on which the fit was done.
+        popt: [list] Fitted 2D Gaussian parameters (amplitude, yo, xo, sigma_y, sigma_x, theta, offset).
+        segment_radius: [int] Radius (in pixels) of image segment around the detected star.
+        roundness_threshold: [float] Minimum ratio of 2D Gaussian sigma X and sigma Y.
+        max_feature_ratio: [float] Maximum ratio between 2 sigma of the star and the image segment area.
+        gamma: [float] Gamma correction factor for the image.
+        saturation_threshold_report: [int] Level above which the pixels are counted as saturated.
+
+    Return:
+        [tuple] (yo, xo, amplitude, intensity, sigma_y, sigma_x, background, snr, saturated_count), or None
+            if the candidate was rejected.
+    """
+
+    # Unpack fitted gaussian parameters
+    amplitude, yo, xo, sigma_y, sigma_x, theta, offset = popt
+
+    # Take absolute values of some parameters
+    amplitude = abs(amplitude)
+    sigma_x = abs(sigma_x)
+    sigma_y = abs(sigma_y)
+
+    # Filter hot pixels by looking at the ratio between x and y sigmas (HPs are very narrow)
+    if min(sigma_y/sigma_x, sigma_x/sigma_y) < roundness_threshold:
+        # Skip if it is a hot pixel
+        return None
+
+    # Reject the star candidate if it is too large 
+    if (4*sigma_x*sigma_y/segment_radius**2 > max_feature_ratio):
+        return None
+
+
+    ### If the fitting was successful, compute the star intensity
+
+    # Crop the star segment to take 3 sigma portion around the star
+    crop_y_min = int(yo - 3*sigma_y) + 1
+    if crop_y_min < 0: crop_y_min = 0
+    
+    crop_y_max = int(yo + 3*sigma_y) + 1
+    if crop_y_max >= star_seg.shape[0]: crop_y_max = star_seg.shape[0] - 1
+
+    crop_x_min = int(xo - 3*sigma_x) + 1
+    if crop_x_min < 0: crop_x_min = 0
+
+    crop_x_max = int(xo + 3*sigma_x) + 1
+    if crop_x_max >= star_seg.shape[1]: crop_x_max = star_seg.shape[1] - 1
+
+    # If the segment is too small, set a fixed size
+    if star_seg.shape[0] < 3:
+        crop_y_min = int(yo - 2)
+        crop_y_max = int(yo + 2)
+
+    if star_seg.shape[1] < 3:
+        crop_x_min = int(xo - 2)
+        crop_x_max = int(xo + 2)
+
+
+    star_seg_crop = star_seg[crop_y_min:crop_y_max, crop_x_min:crop_x_max]
+
+    # Skip the star if the shape is too small
+    if (star_seg_crop.shape[0] == 0) or (star_seg_crop.shape[1] == 0):
+        return None
+
+    # Gamma correct the star segment
+    star_seg_crop_corr = Image.gammaCorrectionImage(star_seg_crop.astype(np.float32), gamma)
+
+    # Correct the background for gamma
+    bg_corrected = Image.gammaCorrectionScalar(offset, gamma)
+
+    # Subtract the background from the star segment and compute the total intensity
+    intensity = np.sum(star_seg_crop_corr - bg_corrected)
+
+    # Skip stars with zero intensity
+    if intensity <= 0:
+        return None
+
+
+    ### Compute the star's SNR
+
+    # Compute the number of pixels inside the 3 sigma ellipse around the star
+    star_px_area = np.pi*(3*sigma_x)*(3*sigma_y)
+
+    # Estimate the standard deviation of the background, which is area outside the 3 sigma ellipse
+    star_seg_crop_nan = np.copy(star_seg_crop_corr)
+    star_seg_crop_nan[crop_y_min:crop_y_max, crop_x_min:crop_x_max] = np.nan
+    bg_std = np.nanstd(star_seg_crop_nan)
+
+    # Make sure the background standard deviation is not zero
+    if (bg_std <= 0) or np.isnan(bg_std):
+        bg_std = 1
+
+    # Compute the SNR
+    snr = Image.signalToNoise(intensity, star_px_area, bg_corrected, bg_std)
+
+    ###
+
+
+    ### Determine the number of saturated pixels ###
+
+    # Count the number of saturated pixels (before gamma correction)
+    saturated_count = np.sum(star_seg_crop >= saturation_threshold_report)
+
+    ###
+
+
+    return yo, xo, amplitude, intensity, sigma_y, sigma_x, bg_corrected, snr, saturated_count
+
+
+
+def _starSegmentBounds(y, x, segment_radius, nrows, ncols):
+    """ Compute the bounds of the image segment around the star. Returns None if the position is NaN. """
+
+    y_min = y - segment_radius
+    y_max = y + segment_radius
+    x_min = x - segment_radius
+    x_max = x + segment_radius
+
+    if y_min < 0:
+        y_min = np.array([0])
+    if y_max > nrows:
+        y_max = np.array([nrows])
+    if x_min < 0:
+        x_min = np.array([0])
+    if x_max > ncols:
+        x_max = np.array([ncols])
+
+    # Check if any of these values is NaN and skip the star
+    if np.any(np.isnan([x_min, x_max, y_min, y_max])):
+        return None
+
+    return int(y_min), int(y_max), int(x_min), int(x_max)
+
+
+
 def fitPSF(img, img_median, x_init, y_init, gamma=1.0, segment_radius=4, roundness_threshold=0.5, 
            max_feature_ratio=0.8, bit_depth=8):
-    """ Fit a 2D Gaussian to the star candidate cutout to check if it's a star.
+    """ Fit a 2D Gaussian to the star candidate cutout to check if it's a star. Every candidate is fitted
+        separately with scipy.optimize.curve_fit, see fitPSFBatch for a faster version which fits all 
+        candidates at once.
     
     Arguments:
         img: [ndarray] Image data.
@@ -541,28 +703,11 @@ def fitPSF(img, img_median, x_init, y_init, gamma=1.0, segment_radius=4, roundne
 
         y, x = star
 
-        y_min = y - segment_radius
-        y_max = y + segment_radius
-        x_min = x - segment_radius
-        x_max = x + segment_radius
-
-        if y_min < 0:
-            y_min = np.array([0])
-        if y_max > nrows:
-            y_max = np.array([nrows])
-        if x_min < 0:
-            x_min = np.array([0])
-        if x_max > ncols:
-            x_max = np.array([ncols])
-
-        # Check if any of these values is NaN and skip the star
-        if np.any(np.isnan([x_min, x_max, y_min, y_max])):
+        bounds = _starSegmentBounds(y, x, segment_radius, nrows, ncols)
+        if bounds is None:
             continue
 
-        x_min = int(x_min)
-        x_max = int(x_max)
-        y_min = int(y_min)
-        y_max = int(y_max)
+        y_min, y_max, x_min, x_max = bounds
 
         # Extract an image segment around each star
         star_seg = img[y_min:y_max, x_min:x_max]
@@ -586,145 +731,314 @@ def fitPSF(img, img_median, x_init, y_init, gamma=1.0, segment_radius=4, roundne
             # Skip stars that can't be fitted in 200 iterations
             continue
 
-        # Unpack fitted gaussian parameters
-        amplitude, yo, xo, sigma_y, sigma_x, theta, offset = popt
-
-        # Take absolute values of some parameters
-        amplitude = abs(amplitude)
-        sigma_x = abs(sigma_x)
-        sigma_y = abs(sigma_y)
+        # Filter the star and compute the photometry
+        star_params = _psfPhotometry(star_seg, popt, segment_radius, roundness_threshold, max_feature_ratio, 
+            gamma, saturation_threshold_report)
 
-        # Filter hot pixels by looking at the ratio between x and y sigmas (HPs are very narrow)
-        if min(sigma_y/sigma_x, sigma_x/sigma_y) < roundness_threshold:
-            # Skip if it is a hot pixel
+        if star_params is None:
             continue
 
-        # Reject the star candidate if it is too large 
-        if (4*sigma_x*sigma_y/segment_radius**2 > max_feature_ratio):
-            continue
+        yo, xo, amplitude, intensity, sigma_y, sigma_x, bg_corrected, snr, saturated_count = star_params
+
+        # Add stars to the final list
+        x_fitted.append(x_min + xo)
+        y_fitted.append(y_min + yo)
+        amplitude_fitted.append(amplitude)
+        intensity_fitted.append(intensity)
+        sigma_y_fitted.append(sigma_y)
+        sigma_x_fitted.append(sigma_x)
+        background_fitted.append(bg_corrected)
+        snr_fitted.append(snr)
+        saturated_count_fitted.append(saturated_count)
 
+        # # Plot fitted stars
+        # data_fitted = twoDGaussian((y_ind, x_ind), *popt) - offset
 
-        ### If the fitting was successful, compute the star intensity
+        # fig, ax = plt.subplots(1, 1)
+        # ax.hold(True)
+        # plt.title('Center Y: '+str(y_min[0])+', X:'+str(x_min[0]))
+        # ax.imshow(star_seg.reshape(segment_radius*2, segment_radius*2), cmap=plt.cm.inferno, origin='bottom',
+        #     extent=(x_ind.min(), x_ind.max(), y_ind.min(), y_ind.max()))
+        # # ax.imshow(data_fitted.reshape(segment_radius*2, segment_radius*2), cmap=plt.cm.jet, origin='bottom')
+        # ax.contour(x_ind, y_ind, data_fitted.reshape(segment_radius*2, segment_radius*2), 8, colors='w')
 
-        # Crop the star segment to take 3 sigma portion around the star
-        crop_y_min = int(yo - 3*sigma_y) + 1
-        if crop_y_min < 0: crop_y_min = 0
-        
-        crop_y_max = int(yo + 3*sigma_y) + 1
-        if crop_y_max >= star_seg.shape[0]: crop_y_max = star_seg.shape[0] - 1
+        # plt.show()
+        # plt.clf()
+        # plt.close()
 
-        crop_x_min = int(xo - 3*sigma_x) + 1
-        if crop_x_min < 0: crop_x_min = 0
+    return (
+            x_fitted, y_fitted, 
+            amplitude_fitted, intensity_fitted, 
+            sigma_y_fitted, sigma_x_fitted, 
+            background_fitted, snr_fitted, saturated_count_fitted
+            )
 
-        crop_x_max = int(xo + 3*sigma_x) + 1
-        if crop_x_max >= star_seg.shape[1]: crop_x_max = star_seg.shape[1] - 1
 
-        # If the segment is too small, set a fixed size
-        if (y_max - y_min) < 3:
-            crop_y_min = int(yo - 2)
-            crop_y_max = int(yo + 2)
 
-        if (x_max - x_min) < 3:
-            crop_x_min = int(xo - 2)
-            crop_x_max = int(xo + 2)
+def _twoDGaussianBatch(params, y_ind, x_ind, saturation):
+    """ Evaluate the 2D Gaussians (same model as Math.twoDGaussian) and their Jacobians for a stack of 
+        parameter sets.
 
+    Arguments:
+        params: [ndarray] (N, 7) array of (amplitude, yo, xo, sigma_y, sigma_x, theta, offset).
+        y_ind: [ndarray] Y pixel indices of the segment, shape (H, 1).
+        x_ind: [ndarray] X pixel indices of the segment, shape (1, W).
+        saturation: [float] Saturation level.
 
-        star_seg_crop = star_seg[crop_y_min:crop_y_max, crop_x_min:crop_x_max]
+    Return:
+        (model, jac): [tuple of ndarrays] Model values of shape (N, H, W) and the Jacobian of shape 
+            (N, H, W, 7).
+    """
 
-        # Skip the star if the shape is too small
-        if (star_seg_crop.shape[0] == 0) or (star_seg_crop.shape[1] == 0):
-            continue
+    amp, yo, xo, s1, s2, theta, offset = [params[:, i, None, None] for i in range(7)]
 
-        # Gamma correct the star segment
-        star_seg_crop_corr = Image.gammaCorrectionImage(star_seg_crop.astype(np.float32), gamma)
+    amp_sign = np.where(amp < 0, -1.0, 1.0)
+    s1_sign = np.where(s1 < 0, -1.0, 1.0)
+    s2_sign = np.where(s2 < 0, -1.0, 1.0)
 
-        # Correct the background for gamma
-        bg_corrected = Image.gammaCorrectionScalar(offset, gamma)
+    amp = np.abs(amp)
+    s1 = np.abs(s1)
+    s2 = np.abs(s2)
 
-        # Subtract the background from the star segment and compute the total intensity
-        intensity = np.sum(star_seg_crop_corr - bg_corrected)
+    cos_t = np.cos(theta)
+    sin_t = np.sin(theta)
+    sin_2t = np.sin(2*theta)
+    cos_2t = np.cos(2*theta)
 
-        # Skip stars with zero intensity
-        if intensity <= 0:
-            continue
+    a = cos_t**2/(2*s1**2) + sin_t**2/(2*s2**2)
+    b = -sin_2t/(4*s1**2) + sin_2t/(4*s2**2)
+    c = sin_t**2/(2*s1**2) + cos_t**2/(2*s2**2)
 
+    u = y_ind - yo
+    v = x_ind - xo
 
-        ### Compute the star's SNR
+    uu = u*u
+    uv = u*v
+    vv = v*v
 
-        # Compute the number of pixels inside the 3 sigma ellipse around the star
-        star_px_area = np.pi*(3*sigma_x)*(3*sigma_y)
+    expo = np.exp(-(a*uu + 2*b*uv + c*vv))
+    amp_expo = amp*expo
 
-        # Estimate the standard deviation of the background, which is area outside the 3 sigma ellipse
-        star_seg_crop_nan = np.copy(star_seg_crop_corr)
-        star_seg_crop_nan[crop_y_min:crop_y_max, crop_x_min:crop_x_max] = np.nan
-        bg_std = np.nanstd(star_seg_crop_nan)
+    model = offset + amp_expo
 
-        # Make sure the background standard deviation is not zero
-        if (bg_std <= 0) or np.isnan(bg_std):
-            bg_std = 1
+    # Derivatives of the quadratic form coefficients by the sigmas and the rotation
+    da_s1, db_s1, dc_s1 = -cos_t**2/s1**3, sin_2t/(2*s1**3), -sin_t**2/s1**3
+    da_s2, db_s2, dc_s2 = -sin_t**2/s2**3, -sin_2t/(2*s2**3), -cos_t**2/s2**3
+    da_t = sin_2t*(1.0/s2**2 - 1.0/s1**2)/2
+    db_t = cos_2t*(1.0/s2**2 - 1.0/s1**2)/2
+    dc_t = -da_t
 
-        # Compute the SNR
-        snr = Image.signalToNoise(intensity, star_px_area, bg_corrected, bg_std)
+    jac = np.empty(model.shape + (7,))
+    jac[..., 0] = amp_sign*expo
+    jac[..., 1] = amp_expo*(2*a*u + 2*b*v)
+    jac[..., 2] = amp_expo*(2*b*u + 2*c*v)
+    jac[..., 3] = -amp_expo*s1_sign*(da_s1*uu + 2*db_s1*uv + dc_s1*vv)
+    jac[..., 4] = -amp_expo*s2_sign*(da_s2*uu + 2*db_s2*uv + dc_s2*vv)
+    jac[..., 5] = -amp_expo*(da_t*uu + 2*db_t*uv + dc_t*vv)
+    jac[..., 6] = 1.0
 
-        ###
+    # Limit values to saturation level, the saturated pixels do not depend on the parameters
+    saturated = model > saturation
+    model[saturated] = saturation
+    jac[saturated] = 0
 
+    return model, jac
 
-        ### Determine the number of saturated pixels ###
 
-        # Count the number of saturated pixels (before gamma correction)
-        saturated_count = np.sum(star_seg_crop >= saturation_threshold_report)
 
-        ###
+def fitTwoDGaussianBatch(segments, weights, initial_guess, saturation, max_iter=50, ftol=1.49012e-08, 
+        xtol=1.49012e-08):
+    """ Fit 2D Gaussians to a stack of image segments at once, using the Levenberg-Marquardt method which is
+        vectorized over the segments.
 
+    Arguments:
+        segments: [ndarray] (N, H, W) stack of image segments.
+        weights: [ndarray] (N, H, W) array with 1 for the pixels used in the fit and 0 for the padding.
+        initial_guess: [ndarray] (N, 7) initial parameters (see _twoDGaussianBatch).
+        saturation: [float] Saturation level.
 
-        # print(intensity)
-        # plt.imshow(star_seg_crop - bg_corrected, cmap='gray', vmin=0, vmax=255)
-        # plt.show()
+    Keyword arguments:
+        max_iter: [int] Maximum number of iterations, i.e. evaluations of the model and its Jacobian. The 
+            fits which don't converge in this number of iterations are reported as failed.
+        ftol: [float] Relative tolerance for the decrease of the sum of squares, the same default as for
+            curve_fit.
+        xtol: [float] Relative tolerance for the change of the parameters, the same default as for 
+            curve_fit.
 
+    Return:
+        (params, converged): [tuple of ndarrays] Fitted parameters (N, 7) and a boolean array of fits which
+            have converged.
+    """
 
-        ###
+    n_segs, height, width = segments.shape
 
-        # Calculate the intensity (as a volume under the 2D Gaussian) (OLD, before gamma correction)
-        # intensity = 2*np.pi*amplitude*sigma_x*sigma_y
+    y_ind = np.arange(height, dtype=np.float64)[:, None]
+    x_ind = np.arange(width, dtype=np.float64)[None, :]
 
+    params = np.array(initial_guess, dtype=np.float64)
+    lam = np.full(n_segs, 1e-3)
+    scale_sq = np.zeros((n_segs, 7))
+    converged = np.zeros(n_segs, dtype=bool)
+    failed = np.zeros(n_segs, dtype=bool)
 
+    # Ignore overflows for the candidates with diverging parameters, they will not converge
+    err_settings = np.seterr(over='ignore', invalid='ignore', divide='ignore')
 
-        # # Skip if the star intensity is below background level
-        # if intensity < offset:
-        #     continue
+    model, jac = _twoDGaussianBatch(params, y_ind, x_ind, saturation)
+    resid = (segments - model)*weights
+    cost = np.sum(resid**2, axis=(1, 2))
 
-        # Add stars to the final list
-        x_fitted.append(x_min + xo)
-        y_fitted.append(y_min + yo)
-        amplitude_fitted.append(amplitude)
-        intensity_fitted.append(intensity)
-        sigma_y_fitted.append(sigma_y)
-        sigma_x_fitted.append(sigma_x)
-        background_fitted.append(bg_corrected)
-        snr_fitted.append(snr)
-        saturated_count_fitted.append(saturated_count)
+    for _ in range(max_iter - 1):
 
-        # # Plot fitted stars
-        # data_fitted = twoDGaussian((y_ind, x_ind), *popt) - offset
+        active = ~(converged | failed)
+        if not np.any(active):
+            break
 
-        # fig, ax = plt.subplots(1, 1)
-        # ax.hold(True)
-        # plt.title('Center Y: '+str(y_min[0])+', X:'+str(x_min[0]))
-        # ax.imshow(star_seg.reshape(segment_radius*2, segment_radius*2), cmap=plt.cm.inferno, origin='bottom',
-        #     extent=(x_ind.min(), x_ind.max(), y_ind.min(), y_ind.max()))
-        # # ax.imshow(data_fitted.reshape(segment_radius*2, segment_radius*2), cmap=plt.cm.jet, origin='bottom')
-        # ax.contour(x_ind, y_ind, data_fitted.reshape(segment_radius*2, segment_radius*2), 8, colors='w')
+        idx = np.where(active)[0]
 
-        # plt.show()
-        # plt.clf()
-        # plt.close()
+        # Normal equations for the active fits
+        jac_w = (jac[idx]*weights[idx, :, :, None]).reshape(len(idx), -1, 7)
+        jac_w_t = jac_w.transpose(0, 2, 1)
+        jtj = np.matmul(jac_w_t, jac_w)
+        jtr = np.matmul(jac_w_t, resid[idx].reshape(len(idx), -1, 1))[:, :, 0]
 
-    return (
-            x_fitted, y_fitted, 
-            amplitude_fitted, intensity_fitted, 
-            sigma_y_fitted, sigma_x_fitted, 
-            background_fitted, snr_fitted, saturated_count_fitted
-            )
+        # Levenberg-Marquardt damping, scaled by the largest diagonal seen so far (as in MINPACK). Scaling 
+        #   by the current diagonal lets the parameters with a vanishing gradient run away
+        scale_sq[idx] = np.maximum(scale_sq[idx], np.einsum('nii->ni', jtj))
+        diag = np.where(scale_sq[idx] > 0, scale_sq[idx], 1.0)
+        lhs = jtj + (lam[idx, None]*diag)[:, :, None]*np.eye(7)
+
+        try:
+            step = np.linalg.solve(lhs, jtr[:, :, None])[:, :, 0]
+
+        except np.linalg.LinAlgError:
+            step = np.zeros_like(jtr)
+            for i in range(len(idx)):
+                try:
+                    step[i] = np.linalg.solve(lhs[i], jtr[i])
+                except np.linalg.LinAlgError:
+                    failed[idx[i]] = True
+
+        # Evaluate the step
+        params_new = params[idx] + step
+        model_new, jac_new = _twoDGaussianBatch(params_new, y_ind, x_ind, saturation)
+        resid_new = (segments[idx] - model_new)*weights[idx]
+        cost_new = np.sum(resid_new**2, axis=(1, 2))
+
+        improved = np.isfinite(cost_new) & (cost_new <= cost[idx]) & ~failed[idx]
+
+        # Check the convergence on the sum of squares and on the scaled parameters
+        cost_change = cost[idx] - cost_new <= ftol*cost[idx]
+        scale = np.sqrt(diag)
+        param_change = np.sqrt(np.sum((scale*step)**2, axis=1)) \
+            <= xtol*np.sqrt(np.sum((scale*params[idx])**2, axis=1))
+
+        # Accept the improved steps and decrease the damping
+        acc = idx[improved]
+        params[acc] = params_new[improved]
+        model[acc] = model_new[improved]
+        jac[acc] = jac_new[improved]
+        resid[acc] = resid_new[improved]
+        converged[acc] = (cost_change | param_change)[improved]
+        cost[acc] = cost_new[improved]
+        lam[acc] = np.maximum(lam[acc]/10.0, 1e-12)
+
+        # Increase the damping for the rejected steps. A fit which can't move the parameters anymore is at
+        #   the minimum, and a fit is failed when the damping can't help anymore
+        rej = idx[~improved]
+        converged[rej] = param_change[~improved] & ~failed[rej]
+        lam[rej] *= 10.0
+        failed[rej[lam[rej] > 1e10]] = True
+
+    np.seterr(**err_settings)
+
+    return params, converged & ~failed
+
+
+
+def fitPSFBatch(img, img_median, x_init, y_init, gamma=1.0, segment_radius=4, roundness_threshold=0.5, 
+           max_feature_ratio=0.8, bit_depth=8, max_iter=50):
+    """ Fit a 2D Gaussian to the star candidate cutouts to check if they are stars. All cutouts are fitted
+        at once with a vectorized Levenberg-Marquardt solver (see fitTwoDGaussianBatch). The arguments and 
+        the outputs are the same as for fitPSF. The fitted values agree with curve_fit to within the fit 
+        tolerance, but a few marginal candidates may be accepted by one fit and rejected by the other.
+
+    Keyword arguments:
+        max_iter: [int] Maximum number of iterations of every fit. The candidates which don't converge are 
+            rejected.
+
+    """
+
+    # Get the image dimensions
+    nrows, ncols = img.shape
+
+    # Threshold for the reported numbers of saturated pixels (98% of the dynamic range)
+    saturation_threshold_report = int(round(0.98*(2**bit_depth - 1)))
+
+    # Saturation level of the image
+    saturation = 2**bit_depth - 1
+
+    seg_size = 2*segment_radius
+
+
+    # Compute the segment bounds of all stars
+    bounds = []
+    for y, x in zip(list(y_init), list(x_init)):
+
+        star_bounds = _starSegmentBounds(y, x, segment_radius, nrows, ncols)
+        if star_bounds is not None:
+            bounds.append(star_bounds)
+
+    # Fill the output columns with the fit results
+    results = [[] for _ in range(9)]
+
+    if not bounds:
+        return tuple(results)
+
+    bounds = np.array(bounds, dtype=np.int64)
+    y_min, y_max, x_min, x_max = bounds.T
+
+
+    # Cut out all segments at once. The segments on the image edge are smaller, so the stack is padded and
+    #   the padding is excluded from the fit by the weights
+    offsets = np.arange(seg_size)
+    rows = y_min[:, None] + offsets
+    cols = x_min[:, None] + offsets
+    rows_valid = rows < y_max[:, None]
+    cols_valid = cols < x_max[:, None]
+
+    segments = img[np.clip(rows, 0, nrows - 1)[:, :, None], np.clip(cols, 0, ncols - 1)[:, None, :]]
+    segments = segments.astype(np.float64)
+    weights = (rows_valid[:, :, None] & cols_valid[:, None, :]).astype(np.float64)
+
+    # Set the initial guess
+    initial_guess = np.tile([30.0, segment_radius, segment_radius, 1.0, 1.0, 0.0, img_median], \
+        (len(bounds), 1))
+
+    # Fit the PSFs
+    popts, converged = fitTwoDGaussianBatch(segments, weights, initial_guess, saturation, \
+        max_iter=max_iter)
+
+
+    # Filter the stars and compute the photometry
+    for i in np.where(converged)[0]:
+
+        star_seg = img[y_min[i]:y_max[i], x_min[i]:x_max[i]]
+
+        star_params = _psfPhotometry(star_seg, popts[i], segment_radius, roundness_threshold, 
+            max_feature_ratio, gamma, saturation_threshold_report)
+
+        if star_params is None:
+            continue
+
+        yo, xo, amplitude, intensity, sigma_y, sigma_x, bg_corrected, snr, saturated_count = star_params
+
+        for col, val in zip(results, [x_min[i] + xo, y_min[i] + yo, amplitude, intensity, sigma_y, sigma_x, 
+            bg_corrected, snr, saturated_count]):
+
+            col.append(val)
+
+    return tuple(results)
 
 
 
@@ -768,8 +1082,8 @@ def extractStarsAndSave(config, ff_dir):
 
     time_start = time.time()
 
-    # Load mask, dark, flat
-    mask, dark, flat_struct = loadImageCalibration(ff_dir, config)
+    # Load mask, dark, flat into shared memory, so they are given to the workers only once
+    calibration = loadSharedImageCalibration(ff_dir, config)
     
 
     extraction_list = []
@@ -792,10 +1106,7 @@ def extractStarsAndSave(config, ff_dir):
         log.info('Extracting stars from ' + ff_name)
 
         # Run the extraction
-        result = extractStarsFF(
-            ff_dir, ff_name, flat_struct=flat_struct, dark=dark, mask=mask,
-            config=config
-        )
+        result = extractStarsFF(ff_dir, ff_name, config=config, calibration=calibration)
 
         results = [result]
 
@@ -806,14 +1117,16 @@ def extractStarsAndSave(config, ff_dir):
         # workers waiting for the tasks to finish
         num_cores = min(config.num_cores, len(extraction_list))
 
-        # Run the QueuedPool for detection
-        workpool = QueuedPool(extractStarsFF, cores=num_cores, backup_dir=ff_dir, input_queue_maxsize=None)
+        # Run the QueuedPool for detection. The config and the calibration are given to the workers once
+        #   when they start, so the jobs only carry the file names
+        workpool = QueuedPool(extractStarsFF, cores=num_cores, backup_dir=ff_dir, input_queue_maxsize=None,
+            func_kwargs={'config': config, 'calibration': calibration}, fast_transport=True)
 
 
         # Add jobs for the pool
         for ff_name in extraction_list:
             log.info('Adding for extraction: ' + ff_name)
-            workpool.addJob([ff_dir, ff_name, flat_struct, dark, mask, config, None, None, None, None, None, None, None])
+            workpool.addJob([ff_dir, ff_name])
 
 
         log.info('Starting pool...')
@@ -65,7 +65,258 @@ def filenameToDatetimeStr(file_name, iso8601=False):
 
 
 
-def read(directory, filename, array=False, full_filename=False):
+# FITS files are made of blocks of this many bytes, a header is made of 80 character cards
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+# Names of the image HDUs in the order they are written by write()
+FF_IMAGE_NAMES = ['MAXPIXEL', 'MAXFRAME', 'AVEPIXEL', 'STDPIXEL']
+
+# Layouts of the image HDUs of already read files. The key is the size of the file and the size of the primary
+#   header, the value is a list of (header offset, header bytes) of the 4 image HDUs, and the shape and dtype
+#   of the images
+FAST_LAYOUTS = {}
+
+
+def _parseCardValue(value):
+    """ Convert the value part of a FITS header card to a Python value, in the same way astropy does it for
+        the values written by RMS.
+    """
+
+    value = value.strip()
+
+    # String values are quoted, with the quotes escaped by doubling
+    if value.startswith("'"):
+
+        i = 1
+        chars = []
+        while i < len(value):
+
+            if value[i] == "'":
+
+                if value[i + 1:i + 2] == "'":
+                    chars.append("'")
+                    i += 2
+                    continue
+
+                break
+
+            chars.append(value[i])
+            i += 1
+
+        return "".join(chars).rstrip()
+
+
+    # Strip the comment
+    value = value.split('/')[0].strip()
+
+    if value == 'T':
+        return True
+
+    if value == 'F':
+        return False
+
+    try:
+        return int(value)
+
+    except ValueError:
+        return float(value.replace('D', 'E'))
+
+
+
+def _parseHeader(mm, offset, max_blocks=10):
+    """ Parse a FITS header starting at the given offset in the memory map.
+
+    Return:
+        (header, header_size): [tuple] A dictionary of header keywords and values, and the size of the header
+            in bytes (a multiple of the block size). None if the header is not valid.
+    """
+
+    header = {}
+
+    for block in range(max_blocks):
+
+        block_start = offset + block*FITS_BLOCK_SIZE
+        if block_start + FITS_BLOCK_SIZE > len(mm):
+            return None
+
+        block_data = mm[block_start:block_start + FITS_BLOCK_SIZE].tobytes()
+
+        for i in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+
+            card = block_data[i:i + FITS_CARD_SIZE].decode('ascii', 'replace')
+            keyword = card[:8].strip()
+
+            if keyword == 'END':
+                return header, (block + 1)*FITS_BLOCK_SIZE
+
+            # Only cards with values are needed
+            if card[8:10] != '= ':
+                continue
+
+            try:
+                header[keyword] = _parseCardValue(card[10:])
+            except ValueError:
+                pass
+
+    return None
+
+
+
+def _imageLayout(mm, offset):
+    """ Find the layout of the 4 image HDUs written by write(), starting at the given offset. 
+
+    Return:
+        [list] (header offset, header bytes) of every image HDU, the image shape and the dtype. None if the 
+            HDUs don't have the expected layout, in which case the file should be read with astropy.
+    """
+
+    hdus = []
+    shape = None
+    dtype = None
+
+    for name in FF_IMAGE_NAMES:
+
+        parsed = _parseHeader(mm, offset)
+        if parsed is None:
+            return None
+
+        head, header_size = parsed
+
+        if (head.get('XTENSION') != 'IMAGE') or (head.get('EXTNAME') != name) or (head.get('NAXIS') != 2) \
+            or (head.get('PCOUNT', 0) != 0) or (head.get('GCOUNT', 1) != 1) or (head.get('BSCALE', 1) != 1):
+            return None
+
+        # Only unsigned 8 and 16 bit images are supported, as written by RMS
+        bitpix = head.get('BITPIX')
+        bzero = head.get('BZERO', 0)
+        if (bitpix == 8) and (bzero == 0):
+            hdu_dtype = np.uint8
+
+        elif (bitpix == 16) and (bzero == 32768):
+            hdu_dtype = np.uint16
+
+        else:
+            return None
+
+        hdu_shape = (head['NAXIS2'], head['NAXIS1'])
+
+        # All images must be of the same size and type
+        if shape is None:
+            shape, dtype = hdu_shape, hdu_dtype
+
+        elif (hdu_shape != shape) or (hdu_dtype != dtype):
+            return None
+
+        hdus.append((offset, mm[offset:offset + header_size].tobytes()))
+
+        # Data is padded to the full block
+        data_size = shape[0]*shape[1]*np.dtype(dtype).itemsize
+        offset += header_size + int(np.ceil(data_size/FITS_BLOCK_SIZE))*FITS_BLOCK_SIZE
+
+    if offset > len(mm):
+        return None
+
+    return hdus, shape, dtype
+
+
+
+def readFast(file_path):
+    """ Read a FF file in the FITS layout written by write(), without astropy. The file is memory mapped and 
+        the images are read directly from the image HDUs. The offsets of the HDUs are computed once for 
+        every file size and reused while the headers of the files match.
+
+    Arguments:
+        file_path: [str] Path to the FF*.fits file.
+
+    Return:
+        [ff structure] None if the file is not in the layout written by RMS.
+    """
+
+    if os.path.getsize(file_path) < FITS_BLOCK_SIZE:
+        return None
+
+    # Map the file copy-on-write, so the images can be modified in memory as with astropy
+    mm = np.memmap(file_path, dtype=np.uint8, mode='c')
+
+    # Read the primary header
+    parsed = _parseHeader(mm, 0)
+    if parsed is None:
+        return None
+
+    head, primary_size = parsed
+
+    if (head.get('SIMPLE') is not True) or (head.get('NAXIS') != 0):
+        return None
+
+    for key in ['NROWS', 'NCOLS', 'NBITS', 'NFRAMES', 'FIRST', 'CAMNO', 'FPS']:
+        if key not in head:
+            return None
+
+
+    # Reuse the layout of a previously read file if the image headers are the same
+    layout_key = (len(mm), primary_size)
+    layout = FAST_LAYOUTS.get(layout_key)
+
+    if layout is not None:
+        for header_offset, header_bytes in layout[0]:
+            if mm[header_offset:header_offset + len(header_bytes)].tobytes() != header_bytes:
+                layout = None
+                break
+
+    if layout is None:
+
+        layout = _imageLayout(mm, primary_size)
+        if layout is None:
+            return None
+
+        FAST_LAYOUTS[layout_key] = layout
+
+
+    hdus, shape, dtype = layout
+
+    images = []
+    for header_offset, header_bytes in hdus:
+
+        data_offset = header_offset + len(header_bytes)
+        data_size = shape[0]*shape[1]*np.dtype(dtype).itemsize
+
+        if dtype == np.uint8:
+            img = mm[data_offset:data_offset + data_size].reshape(shape)
+
+        else:
+            # 16 bit data is stored as big endian signed integers with BZERO = 32768
+            img = (mm[data_offset:data_offset + data_size].view('>u2') ^ 0x8000).astype(np.uint16)
+            img = img.reshape(shape)
+
+        images.append(img)
+
+
+    # Init an empty FF structure
+    ff = FFStruct()
+
+    # Read in the data from the header
+    ff.nrows = head['NROWS']
+    ff.ncols = head['NCOLS']
+    ff.nbits = head['NBITS']
+    ff.nframes = head['NFRAMES']
+    ff.first = head['FIRST']
+    ff.camno = head['CAMNO']
+    ff.fps = head['FPS']
+
+    # Check for the DATE-OBS field and read datetime from filename it if it doesn't exist
+    if 'DATE-OBS' in head:
+        ff.starttime = head['DATE-OBS']
+    else:
+        ff.starttime = filenameToDatetimeStr(os.path.basename(file_path), iso8601=True)
+
+    ff.maxpixel, ff.maxframe, ff.avepixel, ff.stdpixel = images
+
+    return ff
+
+
+
+def read(directory, filename, array=False, full_filename=False, fast=True):
     """ Read a FF structure from a FITS file. 
     
     Arguments:
@@ -76,6 +327,8 @@ def read(directory, filename, array=False, full_filename=False):
         array: [ndarray] True in order to populate structure's array element (default is False)
         full_filename: [bool] True if full file name is given explicitly, a name which may differ from the
             usual FF*.fits format. False by default.
+        fast: [bool] Read the file with readFast if it has the layout written by RMS, otherwise use astropy.
+            True by default.
     
     Return:
         [ff structure]
@@ -84,9 +337,28 @@ def read(directory, filename, array=False, full_filename=False):
 
     # Make sure the file starts with "FF_"
     if (filename.startswith('FF') and ('.fits' in filename)) or full_filename:
-        fid = open(os.path.join(directory, filename), "rb")
+        file_path = os.path.join(directory, filename)
     else:
-        fid = open(os.path.join(directory, "FF_" + filename + ".fits"), "rb")
+        file_path = os.path.join(directory, "FF_" + filename + ".fits")
+
+
+    if fast:
+
+        try:
+            ff = readFast(file_path)
+
+        except (ValueError, KeyError, IndexError):
+            ff = None
+
+        if ff is not None:
+
+            if array:
+                ff.array = np.stack([ff.maxpixel, ff.maxframe, ff.avepixel, ff.stdpixel], axis=0)
+
+            return ff
+
+
+    fid = open(file_path, "rb")
 
     # Init an empty FF structure
     ff = FFStruct()
@@ -155,97 +155,198 @@ class fr_struct:
 
 
 
-def read(dir_path, filename):
-    """ Read an FR*.bin file.
+# Number of lines, number of frames in a line, and the header of every frame cutout (yc, xc, t, size)
+FR_COUNT = struct.Struct('=I')
+FR_FRAME_HEADER = struct.Struct('=4I')
+
+
+class FRLineFrames(object):
+    """ Frame cutouts of one line of an FR file. The cutouts are returned as views on the file buffer, which
+        are only made when the frame is accessed.
+    """
+
+    def __init__(self, buffer, offsets, sizes):
+        """
+        Arguments:
+            buffer: [ndarray] uint8 contents of the whole FR file.
+            offsets: [list] Offsets of the image data of every frame in the buffer.
+            sizes: [list] Sizes of every frame cutout.
+        """
+
+        self.buffer = buffer
+        self.offsets = offsets
+        self.sizes = sizes
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        offset = self.offsets[i]
+        size = self.sizes[i]
+
+        return self.buffer[offset:(offset + size**2)].reshape(size, size)
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+
+def _frPath(dir_path, filename):
+    """ Return the full path of the FR file, the name can be given either with the FR prefix and the .bin 
+        suffix, or without.
+    """
+
+    if filename[:2] == "FR":
+        return os.path.join(dir_path, filename)
+    else:
+        return os.path.join(dir_path, "FR_" + filename + ".bin")
+
+
+
+def read(dir_path, filename, mmap=False):
+    """ Read an FR*.bin file. The file is read in one go (or memory mapped), only the headers are parsed
+        and the frame cutouts are views on the file data.
     
     Arguments:
         dir_path: [str] Path to directory containing file.
         filename: [str] Name of FR*.bin file (either with the FR prefix and the .bin suffix, or without).
+
+    Keyword arguments:
+        mmap: [bool] Memory map the file instead of reading it, so only the accessed cutouts are read from
+            disk. Changes to the cutouts are not written back to the file. False by default.
     
     Return:
         fr: [fr_struct instance] 
 
     """
-    if filename[:2] == "FR":
-        fid = open(os.path.join(dir_path, filename), "rb")
+
+    file_path = _frPath(dir_path, filename)
+
+    if mmap and (os.path.getsize(file_path) > 0):
+        buffer = np.memmap(file_path, dtype=np.uint8, mode='c')
     else:
-        fid = open(os.path.join(dir_path, "FR_" + filename + ".bin"), "rb")
+        buffer = np.fromfile(file_path, dtype=np.uint8)
 
     fr = fr_struct()
 
-    fr.lines = np.fromfile(fid, dtype=np.uint32, count=1)[0]
+    if len(buffer) < FR_COUNT.size:
+        raise ValueError("The FR file is too short: {:s}".format(file_path))
+
+    fr.lines = FR_COUNT.unpack_from(buffer, 0)[0]
+    offset = FR_COUNT.size
+
+    # Index the headers of all lines and frames
+    for _ in range(fr.lines):
+
+        if offset + FR_COUNT.size > len(buffer):
+            raise ValueError("The FR file is truncated: {:s}".format(file_path))
+
+        frameNum = FR_COUNT.unpack_from(buffer, offset)[0]
+        offset += FR_COUNT.size
 
-    for i in range(fr.lines):
-        frameNum = np.fromfile(fid, dtype=np.uint32, count=1)[0]
         yc = []
         xc = []
         t = []
         size = []
-        frames = []
+        offsets = []
+
+        for _ in range(frameNum):
+
+            if offset + FR_FRAME_HEADER.size > len(buffer):
+                raise ValueError("The FR file is truncated: {:s}".format(file_path))
+
+            frame_yc, frame_xc, frame_t, frame_size = FR_FRAME_HEADER.unpack_from(buffer, offset)
+            offset += FR_FRAME_HEADER.size
 
-        for z in range(frameNum):
-            yc.append(int(np.fromfile(fid, dtype=np.uint32, count=1)))
-            xc.append(int(np.fromfile(fid, dtype=np.uint32, count=1)))
-            t.append(int(np.fromfile(fid, dtype=np.uint32, count=1)))
-            size.append(int(np.fromfile(fid, dtype=np.uint32, count=1)))
-            frames.append(np.reshape(np.fromfile(fid, dtype=np.uint8, count=size[-1]**2), (size[-1], size[-1])))
+            if offset + frame_size**2 > len(buffer):
+                raise ValueError("The FR file is truncated: {:s}".format(file_path))
+
+            yc.append(frame_yc)
+            xc.append(frame_xc)
+            t.append(frame_t)
+            size.append(frame_size)
+            offsets.append(offset)
+
+            offset += frame_size**2
 
         fr.frameNum.append(frameNum)
         fr.yc.append(yc)
         fr.xc.append(xc)
         fr.t.append(t)
         fr.size.append(size)
-        fr.frames.append(frames)
+        fr.frames.append(FRLineFrames(buffer, offsets, size))
 
     return fr
 
 
+
+def _writeLines(file_path, lines):
+    """ Write the lines to an FR file. 
+
+    Arguments:
+        file_path: [str] Path to the FR file.
+        lines: [list] A list of (headers, frames) for every line, where headers is an (N, 4) array of (yc, xc,
+            t, size) of the N frames and frames are the N square cutouts.
+    """
+
+    chunks = [FR_COUNT.pack(len(lines))]
+
+    for headers, frames in lines:
+
+        headers = np.asarray(headers, dtype=np.uint32).reshape(-1, 4)
+
+        chunks.append(FR_COUNT.pack(len(headers)))
+
+        # Header of every frame is followed by its image data
+        for header, frame in zip(headers, frames):
+            chunks.append(header.tobytes())
+            chunks.append(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+
+    with open(file_path, "wb") as f:
+        f.write(b"".join(chunks))
+
+
+
 def write(fr, dir_path, filename):
     """ Write FR*.bin structure to a file in specified directory.
     """
 
-    if filename[:2] == "FR":
-        file = os.path.join(dir_path, filename)
-    else:
-        file = os.path.join(dir_path, "FR_" + filename + ".bin")
+    lines = []
+    for i in range(fr.lines):
+
+        n = fr.frameNum[i]
+        headers = np.column_stack([fr.yc[i][:n], fr.xc[i][:n], fr.t[i][:n], fr.size[i][:n]])
+        frames = [frame[:size, :size] for frame, size in zip(fr.frames[i][:n], fr.size[i][:n])]
 
-    file = os.path.join()
-    with open(file, "wb") as fid:
-        fid.write(struct.pack('I', fr.lines))
+        lines.append((headers, frames))
 
-        for i in range(fr.lines):
-            fid.write(struct.pack('I', fr.frameNum[i]))
+    _writeLines(_frPath(dir_path, filename), lines)
 
-            for z in range(fr.frameNum[i]):
-                fid.write(struct.pack('I', fr.yc[i, z]))
-                fid.write(struct.pack('I', fr.xc[i, z]))
-                fid.write(struct.pack('I', fr.t[i, z]))
-                fid.write(struct.pack('I', fr.size[i, z]))
-                fr.frames[i, z].tofile(fid)
 
 
 def writeArray(arr, dir_path, filename):
     """ Write array with extracted clips to a file in specified directory.
     """
 
-    if filename[:2] == "FR":
-        file = os.path.join(dir_path, filename)
-    else:
-        file = os.path.join(dir_path, "FR_" + filename + ".bin")
+    lines = []
+    for frames, sizepos in arr:
+
+        # y of center, x of center, time, cropped frame size
+        headers = np.asarray(sizepos)[:len(frames), :4]
+        frames = [frame[:size, :size] for frame, size in zip(frames, headers[:, 3])]
 
-    with open(file, "wb") as f:
-        f.write(struct.pack('I', len(arr)))  # number of extracted lines
+        lines.append((headers, frames))
 
-        for frames, sizepos in arr:
-            f.write(struct.pack('I', len(frames)))  # number of extracted frames
+    _writeLines(_frPath(dir_path, filename), lines)
 
-            for i, frame in enumerate(frames):
-                f.write(struct.pack('I', sizepos[i, 0]))  # y of center
-                f.write(struct.pack('I', sizepos[i, 1]))  # x of center
-                f.write(struct.pack('I', sizepos[i, 2]))  # time
-                size = sizepos[i, 3]
-                f.write(struct.pack('I', size))  # cropped frame size
-                frame[:size, :size].tofile(f)  # cropped frame
 
 
 def validFRName(fr_name):
@@ -0,0 +1,447 @@
+""" Functions for reading/writing frame segment files, containers of encoded raw frames.
+
+    A frame segment holds all raw frames saved during one UTC hour in one camera mode. The frames are
+    appended to the segment as encoded JPG/PNG images, each preceded by a small record header:
+
+        magic (4s), timestamp (float64), image size (uint32), image type (uint32)
+
+    Every frame also gets an entry in the index file next to the segment (segment path + '.idx'):
+
+        timestamp (float64), record offset (uint64), image size (uint32), image type (uint32)
+
+    The index only speeds up reading - if it is missing or not in sync with the segment (e.g. after a
+    power loss), the records are recovered by scanning the segment file. Regions of the segment which
+    can't be scanned, e.g. a partially written record, are skipped up to the next indexed record. Before
+    appending to a segment which is not in sync with its index, the segment is truncated after the last
+    valid record and the index is rewritten.
+
+    Frames inside of segments can be addressed by a virtual path, the path of the segment file followed by
+    the name the frame would have as a separate image file, e.g.:
+
+        .../20240101-001/XX0001_20240101_01_n.frs/XX0001_20240101_011502_120_n.jpg
+"""
+
+
+from __future__ import print_function, division, absolute_import
+
+import bisect
+import calendar
+import os
+import re
+import struct
+import time
+from math import floor
+
+import numpy as np
+import cv2
+
+
+# Extension of frame segment files
+SEGMENT_EXTENSION = '.frs'
+
+# Extension of the index, appended to the segment file name
+INDEX_EXTENSION = '.idx'
+
+RECORD_MAGIC = b'RFRM'
+RECORD_HEADER = struct.Struct('<4sdII')
+INDEX_ENTRY = struct.Struct('<dQII')
+
+# Image types of the records
+IMAGE_TYPES = {0: '.jpg', 1: '.png'}
+IMAGE_TYPE_CODES = {ext: code for code, ext in IMAGE_TYPES.items()}
+
+# Records must have timestamps within the hour of the segment, give or take this many seconds
+TIMESTAMP_TOLERANCE = 3600
+
+# Segment file name pattern
+SEGMENT_PATTERN = re.compile(
+    r"""
+    ^(?P<station>.+?)_
+      (?P<date>\d{8})_            # YYYYMMDD
+      (?P<hour>\d{2})             # HH
+    (?:_(?P<suffix>[dn]))?        # optional _d / _n
+    \.frs$
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+
+def segmentDirName(timestamp):
+    """ Return the directory of the segment relative to the saved frames directory,
+        YYYY/YYYYMMDD-DoY.
+    """
+
+    return time.strftime("%Y/%Y%m%d-%j", time.gmtime(timestamp))
+
+
+def segmentName(station_id, timestamp, daytime_mode):
+    """ Return the name of the segment which holds the frame taken at the given time.
+
+    Arguments:
+        station_id: [str] Station code.
+        timestamp: [float] Unix time of the frame.
+        daytime_mode: [bool] True if the camera is in daytime mode.
+
+    Return:
+        [str] Segment file name, e.g. XX0001_20240101_01_n.frs
+    """
+
+    return "{:s}_{:s}{:s}{:s}".format(str(station_id).zfill(3),
+        time.strftime("%Y%m%d_%H", time.gmtime(timestamp)), "_d" if daytime_mode else "_n",
+        SEGMENT_EXTENSION)
+
+
+def frameName(station_id, timestamp, mode_suffix, file_extension):
+    """ Return the name of a saved raw frame, the same as the separate image files have,
+        e.g. XX0001_20240101_011502_120_n.jpg
+    """
+
+    return "{0}_{1}_{2:03d}{3}{4}".format(
+        str(station_id).zfill(3),
+        time.strftime("%Y%m%d_%H%M%S", time.gmtime(timestamp)),
+        int((timestamp - floor(timestamp))*1000),
+        mode_suffix,
+        file_extension
+    )
+
+
+def isSegmentFile(file_name):
+    """ Check if the given file name is a name of a frame segment. """
+
+    return SEGMENT_PATTERN.match(os.path.basename(file_name)) is not None
+
+
+def isSegmentFramePath(path):
+    """ Check if the given path is a virtual path of a frame inside of a segment. """
+
+    return isSegmentFile(os.path.dirname(path))
+
+
+def repairSegment(segment_path):
+    """ Truncate the segment after its last valid record and rewrite its index, if the index doesn't end
+        at the end of the segment. Otherwise frames appended after a partially written record (e.g. after a
+        power loss) couldn't be found by scanning the segment.
+
+    Arguments:
+        segment_path: [str] Path to the segment file.
+
+    Return:
+        [bool] True if the segment was repaired, False if it was in sync with the index.
+    """
+
+    if not os.path.isfile(segment_path):
+        return False
+
+    segment_size = os.path.getsize(segment_path)
+
+    index_path = segment_path + INDEX_EXTENSION
+    index_size = os.path.getsize(index_path) if os.path.isfile(index_path) else 0
+
+    # The segment is in sync if the last index entry ends at the end of the segment
+    if (index_size == 0) and (segment_size == 0):
+        return False
+
+    if (index_size > 0) and (index_size%INDEX_ENTRY.size == 0):
+
+        with open(index_path, 'rb') as f:
+            f.seek(index_size - INDEX_ENTRY.size)
+            _, offset, size, _ = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+
+        if offset + RECORD_HEADER.size + size == segment_size:
+            return False
+
+
+    # Find all valid records
+    entries = FrameSegment(segment_path).entries
+    valid_end = max([offset + RECORD_HEADER.size + size for _, offset, size, _ in entries] + [0])
+
+    with open(segment_path, 'r+b') as f:
+        f.truncate(valid_end)
+        f.flush()
+        os.fsync(f.fileno())
+
+    with open(index_path, 'wb') as f:
+
+        for timestamp, offset, size, file_extension in sorted(entries, key=lambda entry: entry[1]):
+            f.write(INDEX_ENTRY.pack(timestamp, offset, size, IMAGE_TYPE_CODES[file_extension]))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    return True
+
+
+def appendFrames(segment_path, records):
+    """ Append encoded frames to the segment and to its index. The segment is created if it doesn't exist.
+
+    Arguments:
+        segment_path: [str] Path to the segment file.
+        records: [list] A list of (timestamp, file_extension, encoded image bytes).
+
+    Return:
+        [int] Number of appended frames.
+    """
+
+    if not records:
+        return 0
+
+    # Don't append after a partially written record
+    repairSegment(segment_path)
+
+    index_entries = []
+
+    with open(segment_path, 'ab') as f:
+
+        # Records are appended at the end of the segment
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+
+        for timestamp, file_extension, data in records:
+
+            image_type = IMAGE_TYPE_CODES[file_extension]
+
+            f.write(RECORD_HEADER.pack(RECORD_MAGIC, timestamp, len(data), image_type))
+            f.write(data)
+
+            index_entries.append(INDEX_ENTRY.pack(timestamp, offset, len(data), image_type))
+            offset += RECORD_HEADER.size + len(data)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    # The index is written after the data, so it never points to frames which are not on disk
+    with open(segment_path + INDEX_EXTENSION, 'ab') as f:
+        f.write(b''.join(index_entries))
+
+    return len(records)
+
+
+
+class FrameSegment(object):
+    """ Read access to the frames stored in a segment file. """
+
+    def __init__(self, segment_path):
+
+        self.segment_path = segment_path
+
+        match = SEGMENT_PATTERN.match(os.path.basename(segment_path))
+        if match is None:
+            raise ValueError("Not a frame segment: {:s}".format(segment_path))
+
+        self.station_id = match.group("station")
+        self.mode_suffix = "_" + match.group("suffix") if match.group("suffix") else ""
+
+        # Start of the UTC hour of the segment
+        self.hour_start = calendar.timegm(time.strptime(match.group("date") + match.group("hour"), 
+            "%Y%m%d%H"))
+
+        # List of (timestamp, offset, size, file extension) of all frames, ordered by time
+        self.entries = self._loadEntries()
+
+        # Map frame names to entries
+        self.names = {}
+        for i, entry in enumerate(self.entries):
+            self.names[self.frameName(i)] = i
+
+
+    def _validRecord(self, timestamp, offset, size, image_type, segment_size):
+        """ Check if the record header or the index entry describes a record which can be in the segment. """
+
+        return (image_type in IMAGE_TYPES) and (size > 0) \
+            and (offset + RECORD_HEADER.size + size <= segment_size) \
+            and (self.hour_start - TIMESTAMP_TOLERANCE <= timestamp <= self.hour_start + 3600 \
+                + TIMESTAMP_TOLERANCE)
+
+
+    def _loadEntries(self):
+        """ Load the frame entries from the index, and recover the frames which are missing in the index by
+            scanning the segment. A region which can't be scanned is skipped up to the next indexed record.
+        """
+
+        segment_size = os.path.getsize(self.segment_path)
+
+        # Valid index entries by their offsets
+        indexed = {}
+
+        index_path = self.segment_path + INDEX_EXTENSION
+        if os.path.isfile(index_path):
+
+            with open(index_path, 'rb') as f:
+                index_data = f.read()
+
+            n_entries = len(index_data)//INDEX_ENTRY.size
+            for i in range(n_entries):
+
+                timestamp, offset, size, image_type = INDEX_ENTRY.unpack_from(index_data, i*INDEX_ENTRY.size)
+
+                if self._validRecord(timestamp, offset, size, image_type, segment_size):
+                    indexed[offset] = (timestamp, size, image_type)
+
+        indexed_offsets = sorted(indexed)
+
+
+        entries = []
+        offset = 0
+
+        with open(self.segment_path, 'rb') as f:
+
+            while offset + RECORD_HEADER.size <= segment_size:
+
+                # Indexed records are taken without reading the segment
+                if offset in indexed:
+                    timestamp, size, image_type = indexed[offset]
+                    entries.append((timestamp, offset, size, IMAGE_TYPES[image_type]))
+                    offset += RECORD_HEADER.size + size
+                    continue
+
+                # The first indexed record after this offset
+                next_i = bisect.bisect_right(indexed_offsets, offset)
+                next_indexed = indexed_offsets[next_i] if next_i < len(indexed_offsets) else None
+
+                # Scan the records which are not indexed
+                f.seek(offset)
+                magic, timestamp, size, image_type = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+
+                valid = (magic == RECORD_MAGIC) \
+                    and self._validRecord(timestamp, offset, size, image_type, segment_size)
+
+                # A record which overlaps the next indexed record was only partially written
+                if valid and (next_indexed is not None) and (offset + RECORD_HEADER.size + size > next_indexed):
+                    valid = False
+
+                if valid:
+                    entries.append((timestamp, offset, size, IMAGE_TYPES[image_type]))
+                    offset += RECORD_HEADER.size + size
+                    continue
+
+                # Skip the broken region, stop if no indexed records follow it
+                if next_indexed is None:
+                    break
+
+                offset = next_indexed
+
+        entries.sort(key=lambda entry: entry[0])
+
+        return entries
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def frameName(self, i):
+        """ Return the image file name of the i-th frame. """
+
+        timestamp, _, _, file_extension = self.entries[i]
+
+        return frameName(self.station_id, timestamp, self.mode_suffix, file_extension)
+
+
+    def framePaths(self):
+        """ Return the virtual paths of all frames in the segment. """
+
+        return [os.path.join(self.segment_path, self.frameName(i)) for i in range(len(self.entries))]
+
+
+    def readEncoded(self, i):
+        """ Return the encoded image bytes of the i-th frame. """
+
+        _, offset, size, _ = self.entries[i]
+
+        with open(self.segment_path, 'rb') as f:
+            f.seek(offset + RECORD_HEADER.size)
+            return f.read(size)
+
+
+    def read(self, i, flags=cv2.IMREAD_UNCHANGED):
+        """ Decode and return the i-th frame as a numpy array, None if it can't be decoded. """
+
+        data = np.frombuffer(self.readEncoded(i), dtype=np.uint8)
+
+        return cv2.imdecode(data, flags)
+
+
+    def readByName(self, frame_name, flags=cv2.IMREAD_UNCHANGED):
+        """ Decode and return the frame with the given image file name, None if it is not in the segment. """
+
+        i = self.names.get(frame_name)
+        if i is None:
+            return None
+
+        return self.read(i, flags=flags)
+
+
+
+def listSegmentFrames(dir_path):
+    """ Return the virtual paths of all frames in all segments in the given directory tree. """
+
+    frame_paths = []
+    for root, _, files in os.walk(dir_path):
+        for file_name in files:
+            if isSegmentFile(file_name):
+                frame_paths += FrameSegment(os.path.join(root, file_name)).framePaths()
+
+    return frame_paths
+
+
+def segmentFiles(paths):
+    """ Map a list of paths to the files on disk, i.e. virtual frame paths are replaced by their segment
+        files. The order is preserved and every file is listed only once.
+    """
+
+    files = []
+    seen = set()
+    for path in paths:
+
+        if isSegmentFramePath(path):
+            path = os.path.dirname(path)
+
+        if path not in seen:
+            seen.add(path)
+            files.append(path)
+
+    return files
+
+
+def segmentFilesOnDisk(segment_path):
+    """ Return the segment file and its index, if they exist. """
+
+    return [path for path in [segment_path, segment_path + INDEX_EXTENSION] if os.path.isfile(path)]
+
+
+# The last opened segment, as frames are usually read in order
+_SEGMENT_CACHE = {}
+
+
+def readFramePath(path, flags=cv2.IMREAD_UNCHANGED):
+    """ Read a frame either from an image file or, if given a virtual path, from a segment.
+
+    Arguments:
+        path: [str] Path to the image file or a virtual path of a frame inside of a segment.
+
+    Keyword arguments:
+        flags: [int] cv2.imread flags. cv2.IMREAD_UNCHANGED by default.
+
+    Return:
+        [ndarray] The image, None if it couldn't be read.
+    """
+
+    if not isSegmentFramePath(path):
+        return cv2.imread(path, flags)
+
+    segment_path = os.path.dirname(path)
+    frame_name = os.path.basename(path)
+
+    # Reopen the segment if it is not cached, or if the frame was appended after it was opened
+    segment = _SEGMENT_CACHE.get(segment_path)
+    if (segment is None) or (frame_name not in segment.names):
+
+        try:
+            segment = FrameSegment(segment_path)
+        except (IOError, OSError, ValueError, OverflowError, struct.error):
+            return None
+
+        _SEGMENT_CACHE.clear()
+        _SEGMENT_CACHE[segment_path] = segment
+
+    return segment.readByName(frame_name, flags=flags)
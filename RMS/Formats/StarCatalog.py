@@ -16,6 +16,11 @@ except ImportError:
 
 import numpy as np
 
+# Cython init
+import pyximport
+pyximport.install(setup_args={'include_dirs':[np.get_include()]})
+from RMS.Astrometry.CyFunctions import buildCatalogIndex
+
 from RMS.Decorators import memoizeSingle
 from RMS.Misc import RmsDateTime
 from datetime import datetime
@@ -178,6 +183,154 @@ def loadGaiaCatalog(dir_path, file_name, lim_mag=None):
     return results
 
 
+# Version of the decompressed GMN catalog cache files, increment when the cache layout changes
+GMN_CACHE_VERSION = 1
+
+# Magic bytes at the beginning of every cache file
+GMN_CACHE_MAGIC = b'GMNCACHE'
+
+# Size of the cache file header, the data is stored after it
+GMN_CACHE_HEADER_SIZE = 64
+
+
+def _gmnCacheHeaderDtype():
+    """ Data type of the GMN catalog cache header. """
+
+    return np.dtype([
+        ('magic', 'S8'),
+        ('version', '<u4'),
+        ('row_size', '<u4'),
+        ('num_rows', '<u8'),
+        ('source_size', '<u8'),
+        ('source_checksum', '<u4'),
+    ])
+
+
+def _gmnSourceChecksum(file_path, chunk_size=16*1024*1024):
+    """ Compute the Adler-32 checksum of the compressed GMN catalog file. """
+
+    checksum = zlib.adler32(b'')
+
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+
+            checksum = zlib.adler32(data, checksum)
+
+    return checksum & 0xffffffff
+
+
+def _readGMNCompressed(file_path, data_types):
+    """ Read and decompress the GMN star catalog binary file into memory. """
+
+    with open(file_path, 'rb') as fid:
+
+        # Read the catalog header
+        declared_header_size = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
+        num_rows = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
+        num_columns = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
+        fid.read(declared_header_size - 12)  # Skip column names
+
+        # Read and decompress the catalog data
+        compressed_data = fid.read()
+        decompressed_data = zlib.decompress(compressed_data)
+        catalog_data = np.frombuffer(decompressed_data, dtype=data_types, count=num_rows)
+
+    return catalog_data
+
+
+def loadGMNCatalogCache(file_path, data_types):
+    """ Load the GMN star catalog through an on-disk cache of the decompressed data. The cache is stored 
+        next to the catalog file (with the .cache suffix) and opened with np.memmap, so all processes which
+        load the catalog share the same pages and don't have to decompress it. The cache is rebuilt if its
+        version, the row size or the checksum of the source file don't match. If the cache cannot be written,
+        the decompressed catalog is returned from memory.
+
+    Arguments:
+        file_path: [str] Path to the compressed catalog file.
+        data_types: [list] Numpy data type of the catalog rows.
+
+    Return:
+        catalog_data: [ndarray] Structured array with the catalog (read-only np.memmap if the cache is used).
+    """
+
+    dtype = np.dtype(data_types)
+    header_dtype = _gmnCacheHeaderDtype()
+    cache_path = file_path + ".cache"
+
+    source_size = os.path.getsize(file_path)
+    source_checksum = _gmnSourceChecksum(file_path)
+
+
+    # Try using the existing cache
+    if os.path.isfile(cache_path):
+
+        try:
+            header = np.fromfile(cache_path, dtype=header_dtype, count=1)
+
+            if len(header):
+
+                header = header[0]
+                num_rows = int(header['num_rows'])
+
+                if (header['magic'] == GMN_CACHE_MAGIC) \
+                    and (int(header['version']) == GMN_CACHE_VERSION) \
+                    and (int(header['row_size']) == dtype.itemsize) \
+                    and (int(header['source_size']) == source_size) \
+                    and (int(header['source_checksum']) == source_checksum) \
+                    and (os.path.getsize(cache_path) == GMN_CACHE_HEADER_SIZE + num_rows*dtype.itemsize):
+
+                    return np.memmap(cache_path, dtype=dtype, mode='r', offset=GMN_CACHE_HEADER_SIZE, 
+                        shape=(num_rows,))
+
+        except (IOError, OSError, ValueError) as e:
+            print("The GMN star catalog cache could not be read: {:s}".format(repr(e)))
+
+
+    # Decompress the catalog
+    catalog_data = _readGMNCompressed(file_path, data_types)
+
+
+    # Write the cache into a temporary file first, so other processes never see a partial cache
+    tmp_path = "{:s}.{:d}.tmp".format(cache_path, os.getpid())
+
+    try:
+
+        header = np.zeros(1, dtype=header_dtype)
+        header['magic'] = GMN_CACHE_MAGIC
+        header['version'] = GMN_CACHE_VERSION
+        header['row_size'] = dtype.itemsize
+        header['num_rows'] = len(catalog_data)
+        header['source_size'] = source_size
+        header['source_checksum'] = source_checksum
+
+        with open(tmp_path, 'wb') as f:
+            f.write(header.tobytes().ljust(GMN_CACHE_HEADER_SIZE, b'\x00'))
+            f.write(catalog_data.tobytes())
+
+        # os.rename doesn't overwrite existing files on Windows
+        if os.path.isfile(cache_path):
+            os.remove(cache_path)
+
+        os.rename(tmp_path, cache_path)
+
+        return np.memmap(cache_path, dtype=dtype, mode='r', offset=GMN_CACHE_HEADER_SIZE, 
+            shape=(len(catalog_data),))
+
+    except (IOError, OSError) as e:
+        print("The GMN star catalog cache could not be written: {:s}".format(repr(e)))
+
+        if os.path.isfile(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    return catalog_data
+
+
 @memoizeSingle
 def loadGMNStarCatalog(file_path,
                        years_from_J2000=0,
@@ -216,7 +369,8 @@ def loadGMNStarCatalog(file_path,
     # Catalog data used for caching
     cache_name = "_catalog_data_{:s}".format(catalog_file.replace(".", "_"))
 
-    # Step 1: Cache the catalog data to avoid repeated decompression
+    # Step 1: Cache the catalog data to avoid repeated decompression (the decompressed data is also cached 
+    #   on disk and shared between processes, see loadGMNCatalogCache)
     if not hasattr(loadGMNStarCatalog, cache_name):
 
         # Define the data structure for the catalog
@@ -241,18 +395,7 @@ def loadGMNStarCatalog(file_path,
             ('Simbad_OType', 'S30')
         ]
 
-        with open(file_path, 'rb') as fid:
-
-            # Read the catalog header
-            declared_header_size = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
-            num_rows = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
-            num_columns = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
-            fid.read(declared_header_size - 12)  # Skip column names
-
-            # Read and decompress the catalog data
-            compressed_data = fid.read()
-            decompressed_data = zlib.decompress(compressed_data)
-            catalog_data = np.frombuffer(decompressed_data, dtype=data_types, count=num_rows)
+        catalog_data = loadGMNCatalogCache(file_path, data_types)
 
         # Cache the catalog data for future use
         setattr(loadGMNStarCatalog, cache_name, catalog_data)
@@ -346,6 +489,9 @@ def loadGMNStarCatalog(file_path,
     for k in extras_dict:
         extras_dict[k] = extras_dict[k][sort_idx]
 
+    # Index the stars by sky position, so FOV subsets of the cached catalog only touch the nearby stars
+    buildCatalogIndex(core_data)
+
     # Step 7: Generate the magnitude band string
     if mag_band_ratios is None:
         mag_band_string = "GMN V band"
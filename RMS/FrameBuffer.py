@@ -0,0 +1,194 @@
+""" Shared memory ring buffer of frame blocks, used to pass raw frames from the capture to the compression.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+
+class FrameRingBuffer(object):
+    """ N-slot ring buffer of frame blocks in shared memory.
+
+    There is a single producer (the capture) and a single consumer (the compression). The producer takes
+    a free slot, fills it with frames and commits it together with the time of the first frame. The
+    consumer takes the oldest committed slot, processes it and releases it back to the pool of free slots.
+    Both sides are signalled through semaphores, so nothing has to be polled.
+
+    The producer never waits for the consumer when capturing from a live camera - if all slots are taken
+    the new block is dropped and counted in dropped_blocks. When a video file is used, the producer waits
+    for a free slot instead so no frames are lost.
+    """
+
+    def __init__(self, n_slots, block_frames, height, width):
+        """
+        Arguments:
+            n_slots: [int] Number of frame blocks in the ring (at least 2).
+            block_frames: [int] Number of frames in one block (256 for FF files).
+            height: [int] Height of the frame buffer in pixels.
+            width: [int] Width of the frame buffer in pixels.
+
+        """
+
+        self.n_slots = max(2, int(n_slots))
+        self.block_frames = block_frames
+        self.height = height
+        self.width = width
+
+        # Allocate the frame blocks in shared memory
+        self._bases = []
+        self._arrays = []
+        for _ in range(self.n_slots):
+            base = multiprocessing.Array(ctypes.c_uint8, block_frames*height*width)
+            arr = np.ctypeslib.as_array(base.get_obj()).reshape(block_frames, height, width)
+
+            self._bases.append(base)
+            self._arrays.append(arr)
+
+        # Time of the first frame in every slot
+        self.start_times = multiprocessing.Array('d', self.n_slots)
+
+        # Counting semaphores for free and committed slots
+        self._free = multiprocessing.Semaphore(self.n_slots)
+        self._filled = multiprocessing.Semaphore(0)
+
+        # Next slot to be written by the producer and next slot to be read by the consumer. These are kept
+        #   in shared memory because the compressor is restarted every night while the capture keeps running
+        self._head = multiprocessing.Value('i', 0)
+        self._tail = multiprocessing.Value('i', 0)
+
+        # Metrics - number of committed blocks waiting for compression, the maximum depth reached and the
+        #   number of blocks dropped because the ring was full
+        self._depth = multiprocessing.Value('i', 0)
+        self._max_depth = multiprocessing.Value('i', 0)
+        self._dropped_blocks = multiprocessing.Value('i', 0)
+
+
+
+    def acquireWriteSlot(self, block=False, timeout=None):
+        """ Take the next free slot for writing.
+
+        Keyword arguments:
+            block: [bool] Wait for a free slot if True. If False (default), return immediately.
+            timeout: [float] Maximum time to wait in seconds when block is True. None waits forever.
+
+        Return:
+            slot: [int] Slot index, or None if no slot is free.
+        """
+
+        if block:
+            acquired = self._free.acquire(True, timeout)
+        else:
+            acquired = self._free.acquire(False)
+
+        if not acquired:
+            return None
+
+        with self._head.get_lock():
+            slot = self._head.value
+            self._head.value = (slot + 1)%self.n_slots
+
+        self.start_times[slot] = 0
+
+        return slot
+
+
+
+    def commitWriteSlot(self, slot, start_time):
+        """ Mark the slot as filled and hand it over to the consumer.
+
+        Arguments:
+            slot: [int] Slot index returned by acquireWriteSlot.
+            start_time: [float] Unix time of the first frame in the block.
+        """
+
+        self.start_times[slot] = start_time
+
+        with self._depth.get_lock():
+            self._depth.value += 1
+
+            with self._max_depth.get_lock():
+                if self._depth.value > self._max_depth.value:
+                    self._max_depth.value = self._depth.value
+
+        self._filled.release()
+
+
+
+    def dropBlock(self):
+        """ Record that a block of frames could not be stored because the ring was full. """
+
+        with self._dropped_blocks.get_lock():
+            self._dropped_blocks.value += 1
+
+
+
+    def acquireReadSlot(self, timeout=None):
+        """ Take the oldest committed slot for reading.
+
+        Keyword arguments:
+            timeout: [float] Maximum time to wait in seconds. None waits forever.
+
+        Return:
+            (slot, start_time): [tuple] Slot index and the time of the first frame, or (None, None) if
+                nothing was committed within the timeout.
+        """
+
+        if not self._filled.acquire(True, timeout):
+            return None, None
+
+        with self._tail.get_lock():
+            slot = self._tail.value
+            self._tail.value = (slot + 1)%self.n_slots
+
+        with self._depth.get_lock():
+            self._depth.value -= 1
+
+        return slot, float(self.start_times[slot])
+
+
+
+    def releaseReadSlot(self, slot):
+        """ Return the slot to the pool of free slots once the consumer is done with it.
+
+        Arguments:
+            slot: [int] Slot index returned by acquireReadSlot.
+        """
+
+        self.start_times[slot] = 0
+        self._free.release()
+
+
+
+    def frames(self, slot):
+        """ Return the ndarray view of the given slot (no copy is made). """
+
+        return self._arrays[slot]
+
+
+    def depth(self):
+        """ Number of committed blocks waiting for the consumer. """
+
+        return self._depth.value
+
+
+    def maxDepth(self):
+        """ Maximum number of blocks which were waiting for the consumer at the same time. """
+
+        return self._max_depth.value
+
+
+    def droppedBlocks(self):
+        """ Number of blocks dropped because no slot was free. """
+
+        return self._dropped_blocks.value
+
+
+
+    def free(self):
+        """ Release references to the shared memory. """
+
+        del self._arrays[:]
+        del self._bases[:]
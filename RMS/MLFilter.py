@@ -16,6 +16,7 @@ import traceback
 #import time
 import datetime
 import shutil
+import collections
 
 TFLITE_AVAILABLE = False
 USING_FULL_TF = False
@@ -88,44 +89,141 @@ def classify_image(interpreter, image, top_k=1):
     return output    
 
 
-def classifyPNGs(file_dir, model_path):
-    """ Given a directory with PNG files of meteors, classify them into meteors vs artefacts using the ML 
-        model. 
+def classify_batch(interpreter, images):
+    """ Classify a batch of images with one call of the interpreter. If the model input can't be resized to
+        the batch size, the images are classified one by one.
+
+    Arguments:
+        interpreter: [Interpreter] TFLite interpreter with allocated tensors.
+        images: [ndarray] (n, height, width) array of images prepared with prepareImage.
+
+    Return:
+        [ndarray] Predicted probabilities, one for every image.
+    """
+
+    input_details = interpreter.get_input_details()[0]
+
+    try:
+
+        # Resize the model input to the batch size
+        if input_details['shape'][0] != len(images):
+            interpreter.resize_tensor_input(input_details['index'], 
+                [len(images)] + list(input_details['shape'][1:]))
+            interpreter.allocate_tensors()
+
+        interpreter.set_tensor(input_details['index'], 
+            np.expand_dims(images, axis=3).astype(input_details['dtype']))
+        interpreter.invoke()
+
+    except (ValueError, RuntimeError):
+
+        # The model has a fixed batch size
+        interpreter.resize_tensor_input(input_details['index'], [1] + list(input_details['shape'][1:]))
+        interpreter.allocate_tensors()
+
+        return np.array([classify_image(interpreter, image) for image in images], dtype=np.float32)
+
+    output_details = interpreter.get_output_details()[0]
+    output = interpreter.get_tensor(output_details['index']).reshape(len(images), -1)[:, 0]
+    scale, zero_point = output_details['quantization']
+
+    # no quantization therefore scale is not used
+    output = output.astype(np.float32) - zero_point
+
+    return output
+
+
+def loadModel(model_path):
+    """ Load the TFLite model.
+
+    Return:
+        (interpreter, width, height): [tuple] The interpreter, and the size of the model input images.
     """
 
-    # Load the model
     interpreter = Interpreter(model_path)
-    #input_details = interpreter.get_input_details()
-    #output_details = interpreter.get_output_details()
 
     # Define the input image parameters
     interpreter.allocate_tensors()
     _, height, width, _ = interpreter.get_input_details()[0]['shape']
 
-    #print("Input Shape (", width, ",", height, ")")
-    # PNG images are in the '1' subfolder
-    #file_dir = file_dir + '/1/'
+    return interpreter, width, height
 
 
-    # Run predictions for every meteor detection
+def prepareImage(image, width, height):
+    """ Resize and normalize a grayscale crop to be fed into the model. 
+
+    Arguments:
+        image: [PIL Image] Crop of the detection.
+        width: [int] Width of the model input.
+        height: [int] Height of the model input.
+
+    Return:
+        [ndarray] float32 image.
+    """
+
+    # rescale image size to fit the model 32x32 pixels input
+    image = image.resize((width, height))
+
+    # convert image to numpy array
+    image = np.asarray(image, dtype=np.float32)
+
+    # rescale values to (0;1)
+    image = rescale_me1(image)
+
+    # normalize min and max values
+    image = normalize_me1(image)
+
+    return image
+
+
+def classifyCrops(crops, model_path, batch_size=64):
+    """ Classify detection crops into meteors vs artefacts using the ML model. The crops are prepared and 
+        classified in batches.
+
+    Arguments:
+        crops: [dict] Detection crops (PIL images) keyed by their PNG names, as returned by makeCrops.
+        model_path: [str] Path to the TFLite model.
+
+    Keyword arguments:
+        batch_size: [int] Number of crops classified in one call of the model. 64 by default.
+
+    Return:
+        prediction_dict: [dict] Predicted probabilities keyed by the PNG names.
+    """
+
     prediction_dict = {}
-    for f in sorted(os.listdir(file_dir)):
 
-        image = Image.open(os.path.join(file_dir, f))
+    if not crops:
+        return prediction_dict
 
-        # rescale image size to fit the model 32x32 pixels input
-        image = image.resize((width, height))
+    interpreter, width, height = loadModel(model_path)
 
-        # convert image to numpy array
-        image = np.asarray(image, dtype=np.float32)
+    png_names = list(crops.keys())
+    for i in range(0, len(png_names), batch_size):
 
-        # rescale values to (0;1)
-        image = rescale_me1(image)
+        batch_names = png_names[i:i + batch_size]
+        images = np.array([prepareImage(crops[png_name], width, height) for png_name in batch_names])
 
-        # normalize min and max values
-        image = normalize_me1(image)
+        for png_name, prob in zip(batch_names, classify_batch(interpreter, images)):
+            prediction_dict[png_name] = prob
 
-        #image = standardize_me1(image)
+    return prediction_dict
+
+
+def classifyPNGs(file_dir, model_path):
+    """ Given a directory with PNG files of meteors, classify them into meteors vs artefacts using the ML 
+        model. 
+    """
+
+    # Load the model
+    interpreter, width, height = loadModel(model_path)
+
+
+    # Run predictions for every meteor detection
+    prediction_dict = {}
+    for f in sorted(os.listdir(file_dir)):
+
+        image = prepareImage(Image.open(os.path.join(file_dir, f)), width, height)
         
         # Classify the image and measure the time
         #time1 = time.time()
@@ -226,11 +324,12 @@ def blackfill(image, leftover_top=0, leftover_bottom=0, leftover_left=0, leftove
     return
 
 
-def crop_detections(detection_info, fits_dir):
+def crop_detections(detection_info, fits_dir, ff=None):
     """
     crops the detection from the fits file using the information provided from the FTPdetectinfo files
     detection_info is a single element of the list returned by the RMS.RMS.Formats.FTPdetectinfo.readFTPdetectinfo() function. This list contains only information on a single detection
     fits_dir is the the directory where the fits file is located
+    ff is the already loaded fits file, if None it is read from fits_dir
 
     returns the cropped image as a Numpy array
     """
@@ -247,7 +346,9 @@ def crop_detections(detection_info, fits_dir):
         # Read the fits_file
         # print("fits_dir:", fits_dir)
         # print("fits_file_name:", fits_file_name)
-        fits_file = FFfile.read(fits_dir, fits_file_name, fmt="fits")
+        fits_file = ff
+        if fits_file is None:
+            fits_file = FFfile.read(fits_dir, fits_file_name, fmt="fits")
 
         # image array with background set to 0 so detections stand out more
         # TODO include code to use mask for the camera, currently masks not available on the data given to me, Fiachra Feehilly (2021)
@@ -329,6 +430,56 @@ def makePNGname(fits_file_name, meteor_num):
 
 
 
+def makeCrops(FTP_path, FF_dir_path):
+    """ Take the FTPdetectinfo file and the FF files in the directory, and make crops centered around the
+        detections in memory. Every FF file is read only once, no matter how many detections it has.
+
+    Return:
+        crops: [OrderedDict] Grayscale crops (PIL images) keyed by their PNG names (see makePNGname).
+    """
+
+    crops = collections.OrderedDict()
+
+    try:
+        #read data from FTPdetectinfo file
+        meteor_list = FTPdetectinfo.readFTPdetectinfo(os.path.dirname(FTP_path), os.path.basename(FTP_path))
+        fits_file_list = set(os.listdir(FF_dir_path))
+
+    except:
+        print(traceback.format_exc())
+        return crops
+
+    # Group the detections by FF file
+    ff_detections = collections.OrderedDict()
+    for detection_entry in meteor_list:
+        ff_detections.setdefault(detection_entry[0], []).append(detection_entry)
+
+    for fits_file_name, detection_entries in ff_detections.items():
+
+        if fits_file_name not in fits_file_list:
+            print("file:", fits_file_name, " not found")
+            continue
+
+        try:
+            ff = FFfile.read(FF_dir_path, fits_file_name, fmt="fits")
+        except:
+            print(traceback.format_exc())
+            continue
+
+        for detection_entry in detection_entries:
+
+            square_crop_image = crop_detections(detection_entry, FF_dir_path, ff=ff)
+            if square_crop_image is None:
+                continue
+
+            # Convert to grayscale, the same as the PNG crops
+            png_name = makePNGname(fits_file_name, detection_entry[2])
+            crops[png_name] = Image.fromarray(square_crop_image).convert("L")
+
+    return crops
+
+
+
 def makePNGCrops(FTP_path, FF_dir_path):
     """ Take the FTPdetectinfo file and the FF files in the directory, and make PNG crops centered around
         the detection. These will be fed into the ML algorithm.
@@ -453,34 +604,30 @@ def filterFTPdetectinfoML(config, ftpdetectinfo_path, threshold=0.85, keep_pngs=
 
     # Create cropped images from observations in FTPdetectinfo file
     log.info("Creating images for inference...")
-    png_dir = makePNGCrops(ftpdetectinfo_path, dir_path)
+    crops = makeCrops(ftpdetectinfo_path, dir_path)
     
     # Run inference and return probabilities along with file names
     log.info("Inference starting...")
-    prediction_dict = classifyPNGs(png_dir, config.ml_model_path)
-    
+    prediction_dict = classifyCrops(crops, config.ml_model_path)
 
-    # create list of PNG images to be moved into subdirs later on
-    png_list = []
-    for f in sorted(os.listdir(png_dir)):
-        png_list.append(f)
 
+    png_dir = os.path.join(dir_path, "temp_png_dir")
 
     # Create meteor/artefact subdirs for easier manual confirmation
     if keep_pngs:
 
-        meteors_dir = os.path.abspath(os.path.join(png_dir, os.pardir, 'meteors'))
-        artefacts_dir = os.path.abspath(os.path.join(png_dir, os.pardir, 'artefacts'))
+        meteors_dir = os.path.abspath(os.path.join(png_dir, 'meteors'))
+        artefacts_dir = os.path.abspath(os.path.join(png_dir, 'artefacts'))
 
         if not os.path.exists(meteors_dir):
-            os.mkdir(meteors_dir)
+            os.makedirs(meteors_dir)
 
         if not os.path.exists(artefacts_dir):
-            os.mkdir(artefacts_dir)
+            os.makedirs(artefacts_dir)
 
     # Otherwise remove any PNG directories that might already exist
-    else:
-        shutil.rmtree(os.path.abspath(os.path.join(png_dir, os.pardir)))
+    elif os.path.isdir(png_dir):
+        shutil.rmtree(png_dir)
 
 
     # Generate a list of FF files in the data directory
@@ -538,10 +685,9 @@ def filterFTPdetectinfoML(config, ftpdetectinfo_path, threshold=0.85, keep_pngs=
         log.info(png_name + " - " + "Score: {:6.1%} - {:s}".format(pred_score, status_str))
 
 
-        # Sort into PNG dir, if they are kept
+        # Save into the PNG dir, if they are kept
         if keep_pngs:
-            os.replace(
-                os.path.join(png_dir, png_name + '.png'), 
+            crops[png_name].save(
                 os.path.join(
                     keep_png_dir, 
                     os.path.splitext(os.path.basename(png_name))[0] \
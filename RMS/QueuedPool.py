@@ -2,15 +2,22 @@ from __future__ import print_function
 
 import os
 import sys
+import struct
+import pickle
+import zlib
+import inspect
 import traceback
 import time
+import threading
 import functools
 import multiprocessing
 import multiprocessing.dummy
 
-from RMS.Pickling import savePickle, loadPickle
+import numpy as np
+
+from RMS.Pickling import loadPickle
 from RMS.Logger import getLogger
-from RMS.Misc import randomCharacters, isListKeyInDict, listToTupleRecursive
+from RMS.Misc import mkdirP, listToTupleRecursive
 
 
 from errno import EPIPE
@@ -23,6 +30,16 @@ try:
 except NameError:
     broken_pipe_exception = IOError
 
+try:
+    # Python 3
+    from queue import Empty as QueueEmpty
+    from queue import Queue as LocalQueue
+
+except ImportError:
+    # Python 2
+    from Queue import Empty as QueueEmpty
+    from Queue import Queue as LocalQueue
+
 
 
 class SafeValue(object):
@@ -69,6 +86,344 @@ class SafeValue(object):
 
 
 
+class CountedQueue(object):
+    """ A pipe-based multiprocessing.Queue which keeps track of its size in shared memory. Unlike the queues
+        from multiprocessing.Manager(), there is no server process in between, and qsize() works on all 
+        platforms (it is not implemented on macOS for the plain multiprocessing.Queue).
+
+        The process which reads from the queue while others are still writing to it should call
+        startReceiving(), so the pipe is always emptied and the writers never block when they exit.
+    """
+
+    def __init__(self, maxsize=0):
+
+        self.queue = multiprocessing.Queue(maxsize)
+
+        # The size is incremented before an item is put in and decremented after it is taken out, so it is
+        #   never smaller than the number of items in the queue
+        self.size = SafeValue(minval=0)
+
+        # Items received from the pipe by the receiving thread
+        self.received = None
+        self.receiving_thread = None
+
+
+    def __getstate__(self):
+
+        # The receiving thread stays in the process which started it
+        state = self.__dict__.copy()
+        state['received'] = None
+        state['receiving_thread'] = None
+
+        return state
+
+
+    def _receive(self):
+        """ Move items from the pipe to the local buffer. Runs in a daemon thread. """
+
+        while True:
+
+            try:
+                obj = self.queue.get(True)
+
+            except (EOFError, OSError, IOError):
+                break
+
+            self.received.put(obj)
+
+
+    def startReceiving(self):
+        """ Start a thread in this process which keeps reading items from the pipe. """
+
+        if self.receiving_thread is not None:
+            return None
+
+        self.received = LocalQueue()
+
+        self.receiving_thread = threading.Thread(target=self._receive)
+        self.receiving_thread.daemon = True
+        self.receiving_thread.start()
+
+
+    def put(self, obj, block=True, timeout=None):
+
+        self.size.increment()
+
+        try:
+            self.queue.put(obj, block, timeout)
+
+        except:
+            self.size.decrement()
+            raise
+
+
+    def get(self, block=True, timeout=None):
+
+        if self.received is not None:
+            obj = self.received.get(block, timeout)
+        else:
+            obj = self.queue.get(block, timeout)
+
+        self.size.decrement()
+
+        return obj
+
+
+    def get_nowait(self):
+        """ Return an item if there is one. If an item was put in but it's still in transit through the pipe,
+            wait for it to arrive. 
+        """
+
+        if self.size.value() > 0:
+            return self.get(True, 5.0)
+
+        raise QueueEmpty
+
+
+    def qsize(self):
+        return self.size.value()
+
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+    def flush(self):
+        """ Flush all items put in by this process into the pipe. Has to be called by the workers before 
+            they exit, otherwise the items might be lost if the process is terminated.
+        """
+
+        self.queue.close()
+        self.queue.join_thread()
+
+
+
+def backupKey(obj):
+    """ Convert the job inputs into a hashable key, so the backed up results can be looked up in a dictionary.
+        Lists and tuples are compared element-wise, and object instances are compared attribute-wise, in
+        the same way as Misc.checkListEquality does it.
+
+    Arguments:
+        obj: [object] Job inputs (usually a list or a tuple).
+
+    Return:
+        [tuple or object] Hashable key.
+    """
+
+    if isinstance(obj, (list, tuple)):
+        return ('seq', tuple(backupKey(elem) for elem in obj))
+
+    if isinstance(obj, np.ndarray):
+        return ('ndarray', obj.dtype.str, obj.shape, obj.tobytes())
+
+    if isinstance(obj, dict):
+        return ('dict', tuple(sorted((repr(key), backupKey(obj[key])) for key in obj)))
+
+    # Functions and classes are compared directly
+    if inspect.isroutine(obj) or inspect.isclass(obj):
+        return ('routine', getattr(obj, '__module__', None), getattr(obj, '__name__', repr(obj)))
+
+    # Compare instances by their attributes
+    if hasattr(obj, '__dict__'):
+        attrs = vars(obj)
+        return ('object', type(obj).__name__, tuple(sorted((key, backupKey(attrs[key])) for key in attrs)))
+
+    try:
+        hash(obj)
+        return obj
+
+    except TypeError:
+        return ('repr', repr(obj))
+
+
+
+class BackupJournal(object):
+    """ Append-only file which stores the inputs and outputs of finished jobs, so processing can be resumed
+        if the script breaks. All workers append to the same file. Every record is a pickled (inputs, outputs)
+        pair prefixed by its length and a CRC32 checksum, so a record which was only partially written 
+        during a crash is detected and discarded on loading.
+
+        Every record is written and flushed to the operating system as soon as it is added, so it survives
+        if the process is killed. Only syncing the file to the disk is done in batches - after batch_size
+        records or after flush_interval seconds since the last sync.
+    """
+
+    # Record header: payload length and CRC32 of the payload
+    HEADER = struct.Struct('<II')
+
+
+    def __init__(self, dir_path, file_name, batch_size=10, flush_interval=5.0):
+        """
+        Arguments:
+            dir_path: [str] Directory where the journal is kept.
+            file_name: [str] Name of the journal file.
+
+        Keyword arguments:
+            batch_size: [int] Number of records after which the file is synced to the disk. 10 by default.
+            flush_interval: [float] Maximum time in seconds between syncs of new records to the disk. 5 s by
+                default.
+        """
+
+        self.dir_path = dir_path
+        self.file_name = file_name
+        self.file_path = os.path.join(dir_path, file_name)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Lock shared between the processes, so records from different workers are not interleaved
+        self.lock = multiprocessing.Lock()
+
+        # Number of records written by this process which haven't been synced to the disk yet
+        self.unsynced = 0
+        self.last_flush = time.time()
+
+
+    def exists(self):
+        return os.path.isfile(self.file_path)
+
+
+    def _encode(self, inputs, outputs):
+        """ Serialize one record. """
+
+        payload = pickle.dumps((inputs, outputs), protocol=2)
+
+        return self.HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+
+    def _syncDue(self):
+        """ Check if the records written by this process should be synced to the disk. """
+
+        return (self.unsynced >= self.batch_size) \
+            or ((time.time() - self.last_flush) >= self.flush_interval)
+
+
+    def append(self, inputs, outputs):
+        """ Write a record to the journal. The file is synced to the disk when the batch is full or the 
+            flush interval has passed.
+        """
+
+        data = self._encode(inputs, outputs)
+
+        self.unsynced += 1
+        sync = self._syncDue()
+
+        with self.lock:
+            with open(self.file_path, 'ab') as f:
+                f.write(data)
+                f.flush()
+
+                if sync:
+                    os.fsync(f.fileno())
+
+        if sync:
+            self.unsynced = 0
+            self.last_flush = time.time()
+
+
+    def flush(self, force=True):
+        """ Sync the records written by this process to the disk.
+
+        Keyword arguments:
+            force: [bool] If False, sync only if the batch is full or the flush interval has passed. True
+                by default.
+        """
+
+        if self.unsynced == 0:
+            return None
+
+        if (not force) and (not self._syncDue()):
+            return None
+
+        with self.lock:
+            with open(self.file_path, 'ab') as f:
+                os.fsync(f.fileno())
+
+        self.unsynced = 0
+        self.last_flush = time.time()
+
+
+    def read(self):
+        """ Read all valid records from the journal.
+
+        Return:
+            (records, valid_size, total_size): 
+                - records: [list] A list of (inputs, outputs) tuples.
+                - valid_size: [int] Size in bytes of the part of the file with valid records.
+                - total_size: [int] Size of the file in bytes.
+        """
+
+        records = []
+        valid_size = 0
+
+        if not self.exists():
+            return records, valid_size, 0
+
+        with open(self.file_path, 'rb') as f:
+            data = f.read()
+
+        while (valid_size + self.HEADER.size) <= len(data):
+
+            length, crc = self.HEADER.unpack_from(data, valid_size)
+
+            payload_start = valid_size + self.HEADER.size
+            payload = data[payload_start:payload_start + length]
+
+            # Stop at a partially written or damaged record
+            if (len(payload) < length) or ((zlib.crc32(payload) & 0xffffffff) != crc):
+                break
+
+            try:
+                # Python 2
+                if sys.version_info[0] < 3:
+                    records.append(pickle.loads(payload))
+
+                # Python 3
+                else:
+                    records.append(pickle.loads(payload, encoding='latin1'))
+
+            except Exception:
+                break
+
+            valid_size = payload_start + length
+
+        return records, valid_size, len(data)
+
+
+    def rewrite(self, records):
+        """ Replace the journal with the given records. The new journal is written to a temporary file
+            first, so the old one stays intact if the writing fails.
+
+        Arguments:
+            records: [list] A list of (inputs, outputs) tuples.
+        """
+
+        tmp_path = self.file_path + '.tmp'
+
+        with self.lock:
+
+            with open(tmp_path, 'wb') as f:
+                for inputs, outputs in records:
+                    f.write(self._encode(inputs, outputs))
+
+            # os.rename doesn't overwrite existing files on Windows
+            if os.path.isfile(self.file_path):
+                os.remove(self.file_path)
+
+            os.rename(tmp_path, self.file_path)
+
+
+    def delete(self):
+        """ Delete the journal file. """
+
+        self.unsynced = 0
+
+        for file_path in [self.file_path, self.file_path + '.tmp']:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+
+
 class BackupContainer(object):
     def __init__(self, inputs, outputs):
         """ Container for storing the inputs and outputs of a certain worker function. This container is 
@@ -85,7 +440,7 @@ class BackupContainer(object):
 class QueuedPool(object):
     def __init__(self, func, cores=None, log=None, delay_start=0, worker_timeout=2000, backup_dir='.', \
         input_queue_maxsize=None, low_priority=False, func_extra_args=None, func_kwargs=None, 
-        worker_wait_inbetween_jobs=0.1, print_state=True):
+        worker_wait_inbetween_jobs=0.1, print_state=True, fast_transport=False):
         """ Provides capability of creating a pool of workers which will process jobs in a given queue, and 
         the input queue can be updated in another thread. 
 
@@ -116,8 +471,11 @@ class QueuedPool(object):
                 arguments are the same for all function calls to conserve memory if they are large. None by
                 default.
             worker_wait_inbetween_jobs: [float] Wait this number of seconds after finished a job and putting
-                the result in the output queue. 0.1 s by default.
+                the result in the output queue. 0.1 s by default. Not used with the fast transport.
             print_state: [bool] Print state of workers during execution, True by default.
+            fast_transport: [bool] Pass the jobs and the results through pipes directly between the
+                processes, instead of through the server process of multiprocessing.Manager(). The workers
+                take the next job as soon as it is available. False by default.
         """
 
 
@@ -155,18 +513,35 @@ class QueuedPool(object):
         self.func_extra_args = func_extra_args
         self.func_kwargs = func_kwargs
         self.worker_wait_inbetween_jobs = worker_wait_inbetween_jobs
+        self.fast_transport = fast_transport
+
+        # Use pipe-based queues which don't go through a server process
+        if self.fast_transport:
+
+            if input_queue_maxsize is None:
+                self.input_queue = CountedQueue()
+            else:
+                self.input_queue = CountedQueue(maxsize=input_queue_maxsize)
 
-        # Initialize queues (for some reason queues from Manager need to be created, otherwise they are 
-        # blocking when using get_nowait)
-        manager = multiprocessing.Manager()
+            self.output_queue = CountedQueue()
+            self.output_queue.startReceiving()
+
+            # The workers don't have to wait for anything in between jobs
+            self.worker_wait_inbetween_jobs = 0
 
-        # Only init with maxsize if given, otherwise it return a TypeError when fed data from Compressor
-        if input_queue_maxsize is None:
-            self.input_queue = manager.Queue()
         else:
-            self.input_queue = manager.Queue(maxsize=input_queue_maxsize)
 
-        self.output_queue = manager.Queue()
+            # Initialize queues (for some reason queues from Manager need to be created, otherwise they are 
+            # blocking when using get_nowait)
+            manager = multiprocessing.Manager()
+
+            # Only init with maxsize if given, otherwise it return a TypeError when fed data from Compressor
+            if input_queue_maxsize is None:
+                self.input_queue = manager.Queue()
+            else:
+                self.input_queue = manager.Queue(maxsize=input_queue_maxsize)
+
+            self.output_queue = manager.Queue()
 
         self.func = func
         self.pool = None
@@ -181,12 +556,23 @@ class QueuedPool(object):
         ### Backing up results
 
         self.bkup_dir = backup_dir
+
+        # Individual backup files written by older versions, they are loaded and merged into the journal
         self.bkup_file_prefix = 'rms_queue_bkup_'
         self.bkup_file_extension = '.pickle'
+
+        self.bkup_journal_name = 'rms_queue_bkup.journal'
+        self.bkup_journal = None
+
+        # Lookup of backed up results, the keys are made by backupKey
         self.bkup_dict = {}
 
         # Load all previous backup files in the given directory, if any
         if self.bkup_dir is not None:
+
+            mkdirP(self.bkup_dir)
+
+            self.bkup_journal = BackupJournal(self.bkup_dir, self.bkup_journal_name)
             self.loadBackupFiles()
 
         ### ###
@@ -205,24 +591,17 @@ class QueuedPool(object):
 
 
     def saveBackupFile(self, inputs, outputs):
-        """ Save the pair of inputs and outputs to disk, so if the script breaks, previous results can be
-            loaded in and processing can continue from that point.
+        """ Save the pair of inputs and outputs to the backup journal, so if the script breaks, previous 
+            results can be loaded in and processing can continue from that point.
         """
 
-        # Create a backup object
-        bkup_obj = BackupContainer(inputs, outputs)
-
-        # Create a name for the backup file
-        bkup_file_name = self.bkup_file_prefix + str(self.results_counter.value()) + "_" + randomCharacters(9) \
-            + self.bkup_file_extension
-
-        # Save the backup to disk
-        savePickle(bkup_obj, self.bkup_dir, bkup_file_name)
+        self.bkup_journal.append(listToTupleRecursive(inputs), outputs)
 
 
 
     def _listBackupFiles(self):
-        """ Returns a list of all backup files in the backup folder. """
+        """ Returns a list of all individual backup files in the backup folder (written by older versions).
+        """
 
         bkup_file_list = []
 
@@ -238,10 +617,18 @@ class QueuedPool(object):
 
 
     def loadBackupFiles(self):
-        """ Load previous backup files. """
+        """ Load previous results from the backup journal and from the individual backup files. 
 
-        # Load all backup files in a dictionary
-        for file_name in self._listBackupFiles():
+        The journal is compacted if it contains damaged or repeated records, and the individual backup 
+        files are merged into it.
+        """
+
+        # Load the journal
+        records, valid_size, total_size = self.bkup_journal.read()
+
+        # Load the individual backup files
+        bkup_file_list = self._listBackupFiles()
+        for file_name in bkup_file_list:
 
             # Load the backup file
             try:
@@ -254,15 +641,30 @@ class QueuedPool(object):
             if bkup_obj is None:
                 continue
 
-            # Get the inputs
-            bkup_inputs = listToTupleRecursive(bkup_obj.inputs)
+            records.append((bkup_obj.inputs, bkup_obj.outputs))
+
+
+        # Add the pairs of inputs vs. outputs to the lookup dictionary, keep only the first result for every
+        #   set of inputs
+        unique_records = []
+        for inputs, outputs in records:
+
+            key = backupKey(listToTupleRecursive(inputs))
 
-            # Make sure the value-key pair does not exist
-            key_status, _ = isListKeyInDict(bkup_inputs, self.bkup_dict)
-            if not key_status:
+            if key not in self.bkup_dict:
+                self.bkup_dict[key] = outputs
+                unique_records.append((inputs, outputs))
 
-                # Add the pair of inputs vs. outputs to the lookup dictionary
-                self.bkup_dict[bkup_inputs] = bkup_obj.outputs
+
+        # Compact the journal if the end is damaged, if there are repeated records, or if there were 
+        #   individual backup files to merge in
+        if (valid_size < total_size) or (len(unique_records) < len(records)) or bkup_file_list:
+
+            self.printAndLog("Compacting the backup journal...")
+            self.bkup_journal.rewrite(unique_records)
+
+            for file_name in bkup_file_list:
+                os.remove(os.path.join(self.bkup_dir, file_name))
 
 
         # Print and log how many previous files have been loaded
@@ -272,10 +674,12 @@ class QueuedPool(object):
 
 
     def deleteBackupFiles(self):
-        """ Delete all backup files in the backup folder. """
+        """ Delete the backup journal and all backup files in the backup folder. """
 
         if self.bkup_dir is not None:
 
+            self.bkup_journal.delete()
+
             # Go though all backup files
             for file_name in self._listBackupFiles():
 
@@ -311,7 +715,27 @@ class QueuedPool(object):
 
             # Get the function arguments (block until available, handle possible errors)
             try:
-                args = self.input_queue.get(True)
+
+                # With the fast transport, wake up regularly when idle to check if the worker should exit.
+                #   The pool is terminated after the workers exit, and a worker must not be killed while
+                #   it's reading from the pipe as that would leave the queue locked
+                if self.fast_transport:
+                    try:
+                        args = self.input_queue.get(True, 0.5)
+
+                    except QueueEmpty:
+
+                        # Sync the backups to the disk while idle
+                        if self.bkup_journal is not None:
+                            self.bkup_journal.flush(force=False)
+
+                        if self.kill_workers.is_set():
+                            break
+
+                        continue
+
+                else:
+                    args = self.input_queue.get(True)
             
             except:
                 tb = traceback.format_exc()
@@ -337,10 +761,10 @@ class QueuedPool(object):
             read_from_backup = False
             args_tpl = listToTupleRecursive(args)
 
-            # Check if the key exists. Return the found key as object instances might differ
-            key_status, key = isListKeyInDict(args_tpl, self.bkup_dict)
+            # Check if the inputs were already processed
+            key = backupKey(args_tpl)
 
-            if key_status:
+            if key in self.bkup_dict:
 
                 # Load the results from backup
                 result = self.bkup_dict[key]
@@ -372,7 +796,9 @@ class QueuedPool(object):
             self.output_queue.put(result)
             self.results_counter.increment()
             self.available_workers.increment()
-            time.sleep(self.worker_wait_inbetween_jobs)
+
+            if self.worker_wait_inbetween_jobs > 0:
+                time.sleep(self.worker_wait_inbetween_jobs)
 
             # Back up the result to disk, if it was not already in the backup
             if (not read_from_backup) and (self.bkup_dir is not None):
@@ -383,6 +809,14 @@ class QueuedPool(object):
                 self.printAndLog('Worker killed!')
                 break
 
+        # Sync the remaining backups to the disk
+        if self.bkup_journal is not None:
+            self.bkup_journal.flush()
+
+        # Make sure all results are written to the pipe before the pool is terminated
+        if self.fast_transport:
+            self.output_queue.flush()
+
         self.active_workers.decrement()
 
 
@@ -527,6 +961,12 @@ class QueuedPool(object):
                                 break
 
 
+                    # Give the workers time to write out the backups and exit after taking the pill
+                    loop_start = time.time()
+                    while (self.active_workers.value() > 0) and ((time.time() - loop_start) < 10):
+                        time.sleep(0.01)
+
+
                     # Close the pool and wait for all threads to terminate
                     self.printAndLog('Closing pool...')
                     self.pool.close()
@@ -21,10 +21,12 @@ import sys
 import traceback
 import time
 import multiprocessing
+import multiprocessing.pool
 from math import floor
 
 import cv2
 
+from RMS.Formats.FrameSegment import appendFrames, segmentDirName, segmentName
 from RMS.Logger import getLogger
 from RMS.Misc import mkdirP
 
@@ -69,6 +71,9 @@ class RawFrameSaver(multiprocessing.Process):
         self.total_saved_frames = 0
         self.day_of_year = time.strftime("%j", time.gmtime())
 
+        # Thread pool for encoding frames into segments, created in the saver process when first used
+        self.encode_pool = None
+
         self.exit = multiprocessing.Event()
         self.run_exited = multiprocessing.Event()
 
@@ -91,6 +96,11 @@ class RawFrameSaver(multiprocessing.Process):
             frametimes : [List] list of (frame, timestamp) pairs of corresponding frames and timestamps
         """
 
+        # Append the frames to hourly segment files instead of saving every frame into its own file
+        if self.config.frame_container:
+            self.saveFramesToSegments(frametimes, daytime_mode=daytime_mode)
+            return
+
 
         for (frame, timestamp) in frametimes:
 
@@ -155,6 +165,91 @@ class RawFrameSaver(multiprocessing.Process):
             self.total_saved_frames += 1
 
 
+    def encodeFrame(self, frame):
+        """ Encode the frame into the configured image format, return the encoded bytes. """
+
+        if self.config.frame_file_type == 'png':
+            ret, data = cv2.imencode('.png', frame, [int(cv2.IMWRITE_PNG_COMPRESSION), self.config.png_compression])
+
+        else:
+            ret, data = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.config.jpgs_quality])
+
+        if not ret:
+            raise ValueError("Frame encoding failed")
+
+        return data.tobytes()
+
+
+    def saveFramesToSegments(self, frametimes, daytime_mode=False):
+        """Saves a block of raw image frames by appending them to frame segment files.
+
+        The frames are encoded in parallel by a small thread pool and appended, together with their
+        timestamps, to the segment of the hour they were taken in:
+        saved_frames_dir/YYYY/YYYYMMDD-DoY/stationID_YYYYMMDD_HH_M.frs
+
+        Where 'M' is either 'd' or 'n' for the daytime and nighttime mode. The frames are named the same as
+        the separate image files when they are read from the segment (see RMS.Formats.FrameSegment).
+
+        Arguments
+        ---------
+            frametimes : [List] list of (frame, timestamp) pairs of corresponding frames and timestamps
+        """
+
+        # If timestamp is 0, then we've reached the end and this is the last block
+        valid_frametimes = []
+        for (frame, timestamp) in frametimes:
+            if timestamp == 0:
+                break
+
+            valid_frametimes.append((frame, float(timestamp)))
+
+        if not valid_frametimes:
+            return
+
+        if self.config.frame_file_type == 'png':
+            file_extension = '.png'
+        else:
+            file_extension = '.jpg'
+
+        if self.encode_pool is None:
+            self.encode_pool = multiprocessing.pool.ThreadPool(max(1, self.config.frame_encode_threads))
+
+        # Encode all frames of the block in parallel
+        try:
+            encoded_frames = self.encode_pool.map(self.encodeFrame, [frame for frame, _ in valid_frametimes])
+
+        except Exception as e:
+            log.error("Could not encode frames: {0}".format(e))
+            return
+
+        # Group the frames by segments, the block can span over the hour
+        segments = {}
+        for (_, timestamp), data in zip(valid_frametimes, encoded_frames):
+
+            # In case the timestamp day changes mid-block
+            if self.day_of_year != time.strftime("%j", time.gmtime(timestamp)):
+                self.total_saved_frames = 0
+                self.day_of_year = time.strftime("%j", time.gmtime(timestamp))
+
+            segment_path = os.path.join(self.saved_frames_dir, segmentDirName(timestamp), 
+                segmentName(self.config.stationID, timestamp, daytime_mode))
+
+            segments.setdefault(segment_path, []).append((timestamp, file_extension, data))
+            self.total_saved_frames += 1
+
+        for segment_path in sorted(segments):
+
+            try:
+                mkdirP(os.path.dirname(segment_path))
+                appendFrames(segment_path, segments[segment_path])
+
+                log.info("{:d} frames saved to: {:s}".format(len(segments[segment_path]), 
+                    os.path.basename(segment_path)))
+
+            except Exception as e:
+                log.error("Could not save frames to disk: {0}".format(e))
+
+
     def stop(self):
         """ Stop saving frames.
         """
@@ -250,6 +345,10 @@ class RawFrameSaver(multiprocessing.Process):
 
             log.debug("Raw frame block saving time: {:.3f} s".format(time.time() - t))
 
+        if self.encode_pool is not None:
+            self.encode_pool.close()
+            self.encode_pool.join()
+
         log.debug('Raw frame saver run exit')
         time.sleep(1.0)
         self.run_exited.set()
@@ -32,7 +32,7 @@ from RMS.Routines.MaskImage import loadMask
 from Utils.CalibrationReport import generateCalibrationReport
 from Utils.Flux import prepareFluxFiles
 from Utils.FOVKML import fovKML
-from Utils.GenerateTimelapse import generateTimelapse, generateTimelapseFromFrameBlocks, listImageBlocksBefore
+from Utils.GenerateTimelapse import generateTimelapseFromFrameBlocks, listImageBlocksBefore
 from RMS.CaptureModeSwitcher import lastNightToDaySwitch
 from Utils.MakeFlat import makeFlat
 from Utils.PlotFieldsums import plotFieldsums
@@ -460,26 +460,18 @@ def processNight(night_data_dir, config, detection_results=None, nodetect=False)
 
 
 
-    # Generate a timelapse
+    # Generate a timelapse. It is made while archiving the detections, in the same pass over the FF files 
+    #   as the thumbnails and the stacks
+    timelapse_file_name = None
     if config.timelapse_generate_captured:
-        
-        log.info('Generating a timelapse...')
-        try:
-
-            # Make the name of the timelapse file
-            timelapse_file_name = night_data_dir_name.replace("_detected", "") + "_timelapse.mp4"
-
-            # Generate the timelapse
-            generateTimelapse(night_data_dir, output_file=timelapse_file_name)
 
-            timelapse_path = os.path.join(night_data_dir, timelapse_file_name)
+        # Make the name of the timelapse file
+        timelapse_file_name = night_data_dir_name.replace("_detected", "") + "_timelapse.mp4"
 
-            # Add the timelapse to the extra files
-            extra_files.append(timelapse_path)
+        timelapse_path = os.path.join(night_data_dir, timelapse_file_name)
 
-        except Exception as e:
-            log.debug('Generating a timelapse failed with message:\n' + repr(e))
-            log.debug(repr(traceback.format_exception(*sys.exc_info())))
+        # Add the timelapse to the extra files
+        extra_files.append(timelapse_path)
 
     log.info('Plotting timestamp intervals...')
 
@@ -665,7 +657,7 @@ def processNight(night_data_dir, config, detection_results=None, nodetect=False)
     
     # Archive the detections
     archive_name = archiveDetections(night_data_dir, night_archive_dir, ff_detected, config, \
-        extra_files=extra_files)
+        extra_files=extra_files, timelapse_file_name=timelapse_file_name)
 
 
     return night_archive_dir, archive_name, detector
@@ -32,6 +32,7 @@ import pyximport
 pyximport.install(setup_args={'include_dirs':[np.get_include()]})
 
 from RMS.Routines.Grouping3Dcy import find3DLines as find3DLinesCy
+from RMS.Routines.Grouping3Dcy import find3DLinesRansac as find3DLinesRansacCy
 from RMS.Routines.Grouping3Dcy import getAllPoints as getAllPointsCy
 from RMS.Routines.Grouping3Dcy import thresholdAndSubsample as thresholdAndSubsampleCy
 from RMS.Routines.Grouping3Dcy import testPoints as testPointsCy
@@ -101,6 +102,8 @@ def find3DLines(point_list, start_time, config, fireball_detection=True):
             self.min_frames = config.min_frames
             self.line_minimum_frame_range = config.line_minimum_frame_range
             self.line_distance_const = config.line_distance_const
+            self.line_finder = config.fireball_line_finder
+            self.line_hypotheses = config.fireball_line_hypotheses
 
 
     # Convert the point list to numpy array
@@ -131,6 +134,14 @@ def find3DLines(point_list, start_time, config, fireball_detection=True):
         grouping_config.max_lines = 1
         grouping_config.point_ratio_threshold = 1
 
+        # The faint meteor points are already limited to max_points_det, all pairs are tested
+        grouping_config.line_finder = 'pairs'
+
+
+    # Test a sample of point pairs, searching only the points close to the tested lines
+    if grouping_config.line_finder == 'ransac':
+        return find3DLinesRansacCy(point_list, start_time, grouping_config, get_single, line_list, 
+            max_hypotheses=grouping_config.line_hypotheses)
 
     # Call a fast cython function for finding lines in 3D
     return find3DLinesCy(point_list, start_time, grouping_config, get_single, line_list)
@@ -424,6 +424,270 @@ def find3DLines(np.ndarray[UINT16_TYPE_t, ndim=2] point_list, start_time, config
 
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def find3DLinesRansac(np.ndarray[UINT16_TYPE_t, ndim=2] point_list, start_time, config, get_single=False, 
+    line_list=None, max_hypotheses=2000):
+    """ Find N straight lines in 3D space by testing a sample of point pairs. The output is the same as the 
+        output of find3DLines, and every tested pair is scored the same way.
+
+        Instead of testing every point against every pair of points, the points are binned into cubic voxels 
+        and only the voxels close to the tested line are searched, so large point clouds can be processed 
+        without subsampling. If there are fewer pairs than max_hypotheses, all pairs are tested.
+    
+    @param point_list: [ndarray] list of all points, sorted by frame
+    @param start_time: [time.time() object] starting time of the loop
+    @param config: [config object] defines configuration parameters fro the config file
+    @param get_single: [bool] returns only 1 line, does not search for more lines
+    @param line_list: [list] list of lines found previously
+    @param max_hypotheses: [int] maximum number of point pairs tested for every line
+    
+    @return: list of found lines
+    """
+
+    # Load config parameters
+    cdef float distance_threshold = config.distance_threshold
+    cdef float gap_threshold = config.gap_threshold
+    cdef int min_points = config.min_points
+    cdef int line_minimum_frame_range = config.line_minimum_frame_range
+    cdef float line_distance_const = config.line_distance_const
+
+    cdef int i, j, k, m, h, p, n_hyp, n_cand, layer_start, point_list_size
+    cdef int x1, y1, z1, x2, y2, z2, x3, y3, z3, x_prev, y_prev, z_prev
+    cdef int cell, cell_size, nx, ny, nz, x0, y0, z0, ix, iy, iz, ix_lo, ix_hi, iy_lo, iy_hi
+    cdef int counter, results_counter, stop
+    cdef float line_dist, line_dist_sum, line_quality, best_quality, radius, t_lo, t_hi, xa, xb, ya, yb, \
+        search_distance
+    cdef int best_counter, best_i, best_j
+
+    cdef np.ndarray[np.int32_t, ndim=1] cell_start
+    cdef np.ndarray[np.int32_t, ndim=1] cell_points
+    cdef np.ndarray[np.int32_t, ndim=1] candidates
+    cdef np.ndarray[np.int32_t, ndim=2] pairs
+
+    if line_list is None:
+        line_list = []
+
+    # Distance within which the points are searched
+    search_distance = sqrt(distance_threshold)
+
+    # Random generator with a fixed seed, so the results are repeatable
+    rng = np.random.RandomState(0)
+
+    while True:
+
+        # Stop if there are too many lines
+        if len(line_list) >= config.max_lines:
+            break
+
+        # Stop if running for too long
+        if time() - start_time > config.max_time:
+            break
+
+        point_list_size = point_list.shape[0]
+
+        if point_list_size < min_points:
+            break
+
+
+        ### Bin the points into voxels ###
+
+        x0, y0, z0 = np.min(point_list, axis=0)
+
+        # The voxel size is at least the search distance, and is increased if there would be too many voxels
+        cell_size = max(1, int(search_distance))
+        while True:
+            nx, ny, nz = (np.max(point_list, axis=0) - np.array([x0, y0, z0]))//cell_size + 1
+            if nx*ny*nz <= 4*point_list_size + 4096:
+                break
+            cell_size *= 2
+
+        cell_index = (((point_list[:, 2].astype(np.int64) - z0)//cell_size)*ny \
+            + (point_list[:, 1].astype(np.int64) - y0)//cell_size)*nx \
+            + (point_list[:, 0].astype(np.int64) - x0)//cell_size
+
+        # Indices of points in every voxel, ordered by voxel and then by the position in the point list
+        order = np.argsort(cell_index, kind='mergesort')
+        cell_points = order.astype(np.int32)
+        cell_start = np.searchsorted(cell_index[order], np.arange(nx*ny*nz + 1)).astype(np.int32)
+
+        candidates = np.zeros(point_list_size, dtype=np.int32)
+
+
+        ### Choose the point pairs which will be tested ###
+
+        if point_list_size*(point_list_size - 1)//2 <= max_hypotheses:
+            pairs = np.column_stack(np.triu_indices(point_list_size, 1)).astype(np.int32)
+        else:
+            pairs = rng.randint(0, point_list_size, size=(max_hypotheses, 2)).astype(np.int32)
+
+        n_hyp = pairs.shape[0]
+
+
+        results_counter = 0
+        best_counter = 0
+        best_quality = 0
+        best_i = -1
+        best_j = -1
+
+        for h in range(n_hyp):
+
+            i = pairs[h, 0]
+            j = pairs[h, 1]
+
+            # Keep the pair in the order of the point list
+            if i > j:
+                i, j = j, i
+
+            # These 2 points define the line
+            x1 = point_list[i, 0]
+            y1 = point_list[i, 1]
+            z1 = point_list[i, 2]
+
+            x2 = point_list[j, 0]
+            y2 = point_list[j, 1]
+            z2 = point_list[j, 2]
+
+            # Don't check point pairs on the same frame, as the velocity can't be computed then
+            if z1 == z2:
+                continue
+
+
+            # A point within the search distance from the line is at most this far from the line point on 
+            #   the same frame
+            radius = search_distance*sqrt(<float> ((x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2))/abs(z2 - z1)
+
+            counter = 0
+            line_dist_sum = 0
+            stop = 0
+
+            x_prev, y_prev, z_prev = x1, y1, z1
+
+            # Find the points close to the line, going through the voxels frame by frame
+            n_cand = 0
+            for iz in range(nz):
+
+                layer_start = n_cand
+
+                # Position of the line at the first and the last frame of the voxel layer
+                t_lo = <float> (z0 + iz*cell_size - z1)/(z2 - z1)
+                t_hi = <float> (z0 + (iz + 1)*cell_size - 1 - z1)/(z2 - z1)
+
+                xa = x1 + t_lo*(x2 - x1)
+                xb = x1 + t_hi*(x2 - x1)
+                ya = y1 + t_lo*(y2 - y1)
+                yb = y1 + t_hi*(y2 - y1)
+
+                ix_lo = max(0, <int> floor((min(xa, xb) - radius - x0)/cell_size))
+                ix_hi = min(nx - 1, <int> floor((max(xa, xb) + radius - x0)/cell_size))
+                iy_lo = max(0, <int> floor((min(ya, yb) - radius - y0)/cell_size))
+                iy_hi = min(ny - 1, <int> floor((max(ya, yb) + radius - y0)/cell_size))
+
+                for iy in range(iy_lo, iy_hi + 1):
+                    for ix in range(ix_lo, ix_hi + 1):
+
+                        cell = (iz*ny + iy)*nx + ix
+
+                        for k in range(cell_start[cell], cell_start[cell + 1]):
+
+                            p = cell_points[k]
+
+                            line_dist = line3DDistance_simple(x1, y1, z1, x2, y2, z2, point_list[p, 0], 
+                                point_list[p, 1], point_list[p, 2])
+
+                            if line_dist < distance_threshold:
+                                candidates[n_cand] = p
+                                n_cand += 1
+
+                # The points are sorted by frame, so only the points inside of one voxel layer have to be 
+                #   sorted to go through them in the order of the point list, the same as find3DLines does
+                for k in range(layer_start + 1, n_cand):
+
+                    p = candidates[k]
+                    m = k - 1
+
+                    while (m >= layer_start) and (candidates[m] > p):
+                        candidates[m + 1] = candidates[m]
+                        m -= 1
+
+                    candidates[m + 1] = p
+
+
+                for k in range(layer_start, n_cand):
+
+                    p = candidates[k]
+                    x3 = point_list[p, 0]
+                    y3 = point_list[p, 1]
+                    z3 = point_list[p, 2]
+
+                    # Calculate the gap from the previous point and reject the solution if the point is too far
+                    if point3DDistance(x_prev, y_prev, z_prev, x3, y3, z3) > gap_threshold:
+
+                        # Reject solution (reset counter) if the last point is too far
+                        if point3DDistance(x2, y2, z2, x_prev, y_prev, z_prev) > gap_threshold:
+                            counter = 0
+
+                        stop = 1
+                        break
+
+                    counter += 1
+                    line_dist_sum += line3DDistance_simple(x1, y1, z1, x2, y2, z2, x3, y3, z3)
+
+                    x_prev, y_prev, z_prev = x3, y3, z3
+
+                # The rest of the points are not counted after a gap
+                if stop:
+                    break
+
+            # Skip if too little points were found
+            if counter < min_points:
+                continue
+
+            # Larger average distance from the line = less quality
+            line_quality = <float> counter - line_distance_const*line_dist_sum/(<float> counter)
+            results_counter += 1
+
+            if (best_i < 0) or (line_quality > best_quality):
+                best_quality = line_quality
+                best_counter = counter
+                best_i = i
+                best_j = j
+
+
+        # Stop if no good match was found
+        if results_counter == 0:
+            break
+
+        max_line = Line(point_list[best_i, 0], point_list[best_i, 1], point_list[best_i, 2], 
+            point_list[best_j, 0], point_list[best_j, 1], point_list[best_j, 2], best_counter, best_quality)
+
+        # Remove points from the point cloud that belong to line with the best quality
+        point_list, max_line_points = remove3DPoints(point_list, max_line, distance_threshold, gap_threshold)
+
+        if not max_line_points.size:
+            break
+
+        # Get the first and the last frame from the max_line point could
+        first_frame = max_line_points[0, 2]
+        last_frame = max_line_points[len(max_line_points) - 1, 2]
+
+        # Reject the line if all points are only in very close frames (eliminate flashes)
+        if abs(last_frame - first_frame) + 1 >= line_minimum_frame_range:
+            line_list.append(_formatLine(max_line, first_frame, last_frame))
+
+        # Search for more lines only if the line doesn't contain most of the points
+        if get_single or (best_counter >= config.point_ratio_threshold*point_list_size):
+            break
+
+
+    if len(line_list) == 0:
+        return None
+
+    return line_list
+
+
+
 
 
 @cython.boundscheck(False)
@@ -0,0 +1,148 @@
+""" Calibration images (mask, dark, flat) held in shared memory, so they can be given to worker processes once
+    instead of being pickled with every job.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import copy
+import multiprocessing
+
+import numpy as np
+
+from RMS.DetectionTools import loadImageCalibration
+
+
+class SharedArray(object):
+    def __init__(self, arr):
+        """ Copy of a numpy array in shared memory. The object can be passed to child processes when they are
+            started, and all processes then read the same memory.
+
+        Arguments:
+            arr: [ndarray] Array to copy to shared memory.
+        """
+
+        arr = np.ascontiguousarray(arr)
+
+        self.shape = arr.shape
+        self.dtype = arr.dtype.str
+
+        # Allocate the shared memory (at least one byte, so empty arrays can also be shared)
+        self.raw = multiprocessing.RawArray('B', max(1, arr.nbytes))
+
+        if arr.size:
+            self.view()[...] = arr
+
+
+    def view(self, writeable=True):
+        """ Return a numpy array which uses the shared memory as its buffer (no copy is made). """
+
+        count = int(np.prod(self.shape))
+        arr = np.frombuffer(self.raw, dtype=np.dtype(self.dtype), count=count).reshape(self.shape)
+
+        if not writeable:
+            arr.flags.writeable = False
+
+        return arr
+
+
+
+class SharedImageCalibration(object):
+    def __init__(self, mask, dark, flat_struct, dtype=None, byteswap=False):
+        """ Mask, dark and flat stored in shared memory. Give the object to the worker processes when they
+            are started (e.g. through the func_kwargs of QueuedPool) and call get() inside the worker to
+            obtain the calibration images. The images in the workers are read-only views of the shared
+            memory.
+
+        Arguments:
+            mask: [MaskStructure] Mask, or None.
+            dark: [ndarray] Dark frame, or None.
+            flat_struct: [FlatStruct] Flat field structure, or None.
+
+        Keyword arguments:
+            dtype: [object] Image dtype the calibration was loaded for. None by default.
+            byteswap: [bool] Whether the calibration was byteswapped on loading. False by default.
+        """
+
+        self.dtype = dtype
+        self.byteswap = byteswap
+
+        self._mask = self._share(mask)
+        self._dark = self._share(dark)
+        self._flat = self._share(flat_struct)
+
+
+    def _share(self, obj):
+        """ Move the array or the array attributes of the given object to shared memory. Returns a
+            (skeleton, shared_arrays) pair, where the skeleton is a shallow copy of the object without the
+            arrays.
+        """
+
+        if obj is None:
+            return None
+
+        if isinstance(obj, np.ndarray):
+            return None, SharedArray(obj)
+
+        skeleton = copy.copy(obj)
+        shared_arrays = {}
+
+        for key, value in vars(obj).items():
+            if isinstance(value, np.ndarray):
+                shared_arrays[key] = SharedArray(value)
+                setattr(skeleton, key, None)
+
+        return skeleton, shared_arrays
+
+
+    def _restore(self, shared):
+        """ Build the calibration object back from the shared memory. """
+
+        if shared is None:
+            return None
+
+        skeleton, shared_arrays = shared
+
+        if skeleton is None:
+            return shared_arrays.view(writeable=False)
+
+        # A new shallow copy is made every time, so changing attributes in one job will not affect others
+        obj = copy.copy(skeleton)
+        for key, shared_arr in shared_arrays.items():
+            setattr(obj, key, shared_arr.view(writeable=False))
+
+        return obj
+
+
+    def matches(self, dtype, byteswap):
+        """ Check if the calibration was loaded for the given image dtype and byteswap setting. """
+
+        if (self.dtype is None) or (dtype is None):
+            dtype_match = (self.dtype is None) and (dtype is None)
+        else:
+            dtype_match = np.dtype(self.dtype) == np.dtype(dtype)
+
+        return dtype_match and (self.byteswap == byteswap)
+
+
+    def get(self):
+        """ Return the calibration images.
+
+        Return:
+            mask, dark, flat_struct: [tuple]
+        """
+
+        return self._restore(self._mask), self._restore(self._dark), self._restore(self._flat)
+
+
+
+def loadSharedImageCalibration(dir_path, config, dtype=None, byteswap=False):
+    """ Load the mask, dark and flat from disk and put them in shared memory. See
+        DetectionTools.loadImageCalibration for the description of the arguments.
+
+    Return:
+        [SharedImageCalibration]
+    """
+
+    mask, dark, flat_struct = loadImageCalibration(dir_path, config, dtype=dtype, byteswap=byteswap)
+
+    return SharedImageCalibration(mask, dark, flat_struct, dtype=dtype, byteswap=byteswap)
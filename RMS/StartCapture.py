@@ -43,11 +43,13 @@ from RMS.BufferedCapture import BufferedCapture
 from RMS.CaptureDuration import captureDuration
 from RMS.CaptureModeSwitcher import captureModeSwitcher
 from RMS.Compression import Compressor
+from RMS.FrameBuffer import FrameRingBuffer
 from RMS.DeleteOldObservations import deleteOldObservations
 from RMS.DetectStarsAndMeteors import detectStarsAndMeteors
 from RMS.Formats.FFfile import validFFName
 from RMS.Misc import mkdirP, RmsDateTime, UTCFromTimestamp
 from RMS.QueuedPool import QueuedPool
+from RMS.SharedCalibration import loadSharedImageCalibration
 from RMS.Reprocess import getPlatepar, processNight, processFramesFiles
 from RMS.RunExternalScript import runExternalScript
 from RMS.UploadManager import UploadManager
@@ -351,22 +353,16 @@ def runCapture(config, duration=None, video_file=None, nodetect=False, detect_en
         array_pad = 1
 
 
-    # Init arrays for parallel compression on 2 cores
-    sharedArrayBase = multiprocessing.Array(ctypes.c_uint8, 256*(config.width + array_pad)*(config.height + array_pad))
-    sharedArray = np.ctypeslib.as_array(sharedArrayBase.get_obj())
-    sharedArray = sharedArray.reshape(256, (config.height + array_pad), (config.width + array_pad))
-    startTime = multiprocessing.Value('d', 0.0)
+    # Init the ring buffer of frame blocks shared between the capture and the compression
+    frame_buffer = FrameRingBuffer(config.frame_buffer_slots, 256, config.height + array_pad, 
+        config.width + array_pad)
 
-    sharedArrayBase2 = multiprocessing.Array(ctypes.c_uint8, 256*(config.width + array_pad)*(config.height + array_pad))
-    sharedArray2 = np.ctypeslib.as_array(sharedArrayBase2.get_obj())
-    sharedArray2 = sharedArray2.reshape(256, (config.height + array_pad), (config.width + array_pad))
-    start_time2 = multiprocessing.Value('d', 0.0)
-
-    log.info('Initializing frame buffers done!')
+    log.info('Initializing frame buffers done! Number of frame buffer slots: {:d}'.format(
+        frame_buffer.n_slots))
 
 
     # Initialize buffered capture
-    bc = BufferedCapture(sharedArray, startTime, sharedArray2, start_time2, config, video_file=video_file,
+    bc = BufferedCapture(frame_buffer, config, video_file=video_file,
                          night_data_dir=night_data_dir, saved_frames_dir=saved_frames_dir, 
                          daytime_mode=daytime_mode, camera_mode_switch_trigger=camera_mode_switch_trigger)
     bc.startCapture()
@@ -458,9 +454,17 @@ def runCapture(config, duration=None, video_file=None, nodetect=False, detect_en
                 with open(capture_resume_file_path, 'w') as f:
                     pass
 
-                # Initialize the detector
+                # Load the calibration images once into shared memory (FF files are always 8-bit)
+                calibration = loadSharedImageCalibration(night_data_dir, config, dtype=np.uint8)
+
+                # Initialize the detector. The config and the calibration are given to the workers once 
+                #   when they start, so the jobs only carry the file names. The jobs are added by the 
+                #   compressor process and the workers may be delayed until the end of the night, so the 
+                #   Manager queues are kept - with the fast transport the pending jobs would be buffered in
+                #   the compressor process and lost when it is terminated
                 detector = QueuedPool(detectStarsAndMeteors, cores=1, log=log, delay_start=delay_detection, \
-                    backup_dir=night_data_dir, input_queue_maxsize=None)
+                    backup_dir=night_data_dir, input_queue_maxsize=None, func_extra_args=(config,), 
+                    func_kwargs={'calibration': calibration})
                 detector.startPool()
 
 
@@ -481,7 +485,7 @@ def runCapture(config, duration=None, video_file=None, nodetect=False, detect_en
                         if os.path.isfile(ff_path) and (str(config.stationID) in ff_name) and validFFName(ff_name):
 
                             # Add the FF file to the detector
-                            detector.addJob([night_data_dir, ff_name, config], wait_time=0.005)
+                            detector.addJob([night_data_dir, ff_name], wait_time=0.005)
                             log.info("Added existing FF files for detection: {:s}".format(ff_name))
 
 
@@ -510,8 +514,7 @@ def runCapture(config, duration=None, video_file=None, nodetect=False, detect_en
 
 
             # Initialize compression
-            compressor = Compressor(night_data_dir, sharedArray, startTime, sharedArray2, start_time2, config,
-                detector=detector)
+            compressor = Compressor(night_data_dir, frame_buffer, config, detector=detector)
 
             # Open the observation summary report
             if video_file is None:
@@ -557,17 +560,18 @@ def runCapture(config, duration=None, video_file=None, nodetect=False, detect_en
             log.debug('Capture stopped')
 
             log.info('Total number of late or dropped frames: ' + str(dropped_frames))
+            log.info('Frame buffer max queue depth: {:d}/{:d}, dropped blocks: {:d}'.format(
+                frame_buffer.maxDepth(), frame_buffer.n_slots, frame_buffer.droppedBlocks()))
             obs_db_conn = getObsDBConn(config)
             addObsParam(obs_db_conn, "dropped_frames", dropped_frames)
+            addObsParam(obs_db_conn, "frame_buffer_max_depth", frame_buffer.maxDepth())
+            addObsParam(obs_db_conn, "frame_buffer_dropped_blocks", frame_buffer.droppedBlocks())
             obs_db_conn.close()
 
             # Free shared memory after the compressor is done
             try:
                 log.debug('Freeing frame buffers in StartCapture...')
-                del sharedArrayBase
-                del sharedArray
-                del sharedArrayBase2
-                del sharedArray2
+                frame_buffer.free()
 
             except Exception as e:
                 log.debug('Freeing frame buffers failed with error:' + repr(e))
@@ -781,8 +785,9 @@ def processIncompleteCaptures(config, upload_manager):
         captured_dir_path = os.path.join(config.data_dir, config.captured_dir, captured_subdir)
         log.debug("Checking folder: {:s}".format(captured_subdir))
 
-        # Check if there are any backup pickle files in the capture directory
-        pickle_files = glob.glob("{:s}/rms_queue_bkup_*.pickle".format(captured_dir_path))
+        # Check if there are any detection backups (journal or pickle files) in the capture directory
+        pickle_files = glob.glob("{:s}/rms_queue_bkup_*.pickle".format(captured_dir_path)) \
+            + glob.glob("{:s}/rms_queue_bkup.journal".format(captured_dir_path))
         any_pickle_files = False
         if len(pickle_files) > 0:
             any_pickle_files = True
@@ -9,6 +9,8 @@ import multiprocessing
 import time
 import datetime
 import logging
+import threading
+import zlib
 
 import binascii
 import paramiko
@@ -244,6 +246,331 @@ def getSSHAndSFTP(hostname, **kwargs):
     return ssh, sftp
 
 
+class SFTPSession(object):
+    def __init__(self, hostname, username, port=22, rsa_private_key=os.path.expanduser('~/.ssh/id_rsa'),
+                 connect_timeout=300, banner_timeout=300, auth_timeout=300, keepalive_interval=30):
+        """ A long-lived authenticated SSH connection to the upload server. Several SFTP channels can be 
+            opened on the same connection and used in parallel from different threads (one channel per 
+            thread), so the files don't pay for the SSH handshake and authentication every time. If the 
+            connection drops, it is reestablished when the next channel is opened.
+
+        Arguments:
+            hostname: [str] Server name or IP address.
+            username: [str] Username used for connecting to the server.
+
+        Keyword arguments:
+            port: [int] SSH port. 22 by default.
+            rsa_private_key: [str] Path to the SSH private key. ~/.ssh/id_rsa by default.
+        """
+
+        self.hostname = hostname
+        self.username = username
+        self.port = port
+        self.rsa_private_key = rsa_private_key
+        self.connect_timeout = connect_timeout
+        self.banner_timeout = banner_timeout
+        self.auth_timeout = auth_timeout
+        self.keepalive_interval = keepalive_interval
+
+        self.ssh = None
+        self.lock = threading.Lock()
+
+
+    def isActive(self):
+        """ Check if the SSH connection is up. """
+
+        if self.ssh is None:
+            return False
+
+        transport = self.ssh.get_transport()
+
+        return (transport is not None) and transport.is_active()
+
+
+    def openSFTP(self):
+        """ Open a new SFTP channel, connecting to the server first if the connection is not up.
+
+        Return:
+            [paramiko.SFTPClient object] Connection handle, None if the connection failed.
+        """
+
+        with self.lock:
+
+            if not self.isActive():
+
+                self._closeSSH()
+
+                self.ssh = getSSHClient(
+                    self.hostname,
+                    port=self.port,
+                    username=self.username,
+                    key_filename=self.rsa_private_key,
+                    timeout=self.connect_timeout,
+                    banner_timeout=self.banner_timeout,
+                    auth_timeout=self.auth_timeout,
+                    keepalive_interval=self.keepalive_interval
+                )
+
+                if self.ssh is None:
+                    return None
+
+            return getSFTPClient(self.ssh)
+
+
+    def _closeSSH(self):
+
+        if self.ssh is not None:
+            log.info("Closing SSH client connection")
+
+            try:
+                self.ssh.close()
+            except Exception as e:
+                log.warning("Error while closing the SSH connection: {}".format(e))
+
+            self.ssh = None
+
+
+    def close(self):
+        """ Close the SSH connection and all channels opened on it. """
+
+        with self.lock:
+            self._closeSSH()
+
+
+
+# Size of the individual SFTP write requests (paramiko's maximum request size)
+SFTP_WRITE_SIZE = 32768
+
+
+class BandwidthLimiter(object):
+    def __init__(self, rate):
+        """ Limits the upload rate of all threads which share this object.
+
+        Arguments:
+            rate: [float] Maximum rate in bytes per second. 0 or less disables the limit.
+        """
+
+        self.rate = rate
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+
+    def throttle(self, n_bytes):
+        """ Wait until the given number of bytes can be sent without exceeding the rate. """
+
+        if self.rate <= 0:
+            return None
+
+        with self.lock:
+            now = time.time()
+            self.next_time = max(self.next_time, now) + n_bytes/float(self.rate)
+            delay = self.next_time - now
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+
+def _crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+
+def readUploadManifest(sftp, manifest_file):
+    """ Read the chunk checksum manifest of a partial upload from the server.
+
+    The manifest header line holds the chunk size and the total size of the file. Every following line holds
+    the index and the CRC32 of one chunk which was sent to the server, in order.
+
+    Arguments:
+        sftp: [paramiko.SFTPClient object] Connection handle.
+        manifest_file: [str] Path to the manifest on the server.
+
+    Return:
+        (chunk_size, file_size, checksums): [tuple] None if the manifest doesn't exist or is damaged.
+    """
+
+    try:
+        with sftp.open(manifest_file, 'r') as f:
+            lines = f.read().decode('ascii').splitlines()
+
+    except IOError:
+        return None
+
+    try:
+        chunk_size, file_size = [int(x) for x in lines[0].split()]
+
+        checksums = []
+        for line in lines[1:]:
+
+            entry = line.split()
+
+            # The last line might be cut short if the upload was interrupted
+            if (len(entry) != 2) or (int(entry[0]) != len(checksums)):
+                break
+
+            checksums.append(int(entry[1], 16))
+
+    except (IndexError, ValueError):
+        return None
+
+    return chunk_size, file_size, checksums
+
+
+def findResumeOffset(sftp, local_file, part_file, manifest_file, chunk_size):
+    """ Find the number of bytes of a partial upload which are already correctly stored on the server.
+        These are all whole chunks which are listed in the manifest, match the checksums of the local file
+        and fit into the size of the remote .part file.
+
+    Arguments:
+        sftp: [paramiko.SFTPClient object] Connection handle.
+        local_file: [str] Path to the local file.
+        part_file: [str] Path to the partial upload on the server.
+        manifest_file: [str] Path to the chunk checksum manifest on the server.
+        chunk_size: [int] Size of the upload chunks (bytes).
+
+    Return:
+        (offset, checksums): [tuple] Offset from which the upload can continue, and the checksums of the 
+            chunks before it.
+    """
+
+    try:
+        part_size = sftp.lstat(part_file).st_size
+    except IOError:
+        return 0, []
+
+    manifest = readUploadManifest(sftp, manifest_file)
+    if manifest is None:
+        return 0, []
+
+    manifest_chunk_size, file_size, remote_checksums = manifest
+
+    # Start over if the local file or the chunk size have changed
+    if (manifest_chunk_size != chunk_size) or (file_size != os.lstat(local_file).st_size):
+        return 0, []
+
+    offset = 0
+    checksums = []
+    with open(local_file, 'rb') as f:
+
+        for remote_checksum in remote_checksums:
+
+            data = f.read(chunk_size)
+
+            if (not data) or (offset + len(data) > part_size) or (_crc32(data) != remote_checksum):
+                break
+
+            checksums.append(remote_checksum)
+            offset += len(data)
+
+    return offset, checksums
+
+
+def putResumable(sftp, local_file, remote_file, chunk_size=1024*1024, callback=None, limiter=None):
+    """ Upload a file to the server so that an interrupted upload can be continued. The data is written to
+        a .part file, and the CRC32 of every chunk written is appended to a .part.manifest file. If an
+        earlier upload of the same file was interrupted, the upload continues after the last chunk which 
+        matches the local file. When all data is sent, the .part file is renamed to the final name and the
+        manifest is removed.
+
+    Arguments:
+        sftp: [paramiko.SFTPClient object] Connection handle.
+        local_file: [str] Full path to the local file.
+        remote_file: [str] Full path to the file on the server.
+
+    Keyword arguments:
+        chunk_size: [int] Size of the chunks which are checksummed (bytes). 1 MB by default.
+        callback: [function] Called as callback(bytes_transferred, total_bytes) after every write.
+        limiter: [BandwidthLimiter] Limits the upload rate. None by default (no limit).
+    """
+
+    part_file = remote_file + '.part'
+    manifest_file = part_file + '.manifest'
+
+    local_file_size = os.lstat(local_file).st_size
+
+    offset, checksums = findResumeOffset(sftp, local_file, part_file, manifest_file, chunk_size)
+
+    if offset > 0:
+        log.info("Resuming the upload of {:s} from {:s}".format(os.path.basename(local_file), 
+            formatSize(offset)))
+
+
+    # Rewrite the manifest with the chunks which are already on the server
+    manifest = sftp.open(manifest_file, 'w')
+    manifest.write("{:d} {:d}\n".format(chunk_size, local_file_size))
+    for i, checksum in enumerate(checksums):
+        manifest.write("{:d} {:08x}\n".format(i, checksum))
+    manifest.flush()
+
+    part = sftp.open(part_file, 'r+' if offset > 0 else 'w')
+
+    try:
+
+        # Writes are sent without waiting for every acknowledgement
+        part.set_pipelined(True)
+
+        if offset > 0:
+            part.truncate(offset)
+            part.seek(offset)
+
+        with open(local_file, 'rb') as f:
+
+            f.seek(offset)
+            chunk_index = len(checksums)
+            bytes_transferred = offset
+
+            while True:
+
+                data = f.read(chunk_size)
+                if not data:
+                    break
+
+                for i in range(0, len(data), SFTP_WRITE_SIZE):
+
+                    block = data[i:i + SFTP_WRITE_SIZE]
+
+                    if limiter is not None:
+                        limiter.throttle(len(block))
+
+                    part.write(block)
+
+                    bytes_transferred += len(block)
+                    if callback is not None:
+                        callback(bytes_transferred, local_file_size)
+
+                # Record the chunk in the manifest. A chunk is only trusted on resume if the .part file on the
+                #   server is long enough to contain it
+                part.flush()
+                manifest.write("{:d} {:08x}\n".format(chunk_index, _crc32(data)))
+                manifest.flush()
+
+                chunk_index += 1
+
+    finally:
+
+        # Closing the file waits for all writes to be acknowledged
+        part.close()
+        manifest.close()
+
+
+    # Move the complete file into place
+    try:
+        sftp.posix_rename(part_file, remote_file)
+
+    except IOError:
+
+        # The server doesn't support the posix-rename extension, which overwrites existing files
+        try:
+            sftp.remove(remote_file)
+        except IOError:
+            pass
+
+        sftp.rename(part_file, remote_file)
+
+    sftp.remove(manifest_file)
+
+
+
 # Define a class to track progress and share values between the callback and the main thread
 class ProgressTracker(object):
     def __init__(self, total_bytes):
@@ -253,13 +580,152 @@ class ProgressTracker(object):
         self.start_time = time.time()
 
 
+def uploadFileSFTP(sftp, local_file, remote_file, chunk_size=1024*1024, limiter=None):
+    """ Upload one file through an open SFTP channel with progress reporting. The file is uploaded only if it
+        does not already exist on the server, or if it has a different size than the local file. Interrupted
+        uploads are continued where they stopped (see putResumable).
+
+    Arguments:
+        sftp: [paramiko.SFTPClient object] Connection handle.
+        local_file: [str] Full path to the local file.
+        remote_file: [str] Full path to the file on the server.
+
+    Keyword arguments:
+        chunk_size: [int] Size of the checksummed upload chunks (bytes). 1 MB by default.
+        limiter: [BandwidthLimiter] Limits the upload rate. None by default (no limit).
+
+    Return:
+        [bool] True if the file is on the server after the upload, False if the verification failed.
+            Connection errors are raised.
+    """
+
+    # Get the size of the local file
+    local_file_size = os.lstat(local_file).st_size
+
+    # Check if the remote file already exists and skip it if it has the same size as the local file
+    try:
+        remote_info = sftp.lstat(remote_file)
+        
+        # If the remote and the local file are of the same size, skip it
+        if local_file_size == remote_info.st_size:
+            log.info("The file '{}' already exists on the server and is the same size. Skipping.".format(remote_file))
+            return True
+    
+    except IOError as e:
+        # Means remote file doesn't exist yet, so proceed
+        pass
+    
+    # Initialize the progress tracker
+    tracker = ProgressTracker(local_file_size)
+
+    update_interval = 1  # Update progress every 1% for large files or 5% for small files
+    if tracker.total_bytes > 100*1024*1024:  # For files over 100MB, update more frequently
+        update_interval = 0.5
+
+    # Define a callback function for progress reporting
+    def progressCallback(bytes_transferred, _):
+        """ Callback function to report upload progress. 
+            It updates the tracker and prints the progress to the console.
+        """
+
+        tracker.uploaded_bytes = bytes_transferred
+        
+        # Calculate percentage
+        if tracker.total_bytes > 0:
+            percent_complete = round(100.0*tracker.uploaded_bytes/tracker.total_bytes, 1)
+            
+            # Only update when the percentage changes by at least update_interval
+            # Also prevent duplicate 100% messages
+            if (percent_complete >= tracker.last_percent + update_interval and tracker.last_percent < 100.0) \
+                or (percent_complete == 100.0 and tracker.last_percent != 100.0):
+                
+                elapsed_time = time.time() - tracker.start_time
+                
+                # Calculate transfer speed
+                if elapsed_time > 0:
+                    transfer_rate = tracker.uploaded_bytes/elapsed_time/1024  # KB/s
+                    
+                    # Format as MB/s if over 1024 KB/s
+                    if transfer_rate > 1024:
+                        transfer_rate_str = "{:.2f} MB/s".format(transfer_rate/1024)
+                    else:
+                        transfer_rate_str = "{:.2f} KB/s".format(transfer_rate)
+                    
+                    # Estimate time remaining
+                    if percent_complete > 0 and percent_complete < 100.0:
+                        time_remaining = (elapsed_time/percent_complete)*(100 - percent_complete)
+                        # Format time remaining
+                        if time_remaining > 60:
+                            time_str = "{:.1f} min remaining".format(time_remaining/60)
+                        else:
+                            time_str = "{:.0f} sec remaining".format(time_remaining)
+                        
+                        print('[{:.1f}%] Uploading: {} ({}/{}) @ {} - {}'.format(
+                            percent_complete,
+                            os.path.basename(local_file),
+                            formatSize(tracker.uploaded_bytes),
+                            formatSize(tracker.total_bytes),
+                            transfer_rate_str,
+                            time_str
+                        ))
+                    else:
+                        # At 100%, show "complete" instead of remaining time
+                        if percent_complete == 100.0:
+                            print('[100.0%] Upload complete: {} ({}/{}) @ {}'.format(
+                                os.path.basename(local_file),
+                                formatSize(tracker.uploaded_bytes),
+                                formatSize(tracker.total_bytes),
+                                transfer_rate_str
+                            ))
+                        else:
+                            print('[{:.1f}%] Uploading: {} ({}/{}) @ {}'.format(
+                                percent_complete,
+                                os.path.basename(local_file),
+                                formatSize(tracker.uploaded_bytes),
+                                formatSize(tracker.total_bytes),
+                                transfer_rate_str
+                            ))
+                
+                else:
+                    print('[{:.1f}%] Uploading: {} ({}/{})'.format(
+                        percent_complete,
+                        os.path.basename(local_file),
+                        formatSize(tracker.uploaded_bytes),
+                        formatSize(tracker.total_bytes)
+                    ))
+                
+                tracker.last_percent = percent_complete
+    
+    # Upload the file to the server if it isn't already there
+    log.info('Starting upload of ' \
+             + local_file + ' ({}) to '.format(formatSize(local_file_size)) + remote_file)
+    putResumable(sftp, local_file, remote_file, chunk_size=chunk_size, callback=progressCallback, 
+        limiter=limiter)
+    log.info("Upload completed, verifying...")
+
+    # Check that the size of the remote file is correct, indicating a successful upload
+    remote_info = sftp.lstat(remote_file)
+    
+    # If the remote and the local file are of the same size, skip it
+    if local_file_size != remote_info.st_size:
+        log.error('File verification failed: local size {} != remote size {}'.format(
+            formatSize(local_file_size), formatSize(remote_info.st_size)))
+        return False
+
+    log.info("File upload verified: {:s}".format(remote_file))
+
+    return True
+
+
 def uploadSFTP(hostname, username, dir_local, dir_remote, file_list, port=22,
                rsa_private_key=os.path.expanduser('~/.ssh/id_rsa'),
                allow_dir_creation=False,
                connect_timeout=300,
                banner_timeout=300,
                auth_timeout=300,
-               keepalive_interval=30):
+               keepalive_interval=30,
+               chunk_size=1024*1024,
+               bandwidth_limit=0):
     """ Upload the given list of files using SFTP with progress reporting.
         The upload only supports uploading files from one local directory to one remote directory.
         The files are uploaded only if they do not already exist on the server, or if they are of 
@@ -282,6 +748,9 @@ def uploadSFTP(hostname, username, dir_local, dir_remote, file_list, port=22,
         port: [int] SSH port. 22 by default.
         rsa_private_key: [str] Path to the SSH private key. ~/.ssh/id_rsa by default.
         allow_dir_creation: [bool] Create a remote directory if it doesn't exist. False by default.
+        chunk_size: [int] Size of the checksummed upload chunks (bytes), interrupted uploads are continued from
+            the last complete chunk. 1 MB by default.
+        bandwidth_limit: [float] Maximum upload rate in bytes per second. 0 by default (no limit).
 
     Return:
         [bool] True if upload successful, false otherwise.
@@ -324,128 +793,19 @@ def uploadSFTP(hostname, username, dir_local, dir_remote, file_list, port=22,
             log.error("Remote directory '{}' does not exist or is not accessible: {}".format(dir_remote, e))
             return False
 
+        limiter = BandwidthLimiter(bandwidth_limit)
+
         # Go through all files
         for fname in file_list:
 
             # Path to the local file
             local_file = os.path.join(dir_local, fname)
 
-            # Get the size of the local file
-            local_file_size = os.lstat(local_file).st_size
-
             # Path to the remote file
             remote_file = dir_remote + '/' + os.path.basename(fname)
 
-            # Check if the remote file already exists and skip it if it has the same size as the local file
-            try:
-                remote_info = sftp.lstat(remote_file)
-                
-                # If the remote and the local file are of the same size, skip it
-                if local_file_size == remote_info.st_size:
-                    log.info("The file '{}' already exists on the server and is the same size. Skipping.".format(remote_file))
-                    continue
-            
-            except IOError as e:
-                # Means remote file doesn't exist yet, so proceed
-                pass
-            
-            # Initialize the progress tracker
-            tracker = ProgressTracker(local_file_size)
-
-            update_interval = 1  # Update progress every 1% for large files or 5% for small files
-            if tracker.total_bytes > 100*1024*1024:  # For files over 100MB, update more frequently
-                update_interval = 0.5
-
-            # Define a callback function for progress reporting
-            def progressCallback(bytes_transferred, _):
-                """ Callback function to report upload progress. 
-                    It updates the tracker and prints the progress to the console.
-                """
-
-                tracker.uploaded_bytes = bytes_transferred
-                
-                # Calculate percentage
-                if tracker.total_bytes > 0:
-                    percent_complete = round(100.0*tracker.uploaded_bytes/tracker.total_bytes, 1)
-                    
-                    # Only update when the percentage changes by at least update_interval
-                    # Also prevent duplicate 100% messages
-                    if (percent_complete >= tracker.last_percent + update_interval and tracker.last_percent < 100.0) \
-                        or (percent_complete == 100.0 and tracker.last_percent != 100.0):
-                        
-                        elapsed_time = time.time() - tracker.start_time
-                        
-                        # Calculate transfer speed
-                        if elapsed_time > 0:
-                            transfer_rate = tracker.uploaded_bytes/elapsed_time/1024  # KB/s
-                            
-                            # Format as MB/s if over 1024 KB/s
-                            if transfer_rate > 1024:
-                                transfer_rate_str = "{:.2f} MB/s".format(transfer_rate/1024)
-                            else:
-                                transfer_rate_str = "{:.2f} KB/s".format(transfer_rate)
-                            
-                            # Estimate time remaining
-                            if percent_complete > 0 and percent_complete < 100.0:
-                                time_remaining = (elapsed_time/percent_complete)*(100 - percent_complete)
-                                # Format time remaining
-                                if time_remaining > 60:
-                                    time_str = "{:.1f} min remaining".format(time_remaining/60)
-                                else:
-                                    time_str = "{:.0f} sec remaining".format(time_remaining)
-                                
-                                print('[{:.1f}%] Uploading: {} ({}/{}) @ {} - {}'.format(
-                                    percent_complete,
-                                    os.path.basename(local_file),
-                                    formatSize(tracker.uploaded_bytes),
-                                    formatSize(tracker.total_bytes),
-                                    transfer_rate_str,
-                                    time_str
-                                ))
-                            else:
-                                # At 100%, show "complete" instead of remaining time
-                                if percent_complete == 100.0:
-                                    print('[100.0%] Upload complete: {} ({}/{}) @ {}'.format(
-                                        os.path.basename(local_file),
-                                        formatSize(tracker.uploaded_bytes),
-                                        formatSize(tracker.total_bytes),
-                                        transfer_rate_str
-                                    ))
-                                else:
-                                    print('[{:.1f}%] Uploading: {} ({}/{}) @ {}'.format(
-                                        percent_complete,
-                                        os.path.basename(local_file),
-                                        formatSize(tracker.uploaded_bytes),
-                                        formatSize(tracker.total_bytes),
-                                        transfer_rate_str
-                                    ))
-                        
-                        else:
-                            print('[{:.1f}%] Uploading: {} ({}/{})'.format(
-                                percent_complete,
-                                os.path.basename(local_file),
-                                formatSize(tracker.uploaded_bytes),
-                                formatSize(tracker.total_bytes)
-                            ))
-                        
-                        tracker.last_percent = percent_complete
-            
-            # Upload the file to the server if it isn't already there
-            log.info('Starting upload of ' \
-                     + local_file + ' ({}) to '.format(formatSize(local_file_size)) + remote_file)
-            sftp.put(local_file, remote_file, callback=progressCallback)
-            log.info("Upload completed, verifying...")
-
-            # Check that the size of the remote file is correct, indicating a successful upload
-            remote_info = sftp.lstat(remote_file)
-            
-            # If the remote and the local file are of the same size, skip it
-            if local_file_size != remote_info.st_size:
-                log.error('File verification failed: local size {} != remote size {}'.format(
-                    formatSize(local_file_size), formatSize(remote_info.st_size)))
+            if not uploadFileSFTP(sftp, local_file, remote_file, chunk_size=chunk_size, limiter=limiter):
                 return False
-
-            log.info("File upload verified: {:s}".format(remote_file))
             
         return True
 
@@ -494,6 +854,15 @@ class UploadManager(multiprocessing.Process):
         # Construct the path to the queue backup file
         self.upload_queue_file_path = os.path.join(self.config.data_dir, self.config.upload_queue_file)
 
+        # Files uploaded since the queue file was last rewritten are appended to this journal, so the queue 
+        #   file doesn't have to be rewritten after every upload
+        self.upload_journal_file_path = self.upload_queue_file_path + '.done'
+
+        # Connection to the server, kept open between the upload runs (opened in the upload process)
+        self.sftp_session = None
+
+        self.journal_lock = multiprocessing.Lock()
+
         self.exit = multiprocessing.Event()
         self.upload_in_progress = multiprocessing.Value(ctypes.c_bool, False)
 
@@ -604,6 +973,9 @@ class UploadManager(multiprocessing.Process):
             return None
 
 
+        # Files which were uploaded, but are still in the queue file (e.g. after a power failure)
+        uploaded = set(self.readUploadJournal())
+
         # Phase 1: read file from disk without holding the lock
         filenames = []
         if os.path.exists(self.upload_queue_file_path):
@@ -618,6 +990,10 @@ class UploadManager(multiprocessing.Process):
                     if len(file_name) == 0:
                         continue
 
+                    # Skip files which were already uploaded
+                    if file_name in uploaded:
+                        continue
+
                     # Make sure the file for upload exists
                     if not os.path.isfile(file_name):
                         log.warning("Local file not found: {:s}".format(file_name))
@@ -690,6 +1066,135 @@ class UploadManager(multiprocessing.Process):
 
 
 
+    def readUploadJournal(self):
+        """ Return the list of files in the upload journal. """
+
+        if not os.path.isfile(self.upload_journal_file_path):
+            return []
+
+        uploaded = []
+        with open(self.upload_journal_file_path) as f:
+            for file_name in f:
+                file_name = file_name.replace('\n', '').replace('\r', '')
+                if file_name:
+                    uploaded.append(file_name)
+
+        return uploaded
+
+
+    def journalUploaded(self, file_name):
+        """ Append the name of an uploaded file to the upload journal. """
+
+        with self.journal_lock:
+            with open(self.upload_journal_file_path, 'a') as f:
+                f.write(file_name + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+
+    def compactQueue(self):
+        """ Rewrite the queue file with the files which are still in the queue and clear the upload journal. """
+
+        self.saveQueue(overwrite=True)
+
+        if os.path.isfile(self.upload_journal_file_path):
+            os.remove(self.upload_journal_file_path)
+
+
+    def _uploadWorker(self, state, retries):
+        """ Upload files from the queue through one SFTP channel until the queue is empty, or until the 
+            uploads fail too many times. Runs in a thread started by uploadData.
+
+        Arguments:
+            state: [dict] Shared between the workers - 'lock', 'tries' (consecutive failures), 'stop' 
+                (threading.Event) and 'limiter' (BandwidthLimiter).
+            retries: [int] Number of failed uploads in a row after which all workers stop.
+        """
+
+        sftp = None
+
+        try:
+
+            while not state['stop'].is_set():
+
+                # Get a file from the queue
+                with self.file_queue_lock:
+                    try:
+                        file_name = self.file_queue.get(timeout=1)
+                    except QueueEmpty:
+                        break  # nothing left to do
+
+                if not os.path.isfile(file_name):
+                    log.warning("Local file not found: {:s}".format(file_name))
+                    log.warning("Skipping it...")
+                    continue
+
+                upload_status = False
+
+                try:
+
+                    # Open a channel on the shared connection and check the remote directory
+                    if sftp is None:
+
+                        sftp = self.sftp_session.openSFTP()
+
+                        if sftp is not None:
+                            try:
+                                sftp.stat(self.config.remote_dir)
+                            except Exception as e:
+                                log.error("Remote directory '{}' does not exist or is not accessible: {}"\
+                                    .format(self.config.remote_dir, e))
+                                sftp.close()
+                                sftp = None
+
+                    if sftp is not None:
+                        upload_status = uploadFileSFTP(sftp, file_name, 
+                            self.config.remote_dir + '/' + os.path.basename(file_name), 
+                            chunk_size=int(self.config.upload_chunk_size*1024*1024), 
+                            limiter=state['limiter'])
+
+                except Exception as e:
+                    log.error("Exception during SFTP upload: {}".format(e), exc_info=True)
+
+                # If the upload was successful, add the file to the journal
+                if upload_status:
+                    log.info('Upload successful!')
+                    self.journalUploaded(file_name)
+
+                    with state['lock']:
+                        state['tries'] = 0
+
+                # If the upload failed, put the file back on the list and wait a bit
+                else:
+
+                    with state['lock']:
+                        state['tries'] += 1
+                        tries = state['tries']
+
+                    log.warning('Uploading failed! Retry {:d} of {:d}'.format(tries, retries))
+
+                    with self.file_queue_lock:
+                        self.file_queue.put(file_name)
+
+                    # Check if the upload was tried too many times
+                    if tries >= retries:
+                        state['stop'].set()
+                        break
+
+                    # Reopen the channel for the next file, the connection might have dropped
+                    if sftp is not None:
+                        sftp.close()
+                        sftp = None
+
+                    # Given the network a moment to recover between attempts
+                    state['stop'].wait(10)
+
+        finally:
+            if sftp is not None:
+                log.info("Closing SFTP channel")
+                sftp.close()
+
+
     def uploadData(self, retries=5):
         """ Pulls the upload list from a file, tries to upload the file, and if it fails it saves the list of 
             failed files to disk. 
@@ -709,52 +1214,29 @@ class UploadManager(multiprocessing.Process):
         # Read the file list from disk
         self.loadQueue()
 
-        tries = 0
+        # Open the connection on the first run, it is kept open between the runs
+        if self.sftp_session is None:
 
-        # Go through every file and upload it to server
-        while True:
+            # Use the lowercase version of the station ID as the username
+            self.sftp_session = SFTPSession(self.config.hostname, self.config.stationID.lower(), 
+                port=self.config.host_port, rsa_private_key=self.config.rsa_private_key)
 
-            # Get a file from the queue
-            with self.file_queue_lock:
-                try:
-                    file_name = self.file_queue.get(timeout=1)
-                except QueueEmpty:
-                    break  # nothing left to do
-
-            if not os.path.isfile(file_name):
-                log.warning("Local file not found: {:s}".format(file_name))
-                log.warning("Skipping it...")
-                continue
-
-            # Separate the path to the file and the file name
-            data_path, f_name = os.path.split(file_name)
-
-            # Upload the file via SFTP (use the lowercase version of the station ID as the username)
-            upload_status = uploadSFTP(self.config.hostname, self.config.stationID.lower(), data_path, \
-                self.config.remote_dir, [f_name], rsa_private_key=self.config.rsa_private_key, 
-                port=self.config.host_port)
-
-            # If the upload was successful, rewrite the holding file, which will remove the uploaded file
-            if upload_status:
-                log.info('Upload successful!')
-                self.saveQueue(overwrite=True)
-                tries = 0
-
-            # If the upload failed, put the file back on the list and wait a bit
-            else:
-
-                log.warning('Uploading failed! Retry {:d} of {:d}'.format(tries + 1, retries))
+        # Upload several files at the same time, every one on its own SFTP channel
+        #   (the bandwidth limit is shared by all of them)
+        state = {'lock': threading.Lock(), 'tries': 0, 'stop': threading.Event(), 
+            'limiter': BandwidthLimiter(self.config.upload_bandwidth_limit*1024)}
+        workers = []
+        for _ in range(max(1, self.config.upload_threads)):
+            worker = threading.Thread(target=self._uploadWorker, args=(state, retries))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
 
-                tries += 1 
-                with self.file_queue_lock:
-                    self.file_queue.put(file_name)
-
-                # Given the network a moment to recover between attempts
-                time.sleep(10)
+        for worker in workers:
+            worker.join()
 
-            # Check if the upload was tried too many times
-            if tries >= retries:
-                break
+        # Remove the uploaded files from the queue file
+        self.compactQueue()
 
         # Set the flag that the upload is done
         self.upload_in_progress.value = False
@@ -811,6 +1293,10 @@ class UploadManager(multiprocessing.Process):
 
             time.sleep(0.1)
 
+        # Close the connection to the server
+        if self.sftp_session is not None:
+            self.sftp_session.close()
+
 
 
 
@@ -17,12 +17,15 @@
 
 
 import math
+import sys
 import time
-from multiprocessing import Process, Event
+import traceback
+from multiprocessing import Process, Event, Queue
 
 import numpy as np
 
 from RMS.DetectionTools import loadImageCalibration, binImageCalibration
+from RMS.FrameBuffer import FrameRingBuffer
 from RMS.Logger import getLogger
 from RMS.Routines import Grouping3D
 from RMS.Routines.MaskImage import maskImage
@@ -102,8 +105,8 @@ class Extractor(Process):
                 z = z[indices]
                 
 
-        # Randomize points if there are too many in total
-        if len(z) > self.config.max_points:
+        # Randomize points if there are too many in total (the ransac line finder takes all points)
+        if (self.config.fireball_line_finder != 'ransac') and (len(z) > self.config.max_points):
             indices = np.random.choice(len(z), self.config.max_points, replace=False)
             y = y[indices]
             x = x[indices]
@@ -261,6 +264,24 @@ class Extractor(Process):
         """
         
         self.executeAll()
+
+
+
+    def extractBlock(self, frames, compressed, filename):
+        """ Run the extraction on the given block of frames in the current process.
+
+        Arguments:
+            frames: [ndarray] raw video frames
+            compressed: [ndarray] array with FTP compressed frames
+            filename: [str] name of the FF file which is being processed
+
+        """
+
+        self.frames = frames
+        self.compressed = compressed
+        self.filename = filename
+
+        self.executeAll()
     
 
 
@@ -321,4 +342,156 @@ class Extractor(Process):
         # Save the extracted clips
         self.save(clips)
 
-        log.debug("[" + self.filename + "] Time for saving: " + str(time.time() - t) + "s")
\ No newline at end of file
+        log.debug("[" + self.filename + "] Time for saving: " + str(time.time() - t) + "s")
+
+
+
+class ExtractionWorker(Process):
+    """ Long-lived process which runs the fireball extraction on the blocks of frames given by the
+        compression. The calibration images are loaded only once, and the raw frames are copied to private
+        blocks in shared memory, so the capture can reuse its buffer while the extraction is running.
+
+    """
+
+    def __init__(self, config, data_dir, block_frames, height, width, n_slots=2):
+        """
+        Arguments:
+            config: [Configuration object] config obj
+            data_dir: [str] path to the directory where FF files are located
+            block_frames: [int] number of frames in one block
+            height: [int] height of the frames in pixels
+            width: [int] width of the frames in pixels
+
+        Keyword arguments:
+            n_slots: [int] number of blocks which can wait for the extraction. 2 by default.
+
+        """
+
+        super(ExtractionWorker, self).__init__()
+
+        self.config = config
+        self.data_dir = data_dir
+
+        # Blocks of raw frames waiting for the extraction. A full ring means the extraction is behind and
+        #   the new block is skipped
+        self.blocks = FrameRingBuffer(n_slots, block_frames, height, width)
+
+        # Compressed frames and file names of the queued blocks, in the same order as the blocks
+        self.jobs = Queue()
+
+        self.exit = Event()
+
+
+
+    def copyBlock(self, frames):
+        """ Copy the raw frames to a free block. Called by the compression, before it releases the frames.
+
+        Arguments:
+            frames: [ndarray] raw video frames
+
+        Return:
+            slot: [int] block index which has to be given to submit, or None if no block is free and the
+                extraction of these frames has to be skipped
+        """
+
+        slot = self.blocks.acquireWriteSlot()
+
+        if slot is None:
+            self.blocks.dropBlock()
+            return None
+
+        np.copyto(self.blocks.frames(slot), frames)
+
+        return slot
+
+
+
+    def submit(self, slot, compressed, filename):
+        """ Queue the copied block for the extraction.
+
+        Arguments:
+            slot: [int] block index returned by copyBlock
+            compressed: [ndarray] array with FTP compressed frames
+            filename: [str] name of the FF file which is being processed
+
+        """
+
+        # The job has to be queued before the block is committed, so it is there when the block is read
+        self.jobs.put((slot, compressed, filename))
+        self.blocks.commitWriteSlot(slot, time.time())
+
+
+
+    def backlog(self):
+        """ Number of blocks waiting for the extraction. """
+
+        return self.blocks.depth()
+
+
+    def maxBacklog(self):
+        """ Maximum number of blocks which were waiting for the extraction at the same time. """
+
+        return self.blocks.maxDepth()
+
+
+    def skippedBlocks(self):
+        """ Number of blocks which were not extracted because the extraction was behind. """
+
+        return self.blocks.droppedBlocks()
+
+
+
+    def stop(self, timeout=60):
+        """ Stop the worker once all queued blocks are extracted.
+
+        Keyword arguments:
+            timeout: [float] maximum time to wait for the worker in seconds, it is terminated afterwards.
+                60 by default.
+
+        """
+
+        self.exit.set()
+        self.join(timeout)
+
+        if self.is_alive():
+            log.debug('Fireball extraction did not finish in {:.0f} s, terminating it...'.format(timeout))
+            self.terminate()
+            self.join()
+
+        self.blocks.free()
+
+
+
+    def run(self):
+        """ Extract the queued blocks until the worker is stopped and all blocks are done. """
+
+        # The calibration is loaded once for the whole night
+        extractor = Extractor(self.config, self.data_dir)
+
+        while True:
+
+            slot, _ = self.blocks.acquireReadSlot(timeout=0.5)
+
+            if slot is None:
+
+                if self.exit.is_set():
+                    break
+
+                continue
+
+            _, compressed, filename = self.jobs.get()
+
+            t = time.time()
+
+            try:
+                extractor.extractBlock(self.blocks.frames(slot), compressed, filename)
+
+            except Exception as e:
+                log.error("Fireball extraction failed on {:s}: {:s}".format(filename, repr(e)))
+                log.error("".join(traceback.format_exception(*sys.exc_info())))
+
+            finally:
+                self.blocks.releaseReadSlot(slot)
+
+            log.debug("[{:s}] fireball extraction time: {:.3f} s, backlog: {:d}".format(filename,
+                time.time() - t, self.backlog()))
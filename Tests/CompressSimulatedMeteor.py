@@ -154,7 +154,7 @@ if __name__ == "__main__":
     #     plt.show()
 
     
-    comp = Compressor(dir_path, None, None, None, None, config)
+    comp = Compressor(dir_path, None, config)
 
     print('Running compression...')
     t1 = time.time()
@@ -0,0 +1,43 @@
+""" Check that the multithreaded compression gives the same output as the serial compression, and compare
+    their run times.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import time
+
+import numpy as np
+
+# Cython init
+import pyximport
+pyximport.install(setup_args={'include_dirs':[np.get_include()]})
+from RMS.CompressionCy import compressFrames
+
+
+if __name__ == "__main__":
+
+    # 720p block with noise and a bright saturated moving object
+    frames = np.random.normal(40, 8, (256, 720, 1280)).clip(0, 255).astype(np.uint8)
+    for i in range(100, 140):
+        frames[i, 300 + i:310 + i, 500 + 2*i:510 + 2*i] = 255
+
+    for deinterlace_order in [-2, 0, 1]:
+
+        t1 = time.time()
+        ftp_serial, fieldsum_serial = compressFrames(frames, deinterlace_order)
+        t_serial = time.time() - t1
+
+        for num_threads in [2, 3, 4]:
+
+            t1 = time.time()
+            ftp_parallel, fieldsum_parallel = compressFrames(frames, deinterlace_order,
+                num_threads=num_threads)
+            t_parallel = time.time() - t1
+
+            identical = np.array_equal(ftp_serial, ftp_parallel) \
+                and np.array_equal(fieldsum_serial, fieldsum_parallel)
+
+            print("Deinterlace {:+d}, threads {:d}: identical = {:s}, serial {:.3f} s, parallel {:.3f} s".format(
+                deinterlace_order, num_threads, str(identical), t_serial, t_parallel))
+
+            assert identical
@@ -0,0 +1,222 @@
+""" Check that EventMonitor.findEventFiles finds the same files through the file time index (EventFileIndex)
+    as the directory scan it replaced, and that the index is refreshed when a directory changes.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import datetime
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+import RMS.ConfigReader as cr
+from RMS.EventMonitor import EventContainer, EventMonitor, convertGMNTimeToPOSIX, posixSeconds
+
+
+def makeNightDir(data_dir, start_time, n_files):
+    """ Make a night directory with FF files every 10.24 s, FR files and JPGs for some of them and a few other 
+        files.
+        Returns the path of the directory.
+    """
+
+    dir_path = os.path.join(data_dir, "XX0001_" + start_time.strftime("%Y%m%d_%H%M%S") + "_123456")
+    os.makedirs(dir_path)
+
+    for i in range(n_files):
+
+        file_time = start_time + datetime.timedelta(seconds=10.24*i)
+        time_str = file_time.strftime("%Y%m%d_%H%M%S_") + "{:03d}".format(file_time.microsecond//1000)
+
+        open(os.path.join(dir_path, "FF_XX0001_{:s}_{:07d}.fits".format(time_str, 256*i)), 'w').close()
+
+        if i%7 == 0:
+            open(os.path.join(dir_path, "FR_XX0001_{:s}_{:07d}.bin".format(time_str, 256*i)), 'w').close()
+
+        if i%50 == 0:
+            open(os.path.join(dir_path, "FF_XX0001_{:s}_{:07d}.jpg".format(time_str, 256*i)), 'w').close()
+
+    for file_name in ["platepar_cmn2010.cal", "mask.bmp"]:
+        open(os.path.join(dir_path, file_name), 'w').close()
+
+    return dir_path
+
+
+
+def scanEventFiles(event, directory_list, file_extension_list):
+    """ The directory scan findEventFiles used before the file index. The previous .fits file is compared by
+        the full path, as in findEventFiles.
+    """
+
+    event_time = convertGMNTimeToPOSIX(event.dt)
+
+    file_list = []
+    last_fits_file = None
+    seeking_first_fits_after_event = True
+
+    for directory in directory_list:
+        for file_extension in file_extension_list:
+
+            dirlist = sorted(os.listdir(directory))
+
+            if file_extension == ".fits":
+                fits_list = sorted(glob.glob(os.path.join(directory, "*.fits")))
+
+                if len(fits_list) == 0:
+                    return file_list
+
+                last_fits_file = fits_list[0]
+                seeking_first_fits_after_event = True
+
+            for file in dirlist:
+                if file.endswith(file_extension):
+                    file_POSIX_time = convertGMNTimeToPOSIX(file[10:25])
+                    if abs((file_POSIX_time - event_time).total_seconds()) < event.time_tolerance:
+                        file_list.append(os.path.join(directory, file))
+
+                    if file_extension == ".fits":
+                        if file_POSIX_time > event_time and seeking_first_fits_after_event:
+                            if os.path.join(directory, last_fits_file) not in file_list:
+                                file_list.append(os.path.join(directory, last_fits_file))
+                            seeking_first_fits_after_event = False
+                        last_fits_file = file
+
+    return file_list
+
+
+
+def makeEvent(event_time, time_tolerance):
+    """ Make an event at the given time, with the given time tolerance in seconds. """
+
+    event = EventContainer(event_time.strftime("%Y%m%d_%H%M%S"), 0, 0, 0)
+    event.time_tolerance = time_tolerance
+
+    return event
+
+
+
+if __name__ == "__main__":
+
+    data_dir = tempfile.mkdtemp()
+
+    try:
+
+        config = cr.Config()
+        config.data_dir = data_dir
+
+        night_start = datetime.datetime(2024, 1, 1, 18, 0, 0)
+        dir_path = makeNightDir(os.path.join(data_dir, "CapturedFiles"), night_start, 1000)
+        dir_path_2 = makeNightDir(os.path.join(data_dir, "ArchivedFiles"), night_start, 300)
+        directory_list = [dir_path, dir_path_2]
+
+        # Pretend the directories were last modified a while ago, so the index keeps them until they change
+        for directory in directory_list:
+            past = time.time() - 100
+            os.utime(directory, (past, past))
+
+        event_monitor = EventMonitor(config)
+        file_index = event_monitor.file_index
+
+
+        # Events before, during and after the night, on file times and between them
+        event_times = [night_start - datetime.timedelta(seconds=30), night_start,
+            night_start + datetime.timedelta(seconds=5), night_start + datetime.timedelta(seconds=1024),
+            night_start + datetime.timedelta(seconds=2000), night_start + datetime.timedelta(seconds=3071),
+            night_start + datetime.timedelta(seconds=4000), night_start + datetime.timedelta(hours=5)]
+
+        t_scan = t_index = 0
+        for event_time in event_times:
+            for time_tolerance in [0, 5, 10, 30, 300]:
+
+                event = makeEvent(event_time, time_tolerance)
+
+                t1 = time.time()
+                ref_files = scanEventFiles(event, directory_list, [".fits", ".bin"])
+                t_scan += time.time() - t1
+
+                t1 = time.time()
+                index_files = event_monitor.findEventFiles(event, directory_list, [".fits", ".bin"])
+                t_index += time.time() - t1
+
+                assert index_files == ref_files, (event_time, time_tolerance)
+
+                # Non-indexed extensions are found by scanning the directory
+                assert event_monitor.findEventFiles(event, directory_list, [".jpg"]) \
+                    == scanEventFiles(event, directory_list, [".jpg"])
+
+        # The index is kept next to the EventMonitor database
+        assert os.path.isfile(os.path.splitext(event_monitor.event_monitor_db_path)[0] + "_file_index.db")
+
+        print("Directory scan: {:.1f} ms, index: {:.1f} ms per event".format(
+            1000*t_scan/(len(event_times)*5), 1000*t_index/(len(event_times)*5)))
+
+
+        # The range excludes both bounds. FF files are 10.24 s apart, the 100th one is at 1024 s
+        file_time = posixSeconds(night_start) + 1024
+        ff_name = "FF_XX0001_20240101_181704_000_0025600.fits"
+        assert file_index.filesInRange(dir_path, ".fits", file_time - 1, file_time + 1) == [ff_name]
+        assert file_index.filesInRange(dir_path, ".fits", file_time, file_time + 1) == []
+        assert file_index.filesInRange(dir_path, ".fits", file_time - 1, file_time) == []
+
+
+        # Without files within the tolerance, only the .fits file before the event is returned
+        event = makeEvent(night_start + datetime.timedelta(seconds=1030), 0)
+        assert event_monitor.findEventFiles(event, [dir_path], [".fits", ".bin"]) \
+            == [os.path.join(dir_path, ff_name)]
+
+        # If all files are after the event, that is the first file. After the last file there is none
+        event = makeEvent(night_start - datetime.timedelta(seconds=30), 0)
+        assert event_monitor.findEventFiles(event, [dir_path], [".fits"]) \
+            == [os.path.join(dir_path, "FF_XX0001_20240101_180000_000_0000000.fits")]
+
+        event = makeEvent(night_start + datetime.timedelta(hours=5), 0)
+        assert event_monitor.findEventFiles(event, [dir_path], [".fits"]) == []
+
+
+        # A file added without changing the directory time is not seen, as the directory isn't rescanned
+        dir_mtime = os.stat(dir_path).st_mtime
+        new_name = "FF_XX0001_20240101_230000_000_9999999.fits"
+        open(os.path.join(dir_path, new_name), 'w').close()
+        os.utime(dir_path, (dir_mtime, dir_mtime))
+
+        event = makeEvent(datetime.datetime(2024, 1, 1, 23, 0, 0), 5)
+        assert os.path.join(dir_path, new_name) not in event_monitor.findEventFiles(event, [dir_path],
+            [".fits"])
+
+        # Once the directory time changes, the directory is rescanned and the file is found
+        os.utime(dir_path, (dir_mtime + 10, dir_mtime + 10))
+        assert os.path.join(dir_path, new_name) in event_monitor.findEventFiles(event, [dir_path], [".fits"])
+
+        # Removed files disappear after the rescan
+        os.remove(os.path.join(dir_path, new_name))
+        os.utime(dir_path, (dir_mtime + 20, dir_mtime + 20))
+        assert os.path.join(dir_path, new_name) not in event_monitor.findEventFiles(event, [dir_path],
+            [".fits"])
+
+
+        # A directory modified within a few seconds of the last scan is always rescanned, as a file added
+        #   later may not change its time on file systems with a coarse time resolution
+        os.utime(dir_path_2, None)
+        dir_mtime = os.stat(dir_path_2).st_mtime
+        file_index.refreshDirectory(dir_path_2)
+
+        new_name = "FF_XX0001_20240101_180001_000_9999999.fits"
+        open(os.path.join(dir_path_2, new_name), 'w').close()
+        os.utime(dir_path_2, (dir_mtime, dir_mtime))
+
+        event = makeEvent(night_start, 5)
+        assert os.path.join(dir_path_2, new_name) in event_monitor.findEventFiles(event, [dir_path_2], 
+            [".fits"])
+
+
+        # Removed directories are pruned from the index
+        shutil.rmtree(dir_path_2)
+        event_monitor.findEventFiles(event, [dir_path], [".fits"])
+        assert file_index.getConnection().execute("SELECT COUNT(*) FROM files WHERE directory = ?",
+            (dir_path_2,)).fetchone()[0] == 0
+
+        print("Event file index test passed")
+
+    finally:
+        shutil.rmtree(data_dir)
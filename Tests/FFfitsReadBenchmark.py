@@ -0,0 +1,107 @@
+""" Compare reading FF files with the fast FITS reader and with astropy, and check that both readers return
+    the same data.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from RMS.Formats.FFStruct import FFStruct
+import RMS.Formats.FFfits as FFfits
+
+
+def makeFF(nrows, ncols, dtype, seed):
+    """ Make a FF structure filled with random images. """
+
+    np.random.seed(seed)
+
+    ff = FFStruct()
+    ff.nrows = nrows
+    ff.ncols = ncols
+    ff.nbits = 8*np.dtype(dtype).itemsize
+    ff.nframes = 256
+    ff.first = 256*seed
+    ff.camno = 1
+    ff.fps = 25.0
+    ff.starttime = "2024-01-01T01:02:03.456000"
+
+    max_value = np.iinfo(dtype).max
+    ff.array = np.random.randint(0, max_value + 1, size=(4, nrows, ncols)).astype(dtype)
+
+    return ff
+
+
+def compareFF(ff1, ff2):
+    """ Check that the two FF structures contain the same data. """
+
+    for attr in ['nrows', 'ncols', 'nbits', 'nframes', 'first', 'camno', 'fps', 'starttime']:
+        assert getattr(ff1, attr) == getattr(ff2, attr), attr
+
+    for attr in ['maxpixel', 'maxframe', 'avepixel', 'stdpixel', 'array']:
+        assert np.array_equal(getattr(ff1, attr), getattr(ff2, attr)), attr
+
+
+
+if __name__ == "__main__":
+
+    n_files = 50
+
+    dir_path = tempfile.mkdtemp()
+
+    try:
+
+        for dtype in [np.uint8, np.uint16]:
+
+            file_names = []
+            for i in range(n_files):
+                file_name = "FF_XX0001_20240101_010203_{:03d}_{:07d}.fits".format(i, 256*i)
+                FFfits.write(makeFF(720, 1280, dtype, i), dir_path, file_name)
+                file_names.append(file_name)
+
+
+            # Both readers must give the same result
+            for file_name in file_names[:5]:
+                compareFF(FFfits.read(dir_path, file_name, array=True, fast=True),
+                    FFfits.read(dir_path, file_name, array=True, fast=False))
+
+            # The fast reader must recognize the files
+            assert FFfits.readFast(os.path.join(dir_path, file_names[0])) is not None
+
+
+            for fast in [False, True]:
+
+                t1 = time.time()
+
+                for file_name in file_names:
+                    ff = FFfits.read(dir_path, file_name, fast=fast)
+
+                    # Touch the data so the memory mapped images are actually read
+                    ff.maxpixel.sum()
+                    ff.avepixel.sum()
+
+                t_read = (time.time() - t1)/n_files
+
+                print("{:s}, {:s}: {:.2f} ms per file".format(np.dtype(dtype).name,
+                    "fast reader" if fast else "astropy", 1000*t_read))
+
+
+            for file_name in file_names:
+                os.remove(os.path.join(dir_path, file_name))
+
+
+        # Foreign FITS files fall back to astropy
+        from astropy.io import fits
+        foreign_name = "FF_XX0001_20240101_010203_000_0000000.fits"
+        fits.HDUList([fits.PrimaryHDU(np.zeros((10, 10), dtype=np.uint8))]).writeto(
+            os.path.join(dir_path, foreign_name), overwrite=True)
+        assert FFfits.readFast(os.path.join(dir_path, foreign_name)) is None
+
+        print("FF FITS reader test passed")
+
+    finally:
+        shutil.rmtree(dir_path)
@@ -0,0 +1,136 @@
+""" Check that FR files written by writeArray and write are read back unchanged, and compare the reading
+    speed with a reader which reads every field separately.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import RMS.Formats.FRbin as FRbin
+
+
+def makeClips(n_lines, n_frames, seed):
+    """ Make random clips in the format returned by Extractor.extract. """
+
+    np.random.seed(seed)
+
+    clips = []
+    for _ in range(n_lines):
+
+        sizes = np.random.randint(8, 64, size=n_frames)
+
+        # Cutouts are allocated with the maximum size, only the top left part is used
+        cropouts = np.random.randint(0, 256, size=(n_frames, 64, 64)).astype(np.uint8)
+
+        sizepos = np.zeros((n_frames, 4), dtype=np.uint16)
+        sizepos[:, 0] = np.random.randint(0, 720, size=n_frames)
+        sizepos[:, 1] = np.random.randint(0, 1280, size=n_frames)
+        sizepos[:, 2] = np.arange(n_frames)
+        sizepos[:, 3] = sizes
+
+        clips.append([cropouts, sizepos])
+
+    return clips
+
+
+def readPerField(file_path):
+    """ Read the FR file one field at a time, the way it used to be read. """
+
+    with open(file_path, "rb") as fid:
+
+        lines = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
+
+        frames = []
+        for _ in range(lines):
+
+            frame_num = int(np.fromfile(fid, dtype=np.uint32, count=1)[0])
+
+            for _ in range(frame_num):
+                yc, xc, t, size = [int(np.fromfile(fid, dtype=np.uint32, count=1)[0]) for _ in range(4)]
+                frames.append(np.fromfile(fid, dtype=np.uint8, count=size**2).reshape(size, size))
+
+    return frames
+
+
+def compareClips(fr, clips):
+    """ Check that the FR structure holds the given clips. """
+
+    assert fr.lines == len(clips)
+
+    for line, (cropouts, sizepos) in enumerate(clips):
+
+        assert fr.frameNum[line] == len(cropouts)
+
+        for i, size in enumerate(sizepos[:, 3]):
+            assert fr.yc[line][i] == sizepos[i, 0]
+            assert fr.xc[line][i] == sizepos[i, 1]
+            assert fr.t[line][i] == sizepos[i, 2]
+            assert fr.size[line][i] == size
+            assert np.array_equal(fr.frames[line][i], cropouts[i][:size, :size])
+
+
+
+if __name__ == "__main__":
+
+    dir_path = tempfile.mkdtemp()
+
+    try:
+
+        clips = makeClips(4, 200, 0)
+
+        FRbin.writeArray(clips, dir_path, "XX0001_20240101_010203_456_0000256")
+        file_name = "FR_XX0001_20240101_010203_456_0000256.bin"
+
+        for mmap in [False, True]:
+            compareClips(FRbin.read(dir_path, file_name, mmap=mmap), clips)
+
+
+        # Writing the read structure must give the same file
+        FRbin.write(FRbin.read(dir_path, file_name), dir_path, "FR_copy.bin")
+
+        with open(os.path.join(dir_path, file_name), 'rb') as f1, \
+            open(os.path.join(dir_path, "FR_copy.bin"), 'rb') as f2:
+
+            assert f1.read() == f2.read()
+
+
+        # A truncated file must raise an error
+        with open(os.path.join(dir_path, file_name), 'rb') as f:
+            data = f.read()
+        with open(os.path.join(dir_path, "FR_truncated.bin"), 'wb') as f:
+            f.write(data[:len(data)//2])
+
+        try:
+            FRbin.read(dir_path, "FR_truncated.bin")
+            assert False, "Reading a truncated file should fail"
+        except ValueError:
+            pass
+
+
+        # Compare the reading speed
+        n_reads = 20
+
+        t1 = time.time()
+        for _ in range(n_reads):
+            readPerField(os.path.join(dir_path, file_name))
+        t_old = (time.time() - t1)/n_reads
+
+        t1 = time.time()
+        for _ in range(n_reads):
+            fr = FRbin.read(dir_path, file_name)
+            for line in range(fr.lines):
+                for frame in fr.frames[line]:
+                    pass
+        t_new = (time.time() - t1)/n_reads
+
+        print("Per field reader: {:.2f} ms, indexed reader: {:.2f} ms".format(1000*t_old, 1000*t_new))
+
+        print("FR file test passed")
+
+    finally:
+        shutil.rmtree(dir_path)
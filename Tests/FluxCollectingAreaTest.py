@@ -0,0 +1,155 @@
+""" Compare the grid based collecting area computation with a computation which projects the corners of
+    every image segment separately, and check the collecting area cache.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import collections
+import os
+import time
+
+import numpy as np
+
+from RMS.Astrometry.ApplyAstrometry import xyToRaDecPP
+from RMS.Astrometry.Conversions import J2000_JD, areaGeoPolygon, jd2Date, raDec2AltAz
+from RMS.Formats.Platepar import Platepar
+from RMS.Routines.FOVArea import xyHt2Geo
+from RMS.Routines.MaskImage import MaskStructure
+import Utils.Flux as Flux
+
+
+def collectingAreaPerSegment(platepar, mask=None, side_points=20, ht_min=60, ht_max=130, dht=2,
+    elev_limit=10):
+    """ Compute the collecting areas segment by segment, the way they used to be computed. """
+
+    if mask is None:
+        mask = MaskStructure(None)
+        mask.resetEmpty(platepar.X_res, platepar.Y_res)
+
+    longer_side_points = side_points
+    shorter_side_points = int(np.ceil(side_points*platepar.Y_res/platepar.X_res))
+
+    longer_dpx = int(platepar.X_res//longer_side_points)
+    shorter_dpx = int(platepar.Y_res//shorter_side_points)
+
+    col_areas_ht = collections.OrderedDict()
+
+    for ht in np.arange(ht_min, ht_max + dht, dht):
+
+        ht = 1000*ht
+
+        col_areas_xy = collections.OrderedDict()
+
+        for x0 in np.linspace(0, platepar.X_res, longer_side_points, dtype=int, endpoint=False):
+            for y0 in np.linspace(0, platepar.Y_res, shorter_side_points, dtype=int, endpoint=False):
+
+                xe = x0 + longer_dpx
+                ye = y0 + shorter_dpx
+
+                corners = [xyHt2Geo(platepar, x, y, ht, indicate_limit=True, elev_limit=elev_limit)
+                    for x, y in [(x0, y0), (x0, ye), (xe, ye), (xe, y0)]]
+
+                if all(corner[3] < 0 for corner in corners):
+                    continue
+
+                area = areaGeoPolygon([corner[1] for corner in corners], [corner[2] for corner in corners], ht)
+
+                mask_segment = mask.img[y0:ye, x0:xe]
+                if mask_segment.size == 0:
+                    continue
+
+                unmasked_ratio = np.count_nonzero(mask_segment > 0)/mask_segment.size
+
+                x_mean = (x0 + xe)/2
+                y_mean = (y0 + ye)/2
+
+                _, ra, dec, mag = xyToRaDecPP([jd2Date(J2000_JD.days)], [x_mean], [y_mean], [400], platepar)
+                azim, elev = raDec2AltAz(ra[0], dec[0], J2000_JD.days, platepar.lat, platepar.lon)
+
+                sensitivity_ratio = 400/10**((mag[0] - platepar.mag_lev)/(-2.5))
+
+                r, _, _, _ = xyHt2Geo(platepar, x_mean, y_mean, ht, indicate_limit=True, elev_limit=elev_limit)
+
+                col_areas_xy[(x_mean, y_mean)] = [area*unmasked_ratio, azim, elev, sensitivity_ratio, r]
+
+        col_areas_ht[float(ht)] = dict(col_areas_xy)
+
+    return col_areas_ht
+
+
+def compareCollectingAreas(col_areas_ht1, col_areas_ht2):
+    """ Check that both collecting areas have the same segments and the same values. """
+
+    assert list(col_areas_ht1.keys()) == list(col_areas_ht2.keys())
+
+    for ht in col_areas_ht1:
+
+        assert list(col_areas_ht1[ht].keys()) == list(col_areas_ht2[ht].keys()), ht
+
+        for img_coords in col_areas_ht1[ht]:
+            assert np.allclose(col_areas_ht1[ht][img_coords], col_areas_ht2[ht][img_coords], rtol=1e-9), \
+                (ht, img_coords, col_areas_ht1[ht][img_coords], col_areas_ht2[ht][img_coords])
+
+
+
+if __name__ == "__main__":
+
+    platepar = Platepar()
+    platepar.read(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "share",
+        "platepar_templates", "template_generic_720p_4mm.cal"))
+
+    # Point the camera low, so the bottom of the image is below the elevation limit
+    platepar.lat = 45.0
+    platepar.lon = 16.0
+    platepar.elev = 300.0
+    platepar.az_centre = 90.0
+    platepar.alt_centre = 15.0
+    platepar.rotation_from_horiz = 0.0
+    platepar.updateRefRADec(preserve_rotation=True)
+
+    # Mask the upper left corner
+    mask = MaskStructure(None)
+    mask.resetEmpty(platepar.X_res, platepar.Y_res)
+    mask.img[:250, :333] = 0
+
+
+    for test_mask in [None, mask]:
+
+        t1 = time.time()
+        col_areas_old = collectingAreaPerSegment(platepar, mask=test_mask)
+        t_old = time.time() - t1
+
+        t1 = time.time()
+        col_areas_new = Flux.collectingArea(platepar, mask=test_mask, use_cache=False)
+        t_new = time.time() - t1
+
+        compareCollectingAreas(col_areas_old, col_areas_new)
+
+        # Some segments must have been skipped because of the elevation limit
+        assert len(col_areas_new[100000.0]) < 20*12
+
+        print("Per segment: {:.2f} s, grid: {:.3f} s".format(t_old, t_new))
+
+
+    # The second computation with the same platepar is taken from the cache
+    col_areas = Flux.collectingArea(platepar, mask=mask)
+
+    t1 = time.time()
+    col_areas_cached = Flux.collectingArea(platepar, mask=mask)
+    t_cached = time.time() - t1
+
+    compareCollectingAreas(col_areas, col_areas_cached)
+    print("Cached: {:.4f} s".format(t_cached))
+
+    # Modifying the returned collecting areas doesn't change the cache
+    for img_coords in col_areas_cached[100000.0]:
+        col_areas_cached[100000.0][img_coords][0] = 0
+    compareCollectingAreas(col_areas, Flux.collectingArea(platepar, mask=mask))
+
+    # A different platepar is not taken from the cache
+    platepar.F_scale *= 1.1
+    assert Flux.collectingAreaKey(platepar, mask=mask) not in Flux._COLLECTING_AREA_CACHE
+    compareCollectingAreas(collectingAreaPerSegment(platepar, mask=mask),
+        Flux.collectingArea(platepar, mask=mask))
+
+    print("Collecting area test passed")
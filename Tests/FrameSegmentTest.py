@@ -0,0 +1,132 @@
+""" Check that frames saved to a frame segment are recovered after a partially written record, e.g. after a
+    power loss during saving.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import struct
+import tempfile
+
+import cv2
+import numpy as np
+
+import RMS.Formats.FrameSegment as FrameSegment
+
+
+# 2024-01-01 01:00:00 UTC
+HOUR_START = 1704070800
+
+
+def makeRecords(n_frames, first_frame):
+    """ Make encoded PNG frames, every frame is filled with its number. """
+
+    records = []
+    for i in range(first_frame, first_frame + n_frames):
+
+        img = np.full((32, 48), i, dtype=np.uint8)
+        records.append((HOUR_START + 10.0*i, '.png', cv2.imencode('.png', img)[1].tobytes()))
+
+    return records
+
+
+def writeRawRecords(segment_path, records, index=True):
+    """ Write the records the same way appendFrames does, without checking the segment first. """
+
+    with open(segment_path, 'ab') as f:
+        offset = f.tell()
+
+        index_entries = []
+        for timestamp, file_extension, data in records:
+
+            image_type = FrameSegment.IMAGE_TYPE_CODES[file_extension]
+            f.write(FrameSegment.RECORD_HEADER.pack(FrameSegment.RECORD_MAGIC, timestamp, len(data), image_type))
+            f.write(data)
+
+            index_entries.append(FrameSegment.INDEX_ENTRY.pack(timestamp, offset, len(data), image_type))
+            offset += FrameSegment.RECORD_HEADER.size + len(data)
+
+    if index:
+        with open(segment_path + FrameSegment.INDEX_EXTENSION, 'ab') as f:
+            f.write(b''.join(index_entries))
+
+
+def writeTornRecord(segment_path, timestamp, size):
+    """ Write a record header followed by only a part of the image, without an index entry. """
+
+    with open(segment_path, 'ab') as f:
+        f.write(FrameSegment.RECORD_HEADER.pack(FrameSegment.RECORD_MAGIC, timestamp, size, 1))
+        f.write(b'\x00'*(size//3))
+
+
+def checkSegment(segment_path, frame_numbers):
+    """ Check that the segment holds the frames with the given numbers, and that all of them decode. """
+
+    segment = FrameSegment.FrameSegment(segment_path)
+
+    assert len(segment) == len(frame_numbers), (len(segment), frame_numbers)
+
+    for i, frame_number in enumerate(frame_numbers):
+
+        img = FrameSegment.readFramePath(os.path.join(segment_path, segment.frameName(i)))
+
+        assert img is not None, i
+        assert np.all(img == frame_number), (i, frame_number)
+
+
+
+if __name__ == "__main__":
+
+    dir_path = tempfile.mkdtemp()
+
+    segment_name = FrameSegment.segmentName("XX0001", HOUR_START, False)
+
+    try:
+
+        # Frames appended after a torn record must be readable, the torn record is truncated before appending
+        segment_path = os.path.join(dir_path, "append_" + segment_name)
+        FrameSegment.appendFrames(segment_path, makeRecords(3, 0))
+        writeTornRecord(segment_path, HOUR_START + 35.0, 5000)
+        FrameSegment.appendFrames(segment_path, makeRecords(3, 3))
+
+        checkSegment(segment_path, list(range(6)))
+        assert not FrameSegment.repairSegment(segment_path)
+
+
+        # A segment written without the repair, the indexed records after the torn one must be found
+        segment_path = os.path.join(dir_path, "torn_" + segment_name)
+        writeRawRecords(segment_path, makeRecords(3, 0))
+        writeTornRecord(segment_path, HOUR_START + 35.0, 5000)
+        writeRawRecords(segment_path, makeRecords(3, 3))
+
+        checkSegment(segment_path, list(range(6)))
+
+
+        # A torn header with a garbage timestamp must not make the segment unreadable
+        segment_path = os.path.join(dir_path, "garbage_" + segment_name)
+        writeRawRecords(segment_path, makeRecords(3, 0))
+        writeTornRecord(segment_path, 1e300, 5000)
+        writeRawRecords(segment_path, makeRecords(3, 3))
+
+        checkSegment(segment_path, list(range(6)))
+
+
+        # Without the index the frames up to the torn record are recovered by scanning
+        segment_path = os.path.join(dir_path, "noindex_" + segment_name)
+        writeRawRecords(segment_path, makeRecords(3, 0), index=False)
+        writeTornRecord(segment_path, HOUR_START + 35.0, 5000)
+
+        checkSegment(segment_path, list(range(3)))
+
+        # The repair truncates the torn record and indexes the scanned records
+        assert FrameSegment.repairSegment(segment_path)
+        FrameSegment.appendFrames(segment_path, makeRecords(2, 3))
+
+        checkSegment(segment_path, list(range(5)))
+        assert os.path.getsize(segment_path + FrameSegment.INDEX_EXTENSION) == 5*FrameSegment.INDEX_ENTRY.size
+
+        print("Frame segment test passed")
+
+    finally:
+        shutil.rmtree(dir_path)
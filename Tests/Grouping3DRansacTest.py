@@ -0,0 +1,84 @@
+""" Compare the line finder which tests all point pairs with the sampled (ransac) line finder on simulated
+    fireball point clouds.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import time
+
+import numpy as np
+
+import RMS.ConfigReader as cr
+
+# Importing Grouping3D compiles the Cython functions
+import RMS.Routines.Grouping3D
+from RMS.Routines.Grouping3Dcy import find3DLines, find3DLinesRansac
+
+
+def simulateCloud(width, noise, seed):
+    """ Simulate the subsampled points of a fireball moving through frames 40 - 200, with random points
+        added.
+
+    Arguments:
+        width: [int] Half width of the fireball trail in subsampled pixels.
+        noise: [int] Number of random points.
+        seed: [int] Random seed.
+
+    Return:
+        [ndarray] (x, y, frame) points sorted by frame.
+    """
+
+    np.random.seed(seed)
+
+    points = set()
+    for z in range(40, 200):
+
+        xc = 10 + 0.35*(z - 40)
+        yc = 5 + 0.2*(z - 40)
+
+        for dx in range(-width, width + 1):
+            for dy in range(-width, width + 1):
+                points.add((int(xc + dx), int(yc + dy), z))
+
+    for _ in range(noise):
+        points.add((np.random.randint(0, 80), np.random.randint(0, 45), np.random.randint(0, 256)))
+
+    return np.array(sorted(points, key=lambda point: point[2]), dtype=np.uint16)
+
+
+
+if __name__ == "__main__":
+
+    config = cr.Config()
+
+    # Normalize the thresholds the same way the config reader does for a 720p camera
+    config.width = 1280
+    config.height = 720
+    config.distance_threshold = cr.normalizeParameter(config.distance_threshold, config)
+    config.gap_threshold = cr.normalizeParameter(config.gap_threshold, config)
+
+
+    # When all pairs are tested, both line finders must return the same lines
+    for seed in range(5):
+
+        points = simulateCloud(0, 20, seed)
+
+        lines_pairs = find3DLines(points.copy(), time.time(), config, line_list=[])
+        lines_ransac = find3DLinesRansac(points.copy(), time.time(), config, max_hypotheses=10**9)
+
+        assert lines_pairs == lines_ransac, (lines_pairs, lines_ransac)
+
+
+    # Bright fireball with thousands of points, the ransac line finder takes all of them
+    points = simulateCloud(3, 200, 0)
+
+    t1 = time.time()
+    lines = find3DLinesRansac(points, time.time(), config, max_hypotheses=config.fireball_line_hypotheses)
+    t_ransac = time.time() - t1
+
+    assert lines is not None
+    assert (lines[0][4] == 40) and (lines[0][5] == 199)
+
+    print("Found {:d} lines in {:d} points in {:.3f} s".format(len(lines), len(points), t_ransac))
+
+    print("Grouping3D ransac test passed")
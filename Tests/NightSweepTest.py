@@ -0,0 +1,135 @@
+""" Check that the night products made in one pass over the FF files (Utils.NightSweep.sweepFFs) are the same
+    as the products made separately by stackFFs and generateThumbnails.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+import RMS.ConfigReader as cr
+from RMS.Formats.FFStruct import FFStruct
+import RMS.Formats.FFfits as FFfits
+from Utils.GenerateThumbnails import generateThumbnails
+from Utils.NightSweep import FFStatsProduct, StackProduct, ThumbnailProduct, sweepFFs
+from Utils.StackFFs import stackFFs
+
+
+def makeFF(nrows, ncols, seed):
+    """ Make a FF structure with a noisy background, a few stars and a meteor on some of the files. """
+
+    rng = np.random.RandomState(seed)
+
+    ff = FFStruct()
+    ff.nrows = nrows
+    ff.ncols = ncols
+    ff.nbits = 8
+    ff.nframes = 256
+    ff.first = 256*seed
+    ff.camno = 1
+    ff.fps = 25.0
+    ff.starttime = "2024-01-01T01:02:03.456000"
+
+    avepixel = rng.normal(30 + seed, 3, (nrows, ncols))
+    stdpixel = rng.normal(4, 0.5, (nrows, ncols))
+    maxpixel = avepixel + 4*stdpixel + rng.uniform(0, 10, (nrows, ncols))
+
+    # Stars
+    star_y, star_x = rng.randint(0, nrows, 20), rng.randint(0, ncols, 20)
+    maxpixel[star_y, star_x] += 150
+    avepixel[star_y, star_x] += 100
+
+    # Meteor on every third file
+    if seed%3 == 0:
+        for i in range(50):
+            maxpixel[20 + i, 30 + 2*i] = 255
+
+    ff.array = np.array([
+        np.clip(maxpixel, 0, 255),
+        rng.randint(0, 256, (nrows, ncols)),
+        np.clip(avepixel, 0, 255),
+        np.clip(stdpixel, 1, 255)
+        ]).astype(np.uint8)
+
+    return ff
+
+
+
+if __name__ == "__main__":
+
+    nrows, ncols = 180, 320
+    n_files = 12
+
+    dir_path = os.path.join(tempfile.mkdtemp(), "XX0001_20240101_010203_456789")
+    os.makedirs(dir_path)
+
+    try:
+
+        file_names = []
+        for i in range(n_files):
+            file_name = "FF_XX0001_20240101_{:02d}0203_456_{:07d}.fits".format(i, 256*i)
+            FFfits.write(makeFF(nrows, ncols, i), dir_path, file_name)
+            file_names.append(file_name)
+
+        detected = file_names[::3]
+
+        config = cr.Config()
+        config.stationID = "XX0001"
+        config.width = ncols
+        config.height = nrows
+
+
+        # Make the products separately, reading the files for every product
+        ref_captured_thumbs = cv2.imread(os.path.join(dir_path, generateThumbnails(dir_path, config,
+            'CAPTURED')), cv2.IMREAD_GRAYSCALE)
+        ref_detected_thumbs = cv2.imread(os.path.join(dir_path, generateThumbnails(dir_path, config,
+            'DETECTED', file_list=detected, no_stack=True)), cv2.IMREAD_GRAYSCALE)
+        _, ref_captured_stack = stackFFs(dir_path, 'png', subavg=True, captured_stack=True,
+            print_progress=False)
+        _, ref_detected_stack = stackFFs(dir_path, 'png', subavg=True, filter_bright=True, file_list=detected,
+            print_progress=False)
+
+
+        # Make all products in one pass
+        results = sweepFFs(dir_path, [
+            ThumbnailProduct(dir_path, config, 'CAPTURED'),
+            ThumbnailProduct(dir_path, config, 'DETECTED', file_list=detected, no_stack=True),
+            StackProduct(dir_path, 'png', subavg=True, captured_stack=True),
+            StackProduct(dir_path, 'png', subavg=True, filter_bright=True, file_list=detected),
+            FFStatsProduct()
+            ])
+
+        captured_thumbs_file, detected_thumbs_file, captured_stack, detected_stack, stats = results
+
+        captured_thumbs = cv2.imread(os.path.join(dir_path, captured_thumbs_file), cv2.IMREAD_GRAYSCALE)
+        detected_thumbs = cv2.imread(os.path.join(dir_path, detected_thumbs_file), cv2.IMREAD_GRAYSCALE)
+
+        assert ref_captured_stack is not None and ref_detected_stack is not None
+
+        assert np.array_equal(captured_thumbs, ref_captured_thumbs)
+        assert np.array_equal(detected_thumbs, ref_detected_thumbs)
+        assert np.array_equal(captured_stack[1], ref_captured_stack)
+        assert np.array_equal(detected_stack[1], ref_detected_stack)
+
+
+        # The statistics are computed for every file, in the order of the names
+        assert [file_stats.file_name for file_stats in stats] == file_names
+
+        for file_name, file_stats in zip(file_names, stats):
+
+            ff = FFfits.read(dir_path, file_name)
+
+            assert file_stats.ave_mean == np.mean(ff.avepixel)
+            assert file_stats.ave_median == np.median(ff.avepixel)
+            assert file_stats.std_mean == np.mean(ff.stdpixel)
+            assert file_stats.max_max == np.max(ff.maxpixel)
+            assert file_stats.saturated_count == np.count_nonzero(ff.maxpixel == 255)
+
+        print("Night sweep test passed")
+
+    finally:
+        shutil.rmtree(os.path.dirname(dir_path))
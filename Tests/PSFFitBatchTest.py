@@ -0,0 +1,157 @@
+""" Compare the batch PSF fit (ExtractStars.fitPSFBatch) with the per-star curve_fit PSF fit
+    (ExtractStars.fitPSF) on a synthetic star field with hot pixels and noise candidates.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import time
+
+import numpy as np
+
+from RMS.ExtractStars import extractStars, fitPSF, fitPSFBatch
+
+
+def makeStarField(nrows, ncols, n_stars, n_hot_pixels, bit_depth=8, seed=0):
+    """ Make an image with Gaussian stars, hot pixels and noise. Returns the image and the true star
+        positions.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    img = rng.normal(40, 3, (nrows, ncols))
+
+    y_ind, x_ind = np.indices((nrows, ncols))
+
+    star_y = rng.uniform(5, nrows - 5, n_stars)
+    star_x = rng.uniform(5, ncols - 5, n_stars)
+
+    for y, x in zip(star_y, star_x):
+
+        amplitude = rng.uniform(15, 400)
+        sigma = rng.uniform(0.8, 1.6)
+
+        y_min, y_max = int(y) - 8, int(y) + 9
+        x_min, x_max = int(x) - 8, int(x) + 9
+        seg_y = y_ind[y_min:y_max, x_min:x_max]
+        seg_x = x_ind[y_min:y_max, x_min:x_max]
+
+        img[y_min:y_max, x_min:x_max] += amplitude*np.exp(-((seg_y - y)**2 + (seg_x - x)**2)/(2*sigma**2))
+
+    # Add hot pixels
+    hot_y = rng.randint(5, nrows - 5, n_hot_pixels)
+    hot_x = rng.randint(5, ncols - 5, n_hot_pixels)
+    img[hot_y, hot_x] += rng.uniform(50, 200, n_hot_pixels)
+
+    img = np.clip(img, 0, 2**bit_depth - 1).astype(np.uint8)
+
+    # Candidates are the stars and the hot pixels with some jitter, plus random background positions
+    cand_y = np.concatenate([star_y, hot_y, rng.uniform(5, nrows - 5, n_stars//4)])
+    cand_x = np.concatenate([star_x, hot_x, rng.uniform(5, ncols - 5, n_stars//4)])
+    cand_y += rng.uniform(-1, 1, len(cand_y))
+    cand_x += rng.uniform(-1, 1, len(cand_x))
+
+    return img, cand_y.reshape(-1, 1), cand_x.reshape(-1, 1), star_y, star_x
+
+
+
+def matchResults(res_ref, res_test, max_dist=0.5):
+    """ Pair up the stars from the two fits by their position. Returns index pairs. """
+
+    x_ref, y_ref = np.array(res_ref[0]).ravel(), np.array(res_ref[1]).ravel()
+    x_test, y_test = np.array(res_test[0]).ravel(), np.array(res_test[1]).ravel()
+
+    pairs = []
+    for i in range(len(x_ref)):
+
+        if not len(x_test):
+            break
+
+        dist = np.hypot(x_test - x_ref[i], y_test - y_ref[i])
+        j = np.argmin(dist)
+
+        if dist[j] < max_dist:
+            pairs.append((i, j))
+
+    return pairs
+
+
+
+if __name__ == "__main__":
+
+    for segment_radius in [4, 8]:
+
+        img, cand_y, cand_x, star_y, star_x = makeStarField(720, 1280, 400, 100, seed=segment_radius)
+        img_median = np.median(img)
+
+        t1 = time.time()
+        res_ref = fitPSF(img, img_median, cand_x, cand_y, segment_radius=segment_radius)
+        t_ref = time.time() - t1
+
+        t1 = time.time()
+        res_batch = fitPSFBatch(img, img_median, cand_x, cand_y, segment_radius=segment_radius)
+        t_batch = time.time() - t1
+
+        pairs = matchResults(res_ref, res_batch)
+
+        print()
+        print("Segment radius: {:d}, candidates: {:d}".format(segment_radius, len(cand_x)))
+        print("    curve_fit: {:4d} stars in {:.3f} s".format(len(res_ref[0]), t_ref))
+        print("    batch:     {:4d} stars in {:.3f} s ({:.1f}x faster)".format(len(res_batch[0]), t_batch,
+            t_ref/t_batch))
+        print("    matched:   {:4d} stars".format(len(pairs)))
+
+        if not pairs:
+            continue
+
+        # Both fits must accept nearly the same stars. The two solvers take different paths to the minimum,
+        #   so a few marginal candidates (hot pixels, background noise) may be accepted by only one of them
+        assert abs(len(res_batch[0]) - len(res_ref[0])) <= 0.03*len(res_ref[0])
+        assert len(pairs) >= 0.95*max(len(res_ref[0]), len(res_batch[0]))
+
+        ref_idx, batch_idx = np.array(pairs).T
+
+        def _matched(res, k, idx):
+            return np.array(res[k], dtype=np.float64).ravel()[idx]
+
+        # Compare the fitted quantities of the matched stars. The fits stop within the solver tolerance, so
+        #   most values agree closely and only a few poorly constrained fits differ more. The sigmas are 
+        #   compared combined, as a swap of sigma_x and sigma_y with a rotation by 90 deg is the same PSF
+        diffs = {}
+        for k, name in [(0, "x"), (1, "y")]:
+            diffs[name] = np.abs(_matched(res_batch, k, batch_idx) - _matched(res_ref, k, ref_idx))
+
+        for k, name in [(2, "amplitude"), (3, "intensity"), (6, "background"), (7, "snr")]:
+            ref_vals = _matched(res_ref, k, ref_idx)
+            diffs[name] = np.abs(_matched(res_batch, k, batch_idx) - ref_vals)/np.maximum(np.abs(ref_vals), 
+                1e-9)
+
+        sigma_ref = np.hypot(_matched(res_ref, 4, ref_idx), _matched(res_ref, 5, ref_idx))
+        sigma_batch = np.hypot(_matched(res_batch, 4, batch_idx), _matched(res_batch, 5, batch_idx))
+        diffs["sigma"] = np.abs(sigma_batch - sigma_ref)/sigma_ref
+
+        for name, diff in diffs.items():
+
+            unit = "px" if name in ["x", "y"] else "rel"
+            print("    {:10s} median diff: {:.2e} {:s}, 95th percentile: {:.2e} {:s}".format(name, 
+                np.median(diff), unit, np.percentile(diff, 95), unit))
+
+            assert np.median(diff) < 1e-4, name
+            assert np.percentile(diff, 95) < 5e-2, name
+
+
+    # The star extraction finds the same stars with both fits
+    img, _, _, _, _ = makeStarField(720, 1280, 400, 100, seed=1)
+    img = img.astype(np.float32)
+
+    stars_ref = extractStars(img, intensity_threshold=10, batch_fit=False)
+    stars_batch = extractStars(img, intensity_threshold=10, batch_fit=True)
+
+    print()
+    print("extractStars: {:d} stars with curve_fit, {:d} with the batch fit".format(len(stars_ref[0]),
+        len(stars_batch[0])))
+
+    assert len(stars_ref[0]) > 0
+    assert len(matchResults(stars_ref, stars_batch)) >= 0.95*max(len(stars_ref[0]), len(stars_batch[0]))
+
+    print()
+    print("PSF batch fit test passed")
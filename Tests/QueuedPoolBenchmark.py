@@ -0,0 +1,66 @@
+""" Compare the job throughput of QueuedPool with the Manager queues and with the fast transport, for small
+    and large job payloads.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import time
+
+import numpy as np
+
+from RMS.QueuedPool import QueuedPool
+
+
+def echoWorker(payload):
+    """ Return the payload size, so only the job transport is measured. """
+
+    return np.asarray(payload).nbytes
+
+
+
+def runBenchmark(payload, n_jobs, cores, fast_transport):
+    """ Push n_jobs jobs with the given payload through the pool and return the number of jobs per second.
+    """
+
+    workpool = QueuedPool(echoWorker, cores=cores, backup_dir=None, worker_timeout=60, print_state=False,
+        fast_transport=fast_transport)
+
+    workpool.startPool()
+
+    t1 = time.time()
+
+    for _ in range(n_jobs):
+        workpool.addJob([payload], wait_time=0)
+
+    # Wait until all results are in
+    while workpool.output_queue.qsize() < n_jobs:
+        time.sleep(0.001)
+
+    t_total = time.time() - t1
+
+    workpool.closePool()
+    results = workpool.getResults()
+
+    assert len(results) == n_jobs
+
+    return n_jobs/t_total
+
+
+
+if __name__ == "__main__":
+
+    cores = 2
+
+    payloads = [
+        ("small (int)", 1, 500),
+        ("large (1 MB array)", np.zeros((1024, 1024), dtype=np.uint8), 200),
+        ]
+
+    for name, payload, n_jobs in payloads:
+
+        for fast_transport in [False, True]:
+
+            jobs_per_sec = runBenchmark(payload, n_jobs, cores, fast_transport)
+
+            print("{:20s} {:8s}: {:8.1f} jobs/s".format(name, "fast" if fast_transport else "manager",
+                jobs_per_sec))
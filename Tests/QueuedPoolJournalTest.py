@@ -0,0 +1,84 @@
+""" Check that the results of QueuedPool jobs are in the backup journal as soon as they are done, and that
+    they survive if the process is killed.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from RMS.QueuedPool import BackupJournal, QueuedPool
+
+
+def squareWorker(x):
+    return x**2
+
+
+def appendAndExit(dir_path, file_name):
+    """ Append a record to the journal and kill the process without any cleanup. """
+
+    journal = BackupJournal(dir_path, file_name)
+    journal.append((7,), 49)
+
+    os._exit(0)
+
+
+def waitForRecords(journal, n_records, timeout=2.0):
+    """ Wait until the journal holds the given number of records, return the records. """
+
+    t1 = time.time()
+    while True:
+
+        records, _, _ = journal.read()
+
+        if (len(records) >= n_records) or ((time.time() - t1) > timeout):
+            return records
+
+        time.sleep(0.05)
+
+
+
+if __name__ == "__main__":
+
+    dir_path = tempfile.mkdtemp()
+
+    try:
+
+        n_jobs = 5
+
+        # The results must be in the journal while the workers are still waiting for more jobs
+        for fast_transport in [False, True]:
+
+            workpool = QueuedPool(squareWorker, cores=1, backup_dir=dir_path, worker_timeout=60,
+                print_state=False, fast_transport=fast_transport)
+
+            workpool.startPool()
+
+            for x in range(n_jobs):
+                workpool.addJob([x], wait_time=0)
+
+            while workpool.output_queue.qsize() < n_jobs:
+                time.sleep(0.01)
+
+            records = waitForRecords(workpool.bkup_journal, n_jobs)
+            assert sorted(records) == [((x,), x**2) for x in range(n_jobs)], records
+
+            workpool.closePool()
+            workpool.deleteBackupFiles()
+
+
+        # A record must survive if the process is killed right after appending it
+        proc = multiprocessing.Process(target=appendAndExit, args=(dir_path, "killed.journal"))
+        proc.start()
+        proc.join()
+
+        records, _, _ = BackupJournal(dir_path, "killed.journal").read()
+        assert records == [((7,), 49)], records
+
+        print("QueuedPool journal test passed")
+
+    finally:
+        shutil.rmtree(dir_path)
@@ -0,0 +1,176 @@
+""" Check that interrupted uploads are continued from the last complete chunk, using a local directory as a
+    stand-in for the SFTP server.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import shutil
+import tempfile
+
+from RMS.UploadManager import uploadFileSFTP
+
+
+class LocalSFTPFile(object):
+    """ File on the local SFTP stand-in. Raises an IOError when the server's write budget runs out. """
+
+    def __init__(self, server, path, mode):
+
+        self.server = server
+
+        # Map the SFTP modes to binary local modes
+        local_mode = {'r': 'rb', 'w': 'wb', 'r+': 'r+b'}[mode]
+        self.f = open(path, local_mode)
+
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
+
+    def write(self, data):
+
+        if not isinstance(data, bytes):
+            data = data.encode('ascii')
+
+        if self.server.write_budget is not None:
+
+            if self.server.write_budget < len(data):
+                self.server.write_budget = 0
+                raise IOError("Connection lost")
+
+            self.server.write_budget -= len(data)
+
+        self.server.bytes_written += len(data)
+        self.f.write(data)
+
+
+    def read(self, size=-1):
+        return self.f.read(size)
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+    def truncate(self, size):
+        self.f.truncate(size)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+class LocalSFTP(object):
+    """ Implements the part of paramiko.SFTPClient used by uploadFileSFTP on a local directory. """
+
+    def __init__(self, root_dir):
+
+        self.root_dir = root_dir
+
+        # Number of bytes which can be written before the connection "drops" (None for no limit)
+        self.write_budget = None
+
+        # Total number of bytes written to the server
+        self.bytes_written = 0
+
+
+    def _path(self, path):
+        return os.path.join(self.root_dir, path)
+
+    def open(self, path, mode='r'):
+        return LocalSFTPFile(self, self._path(path), mode)
+
+    def lstat(self, path):
+        return os.lstat(self._path(path))
+
+    def stat(self, path):
+        return os.stat(self._path(path))
+
+    def remove(self, path):
+        os.remove(self._path(path))
+
+    def rename(self, old_path, new_path):
+        os.rename(self._path(old_path), self._path(new_path))
+
+    def posix_rename(self, old_path, new_path):
+        os.rename(self._path(old_path), self._path(new_path))
+
+
+
+if __name__ == "__main__":
+
+    local_dir = tempfile.mkdtemp()
+    remote_dir = tempfile.mkdtemp()
+
+    try:
+
+        chunk_size = 64*1024
+
+        # Make a ~1 MB local file
+        local_file = os.path.join(local_dir, "test_archive.tar.bz2")
+        data = os.urandom(1000*1000 + 123)
+        with open(local_file, 'wb') as f:
+            f.write(data)
+
+        sftp = LocalSFTP(remote_dir)
+
+
+        # Drop the connection after 40% of the file was sent
+        sftp.write_budget = int(0.4*len(data))
+
+        try:
+            uploadFileSFTP(sftp, local_file, "test_archive.tar.bz2", chunk_size=chunk_size)
+            assert False, "The upload should have been interrupted"
+
+        except IOError:
+            pass
+
+        assert not os.path.exists(os.path.join(remote_dir, "test_archive.tar.bz2"))
+        assert os.path.exists(os.path.join(remote_dir, "test_archive.tar.bz2.part"))
+        assert os.path.exists(os.path.join(remote_dir, "test_archive.tar.bz2.part.manifest"))
+
+        first_attempt = sftp.bytes_written
+        print("Interrupted after {:d} bytes".format(first_attempt))
+
+
+        # Resume the upload, only the missing chunks (plus the manifest) should be sent
+        sftp.write_budget = None
+        sftp.bytes_written = 0
+
+        assert uploadFileSFTP(sftp, local_file, "test_archive.tar.bz2", chunk_size=chunk_size)
+
+        print("Resumed upload sent {:d} bytes".format(sftp.bytes_written))
+
+        with open(os.path.join(remote_dir, "test_archive.tar.bz2"), 'rb') as f:
+            assert f.read() == data
+
+        assert sftp.bytes_written < len(data) - first_attempt + chunk_size + 4096
+        assert not os.path.exists(os.path.join(remote_dir, "test_archive.tar.bz2.part"))
+        assert not os.path.exists(os.path.join(remote_dir, "test_archive.tar.bz2.part.manifest"))
+
+
+        # A changed local file with a stale partial upload is uploaded from the start
+        with open(os.path.join(remote_dir, "test_archive2.tar.bz2.part"), 'wb') as f:
+            f.write(data[:300*1000])
+        with open(os.path.join(remote_dir, "test_archive2.tar.bz2.part.manifest"), 'w') as f:
+            f.write("{:d} {:d}\n0 deadbeef\n".format(chunk_size, len(data)))
+
+        sftp.bytes_written = 0
+        assert uploadFileSFTP(sftp, local_file, "test_archive2.tar.bz2", chunk_size=chunk_size)
+        assert sftp.bytes_written >= len(data)
+
+        with open(os.path.join(remote_dir, "test_archive2.tar.bz2"), 'rb') as f:
+            assert f.read() == data
+
+        print("Resumable upload test passed")
+
+    finally:
+        shutil.rmtree(local_dir)
+        shutil.rmtree(remote_dir)
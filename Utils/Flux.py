@@ -10,6 +10,7 @@ from __future__ import print_function, division, absolute_import
 import argparse
 import collections
 import datetime
+import hashlib
 import json
 import os
 import sys
@@ -33,7 +34,17 @@ from RMS.Astrometry.ApplyAstrometry import (
     xyToRaDecPP,
 )
 from RMS.Astrometry.ApplyRecalibrate import applyRecalibrate, loadRecalibratedPlatepar, recalibrateSelectedFF
-from RMS.Astrometry.Conversions import J2000_JD, areaGeoPolygon, date2JD, datetime2JD, jd2Date, raDec2AltAz
+from RMS.Astrometry.Conversions import (
+    J2000_JD,
+    AEH2Range,
+    AER2ECEF,
+    areaGeoPolygonArrays,
+    date2JD,
+    datetime2JD,
+    ecef2LatLonAltArrays,
+    jd2Date,
+    raDec2AltAz,
+)
 from RMS.ExtractStars import extractStarsAndSave
 from RMS.Formats import FFfile, Platepar, StarCatalog
 from RMS.Formats.CALSTARS import readCALSTARS
@@ -41,7 +52,7 @@ import RMS.Formats.CALSTARS as CALSTARS
 from RMS.Formats.FTPdetectinfo import findFTPdetectinfoFile, readFTPdetectinfo
 from RMS.Formats.Showers import FluxShowers, loadRadiantShowers
 from RMS.Math import angularSeparation, pointInsideConvexPolygonSphere
-from RMS.Routines.FOVArea import fovArea, xyHt2Geo
+from RMS.Routines.FOVArea import xyHt2Geo
 from RMS.Routines.MaskImage import MaskStructure, getMaskFile
 from RMS.Routines.SolarLongitude import jd2SolLonSteyaert, solLon2jdSteyaert, unwrapSol
 from RMS.Misc import SegmentedScale, mkdirP
@@ -1623,9 +1634,123 @@ def predictStarNumberInFOV(recalibrated_platepars, ff_limiting_magnitude, config
     return pred_star_count
 
 
-def collectingArea(platepar, mask=None, side_points=20, ht_min=60, ht_max=130, dht=2, elev_limit=10):
+# Collecting areas computed in this process, keyed on the hash of the platepar, the mask and the sampling
+#   parameters
+_COLLECTING_AREA_CACHE = collections.OrderedDict()
+
+# Maximum number of collecting areas kept in the cache
+COLLECTING_AREA_CACHE_SIZE = 16
+
+
+def collectingAreaKey(platepar, mask=None, side_points=20, ht_min=60, ht_max=130, dht=2, elev_limit=10):
+    """ Compute the key of the collecting area cache, a hash of the platepar, the mask and the sampling
+        parameters. See collectingArea for the description of arguments.
+
+    Return:
+        [str] Hex digest of the hash.
+    """
+
+    # Hash the platepar as it would be written to disk, without the list of stars used for the fit
+    platepar_dict = json.loads(platepar.jsonStr())
+    platepar_dict.pop('star_list', None)
+
+    sha = hashlib.sha1()
+    sha.update(json.dumps(platepar_dict, sort_keys=True).encode('utf-8'))
+
+    if (mask is None) or (mask.img is None):
+        sha.update(b'no mask')
+
+    else:
+        mask_img = np.ascontiguousarray(mask.img)
+        sha.update(str(mask_img.shape).encode('utf-8'))
+        sha.update(mask_img.tobytes())
+
+    sha.update(repr([float(side_points), float(ht_min), float(ht_max), float(dht), \
+        float(elev_limit)]).encode('utf-8'))
+
+    return sha.hexdigest()
+
+
+def _copyCollectingAreas(col_areas_ht):
+    """ Copy the collecting areas, so the cached ones can't be modified by the caller. """
+
+    col_areas_ht_copy = collections.OrderedDict()
+    for ht in col_areas_ht:
+        col_areas_ht_copy[ht] = {img_coords: list(entry) for img_coords, entry in col_areas_ht[ht].items()}
+
+    return col_areas_ht_copy
+
+
+def _imageAltAz(platepar, x_data, y_data, level_data=None):
+    """ Compute the J2000 azimuth and elevation of image points, and optionally their magnitudes corrected
+        for vignetting and extinction.
+
+    Arguments:
+        platepar: [Platepar object]
+        x_data: [ndarray] Image X coordinates.
+        y_data: [ndarray] Image Y coordinates.
+
+    Keyword arguments:
+        level_data: [ndarray] Pixel sums of the points. If None, the extinction is not computed and the
+            returned magnitudes are not used.
+
+    Return:
+        (azim, elev, mag): [tuple of ndarrays] Azimuth and elevation (degrees), magnitudes.
+    """
+
+    n_points = len(x_data)
+
+    extinction_correction = level_data is not None
+    if level_data is None:
+        level_data = np.ones(n_points)
+
+    # Compute the pointing at J2000 epoch time so the coordinates don't have to be precessed
+    _, ra, dec, mag = xyToRaDecPP(n_points*[jd2Date(J2000_JD.days)], x_data, y_data, level_data, platepar, \
+        extinction_correction=extinction_correction)
+
+    azim, elev = raDec2AltAz(np.array(ra, dtype=np.float64), np.array(dec, dtype=np.float64), \
+        J2000_JD.days, platepar.lat, platepar.lon)
+
+    return azim, elev, mag
+
+
+def _projectToHeights(platepar, azim, elev, hts, elev_limit):
+    """ Project lines of sight to the given heights, the same way as xyHt2Geo does for a single point and
+        a single height.
+
+    Arguments:
+        platepar: [Platepar object]
+        azim: [ndarray] Azimuths of the lines of sight (degrees).
+        elev: [ndarray] Elevations of the lines of sight (degrees).
+        hts: [ndarray] Heights above sea level (meters).
+        elev_limit: [float] Limit of elevation above horizon (deg).
+
+    Return:
+        (r, lat, lon): [tuple of ndarrays] Ranges in meters, latitudes and longitudes in degrees. The
+            arrays have one row per height and one column per line of sight.
+    """
+
+    # Limit the elevation to elev_limit degrees above the horizon
+    elev = np.where(elev < elev_limit, elev_limit, elev)
+
+    hts = np.asarray(hts, dtype=np.float64)[:, np.newaxis]
+
+    r = AEH2Range(azim, elev, hts, platepar.lat, platepar.lon, platepar.elev)
+
+    x, y, z = AER2ECEF(azim, elev, r, platepar.lat, platepar.lon, platepar.elev)
+    lat, lon, _ = ecef2LatLonAltArrays(x, y, z)
+
+    return r, np.degrees(lat), np.degrees(lon)
+
+
+def collectingArea(platepar, mask=None, side_points=20, ht_min=60, ht_max=130, dht=2, elev_limit=10, \
+    use_cache=True):
     """Compute the collecting area for the range of given heights.
 
+    The image is divided into segments and the area of every segment is computed from the geo coordinates
+    of its corners. The corners shared by the neighbouring segments are projected only once, and all
+    corners are projected to all heights in one go.
+
     Arguments:
         platepar: [Platepar object]
 
@@ -1637,6 +1762,8 @@ def collectingArea(platepar, mask=None, side_points=20, ht_min=60, ht_max=130, d
         ht_max: [float] Maximum height (km).
         dht: [float] Height delta (km).
         elev_limit: [float] Limit of elevation above horizon (deg). 10 degrees by default.
+        use_cache: [bool] Reuse the collecting areas computed earlier in this process for the same
+            platepar, mask and parameters. True by default.
 
     Return:
         col_areas_ht: [dict] A dictionary where the keys are heights of area evaluation, and values are
@@ -1645,6 +1772,16 @@ def collectingArea(platepar, mask=None, side_points=20, ht_min=60, ht_max=130, d
 
     """
 
+    if use_cache:
+
+        cache_key = collectingAreaKey(platepar, mask=mask, side_points=side_points, ht_min=ht_min, \
+            ht_max=ht_max, dht=dht, elev_limit=elev_limit)
+
+        if cache_key in _COLLECTING_AREA_CACHE:
+            _COLLECTING_AREA_CACHE.move_to_end(cache_key)
+            return _copyCollectingAreas(_COLLECTING_AREA_CACHE[cache_key])
+
+
     # If the mask is not given, make a dummy mask with all white pixels
     if mask is None:
         mask = MaskStructure(None)
@@ -1658,135 +1795,123 @@ def collectingArea(platepar, mask=None, side_points=20, ht_min=60, ht_max=130, d
     longer_dpx = int(platepar.X_res//longer_side_points)
     shorter_dpx = int(platepar.Y_res//shorter_side_points)
 
-    # Dictionary of collection areas per height
-    col_areas_ht = collections.OrderedDict()
+    # Upper left and lower right corners of the segments
+    x0_arr = np.linspace(0, platepar.X_res, longer_side_points, dtype=int, endpoint=False)
+    y0_arr = np.linspace(0, platepar.Y_res, shorter_side_points, dtype=int, endpoint=False)
+    xe_arr = x0_arr + longer_dpx
+    ye_arr = y0_arr + shorter_dpx
 
-    # Estimate the collection area for a given range of heights
-    for ht in np.arange(ht_min, ht_max + dht, dht):
+    # Make a grid of unique corner coordinates, the corners shared by segments are only projected once
+    x_corners, x_inv = np.unique(np.concatenate([x0_arr, xe_arr]), return_inverse=True)
+    y_corners, y_inv = np.unique(np.concatenate([y0_arr, ye_arr]), return_inverse=True)
+    x0_ind, xe_ind = x_inv[:len(x0_arr)], x_inv[len(x0_arr):]
+    y0_ind, ye_ind = y_inv[:len(y0_arr)], y_inv[len(y0_arr):]
 
-        # Convert the height to meters
-        ht = 1000*ht
+    x_grid, y_grid = np.meshgrid(x_corners, y_corners, indexing='ij')
 
-        total_area = 0
+    # Index segments in the order they are stored, X in the outer loop and Y in the inner loop
+    seg_i, seg_j = np.meshgrid(np.arange(len(x0_arr)), np.arange(len(y0_arr)), indexing='ij')
+    seg_i = seg_i.ravel()
+    seg_j = seg_j.ravel()
 
-        # Dictionary of computed sensor-corrected collection areas where X and Y are keys
-        col_areas_xy = collections.OrderedDict()
+    # Flat grid indices of the segment corners, in the order of the polygon (clockwise): upper left,
+    #   lower left, lower right, upper right
+    n_y_corners = len(y_corners)
+    corners = np.column_stack([
+        x0_ind[seg_i]*n_y_corners + y0_ind[seg_j],
+        x0_ind[seg_i]*n_y_corners + ye_ind[seg_j],
+        xe_ind[seg_i]*n_y_corners + ye_ind[seg_j],
+        xe_ind[seg_i]*n_y_corners + y0_ind[seg_j],
+        ])
 
-        # Sample the image
-        for i, x0 in enumerate(np.linspace(0, platepar.X_res, longer_side_points, dtype=int, endpoint=False)):
-            for j, y0 in enumerate(np.linspace(0, platepar.Y_res, shorter_side_points, dtype=int, endpoint=False)):
+    # Compute the pointing of all corners
+    corner_azim, corner_elev, _ = _imageAltAz(platepar, x_grid.ravel().astype(np.float64), \
+        y_grid.ravel().astype(np.float64))
 
-                # Compute lower right corners of the segment
-                xe = x0 + longer_dpx
-                ye = y0 + shorter_dpx
+    # Skip the segments where all corners are hitting the lower apparent elevation limit
+    valid = ~np.all(corner_elev[corners] < elev_limit, axis=1)
 
-                # Compute geo coordinates of the image corners (if the corner is below the elevation limit,
-                #   the *_elev value will be -1)
-                _, ul_lat, ul_lon, ul_ht = xyHt2Geo(
-                    platepar, x0, y0, ht, indicate_limit=True, elev_limit=elev_limit
-                )
-                _, ll_lat, ll_lon, ll_ht = xyHt2Geo(
-                    platepar, x0, ye, ht, indicate_limit=True, elev_limit=elev_limit
-                )
-                _, lr_lat, lr_lon, lr_ht = xyHt2Geo(
-                    platepar, xe, ye, ht, indicate_limit=True, elev_limit=elev_limit
-                )
-                _, ur_lat, ur_lon, ur_ht = xyHt2Geo(
-                    platepar, xe, y0, ht, indicate_limit=True, elev_limit=elev_limit
-                )
 
-                # Skip the block if all corners are hitting the lower apparent elevation limit
-                if np.all([ul_ht < 0, ll_ht < 0, lr_ht < 0, ur_ht < 0]):
-                    continue
+    ### Compute the unmasked ratio of every segment ###
 
-                # Make a polygon (clockwise direction)
-                lats = [ul_lat, ll_lat, lr_lat, ur_lat]
-                lons = [ul_lon, ll_lon, lr_lon, ur_lon]
+    x0_seg, xe_seg = x0_arr[seg_i], xe_arr[seg_i]
+    y0_seg, ye_seg = y0_arr[seg_j], ye_arr[seg_j]
 
-                # Compute the area of the polygon
-                area = areaGeoPolygon(lats, lons, ht)
+    # Assume that a masked area has a black pixel and an unmasked area has a white pixel (0 and 255,
+    #   respectively). Count the unmasked pixels in segments using the integral image of the mask.
+    mask_height, mask_width = mask.img.shape[:2]
+    unmasked_integral = np.zeros((mask_height + 1, mask_width + 1), dtype=np.int64)
+    unmasked_integral[1:, 1:] = np.cumsum(np.cumsum(mask.img > 0, axis=0), axis=1)
 
-                ### Apply sensitivity corrections to the area ###
+    # Clip the segments to the mask, as slicing the mask would
+    x0_clip, xe_clip = np.minimum(x0_seg, mask_width), np.minimum(xe_seg, mask_width)
+    y0_clip, ye_clip = np.minimum(y0_seg, mask_height), np.minimum(ye_seg, mask_height)
 
-                # Get the relevant mask segment
-                mask_segment = mask.img[y0:ye, x0:xe]
+    segment_size = (xe_clip - x0_clip)*(ye_clip - y0_clip)
 
-                # If the mask segment is empty, skip this segment
-                if mask_segment.size == 0:
-                    continue
+    unmasked_count = unmasked_integral[ye_clip, xe_clip] - unmasked_integral[y0_clip, xe_clip] \
+        - unmasked_integral[ye_clip, x0_clip] + unmasked_integral[y0_clip, x0_clip]
 
-                # Compute ratio of masked portion of the segment. Assume that a masked area has a black pixel
-                #   and an unmasked area has a white pixel (0 and 255, respectively)
-                mask_thresholded = mask_segment > 0
-                unmasked_ratio = np.count_nonzero(mask_thresholded)/mask_segment.size
+    # If the mask segment is empty, skip this segment
+    valid &= segment_size > 0
 
-                # Compute the pointing direction and the vignetting and extinction loss for the mean location
+    corners = corners[valid]
+    unmasked_ratio = unmasked_count[valid]/segment_size[valid]
 
-                x_mean = (x0 + xe)/2
-                y_mean = (y0 + ye)/2
+    ### ###
 
-                # Use a test pixel sum
-                test_px_sum = 400
 
-                # Compute the pointing direction and magnitude corrected for vignetting and extinction
-                _, ra, dec, mag = xyToRaDecPP(
-                    [jd2Date(J2000_JD.days)], [x_mean], [y_mean], [test_px_sum], platepar
-                )
-                azim, elev = raDec2AltAz(ra[0], dec[0], J2000_JD.days, platepar.lat, platepar.lon)
+    # Compute the pointing direction and the vignetting and extinction loss for the mean location
+    x_mean = (x0_seg[valid] + xe_seg[valid])/2
+    y_mean = (y0_seg[valid] + ye_seg[valid])/2
 
-                # Compute the pixel sum back assuming no corrections
-                rev_level = 10**((mag[0] - platepar.mag_lev)/(-2.5))
+    # Use a test pixel sum
+    test_px_sum = 400
 
-                # Compute the sensitivity loss due to vignetting and extinction
-                sensitivity_ratio = test_px_sum/rev_level
+    # Compute the pointing direction and magnitude corrected for vignetting and extinction
+    azim, elev, mag = _imageAltAz(platepar, x_mean, y_mean, level_data=np.full(len(x_mean), test_px_sum))
 
-                # Compute the range correction (w.r.t 100 km) to the mean point
-                r, _, _, _ = xyHt2Geo(
-                    platepar, x_mean, y_mean, ht, indicate_limit=True, elev_limit=elev_limit
-                )
+    # Compute the pixel sum back assuming no corrections
+    rev_level = 10**((mag - platepar.mag_lev)/(-2.5))
 
-                # Correct the area for the masked portion
-                raw_area = area
-                area *= unmasked_ratio
+    # Compute the sensitivity loss due to vignetting and extinction
+    sensitivity_ratio = test_px_sum/rev_level
 
-                ### ###
 
-                # Store the raw masked segment collection area, sensitivity, and the range
-                col_areas_xy[(x_mean, y_mean)] = [area, azim, elev, sensitivity_ratio, r]
+    # Heights of area evaluation in meters
+    hts = 1000*np.arange(ht_min, ht_max + dht, dht)
 
-                total_area += area
+    # Compute geo coordinates of all corners at all heights
+    _, corner_lat, corner_lon = _projectToHeights(platepar, corner_azim, corner_elev, hts, elev_limit)
 
+    # Compute the areas of all segment polygons at all heights
+    areas = areaGeoPolygonArrays(corner_lat[:, corners], corner_lon[:, corners], hts[:, np.newaxis])
 
-                # # DEBUG - print a status message for every segment, including all computed values
-                # # Only print on the diagonal
-                # if i == j:
-                #     print()
-                #     print("(x = {:4d}, y = {:4d})".format(x0, y0))
-                #     print("  A: {:6.2f} km^2, Az = {:7.2f}, Ev = {:7.2f}, Sens.: {:6.2f}, Ae: {:6.2f}".format(
-                #         raw_area/1e6, azim, elev, sensitivity_ratio, area/1e6
-                #         )
-                #     )
-                #     print("Mask:", mask_segment, np.count_nonzero(~mask_segment), mask_segment.size, unmasked_ratio)
+    # Correct the area for the masked portion
+    areas = areas*unmasked_ratio
 
-                ##
+    # Compute the range to the mean point of every segment at all heights
+    r_mean, _, _ = _projectToHeights(platepar, azim, elev, hts, elev_limit)
 
-        # Store segments to the height dictionary (save a copy so it doesn't get overwritten)
-        col_areas_ht[float(ht)] = dict(col_areas_xy)
 
-        # print("SUM:", total_area/1e6, "km^2")
+    # Dictionary of collection areas per height
+    col_areas_ht = collections.OrderedDict()
 
-        # Compare to total area computed from the whole area
-        side_points_list = fovArea(
-            platepar, mask=mask, area_ht=ht, side_points=side_points, elev_limit=elev_limit
-        )
-        lats = []
-        lons = []
-        for side in side_points_list:
-            for entry in side:
-                lats.append(entry[0])
-                lons.append(entry[1])
-
-        # print("DIR:", areaGeoPolygon(lats, lons, ht)/1e6)
+    for k, ht in enumerate(hts):
+
+        # Store the raw masked segment collection area, sensitivity, and the range
+        col_areas_ht[float(ht)] = {
+            (x_mean[s], y_mean[s]): [areas[k, s], azim[s], elev[s], sensitivity_ratio[s], r_mean[k, s]]
+            for s in range(len(x_mean))
+            }
+
+
+    if use_cache:
+
+        _COLLECTING_AREA_CACHE[cache_key] = _copyCollectingAreas(col_areas_ht)
+
+        while len(_COLLECTING_AREA_CACHE) > COLLECTING_AREA_CACHE_SIZE:
+            _COLLECTING_AREA_CACHE.popitem(last=False)
 
     return col_areas_ht
 
@@ -56,169 +56,197 @@ def stackIfLighter(arr1, arr2):
 
 
 
-def generateThumbnails(dir_path, config, mosaic_type, file_list=None, no_stack=False):
-    """ Generates a mosaic of thumbnails from all FF files in the given folder and saves it as a JPG image.
-    
-    Arguments:
-        dir_path: [str] Path of the night directory.
-        config: [Conf object] Configuration.
-        mosaic_type: [str] Type of the mosaic (e.g. "Captured" or "Detected")
+class ThumbnailMosaic(object):
+    """ Collects thumbnails of FF files and assembles them into a mosaic. The FF files can be added in any 
+        order, e.g. while they are read for other products as well (see Utils.NightSweep).
+    """
 
-    Keyword arguments:
-        file_list: [list] A list of file names (without full path) which will be searched for FF files. This
-            is used when generating separate thumbnails for captured and detected files.
+    def __init__(self, config, ff_list, no_stack=False):
+        """
+        Arguments:
+            config: [Conf object] Configuration.
+            ff_list: [list] Sorted list of names of all FF files in the mosaic.
 
-    Return:
-        file_name: [str] Name of the thumbnail file.
-        no_stack: [bool] Don't stack the images using the config.thumb_stack option. A max of 1000 images
-            are supported with this option. If there are more, stacks will be done according to the 
-            config.thumb_stack option.
+        Keyword arguments:
+            no_stack: [bool] Don't stack the images using the config.thumb_stack option. A max of 1000 images
+                are supported with this option. If there are more, stacks will be done according to the 
+                config.thumb_stack option.
+        """
 
-    """
+        self.config = config
+        self.ff_list = list(ff_list)
 
-    if file_list is None:
-        file_list = sorted(os.listdir(dir_path))
+        # Calculate the dimensions of the binned image
+        self.bin_w = int(config.width/config.thumb_bin)
+        self.bin_h = int(config.height/config.thumb_bin)
 
+        self.thumb_stack = config.thumb_stack
 
-    # Make a list of all FF files in the night directory
-    ff_list = []
+        # Check if no stacks should be done (max 1000 images for no stack)
+        if no_stack and (len(self.ff_list) < 1000):
+            self.thumb_stack = 1
 
-    for file_name in file_list:
-        if FFfile.validFFName(file_name):
-            ff_list.append(file_name)
+        # Index of the stack every FF file goes into
+        self.stack_indices = {ff_name: i//self.thumb_stack for i, ff_name in enumerate(self.ff_list)}
 
+        # Save the timestamp of the first image in every stack
+        self.timestamps = [FFfile.filenameToDatetime(self.ff_list[i]) 
+            for i in range(0, len(self.ff_list), self.thumb_stack)]
 
-    # Calculate the dimensions of the binned image
-    bin_w = int(config.width/config.thumb_bin)
-    bin_h = int(config.height/config.thumb_bin)
+        self.stacked_imgs = [np.zeros((self.bin_h, self.bin_w)) for _ in self.timestamps]
 
 
-    ### RESIZE AND STACK THUMBNAILS ###
-    ##########################################################################################################
+    def add(self, file_name, ff):
+        """ Resize the maxpixel of the given FF file and stack it into its thumbnail. """
 
-    timestamps = []
-    stacked_imgs = []
+        indx = self.stack_indices.get(file_name)
+        if indx is None:
+            return
 
+        # Resize the image
+        img = cv2.resize(ff.maxpixel, (self.bin_w, self.bin_h))
 
-    thumb_stack = config.thumb_stack
-    
-    # Check if no stacks should be done (max 1000 images for no stack)
-    if no_stack and (len(ff_list) < 1000):
-        thumb_stack = 1
+        # Stack the image
+        self.stacked_imgs[indx] = stackIfLighter(self.stacked_imgs[indx], img)
+
+
+    def save(self, dir_path, mosaic_type):
+        """ Put all thumbnails into one mosaic image and save it as a JPG to the given directory.
+
+        Arguments:
+            dir_path: [str] Path of the night directory.
+            mosaic_type: [str] Type of the mosaic (e.g. "Captured" or "Detected")
+
+        Return:
+            file_name: [str] Name of the thumbnail file.
+        """
 
+        config = self.config
+        bin_w, bin_h = self.bin_w, self.bin_h
 
-    for i in range(0, len(ff_list), thumb_stack):
+        header_height = 20
+        timestamp_height = 10
 
-        img_stack = np.zeros((bin_h, bin_w))
+        # Calculate the number of rows for the thumbnail image
+        n_rows = int(np.ceil(float(len(self.ff_list))/self.thumb_stack/config.thumb_n_width))
 
-        # Stack thumb_stack images using the 'if lighter' method
-        for j in range(thumb_stack):
+        # Calculate the size of the mosaic
+        mosaic_w = int(config.thumb_n_width*bin_w)
+        mosaic_h = int((bin_h + timestamp_height)*n_rows + header_height)
 
-            if (i + j) < len(ff_list):
+        mosaic_img = np.zeros((mosaic_h, mosaic_w), dtype=np.uint8)
 
-                tmp_file_name = ff_list[i + j]
+        # Write header text
+        header_text = 'Station: ' + str(config.stationID) + ' Night: ' + os.path.basename(dir_path) \
+            + ' Type: ' + mosaic_type
+        cv2.putText(mosaic_img, header_text, (0, header_height//2), \
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255), 1)
 
-                    
-                # Read the FF file
-                ff = FFfile.read(dir_path, tmp_file_name)
+        for row in range(n_rows):
 
-                # Skip the FF if it is corrupted
-                if ff is None:
-                    continue
+            for col in range(config.thumb_n_width):
 
-                img = ff.maxpixel
+                # Calculate image index
+                indx = row*config.thumb_n_width + col
 
-                # Resize the image
-                img = cv2.resize(img, (bin_w, bin_h))
+                if indx < len(self.stacked_imgs):
 
-                # Stack the image
-                img_stack = stackIfLighter(img_stack, img)
+                    # Calculate position of the text
+                    text_x = col*bin_w
+                    text_y = row*bin_h + (row + 1)*timestamp_height - 1 + header_height
 
-            else:
-                break
+                    # Add timestamp text
+                    cv2.putText(mosaic_img, self.timestamps[indx].strftime('%H:%M:%S'), (text_x, text_y), \
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
 
+                    # Add the image to the mosaic
+                    img_pos_x = col*bin_w
+                    img_pos_y = row*bin_h + (row + 1)*timestamp_height + header_height
 
-        # Save the timestamp of the first image in the stack
-        timestamps.append(FFfile.filenameToDatetime(ff_list[i]))
+                    mosaic_img[img_pos_y : img_pos_y + bin_h, img_pos_x : img_pos_x + bin_w] = \
+                        self.stacked_imgs[indx]
 
-        # Save the stacked image
-        stacked_imgs.append(img_stack)
 
-        # cv2.imshow('test', img_stack)
-        # cv2.waitKey(0)
-        # cv2.destroyAllWindows()
+                else:
+                    break
 
 
-    ##########################################################################################################
+        # Only add the station ID if the dir name already doesn't start with it
+        dir_name = os.path.basename(os.path.abspath(dir_path))
+        if dir_name.startswith(config.stationID):
+            prefix = dir_name
+        else:
+            prefix = "{:s}_{:s}".format(config.stationID, dir_name)
 
-    ### ADD THUMBS TO ONE MOSAIC IMAGE ###
-    ##########################################################################################################
+        thumb_name = "{:s}_{:s}_thumbs.jpg".format(prefix, mosaic_type)
 
-    header_height = 20
-    timestamp_height = 10
+        # Save the mosaic
+        if USING_IMAGEIO:
+            # Use imageio to write the image
+            imwrite(os.path.join(dir_path, thumb_name), mosaic_img, quality=80)
+        else:
+            # Use OpenCV to save the image
+            imwrite(os.path.join(dir_path, thumb_name), mosaic_img, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
 
-    # Calculate the number of rows for the thumbnail image
-    n_rows = int(np.ceil(float(len(ff_list))/thumb_stack/config.thumb_n_width))
+        return thumb_name
 
-    # Calculate the size of the mosaic
-    mosaic_w = int(config.thumb_n_width*bin_w)
-    mosaic_h = int((bin_h + timestamp_height)*n_rows + header_height)
 
-    mosaic_img = np.zeros((mosaic_h, mosaic_w), dtype=np.uint8)
 
-    # Write header text
-    header_text = 'Station: ' + str(config.stationID) + ' Night: ' + os.path.basename(dir_path) \
-        + ' Type: ' + mosaic_type
-    cv2.putText(mosaic_img, header_text, (0, header_height//2), \
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255), 1)
+def listThumbnailFFs(dir_path, file_list=None):
+    """ Return a sorted list of FF files which go into the thumbnail mosaic. 
 
-    for row in range(n_rows):
+    Arguments:
+        dir_path: [str] Path of the night directory.
 
-        for col in range(config.thumb_n_width):
+    Keyword arguments:
+        file_list: [list] A list of file names (without full path) which will be searched for FF files.
+            All files in the directory are used if None.
+    """
 
-            # Calculate image index
-            indx = row*config.thumb_n_width + col
+    if file_list is None:
+        file_list = sorted(os.listdir(dir_path))
 
-            if indx < len(stacked_imgs):
+    # Make a list of all FF files in the night directory
+    return [file_name for file_name in file_list if FFfile.validFFName(file_name)]
 
-                # Calculate position of the text
-                text_x = col*bin_w
-                text_y = row*bin_h + (row + 1)*timestamp_height - 1 + header_height
 
-                # Add timestamp text
-                cv2.putText(mosaic_img, timestamps[indx].strftime('%H:%M:%S'), (text_x, text_y), \
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
 
-                # Add the image to the mosaic
-                img_pos_x = col*bin_w
-                img_pos_y = row*bin_h + (row + 1)*timestamp_height + header_height
+def generateThumbnails(dir_path, config, mosaic_type, file_list=None, no_stack=False):
+    """ Generates a mosaic of thumbnails from all FF files in the given folder and saves it as a JPG image.
+    
+    Arguments:
+        dir_path: [str] Path of the night directory.
+        config: [Conf object] Configuration.
+        mosaic_type: [str] Type of the mosaic (e.g. "Captured" or "Detected")
+
+    Keyword arguments:
+        file_list: [list] A list of file names (without full path) which will be searched for FF files. This
+            is used when generating separate thumbnails for captured and detected files.
+
+    Return:
+        file_name: [str] Name of the thumbnail file.
+        no_stack: [bool] Don't stack the images using the config.thumb_stack option. A max of 1000 images
+            are supported with this option. If there are more, stacks will be done according to the 
+            config.thumb_stack option.
 
-                mosaic_img[img_pos_y : img_pos_y + bin_h, img_pos_x : img_pos_x + bin_w] = stacked_imgs[indx]
+    """
 
+    ff_list = listThumbnailFFs(dir_path, file_list=file_list)
 
-            else:
-                break
+    mosaic = ThumbnailMosaic(config, ff_list, no_stack=no_stack)
 
-    ##########################################################################################################
+    for file_name in ff_list:
 
-    # Only add the station ID if the dir name already doesn't start with it
-    dir_name = os.path.basename(os.path.abspath(dir_path))
-    if dir_name.startswith(config.stationID):
-        prefix = dir_name
-    else:
-        prefix = "{:s}_{:s}".format(config.stationID, dir_name)
+        # Read the FF file
+        ff = FFfile.read(dir_path, file_name)
 
-    thumb_name = "{:s}_{:s}_thumbs.jpg".format(prefix, mosaic_type)
+        # Skip the FF if it is corrupted
+        if ff is None:
+            continue
 
-    # Save the mosaic
-    if USING_IMAGEIO:
-        # Use imageio to write the image
-        imwrite(os.path.join(dir_path, thumb_name), mosaic_img, quality=80)
-    else:
-        # Use OpenCV to save the image
-        imwrite(os.path.join(dir_path, thumb_name), mosaic_img, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+        mosaic.add(file_name, ff)
 
-    return thumb_name
+    return mosaic.save(dir_path, mosaic_type)
     
 
 
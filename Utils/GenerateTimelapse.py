@@ -10,14 +10,15 @@ import re
 import platform
 import subprocess
 import shutil
+import multiprocessing
 import cv2
 import json
 from datetime import datetime, timedelta
 
-from PIL import ImageFont
-
 from RMS.Formats.FFfile import read as readFF
 from RMS.Formats.FFfile import validFFName, filenameToDatetime
+from RMS.Formats.FrameSegment import FrameSegment, isSegmentFile, isSegmentFramePath, readFramePath, \
+    segmentFiles, segmentFilesOnDisk
 from RMS.Misc import mkdirP, RmsDateTime, tarWithProgress
 from RMS.Logger import getLogger
 
@@ -27,7 +28,252 @@ log = getLogger("logger")
 # --------------------------------------------------------------------
 #  Timelapse generation from FF files (meteors)
 # --------------------------------------------------------------------
-def generateTimelapse(dir_path, keep_images=False, fps=None, output_file=None, hires=False):
+def labelFFImage(file_name, ff, copy=False):
+    """Label the maxpixel of an FF file with the camera ID and time.
+
+    Arguments:
+        file_name: [str] Name of the FF file.
+        ff: [FF object] The FF file.
+
+    Keyword arguments:
+        copy: [bool] Label a copy of the maxpixel, so the FF is not modified.
+            False by default.
+
+    Return:
+        img: [ndarray] Labelled maxpixel image.
+    """
+
+    # Get the timestamp from the FF name
+    timestamp = filenameToDatetime(file_name).strftime("%Y-%m-%d %H:%M:%S")
+
+    # Get id cam from the file name
+    # e.g.  FF499_20170626_020520_353_0005120.bin
+    # or FF_CA0001_20170626_020520_353_0005120.fits
+
+    file_split = file_name.split('_')
+
+    # Check the number of list elements, and the new fits format has one more underscore
+    i = 0
+    if len(file_split[0]) == 2:
+        i = 1
+    camid = file_split[i]
+
+    img = ff.maxpixel
+    if copy:
+        img = img.copy()
+
+    # Draw text to image
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    text = camid + " " + timestamp + " UTC"
+    position = (10, ff.nrows - 6)
+    font_scale = 0.4
+    thickness = 1
+
+    cv2.putText(img, text, position, font, font_scale, (0, 0, 0), thickness + 2, cv2.LINE_AA)
+    cv2.putText(img, text, position, font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
+
+    return img
+
+
+def _labelFF(dir_path, file_name):
+    """Read an FF file and label its maxpixel with the camera ID and time.
+
+    Arguments:
+        dir_path: [str] Directory that contains the FF file.
+        file_name: [str] Name of the FF file.
+
+    Return:
+        img: [ndarray | None] Labelled maxpixel image, None if the FF file
+            could not be read.
+    """
+
+    # Read the FF file
+    ff = readFF(dir_path, file_name)
+
+    # Skip the file if it could not be read
+    if ff is None:
+        return None
+
+    return labelFFImage(file_name, ff)
+
+
+def _labelFFStar(args):
+    """ Unpack the arguments of _labelFF, so it works with Pool.imap. """
+
+    return _labelFF(*args)
+
+
+def timelapseFfmpegPath():
+    """Return the path to a working ffmpeg executable, None if there is none."""
+
+    if platform.system() in ['Linux', 'Darwin']:
+        if isFfmpegWorking("ffmpeg"):
+            return "ffmpeg"
+
+    elif platform.system() == 'Windows':
+        ffmpeg_path = os.path.join(os.path.dirname(__file__), "ffmpeg.exe")
+        if os.path.exists(ffmpeg_path):
+            return ffmpeg_path
+
+    return None
+
+
+class TimelapseStreamWriter(object):
+    """Encode a timelapse by piping raw frames into the stdin of ffmpeg.
+    ffmpeg is started with the size of the first frame, frames of another
+    size are skipped.
+    """
+
+    def __init__(self, mp4_path, ffmpeg_path, fps=30, crf=29):
+        """
+        Arguments:
+            mp4_path: [str] Path of the output video.
+            ffmpeg_path: [str] Path to the ffmpeg executable.
+
+        Keyword arguments:
+            fps: [int] Frames per second; 30 by default.
+            crf: [int] CRF for H.264 encoding; 29 by default.
+        """
+
+        self.mp4_path = mp4_path
+        self.ffmpeg_path = ffmpeg_path
+        self.fps = fps
+        self.crf = crf
+
+        self.ffmpeg_process = None
+        self.frame_shape = None
+        self.n_frames = 0
+
+
+    def _start(self, img):
+        """Start ffmpeg for frames shaped as the given image."""
+
+        self.frame_shape = img.shape
+
+        ffmpeg_cmd = [self.ffmpeg_path, "-nostdin", "-v", "quiet", "-y",
+                      "-f", "rawvideo",
+                      "-vcodec", "rawvideo",
+                      "-s", "{}x{}".format(img.shape[1], img.shape[0]),
+                      "-pix_fmt", "gray" if img.ndim == 2 else "bgr24",
+                      "-r", str(self.fps),
+                      "-i", "-",
+                      "-vcodec", "libx264",
+                      "-pix_fmt", "yuv420p",
+                      "-crf", str(self.crf),
+                      "-movflags", "faststart",
+                      "-threads", "2",
+                      "-g", "15",
+                      "-vf", "hqdn3d=4:3:6:4.5,lutyuv=y=gammaval(0.77)",
+                      self.mp4_path]
+
+        log.info("Creating timelapse using ffmpeg...")
+        log.info(" ".join(ffmpeg_cmd))
+        self.ffmpeg_process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)
+
+
+    def write(self, img):
+        """Send one uint8 frame to ffmpeg. Returns False if it was skipped."""
+
+        if self.ffmpeg_process is None:
+            self._start(img)
+
+        # ffmpeg was told the frame size, skip frames of a different size
+        if img.shape != self.frame_shape:
+            log.warning("Skipping a frame with a different size: {}".format(img.shape))
+            return False
+
+        self.ffmpeg_process.stdin.write(img.tobytes())
+        self.n_frames += 1
+
+        return True
+
+
+    def close(self):
+        """Finish the video. Returns True if ffmpeg finished successfully."""
+
+        if self.ffmpeg_process is None:
+            log.warning("No frames were given, the timelapse was not created.")
+            return False
+
+        try:
+            self.ffmpeg_process.stdin.close()
+        except (IOError, OSError):
+            pass
+
+        return_code = self.ffmpeg_process.wait()
+        if return_code != 0:
+            log.warning("ffmpeg process exited with code {}".format(return_code))
+
+        return return_code == 0
+
+
+def generateTimelapseStream(dir_path, mp4_path, ffmpeg_path, fps=30, crf=29, workers=None):
+    """Generate a timelapse from FF files by streaming the labelled maxpixel
+    images into the stdin of ffmpeg, without temporary images on disk.
+
+    The FF files are read and labelled in a pool of worker processes, and
+    the frames are sent to ffmpeg in the order of the FF files.
+
+    Arguments:
+        dir_path: [str] Directory that contains the FF files.
+        mp4_path: [str] Path of the output video.
+        ffmpeg_path: [str] Path to the ffmpeg executable.
+
+    Keyword arguments:
+        fps: [int] Frames per second; 30 by default.
+        crf: [int] CRF for H.264 encoding; 29 by default.
+        workers: [int | None] Number of worker processes. All cores but one
+            if None. None by default.
+
+    Return:
+        success: [bool] True if ffmpeg finished successfully.
+    """
+
+    t1 = RmsDateTime.utcnow()
+
+    ff_list = [ff_name for ff_name in sorted(os.listdir(dir_path)) if validFFName(ff_name)]
+
+    if workers is None:
+        workers = max(1, multiprocessing.cpu_count() - 1)
+
+    log.info("Streaming {:d} FF files into the timelapse using {:d} workers...".format(len(ff_list), workers))
+
+    writer = TimelapseStreamWriter(mp4_path, ffmpeg_path, fps=fps, crf=crf)
+
+    pool = multiprocessing.Pool(workers)
+
+    try:
+
+        # Labelled images are returned in the order of the FF files
+        for img in pool.imap(_labelFFStar, [(dir_path, file_name) for file_name in ff_list], chunksize=4):
+
+            if img is None:
+                continue
+
+            writer.write(img)
+
+            # Print elapsed time
+            if writer.n_frames % 30 == 0:
+                print("{:>5d}/{:>5d}, Elapsed: {:s}".format(writer.n_frames, len(ff_list), \
+                    str(RmsDateTime.utcnow() - t1)), end="\r")
+                sys.stdout.flush()
+
+    except (IOError, OSError) as e:
+        log.error("Streaming frames to ffmpeg failed: {}".format(e))
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+    success = writer.close()
+
+    log.info("Total time: %s", RmsDateTime.utcnow() - t1)
+
+    return success
+
+
+def generateTimelapse(dir_path, keep_images=False, fps=None, output_file=None, hires=False, stream=True):
     """Generate a high-quality MP4 movie from FF files.
 
     Arguments:
@@ -41,6 +287,10 @@ def generateTimelapse(dir_path, keep_images=False, fps=None, output_file=None, h
             *dir_path* is used. None by default.
         hires: [bool] Produce a higher-resolution movie (lower CRF). False by
             default.
+        stream: [bool] Stream the frames straight into ffmpeg instead of
+            writing temporary JPGs (see generateTimelapseStream). Not used
+            when *keep_images* is set or ffmpeg is not available. True by
+            default.
 
     Return:
         None
@@ -67,13 +317,18 @@ def generateTimelapse(dir_path, keep_images=False, fps=None, output_file=None, h
         crf = 29
 
 
-    t1 = RmsDateTime.utcnow()
+    # Stream the frames into ffmpeg if the images don't have to be kept
+    if stream and not keep_images:
 
-    # Load the font for labeling
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/dejavu/DejaVuSans.ttf", 18)
-    except:
-        font = ImageFont.load_default()
+        ffmpeg_path = timelapseFfmpegPath()
+        if ffmpeg_path is not None:
+            generateTimelapseStream(dir_path, mp4_path, ffmpeg_path, fps=fps, crf=crf)
+            return None
+
+        log.info("ffmpeg is not available, creating the timelapse from temporary images...")
+
+
+    t1 = RmsDateTime.utcnow()
 
     # Create temporary directory
     dir_tmp_path = os.path.join(dir_path, "temp_img_dir")
@@ -93,43 +348,16 @@ def generateTimelapse(dir_path, keep_images=False, fps=None, output_file=None, h
 
     for file_name in ff_list:
 
-        # Read the FF file
-        ff = readFF(dir_path, file_name)
+        # Read and label the FF file
+        img = _labelFF(dir_path, file_name)
 
         # Skip the file if it could not be read
-        if ff is None:
+        if img is None:
             continue
 
-        # Get the timestamp from the FF name
-        timestamp = filenameToDatetime(file_name).strftime("%Y-%m-%d %H:%M:%S")
-		
-        # Get id cam from the file name
-        # e.g.  FF499_20170626_020520_353_0005120.bin
-        # or FF_CA0001_20170626_020520_353_0005120.fits
-
-        file_split = file_name.split('_')
-
-        # Check the number of list elements, and the new fits format has one more underscore
-        i = 0
-        if len(file_split[0]) == 2:
-            i = 1
-        camid = file_split[i]
-
         # Make a filename for the image, continuous count %04d
         img_file_name = 'temp_{:04d}.jpg'.format(c)
 
-        img = ff.maxpixel
-
-        # Draw text to image
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        text = camid + " " + timestamp + " UTC"
-        position = (10, ff.nrows - 6)
-        font_scale = 0.4
-        thickness = 1
-
-        cv2.putText(img, text, position, font, font_scale, (0, 0, 0), thickness + 2, cv2.LINE_AA)
-        cv2.putText(img, text, position, font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
-
         # Save the labelled image to disk
         cv2.imwrite(os.path.join(dir_tmp_path, img_file_name), img, [cv2.IMWRITE_JPEG_QUALITY, 100])
     
@@ -298,9 +526,74 @@ def _parse(fname):
     return station, dt
 
 
+def _listImages(dir_path):
+    """Return paths of all images under *dir_path*, including the virtual
+    paths of frames stored in frame segments.
+
+    Arguments:
+        dir_path: [str] Root directory to search (walks sub-dirs recursively).
+
+    Return:
+        paths: [list[str]] Unsorted image paths.
+    """
+    paths = []
+    for root, _, files in os.walk(dir_path):
+        for fname in files:
+            if IMAGE_PATTERN.match(fname):
+                paths.append(os.path.join(root, fname))
+
+            elif isSegmentFile(fname):
+                try:
+                    paths += FrameSegment(os.path.join(root, fname)).framePaths()
+                except Exception as e:
+                    log.warning("Cannot read frame segment %s: %s", fname, e)
+
+    return paths
+
+
+def _sourceFiles(image_files, complete_only=False):
+    """Map image paths to the files on disk holding them.
+
+    Arguments:
+        image_files: [list[str]] Image paths, possibly virtual paths of frames
+            in frame segments.
+
+    Keyword arguments:
+        complete_only: [bool] Only include segments whose every frame is in
+            *image_files*, so no other frames are lost when the files are
+            deleted. False by default.
+
+    Return:
+        files: [list[str]] Image files, segment files and segment indices.
+    """
+    # Count the frames used from each segment
+    used_frames = {}
+    for path in image_files:
+        if isSegmentFramePath(path):
+            segment_path = os.path.dirname(path)
+            used_frames[segment_path] = used_frames.get(segment_path, 0) + 1
+
+    files = []
+    for path in segmentFiles(image_files):
+        if path not in used_frames:
+            files.append(path)
+            continue
+
+        if complete_only and (used_frames[path] < len(FrameSegment(path))):
+            log.info("Keeping %s, not all frames were used", os.path.basename(path))
+            continue
+
+        files += segmentFilesOnDisk(path)
+
+    return files
+
+
 def listImageBlocksBefore(cutoff, dir_path):
     """Group images into chronological, same-mode blocks before a cutoff.
 
+    Frames stored in frame segments are listed by their virtual paths (see
+    RMS.Formats.FrameSegment).
+
     Arguments:
         cutoff: [datetime] Naive UTC timestamp; images >= cutoff are ignored.
         dir_path: [str] Root directory to search (walks sub-dirs recursively).
@@ -312,14 +605,11 @@ def listImageBlocksBefore(cutoff, dir_path):
     """
     # 1. collect .jpg / .png whose embedded time < cutoff -------------------
     paths = []
-    for root, _, files in os.walk(dir_path):
-        for fname in files:
-            if not IMAGE_PATTERN.match(fname):
-                continue
-            ts = _timestampFromName(fname)
-            if ts >= cutoff:
-                continue
-            paths.append(os.path.join(root, fname))
+    for path in _listImages(dir_path):
+        ts = _timestampFromName(path)
+        if ts >= cutoff:
+            continue
+        paths.append(path)
 
     if not paths:
         return []
@@ -507,11 +797,7 @@ def generateTimelapseFromDir(dir_path,
             Paths on success, (None, None) on failure.
     """
     # 1 - gather images -----------------------------------------------------
-    img_paths = []
-    for root, _, files in os.walk(dir_path):         # use os.listdir(dir_path) if
-        for f in files:                              # you *don't* want recursion
-            if IMAGE_PATTERN.match(f):
-                img_paths.append(os.path.join(root, f))
+    img_paths = _listImages(dir_path)
 
     if not img_paths:
         log.warning("generateTimelapseFromDir: no images found in %s", dir_path)
@@ -608,7 +894,7 @@ def generateTimelapseFromFrames(image_files,
         # (e.g. main capture controls camera mode and passive auxiliary captures)
         idx = sample_size - 1 - i
 
-        sample_image = cv2.imread(image_files[idx], cv2.IMREAD_UNCHANGED)
+        sample_image = readFramePath(image_files[idx], cv2.IMREAD_UNCHANGED)
 
         if sample_image is not None:
 
@@ -709,7 +995,7 @@ def generateTimelapseFromFrames(image_files,
                   .format(index, len(image_files), (index/len(image_files)*100.0)))
         
         # Load image with error handling
-        image = cv2.imread(img_path, cv2.IMREAD_UNCHANGED)
+        image = readFramePath(img_path, cv2.IMREAD_UNCHANGED)
         if image is None:
             log.warning("Warning: Skipping corrupted or unreadable image: {}".format(img_path))
             skipped_count += 1
@@ -811,7 +1097,7 @@ def generateTimelapseFromFrames(image_files,
         
             # Handle cleanup based on specified mode
             if cleanup_mode == 'delete':
-                deleteFilesAndEmptyDirs(image_files, stop_at=frames_root)
+                deleteFilesAndEmptyDirs(_sourceFiles(image_files, complete_only=True), stop_at=frames_root)
 
             elif cleanup_mode == 'tar':
                 try:
@@ -836,7 +1122,7 @@ def generateTimelapseFromFrames(image_files,
                                                       temp_tar_path,
                                                       compression,
                                                       remove_source, 
-                                                      file_list=image_files)
+                                                      file_list=_sourceFiles(image_files))
                     
                     if archive_success:
                         # Rename to final tar path
@@ -846,7 +1132,8 @@ def generateTimelapseFromFrames(image_files,
                         log.info("Archive created successfully at: {}".format(tar_path))
                         if remove_source:
                             # Remove source files if archive creation was successful
-                            deleteFilesAndEmptyDirs(image_files, stop_at=frames_root)
+                            deleteFilesAndEmptyDirs(_sourceFiles(image_files, complete_only=True), 
+                                                    stop_at=frames_root)
                             log.info("Removed source files after archiving.")
                     else:
                         log.warning("Archive creation or verification failed. Keeping original directory.")
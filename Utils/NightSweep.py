@@ -0,0 +1,277 @@
+""" Make the night products (thumbnail mosaics, stacks, timelapse, per-file statistics) in a single pass over 
+    the FF files, so every FF file is read from disk only once.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import sys
+import traceback
+import collections
+import multiprocessing.pool
+
+import numpy as np
+
+from RMS.Formats.FFfile import read as readFF
+from RMS.Formats.FFfile import validFFName
+from RMS.Logger import getLogger
+from Utils.GenerateThumbnails import ThumbnailMosaic, listThumbnailFFs
+from Utils.GenerateTimelapse import TimelapseStreamWriter, labelFFImage
+from Utils.StackFFs import FFStacker, loadStackFlat
+
+
+# Get the logger from the main module
+log = getLogger("logger")
+
+
+
+class SweepProduct(object):
+    """ A product made from FF files during a sweep. Subclasses override add and finish, by default they do 
+        nothing.
+    """
+
+    def __init__(self, name, file_list=None):
+        """
+        Arguments:
+            name: [str] Name of the product used in the log.
+
+        Keyword arguments:
+            file_list: [list] Names of FF files used by the product. All FF files in the directory are used
+                if None.
+        """
+
+        self.name = name
+        self.file_names = None if file_list is None else set(file_list)
+
+        # Set if the product failed, no more files are given to it
+        self.failed = False
+
+
+    def wants(self, file_name):
+        """ Check if the FF file is used by the product. """
+
+        return (not self.failed) and ((self.file_names is None) or (file_name in self.file_names))
+
+
+    def add(self, file_name, ff):
+        """ Add the FF file to the product. The FF must not be modified, it is shared by all products. """
+
+        pass
+
+
+    def finish(self):
+        """ Finish the product once all files were added, return the result. """
+
+        return None
+
+
+    def abort(self):
+        """ Release the resources of a failed product. """
+
+        pass
+
+
+
+class ThumbnailProduct(SweepProduct):
+    """ Thumbnail mosaic, see Utils.GenerateThumbnails.generateThumbnails. """
+
+    def __init__(self, dir_path, config, mosaic_type, file_list=None, no_stack=False):
+
+        ff_list = listThumbnailFFs(dir_path, file_list=file_list)
+
+        super(ThumbnailProduct, self).__init__(mosaic_type + " thumbnails", file_list=ff_list)
+
+        self.dir_path = dir_path
+        self.mosaic_type = mosaic_type
+        self.mosaic = ThumbnailMosaic(config, ff_list, no_stack=no_stack)
+
+
+    def add(self, file_name, ff):
+        self.mosaic.add(file_name, ff)
+
+
+    def finish(self):
+        """ Save the mosaic, return the name of the thumbnail file. """
+
+        return self.mosaic.save(self.dir_path, self.mosaic_type)
+
+
+
+class StackProduct(SweepProduct):
+    """ Stack of maxpixels, see Utils.StackFFs.stackFFs. """
+
+    def __init__(self, dir_path, file_format, deinterlace=False, subavg=False, filter_bright=False,
+        flat_path=None, file_list=None, mask=None, captured_stack=False, print_progress=False):
+
+        if file_list is not None:
+            file_list = [file_name for file_name in file_list if validFFName(file_name)]
+
+        super(StackProduct, self).__init__("stack", file_list=file_list)
+
+        self.dir_path = dir_path
+        self.file_format = file_format
+        self.mask = mask
+        self.captured_stack = captured_stack
+
+        self.stacker = FFStacker(deinterlace=deinterlace, subavg=subavg, filter_bright=filter_bright,
+            flat=loadStackFlat(dir_path, flat_path=flat_path), print_progress=print_progress)
+
+
+    def add(self, file_name, ff):
+        self.stacker.add(file_name, ff)
+
+
+    def finish(self):
+        """ Save the stack, return (stack_path, merge_img). """
+
+        return self.stacker.save(self.dir_path, self.file_format, mask=self.mask,
+            captured_stack=self.captured_stack)
+
+
+
+class TimelapseProduct(SweepProduct):
+    """ Timelapse of labelled maxpixels streamed into ffmpeg, see Utils.GenerateTimelapse. """
+
+    def __init__(self, mp4_path, ffmpeg_path, fps=30, crf=29):
+
+        super(TimelapseProduct, self).__init__("timelapse")
+
+        self.writer = TimelapseStreamWriter(mp4_path, ffmpeg_path, fps=fps, crf=crf)
+
+
+    def add(self, file_name, ff):
+
+        # Label a copy, the maxpixel is used by the other products
+        self.writer.write(labelFFImage(file_name, ff, copy=True))
+
+
+    def finish(self):
+        """ Finish the video, return True if it was successfully encoded. """
+
+        return self.writer.close()
+
+
+    def abort(self):
+        self.writer.close()
+
+
+
+# Statistics of one FF file
+FFStats = collections.namedtuple("FFStats", ["file_name", "ave_mean", "ave_median", "std_mean", "max_max", 
+    "saturated_count"])
+
+
+class FFStatsProduct(SweepProduct):
+    """ Per-file statistics of the FF images, e.g. to find cloudy or bright periods during the night. """
+
+    def __init__(self, file_list=None):
+
+        super(FFStatsProduct, self).__init__("statistics", file_list=file_list)
+
+        self.stats = []
+
+
+    def add(self, file_name, ff):
+
+        # Saturation level of the maxpixel
+        saturation = 2**ff.nbits - 1 if ff.nbits > 0 else 255
+
+        self.stats.append(FFStats(file_name, float(np.mean(ff.avepixel)), float(np.median(ff.avepixel)),
+            float(np.mean(ff.stdpixel)), int(np.max(ff.maxpixel)), 
+            int(np.count_nonzero(ff.maxpixel >= saturation))))
+
+
+    def finish(self):
+        """ Return a list of FFStats, one for every FF file in the order of the file names. """
+
+        return self.stats
+
+
+
+def sweepFFs(dir_path, products, workers=2, prefetch=8):
+    """ Read every FF file used by any of the given products once, in the order of their names, and add it
+        to all products which use it. The files are read ahead in a small thread pool, while the products
+        are being built.
+
+    Arguments:
+        dir_path: [str] Path to the directory with FF files.
+        products: [list] A list of SweepProduct objects.
+
+    Keyword arguments:
+        workers: [int] Number of threads reading the FF files. 2 by default.
+        prefetch: [int] Maximum number of FF files read ahead. 8 by default.
+
+    Return:
+        results: [list] Results of the finish method of every product, None for failed products.
+    """
+
+    # Find all FF files used by any product
+    ff_list = sorted(file_name for file_name in os.listdir(dir_path) if validFFName(file_name))
+    ff_list = [file_name for file_name in ff_list if any(product.wants(file_name) for product in products)]
+
+    log.info("Reading {:d} FF files for {:s}...".format(len(ff_list),
+        ", ".join(product.name for product in products)))
+
+    pool = multiprocessing.pool.ThreadPool(max(1, workers))
+
+    try:
+
+        pending = collections.deque()
+        next_file = 0
+
+        while pending or (next_file < len(ff_list)):
+
+            # Keep reading ahead, but limit the number of FF files in memory
+            while (next_file < len(ff_list)) and (len(pending) < prefetch):
+                file_name = ff_list[next_file]
+                pending.append((file_name, pool.apply_async(readFF, (dir_path, file_name))))
+                next_file += 1
+
+            file_name, result = pending.popleft()
+
+            try:
+                ff = result.get()
+            except Exception as e:
+                log.warning("Reading {:s} failed: {:s}".format(file_name, repr(e)))
+                ff = None
+
+            # Skip the FF if it is corrupted
+            if ff is None:
+                continue
+
+            for product in products:
+
+                if not product.wants(file_name):
+                    continue
+
+                try:
+                    product.add(file_name, ff)
+
+                except Exception as e:
+                    log.error("Adding {:s} to the {:s} failed: {:s}".format(file_name, product.name, repr(e)))
+                    log.error("".join(traceback.format_exception(*sys.exc_info())))
+                    product.failed = True
+
+    finally:
+        pool.close()
+        pool.join()
+
+
+    # Finish all products
+    results = []
+    for product in products:
+
+        if product.failed:
+            product.abort()
+            results.append(None)
+            continue
+
+        try:
+            results.append(product.finish())
+
+        except Exception as e:
+            log.error("Finishing the {:s} failed: {:s}".format(product.name, repr(e)))
+            log.error("".join(traceback.format_exception(*sys.exc_info())))
+            results.append(None)
+
+    return results
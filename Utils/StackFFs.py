@@ -16,33 +16,18 @@ from RMS.Routines import MaskImage
 
 
 
-def stackFFs(dir_path, file_format, deinterlace=False, subavg=False, filter_bright=False, flat_path=None,
-    file_list=None, mask=None, captured_stack=False, print_progress=True):
-    """ Stack FF files in the given folder. 
+def loadStackFlat(dir_path, flat_path=None):
+    """ Load the flat for stacking. 
 
     Arguments:
         dir_path: [str] Path to the directory with FF files.
-        file_format: [str] Image format for the stack. E.g. jpg, png, bmp
 
     Keyword arguments:
-        deinterlace: [bool] True if the image should be deinterlaced prior to stacking. False by default.
-        subavg: [bool] Whether the average pixel image should be subtracted form the max pixel image. False
-            by default. 
-        filter_bright: [bool] Whether images with bright backgrounds (after average subtraction) should be
-            skipped. False by default.
-        flat_path: [str] Path to the flat calibration file. None by default. Will only be used if subavg is
-            False.
-        file_list: [list] A list of file for stacking. False by default, in which case all FF files in the
-            given directory will be used.
-        mask: [MaskStructure] Mask to apply to the stack. None by default.
-        captured_stack: [bool] True if all files are used and "_captured_stack" will be used in the file name.
-            False by default.
-        print_progress: [bool] Allow print calls to show files being stacked. True by default
+        flat_path: [str] Path to the flat calibration file. None by default, in which case flat.bmp is
+            taken from dir_path if it exists. If '', no flat is loaded.
 
     Return:
-        stack_path, merge_img:
-            - stack_path: [str] Path of the save stack.
-            - merge_img: [ndarray] Numpy array of the stacked image.
+        flat: [Flat] The loaded flat, None if no flat was found.
     """
 
     # Load the flat if it was given
@@ -65,126 +50,220 @@ def stackFFs(dir_path, file_format, deinterlace=False, subavg=False, filter_brig
 
             print('Loaded flat:', flat_full_path)
 
+    return flat
 
-    first_img = True
 
-    n_stacked = 0
-    total_ff_files = 0
-    merge_img = None
 
-    # If the list of files was not given, take all files in the given folder
-    if file_list is None:
-        file_list = sorted(os.listdir(dir_path))
+class FFStacker(object):
+    """ Stacks maxpixels of FF files added one by one. When bright images are filtered, the unfiltered stack
+        is kept as well, so the fallback to it doesn't need the files to be read again.
+    """
 
+    def __init__(self, deinterlace=False, subavg=False, filter_bright=False, flat=None, print_progress=True):
+        """ See stackFFs for the description of the arguments. """
 
-    # List all FF files in the current dir
-    for ff_name in file_list:
-        if validFFName(ff_name):
+        self.deinterlace = deinterlace
+        self.subavg = subavg
+        self.filter_bright = filter_bright
+        self.flat = flat
+        self.print_progress = print_progress
 
-            # Load FF file
-            ff = readFF(dir_path, ff_name)
+        self.total_ff_files = 0
 
-            # Skip the file if it is corrupted
-            if ff is None:
-                continue
+        # Stack of images which passed the bright filter
+        self.merge_img = None
+        self.n_stacked = 0
+
+        # Stack of all images
+        self.merge_img_all = None
 
-            total_ff_files += 1
 
-            maxpixel = ff.maxpixel
-            avepixel = ff.avepixel
+    def add(self, ff_name, ff):
+        """ Add the FF file to the stack. """
 
-            # Deinterlace the images
-            if deinterlace:
-                maxpixel = deinterlaceBlend(maxpixel)
-                avepixel = deinterlaceBlend(avepixel)
+        self.total_ff_files += 1
 
-            # If the flat was given, apply it to the image, only if no subtraction is done
-            if (flat is not None) and not subavg:
-                maxpixel = applyFlat(maxpixel, flat)
-                avepixel = applyFlat(avepixel, flat)
+        maxpixel = ff.maxpixel
+        avepixel = ff.avepixel
+
+        # Deinterlace the images
+        if self.deinterlace:
+            maxpixel = deinterlaceBlend(maxpixel)
+            avepixel = deinterlaceBlend(avepixel)
+
+        # If the flat was given, apply it to the image, only if no subtraction is done
+        if (self.flat is not None) and not self.subavg:
+            maxpixel = applyFlat(maxpixel, self.flat)
+            avepixel = applyFlat(avepixel, self.flat)
+
+
+        # Subtract the average from maxpixel
+        if self.subavg:
+            img = maxpixel - avepixel
+
+        else:
+            img = maxpixel
+
+
+        if self.filter_bright:
+
+            # Keep the stack of all images in case too many get rejected
+            if self.merge_img_all is None:
+                self.merge_img_all = np.copy(img)
+            else:
+                self.merge_img_all = blendLighten(self.merge_img_all, img)
 
 
             # Reject the image if the median subtracted image is too bright. This usually means that there
             #   are clouds on the image which can ruin the stack
-            if filter_bright:
+            bright_img = maxpixel - avepixel
 
-                img = maxpixel - avepixel
+            # Compute surface brightness
+            median = np.median(bright_img)
 
-                # Compute surface brightness
-                median = np.median(img)
+            # Compute top detection pixels
+            top_brightness = np.percentile(bright_img, 99.9)
 
-                # Compute top detection pixels
-                top_brightness = np.percentile(img, 99.9)
+            # Reject all images where the median brightness is high
+            # Preserve images with very bright detections
+            if (median > 10) and (top_brightness < (2**(8*bright_img.itemsize) - 10)):
+                if self.print_progress:
+                    print('Skipping: ', ff_name, 'median:', median, 'top brightness:', top_brightness)
+                return
 
-                # Reject all images where the median brightness is high
-                # Preserve images with very bright detections
-                if (median > 10) and (top_brightness < (2**(8*img.itemsize) - 10)):
-                    if print_progress:
-                        print('Skipping: ', ff_name, 'median:', median, 'top brightness:', top_brightness)
-                    continue
 
+        if self.merge_img is None:
+            self.merge_img = np.copy(img)
+            self.n_stacked += 1
+            return
 
-            # Subtract the average from maxpixel
-            if subavg:
-                img = maxpixel - avepixel
+        if self.print_progress:
+            print('Stacking: ', ff_name)
 
-            else:
-                img = maxpixel
+        # Blend images 'if lighter'
+        self.merge_img = blendLighten(self.merge_img, img)
 
-            if first_img:
-                merge_img = np.copy(img)
-                first_img = False
-                n_stacked += 1
-                continue
+        self.n_stacked += 1
+
+
+    def save(self, dir_path, file_format, mask=None, captured_stack=False):
+        """ Save the stack to the given directory.
+
+        Arguments:
+            dir_path: [str] Path to the directory with FF files.
+            file_format: [str] Image format for the stack. E.g. jpg, png, bmp
+
+        Keyword arguments:
+            mask: [MaskStructure] Mask to apply to the stack. None by default.
+            captured_stack: [bool] True if all files are used and "_captured_stack" will be used in the file
+                name. False by default.
+
+        Return:
+            stack_path, merge_img:
+                - stack_path: [str] Path of the save stack.
+                - merge_img: [ndarray] Numpy array of the stacked image.
+        """
+
+        merge_img = self.merge_img
+        n_stacked = self.n_stacked
 
-            if print_progress:
-                print('Stacking: ', ff_name)
+        # If the number of stacked image is less than 20% of the given images, stack without filtering
+        if self.filter_bright and (n_stacked < 0.2*self.total_ff_files):
+            merge_img = self.merge_img_all
+            n_stacked = self.total_ff_files
 
-            # Blend images 'if lighter'
-            merge_img = blendLighten(merge_img, img)
+        # If no images were stacked, do nothing
+        if n_stacked == 0:
+            return None, None
 
-            n_stacked += 1
 
+        # Extract the name of the night directory which contains the FF files
+        night_dir = os.path.basename(dir_path)
+
+        # If the stack was captured, add "_captured_stack" to the file name
+        if captured_stack:
+            filename_suffix = "_captured_stack."
+        else:
+            filename_suffix = "_stack_{:d}_meteors.".format(n_stacked)
 
-    # If the number of stacked image is less than 20% of the given images, stack without filtering
-    if filter_bright and (n_stacked < 0.2*total_ff_files):
-        return stackFFs(dir_path, file_format, deinterlace=deinterlace, subavg=subavg, 
-            filter_bright=False, flat_path=flat_path, file_list=file_list)
 
-    # If no images were stacked, do nothing
-    if n_stacked == 0:
-        return None, None
+        stack_path = os.path.join(dir_path, night_dir + filename_suffix + file_format)
 
+        if self.print_progress:
+            print("Saving stack to:", stack_path)
 
-    # Extract the name of the night directory which contains the FF files
-    night_dir = os.path.basename(dir_path)
+        # Stretch the levels
+        merge_img = adjustLevels(merge_img, np.percentile(merge_img, 0.5), 1.3, np.percentile(merge_img, 99.9))
 
-    # If the stack was captured, add "_captured_stack" to the file name
-    if captured_stack:
-        filename_suffix = "_captured_stack."
-    else:
-        filename_suffix = "_stack_{:d}_meteors.".format(n_stacked)
 
+        # Apply the mask, if given
+        if mask is not None:
+            merge_img = MaskImage.applyMask(merge_img, mask)
+
+        
+        # Save the blended image
+        saveImage(stack_path, merge_img)
 
-    stack_path = os.path.join(dir_path, night_dir + filename_suffix + file_format)
 
-    if print_progress:
-        print("Saving stack to:", stack_path)
+        return stack_path, merge_img
 
-    # Stretch the levels
-    merge_img = adjustLevels(merge_img, np.percentile(merge_img, 0.5), 1.3, np.percentile(merge_img, 99.9))
 
 
-    # Apply the mask, if given
-    if mask is not None:
-        merge_img = MaskImage.applyMask(merge_img, mask)
+def stackFFs(dir_path, file_format, deinterlace=False, subavg=False, filter_bright=False, flat_path=None,
+    file_list=None, mask=None, captured_stack=False, print_progress=True):
+    """ Stack FF files in the given folder. 
+
+    Arguments:
+        dir_path: [str] Path to the directory with FF files.
+        file_format: [str] Image format for the stack. E.g. jpg, png, bmp
+
+    Keyword arguments:
+        deinterlace: [bool] True if the image should be deinterlaced prior to stacking. False by default.
+        subavg: [bool] Whether the average pixel image should be subtracted form the max pixel image. False
+            by default. 
+        filter_bright: [bool] Whether images with bright backgrounds (after average subtraction) should be
+            skipped. False by default.
+        flat_path: [str] Path to the flat calibration file. None by default. Will only be used if subavg is
+            False.
+        file_list: [list] A list of file for stacking. False by default, in which case all FF files in the
+            given directory will be used.
+        mask: [MaskStructure] Mask to apply to the stack. None by default.
+        captured_stack: [bool] True if all files are used and "_captured_stack" will be used in the file name.
+            False by default.
+        print_progress: [bool] Allow print calls to show files being stacked. True by default
+
+    Return:
+        stack_path, merge_img:
+            - stack_path: [str] Path of the save stack.
+            - merge_img: [ndarray] Numpy array of the stacked image.
+    """
+
+    # Load the flat if it was given
+    flat = loadStackFlat(dir_path, flat_path=flat_path)
+
+    stacker = FFStacker(deinterlace=deinterlace, subavg=subavg, filter_bright=filter_bright, flat=flat,
+        print_progress=print_progress)
+
+    # If the list of files was not given, take all files in the given folder
+    if file_list is None:
+        file_list = sorted(os.listdir(dir_path))
+
+
+    # List all FF files in the current dir
+    for ff_name in file_list:
+        if validFFName(ff_name):
+
+            # Load FF file
+            ff = readFF(dir_path, ff_name)
+
+            # Skip the file if it is corrupted
+            if ff is None:
+                continue
 
-    
-    # Save the blended image
-    saveImage(stack_path, merge_img)
+            stacker.add(ff_name, ff)
 
 
-    return stack_path, merge_img
+    return stacker.save(dir_path, file_format, mask=mask, captured_stack=captured_stack)
 
 
 
@@ -91,6 +91,14 @@ else:
 
 ### ###
 
+# OpenMP flags for the multithreaded compression (the parallel loops run on one thread without OpenMP)
+if sys.platform == 'win32':
+    openmp_compile_args, openmp_link_args = ['/openmp'], []
+elif sys.platform == 'darwin':
+    openmp_compile_args, openmp_link_args = [], []
+else:
+    openmp_compile_args, openmp_link_args = ['-fopenmp'], ['-fopenmp']
+
 # Cython modules which will be compiled on setup
 cython_modules = [
     Extension('RMS.Astrometry.CyFunctions', sources=['RMS/Astrometry/CyFunctions.pyx'], \
@@ -104,7 +112,8 @@ cython_modules = [
     Extension('RMS.Routines.MorphCy', sources=['RMS/Routines/MorphCy.pyx'], \
         include_dirs=[numpy.get_include()]),
     Extension('RMS.CompressionCy', sources=['RMS/CompressionCy.pyx'], \
-        include_dirs=[numpy.get_include()]),
+        include_dirs=[numpy.get_include()], extra_compile_args=openmp_compile_args, \
+        extra_link_args=openmp_link_args),
     Extension('Utils.SaturationTools', sources=['Utils/SaturationTools.pyx'], \
         include_dirs=[numpy.get_include()])
     ]